@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+Benchmark of the chunk cache policies of the k-mer matrix (see kover learn scm --chunk-cache).
+
+Creates a dataset from a random k-mer matrix in which the phenotype is explained by a few k-mers, splits it with
+cross-validation folds and times kover learn scm with each chunk cache policy. get_columns is called on the rules of the
+models at each iteration of the SCM, on the models of each fold and for the bound, which reads the chunks of the
+same few columns again and again. sum_rows streams through the matrix and is never cached.
+
+Usage: python benchmarks/bench_chunk_cache.py [--genomes 500] [--kmers 100000] [--hp-choice cv bound]
+"""
+
+import argparse
+import numpy as np
+
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+from kover.dataset.create import from_tsv
+from kover.dataset.split import split_with_proportion
+from kover.learning.common.rules import CHUNK_CACHE_POLICIES
+from kover.learning.experiments.experiment_scm import learn_SCM
+
+
+def _write_tsv(path, metadata_path, n_genomes, n_kmers, random_generator, block_size=10000):
+    genome_ids = ["genome_%d" % i for i in xrange(n_genomes)]
+    with open(path, "w") as f:
+        f.write("kmers\t" + "\t".join(genome_ids) + "\n")
+        kmers = np.array(list("ACGT"))[random_generator.randint(0, 4, size=(n_kmers, 31))]
+        for start in xrange(0, n_kmers, block_size):
+            stop = min(start + block_size, n_kmers)
+            presence = (random_generator.rand(stop - start, n_genomes) <
+                        random_generator.rand(stop - start, 1)).astype(np.uint8)
+            if start == 0:
+                # The phenotype is the presence of the first k-mers (a conjunction), with 5% of noise
+                phenotype = presence[:3].all(axis=0) ^ (random_generator.rand(n_genomes) < 0.05)
+            for kmer, row in zip(kmers[start:stop], presence):
+                f.write("".join(kmer) + "\t" + "\t".join("01"[v] for v in row) + "\n")
+    with open(metadata_path, "w") as f:
+        for genome_id, label in zip(genome_ids, phenotype):
+            f.write("%s\t%d\n" % (genome_id, label))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the chunk cache policies of the k-mer matrix.")
+    parser.add_argument("--genomes", type=int, default=500)
+    parser.add_argument("--kmers", type=int, default=100000)
+    parser.add_argument("--chunk-policy", default="row", choices=["row", "tile"])
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--hp-choice", nargs="+", default=["cv", "bound"], choices=["cv", "bound"])
+    parser.add_argument("--policies", nargs="+", default=CHUNK_CACHE_POLICIES, choices=CHUNK_CACHE_POLICIES)
+    parser.add_argument("--n-cpu", type=int, default=1)
+    parser.add_argument("--random-seed", type=int, default=42)
+    parser.add_argument("--temp-dir", default=None)
+    args = parser.parse_args()
+
+    random_generator = np.random.RandomState(args.random_seed)
+
+    temp_dir = mkdtemp(dir=args.temp_dir)
+    try:
+        tsv_path = join(temp_dir, "kmers.tsv")
+        metadata_path = join(temp_dir, "metadata.tsv")
+        dataset_path = join(temp_dir, "dataset.kover")
+        _write_tsv(tsv_path, metadata_path, args.genomes, args.kmers, random_generator)
+        from_tsv(tsv_path=tsv_path, output_path=dataset_path, phenotype_description="phenotype",
+                 phenotype_metadata_path=metadata_path, gzip=4, n_cpu=args.n_cpu, chunk_policy=args.chunk_policy)
+        split_with_proportion(input=dataset_path, split_name="split", train_prop=0.7, random_seed=args.random_seed,
+                              n_folds=args.folds)
+
+        print "%8s %10s %8s %8s | %12s %8s" % ("genomes", "k-mers", "hp", "policy", "learn scm", "model")
+        for hp_choice in args.hp_choice:
+            models = []
+            for policy in args.policies:
+                t = time()
+                model = learn_SCM(dataset_file=dataset_path,
+                                  split_name="split",
+                                  model_type=["conjunction", "disjunction"],
+                                  p=[0.1, 1.0, 10.0],
+                                  kmer_blacklist_file=None,
+                                  max_rules=10,
+                                  max_equiv_rules=10000,
+                                  parameter_selection=hp_choice,
+                                  n_cpu=args.n_cpu,
+                                  random_seed=args.random_seed,
+                                  authorized_rules="",
+                                  bound_delta=0.05,
+                                  bound_max_genome_size=args.kmers,
+                                  chunk_cache=policy)[4]
+                learn_time = time() - t
+                models.append(str(model))
+                print "%8d %10d %8s %8s | %11.2fs %8s" % (args.genomes, args.kmers, hp_choice, policy, learn_time,
+                                                          "same" if models[-1] == models[0] else "DIFFERENT")
+    finally:
+        rmtree(temp_dir)
+
+
+if __name__ == "__main__":
+    main()
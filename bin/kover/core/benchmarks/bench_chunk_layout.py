@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Benchmark of the chunk layouts of the k-mer matrix.
+
+Stores a random packed k-mer matrix with the chunk shape of each layout policy and times the calls that learning makes
+through KmerRuleClassifications: sum_rows over a training set and a cross-validation fold, and get_columns over a few
+columns. Also reports the layout that the autotune policy selects for the matrix.
+
+Usage: python benchmarks/bench_chunk_layout.py [--genomes 100 1000] [--kmers 1000000] [--compression 4]
+"""
+
+import argparse
+import h5py as h
+import numpy as np
+
+from os import close, remove
+from tempfile import mkstemp
+from time import time
+
+from kover.dataset.tools.chunk_layout import autotune_chunks, row_chunks, tile_chunks
+from kover.learning.common.rules import KmerRuleClassifications
+from kover.utils import _hdf5_open_no_chunk_cache, _pack_binary_bytes_to_ints
+
+
+def _random_matrix(n_genomes, n_kmers, random_generator, block_size=100000):
+    # Most k-mers are present in either very few or most of the genomes
+    packed = np.zeros((int(np.ceil(n_genomes / 64.0)), n_kmers), dtype=np.uint64)
+    for start in xrange(0, n_kmers, block_size):
+        stop = min(start + block_size, n_kmers)
+        density = random_generator.beta(0.5, 0.5, size=stop - start)
+        block = (random_generator.rand(n_genomes, stop - start) < density).astype(np.uint8)
+        packed[:, start:stop] = _pack_binary_bytes_to_ints(block, 64)
+    return packed
+
+
+def _time_layout(packed, n_genomes, chunks, compression, repeats, random_generator):
+    fd, path = mkstemp(suffix=".h5")
+    close(fd)
+    try:
+        f = h.File(path, "w")
+        f.create_dataset("kmer_matrix", data=packed, chunks=chunks, compression="gzip" if compression > 0 else None,
+                         compression_opts=compression if compression > 0 else None)
+        f.close()
+
+        f = _hdf5_open_no_chunk_cache(path)
+        matrix = KmerRuleClassifications(f["kmer_matrix"], n_genomes)
+        train = np.sort(random_generator.choice(n_genomes, n_genomes / 2, replace=False))
+        fold = np.sort(random_generator.choice(train, max(1, len(train) * 4 / 5), replace=False))
+        times = []
+        for rows in [train, fold]:
+            best = np.infty
+            for _ in xrange(repeats):
+                t = time()
+                matrix.sum_rows(rows)
+                best = min(best, time() - t)
+            times.append(best)
+        t = time()
+        for _ in xrange(20):
+            matrix.get_columns(np.sort(random_generator.choice(packed.shape[1] * 2, 5, replace=False)).tolist())
+        times.append((time() - t) / 20)
+        f.close()
+    finally:
+        remove(path)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the chunk layouts of the k-mer matrix.")
+    parser.add_argument("--genomes", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--kmers", type=int, default=1000000)
+    parser.add_argument("--compression", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--random-seed", type=int, default=42)
+    args = parser.parse_args()
+
+    random_generator = np.random.RandomState(args.random_seed)
+    compression_kwargs = dict(compression="gzip" if args.compression > 0 else None,
+                              compression_opts=args.compression if args.compression > 0 else None)
+
+    print "%8s %10s %16s | %12s %12s %14s" % ("genomes", "k-mers", "chunks", "sum_rows", "sum_rows", "get_columns")
+    print "%8s %10s %16s | %12s %12s %14s" % ("", "", "", "(train)", "(fold)", "(5 columns)")
+    for n_genomes in args.genomes:
+        packed = _random_matrix(n_genomes, args.kmers, random_generator)
+        n_rows = packed.shape[0]
+        for name, chunks in [("row", row_chunks(n_rows, args.kmers)), ("tile", tile_chunks(n_rows, args.kmers))]:
+            train_time, fold_time, get_columns_time = _time_layout(packed, n_genomes, chunks, args.compression,
+                                                                   args.repeats, random_generator)
+            print "%8d %10d %16s | %11.3fs %11.3fs %13.5fs  (%s)" % (n_genomes, args.kmers, str(chunks), train_time,
+                                                                    fold_time, get_columns_time, name)
+
+        t = time()
+        chunks, costs = autotune_chunks(packed[:, :100000], n_genomes, args.kmers, compression_kwargs)
+        print "%8d %10d %16s | autotune selection in %.2fs, estimated costs: %s" % \
+              (n_genomes, args.kmers, str(chunks), time() - t,
+               ", ".join("%s: %.2fs" % (str(c), cost) for c, cost in sorted(costs.items())))
+        print
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Benchmark of the compression filters of Kover datasets.
+
+Creates a dataset from a synthetic TSV k-mer matrix with each compression filter and reports the size of the dataset,
+the creation time and the throughput of KmerRuleClassifications.sum_rows over a training set of half the genomes.
+
+Usage: python benchmarks/bench_compression.py [--genomes 500] [--kmers 1000000] [--gzip-level 4]
+"""
+
+import argparse
+import numpy as np
+
+from os.path import getsize, join
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+from kover.dataset.create import COMPRESSION_FILTERS, from_tsv
+from kover.learning.common.rules import KmerRuleClassifications
+from kover.utils import _hdf5_open_no_chunk_cache
+
+
+def _write_tsv(path, n_genomes, n_kmers, kmer_size, random_generator, block_size=10000):
+    nucleotides = np.array(list("ACGT"))
+    with open(path, "w") as f:
+        f.write("kmers\t" + "\t".join("genome_%d" % i for i in xrange(n_genomes)) + "\n")
+        for start in xrange(0, n_kmers, block_size):
+            n = min(block_size, n_kmers - start)
+            kmers = nucleotides[random_generator.randint(0, 4, size=(n, kmer_size))].view("S%d" % kmer_size).ravel()
+            # Most k-mers are present in either very few or most of the genomes
+            density = random_generator.beta(0.5, 0.5, size=(n, 1))
+            values = (random_generator.rand(n, n_genomes) < density).astype(np.uint8)
+            f.writelines("%s\t%s\n" % (k, "\t".join(v)) for k, v in zip(kmers, values.astype("S1")))
+    with open(path + ".metadata", "w") as f:
+        f.writelines("genome_%d\t%d\n" % (i, i % 2) for i in xrange(n_genomes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the compression filters of Kover datasets.")
+    parser.add_argument("--genomes", type=int, default=500)
+    parser.add_argument("--kmers", type=int, default=1000000)
+    parser.add_argument("--kmer-size", type=int, default=31)
+    parser.add_argument("--gzip-level", type=int, default=4)
+    parser.add_argument("--filters", nargs="+", default=COMPRESSION_FILTERS, choices=COMPRESSION_FILTERS)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--random-seed", type=int, default=42)
+    parser.add_argument("--temp-dir", default=None)
+    args = parser.parse_args()
+
+    random_generator = np.random.RandomState(args.random_seed)
+    work_dir = mkdtemp(dir=args.temp_dir)
+    try:
+        tsv_path = join(work_dir, "matrix.tsv")
+        _write_tsv(tsv_path, args.genomes, args.kmers, args.kmer_size, random_generator)
+        train_rows = np.sort(random_generator.choice(args.genomes, args.genomes / 2, replace=False))
+
+        print "%d genomes, %d k-mers (TSV: %.1f MB)" % (args.genomes, args.kmers, getsize(tsv_path) / 1024.0 ** 2)
+        print "%14s | %10s %12s | %12s %16s" % ("filter", "size (MB)", "creation", "sum_rows", "k-mers / second")
+        for compression_filter in args.filters:
+            output_path = join(work_dir, "%s.kover" % compression_filter)
+            t = time()
+            from_tsv(tsv_path=tsv_path,
+                     output_path=output_path,
+                     phenotype_description="benchmark",
+                     phenotype_metadata_path=tsv_path + ".metadata",
+                     gzip=args.gzip_level,
+                     compression_filter=compression_filter)
+            creation_time = time() - t
+
+            dataset = _hdf5_open_no_chunk_cache(output_path)
+            matrix = KmerRuleClassifications(dataset["kmer_matrix"], args.genomes)
+            sum_rows_time = np.infty
+            for _ in xrange(args.repeats):
+                t = time()
+                matrix.sum_rows(train_rows)
+                sum_rows_time = min(sum_rows_time, time() - t)
+            dataset.close()
+
+            print "%14s | %10.1f %11.2fs | %11.3fs %16.0f" % (compression_filter, getsize(output_path) / 1024.0 ** 2,
+                                                              creation_time, sum_rows_time,
+                                                              args.kmers / sum_rows_time)
+    finally:
+        rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
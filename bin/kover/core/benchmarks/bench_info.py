@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+Benchmark of kover dataset info.
+
+Writes a dataset with random k-mers and times the scalar fields of the dataset read from the dataset and from its
+summary (see kover.dataset.summary), and the export of the k-mer sequences with one print per line and with the block
+writers of each format (see kover.dataset.tools.text_export). The k-mers are written to a file.
+
+Usage: python benchmarks/bench_info.py [--kmers 100000 500000] [--genomes 1000]
+"""
+
+import argparse
+import h5py as h
+import numpy as np
+
+from os.path import getsize, join
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+from uuid import uuid1
+
+from kover.dataset.ds import KoverDataset
+from kover.dataset.summary import compute_summary, read_summary, write_summary
+from kover.dataset.tools.text_export import write_kmer_sequences, TEXT_EXPORT_FORMATS
+
+
+def _write_dataset(path, n_genomes, n_kmers, random_generator, block_size=1000000):
+    f = h.File(path, "w")
+    f.attrs["uuid"] = str(uuid1())
+    f.attrs["genome_source_type"] = "tsv"
+    f.attrs["genomic_data"] = "kmers.tsv"
+    f.attrs["phenotype_description"] = "phenotype"
+    f.attrs["phenotype_metadata_source"] = "metadata.tsv"
+    f.attrs["compression"] = "gzip (level 4)"
+    f.attrs["classification_type"] = "binary"
+    f.create_dataset("genome_identifiers", data=np.array(["genome_%d" % i for i in xrange(n_genomes)]))
+    f.create_dataset("phenotype", data=random_generator.randint(0, 2, n_genomes).astype(np.uint8))
+    f.create_dataset("phenotype_tags", data=np.array(["0", "1"]))
+    kmers = f.create_dataset("kmer_sequences", shape=(n_kmers,), dtype="S31", compression="gzip",
+                             compression_opts=4)
+    for start in xrange(0, n_kmers, block_size):
+        stop = min(start + block_size, n_kmers)
+        letters = np.array(list("ACGT"))[random_generator.randint(0, 4, size=(stop - start, 31))]
+        kmers[start:stop] = letters.view("S31").reshape(-1)
+    f.close()
+
+
+def _print_kmers(dataset, path):
+    # How the k-mers were printed before the block writers
+    with open(path, "w") as f:
+        for i, k in enumerate(dataset.kmer_sequences):
+            print >> f, ">k%d" % (i + 1)
+            print >> f, k
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark kover dataset info.")
+    parser.add_argument("--kmers", type=int, nargs="+", default=[100000, 500000])
+    parser.add_argument("--genomes", type=int, default=1000)
+    parser.add_argument("--random-seed", type=int, default=42)
+    parser.add_argument("--temp-dir", default=None)
+    args = parser.parse_args()
+
+    random_generator = np.random.RandomState(args.random_seed)
+
+    print "%10s | %10s %10s | %10s %10s %10s %10s" % ("k-mers", "scalars", "scalars", "print", "fasta", "tsv", "json")
+    print "%10s | %10s %10s | %10s %10s %10s %10s" % ("", "(dataset)", "(summary)", "(fasta)", "", "", "")
+    temp_dir = mkdtemp(dir=args.temp_dir)
+    try:
+        for n_kmers in args.kmers:
+            path = join(temp_dir, "dataset_%d.kover" % n_kmers)
+            _write_dataset(path, args.genomes, n_kmers, random_generator)
+
+            t = time()
+            compute_summary(path)
+            dataset_time = time() - t
+            write_summary(path)
+            t = time()
+            read_summary(path)
+            summary_time = time() - t
+
+            dataset = KoverDataset(path)
+            output_path = join(temp_dir, "kmers.txt")
+            t = time()
+            _print_kmers(dataset, output_path)
+            print_time = time() - t
+            print_size = getsize(output_path)
+            export_times = []
+            for export_format in TEXT_EXPORT_FORMATS:
+                t = time()
+                with open(output_path, "w") as f:
+                    write_kmer_sequences([dataset.kmer_sequences], f, export_format)
+                export_times.append(time() - t)
+                if export_format == "fasta" and getsize(output_path) != print_size:
+                    raise RuntimeError("The k-mers written in fasta differ from the k-mers printed.")
+            dataset.close()
+
+            print "%10d | %9.4fs %9.4fs | %9.2fs %9.2fs %9.2fs %9.2fs" % ((n_kmers, dataset_time, summary_time,
+                                                                             print_time) + tuple(export_times))
+    finally:
+        rmtree(temp_dir)
+
+
+if __name__ == "__main__":
+    main()
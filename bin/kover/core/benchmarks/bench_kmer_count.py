@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Benchmark of the k-mer counters used by "kover dataset create from-contigs".
+
+Creates datasets from synthetic genomes (random mutations of a common ancestor) with the python k-mer counter and,
+when the DSK tools are installed, with multidsk and the k-mer merge of kmer_pack. The datasets are checked to contain
+the same k-mers and the same presence/absence pattern for each k-mer.
+
+Usage: python benchmarks/bench_kmer_count.py [--genomes 10 50] [--genome-length 1000000] [--kmer-size 31] [--n-cpu 0]
+"""
+
+import argparse
+import h5py as h
+import logging
+import numpy as np
+
+from os import mkdir
+from os.path import abspath, dirname, exists, join
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+import kover.dataset.tools.kmer_count as kmer_count
+from kover.dataset.create import from_contigs
+from kover.utils import _unpack_binary_bytes_from_ints
+
+
+def _write_genomes(out_dir, n_genomes, genome_length, n_contigs, mutation_rate, random_generator):
+    ancestor = random_generator.choice(list("ACGT"), genome_length)
+    genome_list = open(join(out_dir, "genomes.tsv"), "w")
+    metadata = open(join(out_dir, "metadata.tsv"), "w")
+    for i in xrange(n_genomes):
+        genome = ancestor.copy()
+        mutations = random_generator.rand(genome_length) < mutation_rate
+        genome[mutations] = random_generator.choice(list("ACGT"), mutations.sum())
+        genome = "".join(genome)
+
+        path = join(out_dir, "genome_%d.fasta" % i)
+        with open(path, "w") as f:
+            contig_length = int(np.ceil(1.0 * genome_length / n_contigs))
+            for j, start in enumerate(xrange(0, genome_length, contig_length)):
+                contig = genome[start: start + contig_length]
+                f.write(">contig_%d\n" % j)
+                f.writelines(contig[k: k + 80] + "\n" for k in xrange(0, len(contig), 80))
+        genome_list.write("genome_%d\t%s\n" % (i, path))
+        metadata.write("genome_%d\t%d\n" % (i, i % 2))
+    genome_list.close()
+    metadata.close()
+
+
+def _kmer_patterns(path):
+    """
+    Returns the k-mers of a dataset, sorted, and their presence/absence pattern in the genomes sorted by identifier.
+    """
+    f = h.File(path, "r")
+    genome_ids = f["genome_identifiers"][...]
+    kmers = f["kmer_sequences"][...][f["kmer_by_matrix_column"][...]]
+    matrix = _unpack_binary_bytes_from_ints(f["kmer_matrix"][...])[: len(genome_ids)]
+    f.close()
+    kmer_sorter = np.argsort(kmers)
+    return kmers[kmer_sorter], matrix[np.argsort(genome_ids)][:, kmer_sorter]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the k-mer counters of from-contigs.")
+    parser.add_argument("--genomes", type=int, nargs="+", default=[10, 50])
+    parser.add_argument("--genome-length", type=int, default=1000000)
+    parser.add_argument("--contigs", type=int, default=50, help="Number of contigs per genome.")
+    parser.add_argument("--mutation-rate", type=float, default=0.005)
+    parser.add_argument("--kmer-size", type=int, default=31)
+    parser.add_argument("--n-cpu", type=int, default=0, help="Number of cores (0 means all the cores).")
+    parser.add_argument("--random-seed", type=int, default=42)
+    parser.add_argument("--temp-dir", default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    random_generator = np.random.RandomState(args.random_seed)
+    work_dir = mkdtemp(dir=args.temp_dir)
+    dsk_available = exists(join(dirname(abspath(kmer_count.__file__)), "kmer_tools", "multidsk"))
+    if not dsk_available:
+        print "The DSK tools are not installed. Only the python k-mer counter is benchmarked."
+        print
+
+    try:
+        print "%10s %12s | %12s %12s | %12s %12s" % ("genomes", "length", "python", "k-mers", "dsk", "k-mers")
+        for n_genomes in args.genomes:
+            genome_dir = join(work_dir, "genomes_%d" % n_genomes)
+            mkdir(genome_dir)
+            _write_genomes(genome_dir, n_genomes, args.genome_length, args.contigs, args.mutation_rate,
+                           random_generator)
+
+            times = {}
+            patterns = {}
+            for counter in (["python", "dsk"] if dsk_available else ["python"]):
+                output = join(genome_dir, "%s.kover" % counter)
+                t = time()
+                from_contigs(contig_list_path=join(genome_dir, "genomes.tsv"),
+                             output_path=output,
+                             kmer_size=args.kmer_size,
+                             filter_singleton="singleton",
+                             phenotype_description="benchmark",
+                             phenotype_metadata_path=join(genome_dir, "metadata.tsv"),
+                             gzip=4,
+                             temp_dir=genome_dir,
+                             nb_cores=args.n_cpu,
+                             verbose=False,
+                             progress=False,
+                             kmer_counter=counter)
+                times[counter] = time() - t
+                patterns[counter] = _kmer_patterns(output)
+
+            if dsk_available:
+                if not (np.array_equal(patterns["python"][0], patterns["dsk"][0]) and
+                        np.array_equal(patterns["python"][1], patterns["dsk"][1])):
+                    raise RuntimeError("The k-mer counters disagree for %d genomes." % n_genomes)
+                print "%10d %12d | %11.3fs %12d | %11.3fs %12d" % (n_genomes, args.genome_length,
+                                                                    times["python"], len(patterns["python"][0]),
+                                                                    times["dsk"], len(patterns["dsk"][0]))
+            else:
+                print "%10d %12d | %11.3fs %12d | %12s %12s" % (n_genomes, args.genome_length, times["python"],
+                                                                len(patterns["python"][0]), "-", "-")
+    finally:
+        rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
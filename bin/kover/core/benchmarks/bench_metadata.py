@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Benchmark of the phenotypic metadata parsing of dataset creation.
+
+Writes synthetic metadata files and times the join of the metadata with the genomes of the k-mer matrix, as done
+before the first k-mer is written. 5% of the genomes only occur in the metadata and 5% only in the genomic data.
+
+Usage: python benchmarks/bench_metadata.py [--rows 1000 10000 100000] [--phenotypes 2]
+"""
+
+import argparse
+import numpy as np
+
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+from kover.dataset.create import _parse_metadata
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the phenotypic metadata parsing of dataset creation.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--phenotypes", type=int, default=2)
+    parser.add_argument("--random-seed", type=int, default=42)
+    parser.add_argument("--temp-dir", default=None)
+    args = parser.parse_args()
+
+    random_generator = np.random.RandomState(args.random_seed)
+    work_dir = mkdtemp(dir=args.temp_dir)
+    try:
+        print "%10s %14s | %10s" % ("rows", "matrix genomes", "time")
+        for n_rows in args.rows:
+            genome_ids = np.array(["genome_%d" % i for i in xrange(n_rows + n_rows / 20)])
+            random_generator.shuffle(genome_ids)
+            metadata_ids = genome_ids[:n_rows]
+            labels = random_generator.randint(0, args.phenotypes, size=n_rows)
+            metadata_path = join(work_dir, "metadata_%d.tsv" % n_rows)
+            with open(metadata_path, "w") as f:
+                f.writelines("%s\t%d\n" % (g_id, label) for g_id, label in zip(metadata_ids, labels))
+
+            # The genomic data is given as the keys of a dictionary, as in from_contigs
+            matrix_genome_ids = dict((g_id, None) for g_id in genome_ids[n_rows / 20:]).keys()
+            t = time()
+            _parse_metadata(metadata_path=metadata_path,
+                            matrix_genome_ids=matrix_genome_ids,
+                            warning_callback=lambda w: None,
+                            error_callback=lambda e: None)
+            print "%10d %14d | %9.3fs" % (n_rows, len(matrix_genome_ids), time() - t)
+    finally:
+        rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Benchmark of the k-mer matrix bit packing/unpacking functions.
+
+Compares the row-by-row implementation that was used up to Kover 2.0.7 to the np.packbits/np.unpackbits engine in
+kover.utils and checks that both produce exactly the same bit layout.
+
+Usage: python benchmarks/bench_packing.py [--genomes 64 1000 10000] [--columns 100000] [--repeats 3]
+"""
+
+import argparse
+import numpy as np
+
+from math import ceil
+from time import time
+
+from kover.utils import _pack_binary_bytes_to_ints, _unpack_binary_bytes_from_ints
+
+
+def _legacy_pack(a, pack_size):
+    type = np.uint64 if pack_size == 64 else np.uint32
+    b = np.zeros((int(ceil(1.0 * a.shape[0] / pack_size)), a.shape[1]), dtype=type)
+    packed_rows = 0
+    packing_row = 0
+    for i in xrange(a.shape[0]):
+        if packed_rows == pack_size:
+            packed_rows = 0
+            packing_row += 1
+        tmp = np.asarray(a[i], dtype=type)
+        tmp = np.left_shift(tmp, type(pack_size - packed_rows - 1))
+        np.bitwise_or(b[packing_row], tmp, out=b[packing_row])
+        packed_rows += 1
+    return b
+
+
+def _legacy_unpack(a):
+    type = a.dtype
+    pack_size = 64 if type == np.uint64 else 32
+    unpacked_n_rows = a.shape[0] * pack_size
+    unpacked_n_columns = a.shape[1] if len(a.shape) > 1 else 1
+    b = np.zeros((unpacked_n_rows, a.shape[1]) if len(a.shape) > 1 else unpacked_n_rows, dtype=np.uint8)
+    packed_rows = 0
+    packing_row = 0
+    for i in xrange(b.shape[0]):
+        if packed_rows == pack_size:
+            packed_rows = 0
+            packing_row += 1
+        tmp = np.left_shift(np.ones(unpacked_n_columns, dtype=type), pack_size - (i - pack_size * packing_row) - 1)
+        np.bitwise_and(a[packing_row], tmp, tmp)
+        b[i] = tmp > 0
+        packed_rows += 1
+    return b
+
+
+def _best_time(func, repeats):
+    best = np.infty
+    result = None
+    for _ in xrange(repeats):
+        t = time()
+        result = func()
+        best = min(best, time() - t)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the k-mer matrix bit packing engine.")
+    parser.add_argument("--genomes", type=int, nargs="+", default=[64, 1000, 10000])
+    parser.add_argument("--columns", type=int, default=100000)
+    parser.add_argument("--model-columns", type=int, default=10,
+                        help="Number of columns unpacked at a time by get_columns/_predictions.")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--random-seed", type=int, default=42)
+    args = parser.parse_args()
+
+    random_generator = np.random.RandomState(args.random_seed)
+
+    print "%10s %10s | %12s %12s %8s | %12s %12s %8s" % ("genomes", "columns", "pack (old)", "pack (new)", "speedup",
+                                                         "unpack (old)", "unpack (new)", "speedup")
+    for n_genomes in args.genomes:
+        a = random_generator.randint(0, 2, size=(n_genomes, args.columns)).astype(np.uint8)
+
+        old_pack_time, old_packed = _best_time(lambda: _legacy_pack(a, 64), args.repeats)
+        new_pack_time, new_packed = _best_time(lambda: _pack_binary_bytes_to_ints(a, 64), args.repeats)
+        if not np.array_equal(old_packed, new_packed):
+            raise RuntimeError("The packed matrices differ for %d genomes." % n_genomes)
+
+        old_unpack_time, old_unpacked = _best_time(lambda: _legacy_unpack(new_packed), args.repeats)
+        new_unpack_time, new_unpacked = _best_time(lambda: _unpack_binary_bytes_from_ints(new_packed), args.repeats)
+        if not np.array_equal(old_unpacked, new_unpacked):
+            raise RuntimeError("The unpacked matrices differ for %d genomes." % n_genomes)
+
+        print "%10d %10d | %11.3fs %11.3fs %7.1fx | %11.3fs %11.3fs %7.1fx" % \
+              (n_genomes, args.columns,
+               old_pack_time, new_pack_time, old_pack_time / new_pack_time,
+               old_unpack_time, new_unpack_time, old_unpack_time / new_unpack_time)
+
+    # get_columns and _predictions unpack a handful of columns at a time, many times per run
+    print
+    print "%10s %10s | %12s %12s %8s" % ("genomes", "columns", "unpack (old)", "unpack (new)", "speedup")
+    for n_genomes in args.genomes:
+        a = random_generator.randint(0, 2, size=(n_genomes, args.model_columns)).astype(np.uint8)
+        packed = _pack_binary_bytes_to_ints(a, 64)
+        old_unpack_time, _ = _best_time(lambda: _legacy_unpack(packed), args.repeats)
+        new_unpack_time, _ = _best_time(lambda: _unpack_binary_bytes_from_ints(packed), args.repeats)
+        print "%10d %10d | %11.5fs %11.5fs %7.1fx" % (n_genomes, args.model_columns, old_unpack_time,
+                                                      new_unpack_time, old_unpack_time / new_unpack_time)
+
+
+if __name__ == "__main__":
+    main()
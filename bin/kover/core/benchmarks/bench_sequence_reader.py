@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Benchmark of the streaming sequence reader.
+
+Writes synthetic multi-megabase assemblies (plain and gzip-compressed FASTA) and reports the throughput of
+kover.utils._read_sequences and of the line-by-line reader that it replaced.
+
+Usage: python benchmarks/bench_sequence_reader.py [--contig-sizes 5000000 1000000] [--line-width 80]
+"""
+
+import argparse
+import gzip
+import numpy as np
+
+from os.path import getsize, join
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+from kover.utils import _read_sequences
+
+
+def _line_by_line_reader(path):
+    """
+    The previous FASTA reader: the contigs are built by concatenating their lines.
+    """
+    contigs = []
+    buffer = None
+    for l in open(path, "r"):
+        if l.startswith(">"):
+            if buffer is not None:
+                contigs.append(buffer.upper())
+                buffer = ""
+        else:
+            if buffer is None:
+                buffer = l.strip()
+            else:
+                buffer += l.strip()
+    if buffer is not None and buffer != "":
+        contigs.append(buffer.upper())
+    return contigs
+
+
+def _write_assembly(path, contig_sizes, line_width, random_generator):
+    nucleotides = np.array(list("ACGT"))
+    open_file = gzip.open if path.endswith(".gz") else open
+    with open_file(path, "wb") as f:
+        for i, size in enumerate(contig_sizes):
+            sequence = nucleotides[random_generator.randint(0, 4, size=size)].tostring()
+            f.write(">contig_%d length=%d\n" % (i, size))
+            f.writelines(sequence[j: j + line_width] + "\n" for j in xrange(0, size, line_width))
+
+
+def _best_time(read, path, repeats):
+    best = np.infty
+    for _ in xrange(repeats):
+        t = time()
+        n_bases = sum(len(s) for s in read(path))
+        best = min(best, time() - t)
+    return best, n_bases
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the streaming sequence reader.")
+    parser.add_argument("--contig-sizes", type=int, nargs="+", default=[5000000, 1000000, 500000] + [10000] * 50)
+    parser.add_argument("--line-width", type=int, default=80)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--random-seed", type=int, default=42)
+    parser.add_argument("--temp-dir", default=None)
+    args = parser.parse_args()
+
+    random_generator = np.random.RandomState(args.random_seed)
+    work_dir = mkdtemp(dir=args.temp_dir)
+    try:
+        plain_path = join(work_dir, "assembly.fa")
+        gzip_path = join(work_dir, "assembly.fa.gz")
+        _write_assembly(plain_path, args.contig_sizes, args.line_width, random_generator)
+        _write_assembly(gzip_path, args.contig_sizes, args.line_width, np.random.RandomState(args.random_seed))
+
+        print "%d contigs, %.1f Mbases, line width %d" % (len(args.contig_sizes), sum(args.contig_sizes) / 1e6,
+                                                          args.line_width)
+        print "%24s %12s | %10s %12s" % ("reader", "file (MB)", "time", "Mbases / s")
+        readers = [("line by line (plain)", _line_by_line_reader, plain_path),
+                   ("streaming (plain)", _read_sequences, plain_path),
+                   ("streaming (gzip)", _read_sequences, gzip_path)]
+        for name, read, path in readers:
+            best, n_bases = _best_time(read, path, args.repeats)
+            print "%24s %12.1f | %9.3fs %12.1f" % (name, getsize(path) / 1024.0 ** 2, best, n_bases / best / 1e6)
+    finally:
+        rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
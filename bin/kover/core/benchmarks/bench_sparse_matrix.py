@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Benchmark of the hybrid layout of the k-mer matrix (see kover dataset sparsify).
+
+Stores a random packed k-mer matrix in which most k-mers are rare, like those of the accessory genome of a large
+collection of genomes, with the dense layout and with the hybrid layout. Reports the storage size of each layout and
+times the calls that learning makes through KmerRuleClassifications: sum_rows over a training set and a
+cross-validation fold, and get_columns over a few columns.
+
+Usage: python benchmarks/bench_sparse_matrix.py [--genomes 1000 5000] [--kmers 200000] [--rare-fraction 0.9]
+"""
+
+import argparse
+import h5py as h
+import numpy as np
+
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+
+from kover.dataset.tools.chunk_layout import row_chunks
+from kover.dataset.tools.sparse_matrix import default_max_sparse_prevalence, open_kmer_matrix, \
+                                             write_hybrid_kmer_matrix
+from kover.learning.common.rules import KmerRuleClassifications
+from kover.utils import _hdf5_open_no_chunk_cache, _pack_binary_bytes_to_ints
+
+
+def _random_matrix(n_genomes, n_kmers, rare_fraction, random_generator, block_size=10000):
+    # The rare k-mers are present in a few genomes, and the others in a proportion of the genomes drawn uniformly
+    packed = np.zeros((int(np.ceil(n_genomes / 64.0)), n_kmers), dtype=np.uint64)
+    for start in xrange(0, n_kmers, block_size):
+        stop = min(start + block_size, n_kmers)
+        is_rare = random_generator.rand(stop - start) < rare_fraction
+        density = np.where(is_rare, random_generator.randint(1, 11, size=stop - start) * 1.0 / n_genomes,
+                           random_generator.rand(stop - start))
+        block = (random_generator.rand(n_genomes, stop - start) < density).astype(np.uint8)
+        packed[:, start:stop] = _pack_binary_bytes_to_ints(block, 64)
+    return packed
+
+
+def _storage_size(h5py_object):
+    if isinstance(h5py_object, h.Dataset):
+        return h5py_object.id.get_storage_size()
+    return sum(_storage_size(h5py_object[name]) for name in h5py_object)
+
+
+def _time_matrix(kmer_matrix, n_genomes, repeats, random_generator):
+    matrix = KmerRuleClassifications(kmer_matrix, n_genomes)
+    train = np.sort(random_generator.choice(n_genomes, n_genomes / 2, replace=False))
+    fold = np.sort(random_generator.choice(train, max(1, len(train) * 4 / 5), replace=False))
+    times = []
+    for rows in [train, fold]:
+        best = np.infty
+        for _ in xrange(repeats):
+            t = time()
+            matrix.sum_rows(rows)
+            best = min(best, time() - t)
+        times.append(best)
+    t = time()
+    for _ in xrange(20):
+        matrix.get_columns(np.sort(random_generator.choice(kmer_matrix.shape[1] * 2, 5, replace=False)).tolist())
+    times.append((time() - t) / 20)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the hybrid layout of the k-mer matrix.")
+    parser.add_argument("--genomes", type=int, nargs="+", default=[1000, 5000])
+    parser.add_argument("--kmers", type=int, default=200000)
+    parser.add_argument("--rare-fraction", type=float, default=0.9)
+    parser.add_argument("--compression", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--random-seed", type=int, default=42)
+    args = parser.parse_args()
+
+    random_generator = np.random.RandomState(args.random_seed)
+    compression_kwargs = dict(compression="gzip" if args.compression > 0 else None,
+                              compression_opts=args.compression if args.compression > 0 else None)
+
+    print "%8s %10s %8s %8s | %10s %12s %12s %14s" % ("genomes", "k-mers", "layout", "sparse", "size", "sum_rows",
+                                                      "sum_rows", "get_columns")
+    print "%8s %10s %8s %8s | %10s %12s %12s %14s" % ("", "", "", "columns", "(MB)", "(train)", "(fold)",
+                                                      "(5 columns)")
+    temp_dir = mkdtemp()
+    try:
+        for n_genomes in args.genomes:
+            packed = _random_matrix(n_genomes, args.kmers, args.rare_fraction, random_generator)
+            dense_path = join(temp_dir, "dense_%d.h5" % n_genomes)
+            hybrid_path = join(temp_dir, "hybrid_%d.h5" % n_genomes)
+
+            f = h.File(dense_path, "w")
+            f.create_dataset("kmer_matrix", data=packed, chunks=row_chunks(packed.shape[0], args.kmers),
+                             **compression_kwargs)
+            f.close()
+            del packed
+
+            source_file = h.File(dense_path, "r")
+            destination_file = h.File(hybrid_path, "w")
+            t = time()
+            n_sparse_columns = write_hybrid_kmer_matrix(source_file["kmer_matrix"], destination_file, n_genomes)
+            sparsify_time = time() - t
+            source_file.close()
+            destination_file.close()
+
+            for name, path, n_sparse in [("dense", dense_path, 0), ("hybrid", hybrid_path, n_sparse_columns)]:
+                f = _hdf5_open_no_chunk_cache(path)
+                kmer_matrix = open_kmer_matrix(f)
+                size = _storage_size(f)
+                train_time, fold_time, get_columns_time = _time_matrix(kmer_matrix, n_genomes, args.repeats,
+                                                                       random_generator)
+                f.close()
+                print "%8d %10d %8s %8d | %10.1f %11.3fs %11.3fs %13.5fs" % (n_genomes, args.kmers, name, n_sparse,
+                                                                             size / 1024.0 ** 2, train_time,
+                                                                             fold_time, get_columns_time)
+            print "%8d %10d sparsified in %.2fs (k-mers present in at most %d genomes)" % \
+                  (n_genomes, args.kmers, sparsify_time, default_max_sparse_prevalence(n_genomes))
+            print
+    finally:
+        rmtree(temp_dir)
+
+
+if __name__ == "__main__":
+    main()
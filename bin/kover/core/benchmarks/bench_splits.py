@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+Benchmark of the lazy splits of a dataset (see KoverDatasetSplit).
+
+Writes a dataset with many splits, each with cross-validation folds, in the layout of kover dataset split, and times
+the ways that the splits are used: listing their names, printing them (kover dataset info --splits), and reading the
+genomes of one split and of its folds (kover learn). The listing is also timed with every field of every split and
+fold read, as the splits were read before they were lazy.
+
+Usage: python benchmarks/bench_splits.py [--splits 12 48] [--folds 10] [--genomes 5000] [--kmers 1000000]
+"""
+
+import argparse
+import h5py as h
+import numpy as np
+
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import time
+from uuid import uuid1
+
+from kover.dataset.ds import KoverDataset
+
+
+def _write_split(group, n_genomes, n_kmers, n_folds, random_generator):
+    group.attrs["random_seed"] = 42
+    group.attrs["n_folds"] = n_folds
+    idx = random_generator.permutation(n_genomes).astype(np.uint32)
+    train_idx = np.sort(idx[:n_genomes * 2 / 3])
+    test_idx = np.sort(idx[n_genomes * 2 / 3:])
+    group.attrs["train_proportion"] = 1.0 * len(train_idx) / n_genomes
+    group.attrs["test_proportion"] = 1.0 * len(test_idx) / n_genomes
+    group.create_dataset("train_genome_idx", data=train_idx)
+    group.create_dataset("test_genome_idx", data=test_idx)
+    group.create_dataset("unique_risks", data=np.linspace(0, 1, 200))
+    # The risks by k-mer are large and are only read through the learning, so they are not filled
+    group.create_dataset("unique_risk_by_kmer", shape=(n_kmers,), dtype=np.uint8)
+    group.create_dataset("unique_risk_by_anti_kmer", shape=(n_kmers,), dtype=np.uint8)
+    if n_folds > 1:
+        folds = group.create_group("folds")
+        fold_by_genome = np.arange(len(train_idx)) % n_folds
+        for fold in xrange(n_folds):
+            fold_group = folds.create_group("fold_%d" % (fold + 1))
+            fold_group.create_dataset("train_genome_idx", data=train_idx[fold_by_genome != fold])
+            fold_group.create_dataset("test_genome_idx", data=train_idx[fold_by_genome == fold])
+            fold_group.create_dataset("unique_risks", data=np.linspace(0, 1, 200))
+            fold_group.create_dataset("unique_risk_by_kmer", shape=(n_kmers,), dtype=np.uint8)
+            fold_group.create_dataset("unique_risk_by_anti_kmer", shape=(n_kmers,), dtype=np.uint8)
+
+
+def _write_dataset(path, n_splits, n_folds, n_genomes, n_kmers, random_generator):
+    f = h.File(path, "w")
+    f.attrs["uuid"] = str(uuid1())
+    f.create_dataset("genome_identifiers", data=np.array(["genome_%d" % i for i in xrange(n_genomes)]))
+    splits = f.create_group("splits")
+    for i in xrange(n_splits):
+        _write_split(splits.create_group("split_%d" % (i + 1)), n_genomes, n_kmers, n_folds, random_generator)
+    f.close()
+
+
+def _read_every_field(dataset):
+    # What listing the splits cost before they were lazy: every array of every split and fold was read
+    for split in dataset.splits:
+        for name in ["train_genome_idx", "test_genome_idx", "unique_risks"]:
+            split.group[name][...]
+        for name in ["train_proportion", "test_proportion", "random_seed"]:
+            split.group.attrs[name]
+        for fold in split.folds:
+            for name in ["train_genome_idx", "test_genome_idx", "unique_risks"]:
+                fold.group[name][...]
+            fold.group["unique_risk_by_kmer"], fold.group["unique_risk_by_anti_kmer"]
+        split.group["unique_risk_by_kmer"], split.group["unique_risk_by_anti_kmer"]
+
+
+def _read_one_split(dataset, split_name):
+    # What kover learn reads: the genomes of one split and of its folds
+    split = dataset.get_split(split_name)
+    split.train_genome_idx, split.test_genome_idx
+    for fold in split.folds:
+        fold.train_genome_idx, fold.test_genome_idx
+
+
+def _best_time(path, function, repeats):
+    best = np.infty
+    for _ in xrange(repeats):
+        dataset = KoverDataset(path)
+        t = time()
+        function(dataset)
+        best = min(best, time() - t)
+        dataset.close()
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the lazy splits of a dataset.")
+    parser.add_argument("--splits", type=int, nargs="+", default=[12, 48])
+    parser.add_argument("--folds", type=int, default=10)
+    parser.add_argument("--genomes", type=int, default=5000)
+    parser.add_argument("--kmers", type=int, default=1000000)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--random-seed", type=int, default=42)
+    args = parser.parse_args()
+
+    random_generator = np.random.RandomState(args.random_seed)
+
+    print "%8s %8s | %12s %12s %12s %14s" % ("splits", "folds", "split_names", "print", "one split",
+                                             "every field")
+    temp_dir = mkdtemp()
+    try:
+        for n_splits in args.splits:
+            path = join(temp_dir, "splits_%d.kover" % n_splits)
+            _write_dataset(path, n_splits, args.folds, args.genomes, args.kmers, random_generator)
+            names_time = _best_time(path, lambda d: d.split_names, args.repeats)
+            print_time = _best_time(path, lambda d: [str(split) for split in d.splits], args.repeats)
+            one_split_time = _best_time(path, lambda d: _read_one_split(d, "split_%d" % n_splits), args.repeats)
+            every_field_time = _best_time(path, _read_every_field, args.repeats)
+            print "%8d %8d | %11.4fs %11.4fs %11.4fs %13.4fs" % (n_splits, args.folds, names_time, print_time,
+                                                                 one_split_time, every_field_time)
+    finally:
+        rmtree(temp_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+#!/usr/bin/env python
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import h5py as h
+import logging
+import numpy as np
+
+from math import ceil
+from os import getpid, mkdir
+from os.path import exists, join
+from shutil import rmtree
+from time import time
+from uuid import uuid1
+
+from ..utils import _init_callback_functions, _minimum_uint_size, _unpack_binary_bytes_from_ints
+from .create import BLOCK_SIZE, KMER_MATRIX_PACKING_SIZE, PHENOTYPE_LABEL_DTYPE
+from .ds import APPEND_IN_PROGRESS
+from .tools.kmer_engine import build_packed_matrix, canonical_kmers, count_kmers, decode_kmers, encode_kmer_sequences, \
+                               MAX_KMER_SIZE
+from .summary import write_summary
+from .tools.chunk_layout import row_chunks
+from .tools.kmer_classes import KMER_CLASSES_GROUP
+from .tools.kmer_index import build_kmer_index
+from .tools.shards import SHARDS_GROUP
+from .tools.sparse_matrix import SPARSE_GROUP
+
+
+def _dataset_compression(h5py_dataset):
+    return dict(compression=h5py_dataset.compression, compression_opts=h5py_dataset.compression_opts,
+                shuffle=h5py_dataset.shuffle)
+
+
+def _make_resizable(h5py_file, name, dtype=None, chunks=None):
+    """
+    Replaces a dataset by a copy that can be resized along all of its dimensions. This is only required for datasets
+    that were created with a fixed shape. The data are copied by blocks of columns. The copy keeps the chunk shape of
+    the dataset, unless another one is specified or the dataset is not chunked.
+    """
+    dataset = h5py_file[name]
+    dtype = dataset.dtype if dtype is None else dtype
+    if chunks is None:
+        chunks = dataset.chunks
+    if chunks is None:
+        chunks = (1, min(dataset.shape[1], BLOCK_SIZE)) if len(dataset.shape) == 2 else \
+                 (min(dataset.shape[0], BLOCK_SIZE),)
+    logging.debug("Copying %s to a resizable dataset." % name)
+    copy = h5py_file.create_dataset(name + "_resizable",
+                                    shape=dataset.shape,
+                                    maxshape=(None,) * len(dataset.shape),
+                                    dtype=dtype,
+                                    chunks=chunks,
+                                    **_dataset_compression(dataset))
+    for key, value in dataset.attrs.iteritems():
+        copy.attrs[key] = value
+    for block_start in xrange(0, dataset.shape[-1], BLOCK_SIZE):
+        block_stop = min(block_start + BLOCK_SIZE, dataset.shape[-1])
+        copy[..., block_start:block_stop] = dataset[..., block_start:block_stop]
+    del h5py_file[name]
+    h5py_file.move(name + "_resizable", name)
+    return h5py_file[name]
+
+
+def _is_resizable(h5py_dataset, dtype=None):
+    return all(m is None for m in h5py_dataset.maxshape) and (dtype is None or h5py_dataset.dtype == dtype)
+
+
+def _parse_appended_metadata(metadata_path, genome_ids, phenotype_tags, error_callback):
+    """
+    Finds the label of the appended genomes. The labels must be among the tags of the dataset's phenotype.
+    """
+    label_by_genome_id = dict(l.split() for l in open(metadata_path, "r"))
+    label_by_tag = dict((t, i) for i, t in enumerate(phenotype_tags))
+    labels = []
+    for g_id in genome_ids:
+        if g_id not in label_by_genome_id:
+            error_callback(Exception("Missing metadata for genome %s." % g_id))
+        if label_by_genome_id[g_id] not in label_by_tag:
+            error_callback(Exception("The phenotype of genome %s (%s) is not one of the phenotypes of the dataset (%s)."
+                                     % (g_id, label_by_genome_id[g_id], ", ".join(phenotype_tags))))
+        labels.append(label_by_tag[label_by_genome_id[g_id]])
+    return np.array(labels, dtype=PHENOTYPE_LABEL_DTYPE)
+
+
+def _replace_small_dataset(h5py_file, name, data):
+    """
+    Replaces a small dataset (e.g., the genome identifiers) by a new one, keeping its attributes and compression.
+    """
+    dataset = h5py_file[name]
+    attributes = dict(dataset.attrs.iteritems())
+    compression = _dataset_compression(dataset)
+    del h5py_file[name], dataset
+    dataset = h5py_file.create_dataset(name, data=data, **compression)
+    for key, value in attributes.iteritems():
+        dataset.attrs[key] = value
+
+
+def append_contigs(dataset_path, contig_list_path, phenotype_metadata_path, temp_dir, nb_cores, warning_callback=None,
+                   error_callback=None, progress_callback=None):
+    """
+    Appends genomes to an existing dataset. The k-mers of the new genomes are counted with the python k-mer counter.
+
+    The k-mers that are already in the dataset gain the presence/absence of the new genomes, while the k-mers that are
+    only found in the new genomes are added as new columns of the k-mer matrix in which the existing genomes are
+    absent. The existing chunks of the k-mer matrix are not rewritten, except for the last packed row when it is
+    shared by existing and new genomes.
+
+    Parameters:
+    -----------
+    dataset_path: str
+        The dataset to which the genomes are appended.
+    contig_list_path: str
+        A file with one line per new genome in the format GENOME_ID{tab}PATH, where the path refers to a fasta file
+        containing the genome's contigs.
+    phenotype_metadata_path: str
+        A file with the phenotype of the new genomes (GENOME_ID{tab}PHENOTYPE). Required if the dataset has phenotypic
+        metadata. The phenotypes must be among those of the dataset.
+    temp_dir: str
+        The directory where temporary files are written.
+    nb_cores: int
+        The number of processes used to count the k-mers (0 means all the cores).
+
+    Notes:
+    ------
+    Datasets that contain splits are rejected, since the splits (and their fold assignments) would no longer cover all
+    the genomes. Create the splits after appending the genomes. Datasets whose k-mers are grouped into equivalence
+    classes are also rejected, as well as sharded and sparsified datasets. Append the genomes to the dataset before
+    sharding or sparsifying it.
+
+    The singleton k-mer filter of the dataset is applied to the k-mers that only occur in the new genomes.
+    """
+    warning_callback, error_callback, progress_callback = _init_callback_functions(warning_callback, error_callback,
+                                                                                   progress_callback)
+
+    h5py_file = h.File(dataset_path, "r+")
+    try:
+        if "splits" in h5py_file and len(h5py_file["splits"]) > 0:
+            split_names = ", ".join(h5py_file["splits"].keys())
+            error_callback(Exception("Genomes cannot be appended to a dataset that contains splits (%s). The splits "
+                                     "would not include the new genomes." % split_names))
+        if KMER_CLASSES_GROUP in h5py_file:
+            error_callback(Exception("Genomes cannot be appended to a dataset whose k-mers are grouped into "
+                                     "equivalence classes, since the new genomes could distinguish the k-mers of a "
+                                     "class."))
+        if SHARDS_GROUP in h5py_file:
+            error_callback(Exception("Genomes cannot be appended to a sharded dataset. Append the genomes to the "
+                                     "dataset from which it was sharded."))
+        if SPARSE_GROUP in h5py_file:
+            error_callback(Exception("Genomes cannot be appended to a dataset whose rare k-mers are stored as genome "
+                                     "lists. Append the genomes to the dataset from which it was sparsified."))
+        if APPEND_IN_PROGRESS in h5py_file.attrs:
+            error_callback(Exception("A previous append of genomes to the dataset was interrupted, so the dataset is "
+                                     "incomplete. Create it again."))
+
+        kmer_sequences = h5py_file["kmer_sequences"]
+        is_2bit_encoded = kmer_sequences.attrs.get("encoding", "ascii") == "2bit"
+        kmer_size = int(kmer_sequences.attrs["kmer_length"]) if is_2bit_encoded else len(kmer_sequences[0])
+        if kmer_size > MAX_KMER_SIZE:
+            error_callback(ValueError("Genomes can only be appended to datasets with k-mers of length at most %d." %
+                                      MAX_KMER_SIZE))
+
+        # Find the contig file for each genome and verify that it exists
+        new_genome_ids = []
+        contig_files = []
+        for l in open(contig_list_path, "r"):
+            g_id, contig_file = l.split()
+            if not exists(contig_file):
+                error_callback(IOError("The contig file for genome %s cannot be found: %s" % (str(g_id), contig_file)))
+            new_genome_ids.append(g_id)
+            contig_files.append(contig_file)
+
+        genome_ids = h5py_file["genome_identifiers"][...]
+        if len(set(new_genome_ids)) < len(new_genome_ids) or len(set(new_genome_ids) & set(genome_ids)) > 0:
+            error_callback(Exception("The genomic data contains genomes with the same identifier."))
+        logging.debug("Appending %d genomes to a dataset of %d genomes." % (len(new_genome_ids), len(genome_ids)))
+
+        if "phenotype" in h5py_file:
+            if phenotype_metadata_path is None:
+                error_callback(ValueError("The dataset has phenotypic metadata, so the phenotype of the new genomes "
+                                          "must be specified."))
+            phenotype_tags = h5py_file["phenotype_tags"][...] if "phenotype_tags" in h5py_file else np.array(["0", "1"])
+            new_labels = _parse_appended_metadata(phenotype_metadata_path, new_genome_ids, phenotype_tags,
+                                                 error_callback)
+
+        # Make sure that the tmp data is unique to the current process
+        temp_dir = join(temp_dir, str(getpid()))
+        if not exists(temp_dir):
+            mkdir(temp_dir)
+
+        genome_kmer_files = count_kmers(fasta_path_by_genome=contig_files,
+                                        kmer_size=kmer_size,
+                                        out_dir=temp_dir,
+                                        n_cpu=int(nb_cores),
+                                        progress_callback=progress_callback)
+
+        # Index the existing k-mers by their canonical encoding
+        logging.debug("Indexing the k-mers of the dataset.")
+        n_kmers = kmer_sequences.shape[0]
+        existing_kmers = np.empty(n_kmers, dtype=np.uint64)
+        existing_is_valid = np.empty(n_kmers, dtype=np.bool)
+        for block_start in xrange(0, n_kmers, BLOCK_SIZE):
+            block_stop = min(block_start + BLOCK_SIZE, n_kmers)
+            if is_2bit_encoded:
+                # The k-mers are already encoded, in a single word since k <= MAX_KMER_SIZE
+                existing_kmers[block_start:block_stop] = canonical_kmers(kmer_sequences[block_start:block_stop, 0],
+                                                                         kmer_size)
+                existing_is_valid[block_start:block_stop] = True
+            else:
+                existing_kmers[block_start:block_stop], existing_is_valid[block_start:block_stop] = \
+                    encode_kmer_sequences(kmer_sequences[block_start:block_stop], kmer_size)
+        existing_kmer_idx = np.flatnonzero(existing_is_valid)
+        existing_kmer_idx = existing_kmer_idx[np.argsort(existing_kmers[existing_kmer_idx], kind="mergesort")]
+        existing_kmers = existing_kmers[existing_kmer_idx]
+        del existing_is_valid
+
+        kmer_by_matrix_column = h5py_file["kmer_by_matrix_column"][...]
+        column_by_kmer = np.empty(n_kmers, dtype=np.int64)
+        column_by_kmer[kmer_by_matrix_column] = np.arange(len(kmer_by_matrix_column))
+        existing_columns = column_by_kmer[existing_kmer_idx]
+        del kmer_by_matrix_column, column_by_kmer, existing_kmer_idx
+
+        # Merge the k-mers of the new genomes with those of the dataset
+        logging.debug("Merging the k-mers of the new genomes with those of the dataset.")
+        n_genomes = len(genome_ids)
+        n_packed_rows = int(ceil(1.0 * n_genomes / KMER_MATRIX_PACKING_SIZE))
+        first_packed_row = n_genomes / KMER_MATRIX_PACKING_SIZE
+        n_new_packed_rows = int(ceil(1.0 * (n_genomes + len(new_genome_ids)) / KMER_MATRIX_PACKING_SIZE)) - \
+                            first_packed_row
+        min_genome_count = 2 if h5py_file.attrs.get("filter", "nothing") == "singleton" else 1
+        existing_rows = np.zeros((n_new_packed_rows, h5py_file["kmer_matrix"].shape[1]), dtype=np.uint64)
+        added_kmers = []
+        added_rows = []
+        progress_callback("Merging", 0.)
+        for block_kmers, block_packed in build_packed_matrix(genome_kmer_files, min_genome_count=1,
+                                                             pack_size=KMER_MATRIX_PACKING_SIZE,
+                                                             first_genome_idx=n_genomes):
+            position = np.minimum(np.searchsorted(existing_kmers, block_kmers), max(len(existing_kmers) - 1, 0))
+            is_existing = existing_kmers[position] == block_kmers if len(existing_kmers) > 0 else \
+                          np.zeros(len(block_kmers), dtype=np.bool)
+            existing_rows[:, existing_columns[position[is_existing]]] = block_packed[:, is_existing]
+
+            is_added = ~is_existing
+            if min_genome_count > 1:
+                is_added[is_added] = _unpack_binary_bytes_from_ints(block_packed[:, is_added]).sum(axis=0) >= \
+                                     min_genome_count
+            added_kmers.append(block_kmers[is_added])
+            added_rows.append(block_packed[:, is_added])
+        added_kmers = np.hstack(added_kmers) if len(added_kmers) > 0 else np.array([], dtype=np.uint64)
+        added_rows = np.hstack(added_rows) if len(added_rows) > 0 else np.zeros((n_new_packed_rows, 0), dtype=np.uint64)
+        del existing_kmers, existing_columns
+        logging.debug("%d k-mers were added to the dataset." % len(added_kmers))
+
+        # The dataset is incomplete until all the genomes are appended. It is marked as such, so that it is refused
+        # (see KoverDataset.dataset_open) if the append is interrupted.
+        h5py_file.attrs[APPEND_IN_PROGRESS] = True
+        h5py_file.flush()
+
+        # Make sure that the datasets can grow. Datasets created with a fixed shape are copied once.
+        new_n_kmers = n_kmers + len(added_kmers)
+        if not _is_resizable(kmer_sequences):
+            warning_callback("The k-mer sequences of the dataset were created with a fixed shape. They will be copied "
+                             "to a resizable dataset.")
+            kmer_sequences = _make_resizable(h5py_file, "kmer_sequences",
+                                             chunks=(max(1, min(n_kmers, BLOCK_SIZE)),) + kmer_sequences.shape[1:])
+        kmer_by_matrix_column_dtype = np.dtype(_minimum_uint_size(new_n_kmers))
+        if h5py_file["kmer_by_matrix_column"].dtype.itemsize >= kmer_by_matrix_column_dtype.itemsize:
+            kmer_by_matrix_column_dtype = h5py_file["kmer_by_matrix_column"].dtype
+        if not _is_resizable(h5py_file["kmer_by_matrix_column"], dtype=kmer_by_matrix_column_dtype):
+            _make_resizable(h5py_file, "kmer_by_matrix_column", dtype=kmer_by_matrix_column_dtype)
+        kmer_by_matrix_column = h5py_file["kmer_by_matrix_column"]
+        kmer_matrix = h5py_file["kmer_matrix"]
+        if not _is_resizable(kmer_matrix):
+            warning_callback("The k-mer matrix of the dataset was created with a fixed shape. It will be copied to a "
+                             "resizable dataset, which requires rewriting it once.")
+            chunks = kmer_matrix.chunks
+            if chunks is None:
+                # A matrix that is not chunked is copied with one packed row per chunk
+                chunks = row_chunks(*kmer_matrix.shape)
+                h5py_file.attrs["chunk_policy"] = "row"
+                h5py_file.attrs["chunk_shape"] = chunks
+            kmer_matrix = _make_resizable(h5py_file, "kmer_matrix", chunks=chunks)
+
+        # Write the k-mers that were added
+        logging.debug("Writing the new k-mers.")
+        kmer_sequences.resize(new_n_kmers, axis=0)
+        kmer_by_matrix_column.resize((new_n_kmers,))
+        for block_start in xrange(0, len(added_kmers), BLOCK_SIZE):
+            block_stop = min(block_start + BLOCK_SIZE, len(added_kmers))
+            if is_2bit_encoded:
+                kmer_sequences[n_kmers + block_start: n_kmers + block_stop] = \
+                    added_kmers[block_start:block_stop].reshape(-1, 1)
+            else:
+                kmer_sequences[n_kmers + block_start: n_kmers + block_stop] = \
+                    decode_kmers(added_kmers[block_start:block_stop], kmer_size)
+            kmer_by_matrix_column[n_kmers + block_start: n_kmers + block_stop] = \
+                np.arange(n_kmers + block_start, n_kmers + block_stop)
+
+        # Write the packed rows of the new genomes. Only the chunks of the new rows are written, in addition to those of
+        # the last existing row if it is shared with the new genomes.
+        logging.debug("Writing the packed rows of the new genomes.")
+        kmer_matrix.resize((first_packed_row + n_new_packed_rows, new_n_kmers))
+        n_blocks = int(ceil(1.0 * new_n_kmers / BLOCK_SIZE))
+        for block_idx, block_start in enumerate(xrange(0, new_n_kmers, BLOCK_SIZE)):
+            block_stop = min(block_start + BLOCK_SIZE, new_n_kmers)
+            if block_stop <= n_kmers:
+                block = existing_rows[:, block_start:block_stop]
+            elif block_start >= n_kmers:
+                block = added_rows[:, block_start - n_kmers: block_stop - n_kmers]
+            else:
+                block = np.hstack((existing_rows[:, block_start:], added_rows[:, : block_stop - n_kmers]))
+
+            for row in xrange(n_new_packed_rows):
+                if first_packed_row + row < n_packed_rows and block_start < n_kmers:
+                    # This row is shared with existing genomes
+                    block[row] |= kmer_matrix[first_packed_row + row, block_start:block_stop]
+                elif not block[row].any():
+                    continue  # Unwritten chunks are read as zeros
+                kmer_matrix[first_packed_row + row, block_start:block_stop] = block[row]
+            progress_callback("Appending", 1.0 * (block_idx + 1) / n_blocks)
+        del existing_rows, added_rows
+
+        # Update the genome identifiers and the phenotypes
+        _replace_small_dataset(h5py_file, "genome_identifiers", np.hstack((genome_ids, new_genome_ids)))
+        if "phenotype" in h5py_file:
+            _replace_small_dataset(h5py_file, "phenotype", np.hstack((h5py_file["phenotype"][...], new_labels)))
+
+        # The index must include the k-mers that were added
+        build_kmer_index(h5py_file, _dataset_compression(kmer_sequences))
+
+        # The content of the dataset changed, so it gets a new identifier
+        h5py_file.attrs["uuid"] = str(uuid1())
+        h5py_file.attrs["appended"] = time()
+        appended_genomic_data = h5py_file.attrs["appended_genomic_data"] if "appended_genomic_data" in h5py_file.attrs \
+                                else ""
+        h5py_file.attrs["appended_genomic_data"] = (appended_genomic_data + "\n" + contig_list_path).strip()
+        del h5py_file.attrs[APPEND_IN_PROGRESS]
+    finally:
+        h5py_file.close()
+
+    logging.debug("Removing temporary files.")
+    rmtree(temp_dir)
+    write_summary(dataset_path)
+    logging.debug("Genome append completed.")
@@ -18,27 +18,46 @@
 	along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import gc
 import h5py as h
 import logging
 import numpy as np
-import pandas as pd
+import sys
 
+from collections import deque
+from functools import partial
+from itertools import chain
 from math import ceil
-from os import getpid, mkdir, listdir
-from os.path import basename, exists, getsize, join, splitext
+from multiprocessing import Pool, cpu_count
+from os import getpid, mkdir, listdir, remove, rename
+from os.path import abspath, basename, dirname, exists, getmtime, join, splitext
 from shutil import rmtree
 from time import time
 from uuid import uuid1
 
-from ..utils import _minimum_uint_size, _pack_binary_bytes_to_ints
+from ..utils import _minimum_uint_size
+from .tools.chunk_layout import choose_chunks, CHUNK_POLICIES
 from .tools.kmer_count import contigs_count_kmers, reads_count_kmers
-from .tools.kmer_pack import contigs_pack_kmers, reads_pack_kmers
+from .tools.kmer_index import build_kmer_index
+from .tools.kmer_engine import build_packed_matrix, count_kmers, decode_kmers, kmer_word_count, merge_ranges, \
+                                pack_kmer_sequences, MAX_KMER_SIZE as MAX_PYTHON_KMER_SIZE
+from .tools.kmer_pack import contigs_pack_kmers, merge_kmer_ranges, reads_pack_kmers, sort_genome_kmers, \
+                             MERGE_RANGE_SIZE
+from .tools.manifest import CreationManifest, resumable_work_dir
+from .tools.prevalence import copy_filtered_dataset, new_removal_counts, prevalence_bounds, prevalence_mask, \
+                               record_prevalence_filter
+from .summary import write_summary
+from .tools.tsv_matrix import find_block_offsets, is_tsv_stream, parse_tsv_block, parse_tsv_lines, read_tsv_header, \
+    read_tsv_stream_blocks, read_tsv_stream_header
 
 KMER_MATRIX_PACKING_SIZE = 64
 KMER_MATRIX_DTYPE = np.uint64
 PHENOTYPE_LABEL_DTYPE = np.uint8
 BLOCK_SIZE = 100000
+STREAM_PENDING_BYTES = 256 * 1024 * 1024  # Bytes of k-mer matrix lines read from a stream and not yet written
+KMER_COUNTERS = ["dsk", "python"]
+COMPRESSION_FILTERS = ["gzip", "gzip-shuffle", "lzf", "none"]
+KMER_ENCODINGS = ["ascii", "2bit"]
+CHECKPOINT_GENOME_BATCH_SIZE = 16  # Genomes counted by each call to multidsk when the creation is resumable
 
 
 def _create_hdf5_file_no_chunk_caching(path):
@@ -62,20 +81,320 @@ def _create_hdf5_file_no_chunk_caching(path):
     return h5py_file
 
 
+def _compression_kwargs(compression_filter, gzip):
+    """
+    Returns the compression arguments of h5py's create_dataset for a compression filter.
+
+    Parameters:
+    -----------
+    compression_filter: str
+        One of COMPRESSION_FILTERS: "gzip", "gzip-shuffle" (the bytes of the packed integers are shuffled before gzip
+        compression), "lzf" (faster, but compresses less) or "none".
+    gzip: int
+        The gzip compression level (0 - 9). 0 means no compression.
+    """
+    if compression_filter == "gzip":
+        return dict(compression="gzip" if gzip > 0 else None, compression_opts=gzip if gzip > 0 else None)
+    elif compression_filter == "gzip-shuffle":
+        return dict(compression="gzip" if gzip > 0 else None, compression_opts=gzip if gzip > 0 else None,
+                    shuffle=gzip > 0)
+    elif compression_filter == "lzf":
+        return dict(compression="lzf")
+    elif compression_filter == "none":
+        return dict(compression=None)
+    else:
+        raise ValueError("Unknown compression filter: %s. The available filters are %s." %
+                         (compression_filter, ", ".join(COMPRESSION_FILTERS)))
+
+
+def _compression_description(compression_filter, gzip):
+    if compression_filter == "gzip":
+        return "gzip (level %d)" % gzip
+    elif compression_filter == "gzip-shuffle":
+        return "gzip with shuffle (level %d)" % gzip
+    return compression_filter
+
+
+def _create_kmer_sequences(h5py_file, kmer_size, kmer_encoding, n_kmers, compression_kwargs, chunks=None):
+    """
+    Creates the k-mer sequence dataset.
+
+    Parameters:
+    -----------
+    kmer_encoding: str
+        One of KMER_ENCODINGS: "ascii" (each k-mer is a string of kmer_size bytes) or "2bit" (each k-mer is encoded in
+        kmer_word_count(kmer_size) uint64 words, see pack_kmer_sequences). The encoding and the k-mer length of 2-bit
+        encoded k-mers are recorded in the attributes of the dataset.
+    n_kmers: int
+        The number of k-mers. The dataset can grow.
+    """
+    if kmer_encoding == "ascii":
+        return h5py_file.create_dataset("kmer_sequences",
+                                        shape=(n_kmers,),
+                                        maxshape=(None,),
+                                        dtype="S%d" % kmer_size,
+                                        chunks=chunks,
+                                        **compression_kwargs)
+    elif kmer_encoding == "2bit":
+        n_words = kmer_word_count(kmer_size)
+        kmers = h5py_file.create_dataset("kmer_sequences",
+                                         shape=(n_kmers, n_words),
+                                         maxshape=(None, None),
+                                         dtype=np.uint64,
+                                         chunks=(chunks[0], n_words) if chunks is not None else None,
+                                         **compression_kwargs)
+        kmers.attrs["encoding"] = kmer_encoding
+        kmers.attrs["kmer_length"] = kmer_size
+        return kmers
+    else:
+        raise ValueError("Unknown k-mer encoding: %s. The available encodings are %s." %
+                         (kmer_encoding, ", ".join(KMER_ENCODINGS)))
+
+
+def _encode_kmer_sequences(kmers, kmer_size, kmer_encoding, error_callback):
+    """
+    Converts a block of k-mer sequences to the encoding of the k-mer sequence dataset.
+    """
+    if kmer_encoding == "ascii":
+        return kmers
+    words, is_valid = pack_kmer_sequences(kmers, kmer_size)
+    if not is_valid.all():
+        error_callback(ValueError("The k-mer %s cannot be 2-bit encoded. Only the nucleotides A, C, G and T are "
+                                  "supported." % kmers[np.flatnonzero(~is_valid)[0]]))
+    return words
+
+
+def _work_dir(temp_dir, output_path, resume, parameters):
+    """
+    Returns the work directory of a dataset creation and the manifest of the completed work (None if the creation is
+    not resumable).
+
+    The work directory of a resumable creation only depends on the output path, so that a rerun of the same command
+    finds the work of the interrupted run. Otherwise, the work directory is unique to the current process.
+    """
+    if resume:
+        work_dir = resumable_work_dir(temp_dir, output_path)
+        return work_dir, CreationManifest(work_dir, parameters)
+
+    # Make sure that the tmp data is unique to the current process
+    work_dir = join(temp_dir, str(getpid()))
+    if not exists(work_dir):
+        mkdir(work_dir)
+    return work_dir, None
+
+
+def _count_kmers_dsk(count_function, input_lines, output_files, genome_ids, work_dir, manifest, error_callback,
+                     **count_kwargs):
+    """
+    Counts the k-mers of the genomes with multidsk.
+
+    When the creation is resumable, the genomes are counted in batches of CHECKPOINT_GENOME_BATCH_SIZE and each batch
+    is recorded in the manifest once its outputs are written. The genomes recorded by a previous run are skipped.
+    """
+    list_path = join(work_dir, "list_files")
+    if manifest is None:
+        open(list_path, "w").writelines(input_lines)
+        count_function(file_path=list_path, out_dir=work_dir, **count_kwargs)
+        return
+
+    completed_genomes = manifest.completed_genomes
+    remaining = [i for i, g_id in enumerate(genome_ids) if str(g_id) not in completed_genomes]
+    logging.debug("Resuming the k-mer counting: %d genomes remaining." % len(remaining))
+    for start in xrange(0, len(remaining), CHECKPOINT_GENOME_BATCH_SIZE):
+        batch = remaining[start: start + CHECKPOINT_GENOME_BATCH_SIZE]
+        open(list_path, "w").writelines(input_lines[i] for i in batch)
+        count_function(file_path=list_path, out_dir=work_dir, **count_kwargs)
+        for i in batch:
+            if not exists(output_files[i]):
+                error_callback(IOError("The k-mers of genome %s were not counted: %s is missing." %
+                                       (str(genome_ids[i]), output_files[i])))
+        manifest.mark_genomes_completed(str(genome_ids[i]) for i in batch)
+
+
+def _checkpointed_blocks(n_ranges, merge_pending_ranges, work_dir, manifest):
+    """
+    Merges the k-mers of the genomes range by range and saves the blocks of each range in the work directory before
+    recording the range in the manifest. The ranges recorded by a previous run are read back instead of being merged
+    again.
+
+    Parameters:
+    -----------
+    n_ranges: int
+        The number of ranges of k-mers (see merge_ranges).
+    merge_pending_ranges: function
+        Called with the indices of the ranges that were not completed by a previous run. Returns a generator that
+        yields the list of the merged blocks of each of these ranges, in order.
+
+    Returns:
+    --------
+    A generator that yields the merged blocks of all the ranges, in order.
+    """
+    completed_blocks = set(manifest.completed_blocks)
+    merged_ranges = merge_pending_ranges([i for i in xrange(n_ranges) if i not in completed_blocks])
+    for block_idx in xrange(n_ranges):
+        block_path = join(work_dir, "block_%d.npz" % block_idx)
+        if block_idx not in completed_blocks:
+            range_blocks = next(merged_ranges)
+            # The blocks of a range are saved together. Ranges without any k-mer that passes the filter are not saved.
+            if len(range_blocks) > 0:
+                np.savez(block_path + ".tmp.npz",
+                         kmers=np.hstack([kmers for kmers, _ in range_blocks]),
+                         packed=np.hstack([packed for _, packed in range_blocks]))
+                rename(block_path + ".tmp.npz", block_path)
+            manifest.mark_block_completed(block_idx)
+        else:
+            logging.debug("Merged block %d was completed by a previous run." % block_idx)
+
+        if exists(block_path):
+            block = np.load(block_path)
+            yield block["kmers"], block["packed"]
+
+    # Let the merge run to completion, so that it releases its resources (e.g., a pool of processes)
+    for _ in merged_ranges:
+        pass
+
+
+def _pack_dsk_kmers(pack_function, dsk_files, work_dir, manifest, kmer_size, filter_singleton, nb_cores,
+                    progress_callback):
+    """
+    Sorts and merges the k-mers counted by DSK (see contigs_pack_kmers). When the creation is resumable, the sorting
+    is recorded in the manifest once all the genomes are sorted and the merged ranges are checkpointed (see
+    _checkpointed_blocks).
+
+    Returns:
+    --------
+    genome_kmer_files: list
+        The file that contains the sorted k-mers of each genome.
+    blocks: generator
+        The packed blocks of the k-mer matrix, in sorted order.
+    """
+    if manifest is None:
+        return pack_function(dsk_files=dsk_files,
+                             out_dir=work_dir,
+                             kmer_length=int(kmer_size),
+                             filter_singleton=filter_singleton,
+                             n_cpu=int(nb_cores),
+                             progress_callback=progress_callback)
+
+    if manifest.is_step_completed("sort_kmers"):
+        logging.debug("The k-mers of the genomes were sorted by a previous run.")
+        genome_kmer_files = [join(work_dir, "%d.npy" % i) for i in xrange(len(dsk_files))]
+    else:
+        genome_kmer_files = sort_genome_kmers(dsk_files=dsk_files,
+                                              out_dir=work_dir,
+                                              n_cpu=int(nb_cores),
+                                              progress_callback=progress_callback)
+        manifest.mark_step_completed("sort_kmers")
+
+    ranges = merge_ranges(genome_kmer_files, merge_block_size=MERGE_RANGE_SIZE)
+    merge_pending_ranges = lambda pending: merge_kmer_ranges(genome_kmer_files=genome_kmer_files,
+                                                             ranges=[ranges[i] for i in pending],
+                                                             kmer_length=int(kmer_size),
+                                                             filter_singleton=filter_singleton,
+                                                             n_cpu=int(nb_cores),
+                                                             progress_callback=progress_callback)
+    return genome_kmer_files, _checkpointed_blocks(len(ranges), merge_pending_ranges, work_dir, manifest)
+
+
+def _create_kmer_matrix(h5py_file, n_genomes, n_kmers, chunk_policy, sample, compression_kwargs, expected_n_kmers=None,
+                        temp_dir=None):
+    """
+    Creates the k-mer matrix dataset with the chunk shape selected by a chunk layout policy. The policy and the chunk
+    shape are recorded in the attributes of the dataset.
+
+    Parameters:
+    -----------
+    n_kmers: int
+        The number of k-mers (columns) in the matrix. The matrix is created with this number of columns and can grow.
+    sample: numpy_array
+        The first columns of the packed k-mer matrix, used by the autotune policy.
+    compression_kwargs: dict
+        The compression arguments of the datasets (see _compression_kwargs).
+    expected_n_kmers: int
+        The expected number of k-mers, when the matrix is created empty and grows as the k-mers are written.
+    """
+    n_packed_rows = int(ceil(1.0 * n_genomes / KMER_MATRIX_PACKING_SIZE))
+    logging.debug("Selecting the chunk shape of the kmer matrix (policy: %s)." % chunk_policy)
+    chunks = choose_chunks(policy=chunk_policy,
+                           sample=sample,
+                           n_genomes=n_genomes,
+                           n_columns=max(n_kmers, expected_n_kmers or 0, sample.shape[1]),
+                           compression_kwargs=compression_kwargs,
+                           temp_dir=temp_dir)
+    logging.debug("Creating the kmer matrix dataset with chunks of shape %s." % str(chunks))
+    kmer_matrix = h5py_file.create_dataset("kmer_matrix",
+                                           shape=(n_packed_rows, n_kmers),
+                                           maxshape=(None, None),
+                                           dtype=KMER_MATRIX_DTYPE,
+                                           chunks=chunks,
+                                           **compression_kwargs)
+    h5py_file.attrs["chunk_policy"] = chunk_policy
+    h5py_file.attrs["chunk_shape"] = chunks
+    return kmer_matrix
+
+
+def _prevalence_bounds(min_prevalence, max_prevalence, n_genomes, error_callback):
+    try:
+        return prevalence_bounds(min_prevalence, max_prevalence, n_genomes)
+    except ValueError as e:
+        error_callback(e)
+
+
+def _complete_kmer_columns(output_path, min_prevalence, max_prevalence, apply_prevalence_filter, deduplicate,
+                           compression_kwargs, removal_counts=None):
+    """
+    Completes the k-mers of a dataset and indexes them. The prevalence filter is recorded and, if it was not applied
+    when the k-mers were written, it is applied. The k-mers with identical columns are grouped into equivalence classes
+    if required. The filtered or grouped k-mers are written to a copy of the dataset, which then replaces it.
+
+    Parameters:
+    -----------
+    apply_prevalence_filter: bool
+        Whether the prevalence filter must be applied to the k-mers of the dataset.
+    deduplicate: bool
+        Whether to group the k-mers with identical columns into equivalence classes.
+    removal_counts: dict
+        The numbers of k-mers removed by the prevalence filter when the k-mers were written (see prevalence_mask).
+    """
+    h5py_file = h.File(output_path, "r+")
+    record_prevalence_filter(h5py_file, min_prevalence, max_prevalence,
+                             removal_counts if removal_counts is not None else new_removal_counts())
+    if not (apply_prevalence_filter or deduplicate):
+        build_kmer_index(h5py_file, compression_kwargs)
+        h5py_file.close()
+        return
+    h5py_file.close()
+
+    logging.debug("Filtering the k-mers by prevalence." if not deduplicate else
+                  "Grouping the k-mers with identical columns into equivalence classes.")
+    unfiltered_path = output_path + ".unfiltered"
+    rename(output_path, unfiltered_path)
+    source_file = h.File(unfiltered_path, "r")
+    destination_file = _create_hdf5_file_no_chunk_caching(output_path)
+    copy_filtered_dataset(source_file=source_file,
+                          destination_file=destination_file,
+                          min_prevalence=min_prevalence,
+                          max_prevalence=max_prevalence,
+                          deduplicate=deduplicate)
+    destination_file.close()
+    source_file.close()
+    remove(unfiltered_path)
+
+
 def _parse_metadata(metadata_path, matrix_genome_ids, warning_callback, error_callback):
     """
 	Parses metadata (genome_id{tab}label)
+
+	The join with the genomes of the matrix is vectorized, so that it is linear in the number of genomes (up to the
+	sorts done by numpy).
 	"""
     logging.debug("Parsing metadata.")
     md_genome_ids, md_genome_labels = zip(*(l.split() for l in open(metadata_path, "r")))
-    md_unique_labels, indices = np.unique(md_genome_labels, return_inverse=True)
+    md_genome_ids = np.array(md_genome_ids)
 
-    # Check case label are 0 and 1 (To be backward compatible with Kover previous dataset creation version)
-    if not(len(md_unique_labels) == 2 and '0' in md_unique_labels and '1' in md_unique_labels):
-        # Sorting labels alphabetically for consistent indices assignement across multiple datasets
-        md_unique_labels.sort()
-        label_to_indice = {md_unique_labels[l]:l for l in range(len(md_unique_labels))}
-        indices = np.array([label_to_indice[l] for l in md_genome_labels])
+    # The labels are sorted alphabetically for consistent indices assignement across multiple datasets. This is also
+    # backward compatible with the 0 and 1 labels of the previous dataset creation version.
+    md_unique_labels, md_genome_labels = np.unique(md_genome_labels, return_inverse=True)
 
     if len(md_unique_labels) < 2:
         error_callback(Exception("The dataset must contain at least 2 different phenotypes"))
@@ -90,51 +409,43 @@ def _parse_metadata(metadata_path, matrix_genome_ids, warning_callback, error_ca
         classification_type = "multiclass"
     logging.debug("The dataset problem type is " + classification_type + " classification.")
 
-    # Converting labels to numerical ascending values
-    numerical_labels = np.arange(0, len(md_unique_labels))
-    md_genome_labels = numerical_labels[indices]
-
-    if len(md_genome_ids) > len(set(md_genome_ids)):
+    if len(np.unique(md_genome_ids)) < len(md_genome_ids):
         error_callback(Exception("The metadata contains multiple values for the same genome."))
 
-    genomes_only_in_matrix = set(matrix_genome_ids) - set(md_genome_ids)
+    matrix_genome_ids = np.array(list(matrix_genome_ids))
+    in_matrix = np.in1d(md_genome_ids, matrix_genome_ids)
+
+    genomes_only_in_matrix = matrix_genome_ids[~np.in1d(matrix_genome_ids, md_genome_ids)]
     if len(genomes_only_in_matrix) > 0:
         warning_callback("Missing metadata for %d genomes (%s). These genomes will be discarded." % (
             len(genomes_only_in_matrix), ", ".join(genomes_only_in_matrix)))
     del genomes_only_in_matrix
 
-    genomes_only_in_metadata = set(md_genome_ids) - set(matrix_genome_ids)
+    genomes_only_in_metadata = md_genome_ids[~in_matrix]
     if len(genomes_only_in_metadata) > 0:
         warning_callback("The metadata contains values for %d genomes that are not in the genomic data (%s)." % (
             len(genomes_only_in_metadata), ", ".join(genomes_only_in_metadata)))
     del genomes_only_in_metadata
 
-    keep_genome_ids, keep_genome_labels = zip(
-        *((md_genome_ids[i], md_genome_labels[i]) for i in xrange(len(md_genome_ids)) if
-          md_genome_ids[i] in matrix_genome_ids))
+    if not in_matrix.any():
+        error_callback(Exception("None of the genomes in the metadata are in the genomic data."))
 
-    return np.array(keep_genome_ids), np.array(keep_genome_labels, dtype=np.uint8), md_unique_labels, classification_type
+    # The identifiers are copied to an array that is as wide as the longest identifier that is kept
+    keep_genome_ids = np.array(md_genome_ids[in_matrix].tolist())
+    keep_genome_labels = md_genome_labels[in_matrix].astype(np.uint8)
 
+    return keep_genome_ids, keep_genome_labels, md_unique_labels, classification_type
 
-def from_tsv(tsv_path, output_path, phenotype_description, phenotype_metadata_path, gzip, warning_callback=None,
-             error_callback=None, progress_callback=None):
-    def get_kmer_length(tsv_path):
-        with open(tsv_path, "r") as f:
-            f.next()
-            kmer_len = len(f.next().split("\t")[0])
-        return kmer_len
 
-    def get_kmer_count(tsv):
-        # XXX: This is can break if the file format changes!
-        #      Assumes that each line has the format kmer_seq\tV\tV\t...V\n with one binary V per genome
-        total_size = getsize(tsv)
-        with open(tsv, "r") as f:
-            header_size = len(f.next())
-            line_size = len(f.next())
-        content_size = float(total_size) - header_size
-        if content_size % line_size != 0:
-            raise Exception()
-        return int(content_size / line_size)
+def from_tsv(tsv_path, output_path, phenotype_description, phenotype_metadata_path, gzip, n_cpu=None,
+             chunk_policy="row", compression_filter="gzip", kmer_encoding="ascii", min_prevalence=None,
+             max_prevalence=None, deduplicate_kmers=False, warning_callback=None, error_callback=None,
+             progress_callback=None):
+    def get_kmer_length(tsv_path, data_start):
+        with open(tsv_path, "rb") as f:
+            f.seek(data_start)
+            kmer_len = len(f.readline().split("\t")[0])
+        return kmer_len
 
     # Execution callback functions
     if warning_callback is None:
@@ -150,15 +461,61 @@ def from_tsv(tsv_path, output_path, phenotype_description, phenotype_metadata_pa
     if (phenotype_description is None and phenotype_metadata_path is not None) or (
                     phenotype_description is not None and phenotype_metadata_path is None):
         raise ValueError("If a phenotype is specified, it must have a description and a metadata file.")
+    if chunk_policy not in CHUNK_POLICIES:
+        error_callback(ValueError("Unknown chunk layout policy: %s. The available policies are %s." %
+                                  (chunk_policy, ", ".join(CHUNK_POLICIES))))
+    if compression_filter not in COMPRESSION_FILTERS:
+        error_callback(ValueError("Unknown compression filter: %s. The available filters are %s." %
+                                  (compression_filter, ", ".join(COMPRESSION_FILTERS))))
+    if kmer_encoding not in KMER_ENCODINGS:
+        error_callback(ValueError("Unknown k-mer encoding: %s. The available encodings are %s." %
+                                  (kmer_encoding, ", ".join(KMER_ENCODINGS))))
+
+    if n_cpu is None or n_cpu < 1:
+        n_cpu = cpu_count()
+
+    # A k-mer matrix that is piped to Kover (e.g., by Ray Surveyor) is read in a single pass, as the lines arrive. The
+    # datasets then grow with each block of k-mers, since the number of k-mers is only known at the end of the stream.
+    streaming = is_tsv_stream(tsv_path)
+    if streaming:
+        logging.debug("Reading the k-mer matrix as a stream.")
+        tsv_stream = sys.stdin if tsv_path == "-" else open(tsv_path, "rb")
+        file_genome_ids = read_tsv_stream_header(tsv_stream)
+        stream_blocks = read_tsv_stream_blocks(tsv_stream, block_size=BLOCK_SIZE)
+        first_stream_block = next(stream_blocks, "")
+        if first_stream_block.strip() == "":
+            error_callback(Exception("The k-mer matrix does not contain any k-mer."))
+        kmer_len = len(first_stream_block.lstrip("\r\n").split("\t", 1)[0])
+        kmer_count = 0
+    else:
+        # Find the blocks of lines of the k-mer matrix
+        header_size, file_genome_ids = read_tsv_header(tsv_path)
+        kmer_len = get_kmer_length(tsv_path, header_size)
+        logging.debug("Finding the line boundaries in the k-mer matrix.")
+        kmer_count, block_offsets = find_block_offsets(tsv_path, data_start=header_size, block_size=BLOCK_SIZE,
+                                                       n_cpu=n_cpu)
+
+    # Read list of genome identifiers
+    genome_ids = file_genome_ids
+    logging.debug("The k-mer matrix contains %d genomes." % len(genome_ids))
+    if len(set(genome_ids)) < len(genome_ids):
+        error_callback(Exception("The genomic data contains genomes with the same identifier."))
+
+    # Extract the metadata. This is done before creating the dataset, so that invalid metadata does not leave an open
+    # file behind.
+    if phenotype_description is not None:
+        genome_ids, labels,\
+        labels_tags, classification_type = _parse_metadata(metadata_path=phenotype_metadata_path,
+                                                           matrix_genome_ids=genome_ids,
+                                                           warning_callback=warning_callback,
+                                                           error_callback=error_callback)
 
-    kmer_len = get_kmer_length(tsv_path)
-    kmer_count = get_kmer_count(tsv_path)
+    min_prevalence, max_prevalence, filter_prevalence = _prevalence_bounds(min_prevalence, max_prevalence,
+                                                                           len(genome_ids), error_callback)
+    removal_counts = new_removal_counts()
 
-    kmer_dtype = 'S' + str(kmer_len)
     kmer_by_matrix_column_dtype = _minimum_uint_size(kmer_count)
-    compression = "gzip" if gzip > 0 else None
-    compression_opts = gzip if gzip > 0 else None
-    tsv_block_size = min(kmer_count, BLOCK_SIZE)
+    compression_kwargs = _compression_kwargs(compression_filter, gzip)
 
     h5py_file = _create_hdf5_file_no_chunk_caching(output_path)
     h5py_file.attrs["created"] = time()
@@ -168,24 +525,10 @@ def from_tsv(tsv_path, output_path, phenotype_description, phenotype_metadata_pa
     h5py_file.attrs["phenotype_description"] = phenotype_description if phenotype_description is not None else "NA"
     h5py_file.attrs[
         "phenotype_metadata_source"] = phenotype_metadata_path if phenotype_metadata_path is not None else "NA"
-    h5py_file.attrs["compression"] = "gzip (level %d)" % gzip
+    h5py_file.attrs["compression"] = _compression_description(compression_filter, gzip)
 
-    # Read list of genome identifiers
-    reader = pd.read_table(tsv_path, sep='\t', index_col=0, iterator=True, engine="c")
-    genome_ids = reader.get_chunk(1).columns.values
-    del reader
-    logging.debug("The k-mer matrix contains %d genomes." % len(genome_ids))
-    if len(set(genome_ids)) < len(genome_ids):
-        error_callback(Exception("The genomic data contains genomes with the same identifier."))
-
-    # Extract/write the metadata
+    # Write the metadata
     if phenotype_description is not None:
-        genome_ids, labels,\
-        labels_tags, classification_type = _parse_metadata(metadata_path=phenotype_metadata_path,
-                                                           matrix_genome_ids=genome_ids,
-                                                           warning_callback=warning_callback,
-                                                           error_callback=error_callback)
-
         h5py_file.attrs["classification_type"] = classification_type
         # Sort the genomes by label for optimal better performance
         logging.debug("Sorting genomes by metadata label for optimal performance.")
@@ -201,86 +544,160 @@ def from_tsv(tsv_path, output_path, phenotype_description, phenotype_metadata_pa
     logging.debug("Creating the genome identifier dataset.")
     h5py_file.create_dataset("genome_identifiers",
                              data=genome_ids,
-                             compression=compression,
-                             compression_opts=compression_opts)
+                             **compression_kwargs)
 
     # Write labels tags
     logging.debug("Creating the phenotype tags dataset.")
     h5py_file.create_dataset("phenotype_tags",
                              data=labels_tags,
-                             compression=compression,
-                             compression_opts=compression_opts)
+                             **compression_kwargs)
 
     # Initialize kmers (kmer_list) dataset
     logging.debug("Creating the kmer sequence dataset.")
-    kmers = h5py_file.create_dataset("kmer_sequences",
-                                     shape=(kmer_count,),
-                                     dtype=kmer_dtype,
-                                     compression=compression,
-                                     compression_opts=compression_opts)
-
-    # Initialize kmer_matrix dataset
-    logging.debug("Creating the kmer matrix dataset.")
-    kmer_matrix = h5py_file.create_dataset("kmer_matrix",
-                                           shape=(
-                                               int(ceil(1.0 * len(genome_ids) / KMER_MATRIX_PACKING_SIZE)), kmer_count),
-                                           dtype=KMER_MATRIX_DTYPE,
-                                           compression=compression,
-                                           compression_opts=compression_opts,
-                                           chunks=(1, tsv_block_size))
-
-    # Initialize kmer_by_matrix_column dataset
-    logging.debug("Creating the kmer sequence/matrix column mapping dataset.")
-    kmer_by_matrix_column = h5py_file.create_dataset("kmer_by_matrix_column",
-                                                     shape=(kmer_count,),
-                                                     dtype=kmer_by_matrix_column_dtype,
-                                                     compression=compression,
-                                                     compression_opts=compression_opts)
+    kmers = _create_kmer_sequences(h5py_file=h5py_file,
+                                   kmer_size=kmer_len,
+                                   kmer_encoding=kmer_encoding,
+                                   n_kmers=kmer_count,
+                                   compression_kwargs=compression_kwargs)
+
+    # Initialize kmer_by_matrix_column dataset. The dtype depends on the number of k-mers, so it is created once the
+    # whole stream is read when streaming.
+    if not streaming:
+        logging.debug("Creating the kmer sequence/matrix column mapping dataset.")
+        kmer_by_matrix_column = h5py_file.create_dataset("kmer_by_matrix_column",
+                                                         shape=(kmer_count,),
+                                                         maxshape=(None,),
+                                                         dtype=kmer_by_matrix_column_dtype,
+                                                         **compression_kwargs)
 
     logging.debug("Transferring the data from TSV to HDF5.")
-    tsv_reader = pd.read_table(tsv_path, index_col='kmers', sep='\t', chunksize=tsv_block_size)
-    n_blocks = int(ceil(1.0 * kmer_count / tsv_block_size))
-    n_copied_blocks = 0.
-    for i, chunk in enumerate(tsv_reader):
-        logging.debug("Block %d/%d." % (i + 1, n_blocks))
-        progress_callback("Creating", n_copied_blocks / n_blocks)
-        logging.debug("Reading data from TSV file.")
-        kmers_data = chunk.index.values.astype(kmer_dtype)
-        read_block_size = kmers_data.shape[0]
-        block_start = i * tsv_block_size
-        block_stop = block_start + read_block_size
-        n_copied_blocks += 0.5
-        progress_callback("Creating", n_copied_blocks / n_blocks)
-
-        if block_start > kmer_count:
-            break
-
-        logging.debug("Writing data to HDF5.")
-        kmers[block_start:block_stop] = kmers_data
-        attribute_classification_sorted_by_strains = chunk[genome_ids]
-        attribute_classification_data = attribute_classification_sorted_by_strains.T.values.astype(np.uint8)
-        logging.debug("Packing the data.")
-        kmer_matrix[:, block_start:block_stop] = _pack_binary_bytes_to_ints(attribute_classification_data,
-                                                                            pack_size=KMER_MATRIX_PACKING_SIZE)
-        n_copied_blocks += 0.5
-        progress_callback("Creating", n_copied_blocks / n_blocks)
-
-        # Write kmer_by_matrix_column
-        kmer_by_matrix_column[block_start:block_stop] = np.arange(block_start, block_stop, dtype=kmer_by_matrix_column)
-        logging.debug("Garbage collection.")
-        gc.collect()  # Clear the memory objects created during the iteration, or else the memory will keep growing.
-
+    column_by_genome_id = dict((g_id, i) for i, g_id in enumerate(file_genome_ids))
+    genome_columns = np.array([column_by_genome_id[g_id] for g_id in genome_ids])
+    if streaming:
+        parse_block = partial(parse_tsv_lines,
+                              n_file_genomes=len(file_genome_ids),
+                              genome_columns=genome_columns,
+                              pack_size=KMER_MATRIX_PACKING_SIZE)
+        blocks = chain([first_stream_block], stream_blocks)
+        n_blocks = None
+    else:
+        parse_block = partial(parse_tsv_block,
+                              path=tsv_path,
+                              n_file_genomes=len(file_genome_ids),
+                              genome_columns=genome_columns,
+                              pack_size=KMER_MATRIX_PACKING_SIZE)
+        blocks = [tuple(block_offsets[i: i + 2]) for i in xrange(len(block_offsets) - 1)]
+        n_blocks = len(blocks)
+    write_progress = {"n_copied_blocks": 0, "block_start": 0, "kmer_matrix": None, "pending_bytes": 0}
+    progress_callback("Creating", 0.)
+
+    def write_next_block(pending_blocks):
+        if n_blocks is None:
+            logging.debug("Writing block %d of the stream to HDF5." % (write_progress["n_copied_blocks"] + 1))
+        else:
+            logging.debug("Writing block %d/%d to HDF5." % (write_progress["n_copied_blocks"] + 1, n_blocks))
+        pending_block, block_bytes = pending_blocks.popleft()
+        kmers_data, packed_data = pending_block.get()
+        write_progress["pending_bytes"] -= block_bytes
+        if write_progress["kmer_matrix"] is None:
+            # The chunk layout can depend on the data, so the k-mer matrix is created with the first block
+            write_progress["kmer_matrix"] = _create_kmer_matrix(h5py_file=h5py_file,
+                                                                n_genomes=len(genome_ids),
+                                                                n_kmers=kmer_count,
+                                                                chunk_policy=chunk_policy,
+                                                                sample=packed_data,
+                                                                compression_kwargs=compression_kwargs,
+                                                                temp_dir=dirname(abspath(output_path)))
+        kmer_matrix = write_progress["kmer_matrix"]
+        if filter_prevalence:
+            keep = prevalence_mask(packed_data, min_prevalence, max_prevalence, removal_counts)
+            kmers_data = kmers_data[keep]
+            packed_data = packed_data[:, keep]
+        block_start = write_progress["block_start"]
+        block_stop = block_start + kmers_data.shape[0]
+        if streaming:
+            kmers.resize(block_stop, axis=0)
+            kmer_matrix.resize(block_stop, axis=1)
+        kmers[block_start:block_stop] = _encode_kmer_sequences(kmers_data, kmer_len, kmer_encoding, error_callback)
+        kmer_matrix[:, block_start:block_stop] = packed_data
+        if not streaming:
+            kmer_by_matrix_column[block_start:block_stop] = np.arange(block_start, block_stop,
+                                                                      dtype=kmer_by_matrix_column_dtype)
+        write_progress["block_start"] = block_stop
+        write_progress["n_copied_blocks"] += 1
+        if n_blocks is not None:
+            progress_callback("Creating", 1.0 * write_progress["n_copied_blocks"] / n_blocks)
+
+    # The workers parse and pack the blocks, while this process is the only one that writes to the HDF5 file. The
+    # blocks are written in order and the number of blocks in flight is bounded to limit the memory usage. When
+    # streaming, the lines of the blocks in flight are held in memory, so their total size is bounded as well.
+    logging.debug("Using %d CPUs." % n_cpu)
+    pool = Pool(processes=n_cpu)
+    pending_blocks = deque()
+    try:
+        for block in blocks:
+            block_bytes = len(block) if streaming else 0
+            pending_blocks.append((pool.apply_async(parse_block, (block,)), block_bytes))
+            write_progress["pending_bytes"] += block_bytes
+            while len(pending_blocks) > 2 * n_cpu or write_progress["pending_bytes"] > STREAM_PENDING_BYTES:
+                write_next_block(pending_blocks)
+        while len(pending_blocks) > 0:
+            write_next_block(pending_blocks)
+    except:
+        # A block could not be parsed or written: stop the workers and release the files before raising the error
+        pool.terminate()
+        pool.join()
+        h5py_file.close()
+        if streaming and tsv_stream is not sys.stdin:
+            tsv_stream.close()
+        raise
+
+    pool.close()
+    pool.join()
+
+    if streaming:
+        if tsv_stream is not sys.stdin:
+            tsv_stream.close()
+        kmer_count = write_progress["block_start"]
+        logging.debug("The k-mer matrix stream contained %d k-mers." % kmer_count)
+        logging.debug("Creating the kmer sequence/matrix column mapping dataset.")
+        kmer_by_matrix_column_dtype = _minimum_uint_size(kmer_count)
+        kmer_by_matrix_column = h5py_file.create_dataset("kmer_by_matrix_column",
+                                                         shape=(kmer_count,),
+                                                         maxshape=(None,),
+                                                         dtype=kmer_by_matrix_column_dtype,
+                                                         **compression_kwargs)
+        for block_start in xrange(0, kmer_count, BLOCK_SIZE):
+            block_stop = min(block_start + BLOCK_SIZE, kmer_count)
+            kmer_by_matrix_column[block_start:block_stop] = np.arange(block_start, block_stop,
+                                                                      dtype=kmer_by_matrix_column_dtype)
+        progress_callback("Creating", 1.0)
+    elif filter_prevalence:
+        # The datasets were created for all the k-mers of the file
+        kmer_count = write_progress["block_start"]
+        kmers.resize(kmer_count, axis=0)
+        kmer_by_matrix_column.resize((kmer_count,))
+        if write_progress["kmer_matrix"] is not None:
+            write_progress["kmer_matrix"].resize(kmer_count, axis=1)
     h5py_file.close()
 
+    _complete_kmer_columns(output_path=output_path,
+                           min_prevalence=min_prevalence,
+                           max_prevalence=max_prevalence,
+                           apply_prevalence_filter=False,
+                           deduplicate=deduplicate_kmers,
+                           compression_kwargs=compression_kwargs,
+                           removal_counts=removal_counts)
+
+    write_summary(output_path)
     logging.debug("Dataset creation completed.")
 
 
 def from_contigs(contig_list_path, output_path, kmer_size, filter_singleton, phenotype_description, phenotype_metadata_path,
-                 gzip, temp_dir, nb_cores, verbose, progress, warning_callback=None,
-                 error_callback=None):
-    compression = "gzip" if gzip > 0 else None
-    compression_opts = gzip if gzip > 0 else None
-
+                 gzip, temp_dir, nb_cores, verbose, progress, kmer_counter="dsk", chunk_policy="row",
+                 compression_filter="gzip", kmer_encoding="ascii", resume=False, min_prevalence=None,
+                 max_prevalence=None, deduplicate_kmers=False, warning_callback=None, error_callback=None,
+                 progress_callback=None):
     # Execution callback functions
     if warning_callback is None:
         warning_callback = lambda w: logging.warning(w)
@@ -288,11 +705,25 @@ def from_contigs(contig_list_path, output_path, kmer_size, filter_singleton, phe
         def normal_raise(exception):
             raise exception
         error_callback = normal_raise
+    if progress_callback is None:
+        progress_callback = lambda t, p: None
 
-    # Make sure that the tmp data is unique to the current process
-    temp_dir = join(temp_dir, str(getpid()))
-    if not exists(temp_dir):
-        mkdir(temp_dir)
+    if kmer_counter not in KMER_COUNTERS:
+        error_callback(ValueError("Unknown k-mer counter: %s. The available counters are %s." %
+                                  (kmer_counter, ", ".join(KMER_COUNTERS))))
+    if kmer_counter == "python" and int(kmer_size) > MAX_PYTHON_KMER_SIZE:
+        error_callback(ValueError("The python k-mer counter supports k-mers of length at most %d." %
+                                  MAX_PYTHON_KMER_SIZE))
+    if chunk_policy not in CHUNK_POLICIES:
+        error_callback(ValueError("Unknown chunk layout policy: %s. The available policies are %s." %
+                                  (chunk_policy, ", ".join(CHUNK_POLICIES))))
+    if compression_filter not in COMPRESSION_FILTERS:
+        error_callback(ValueError("Unknown compression filter: %s. The available filters are %s." %
+                                  (compression_filter, ", ".join(COMPRESSION_FILTERS))))
+    if kmer_encoding not in KMER_ENCODINGS:
+        error_callback(ValueError("Unknown k-mer encoding: %s. The available encodings are %s." %
+                                  (kmer_encoding, ", ".join(KMER_ENCODINGS))))
+    compression_kwargs = _compression_kwargs(compression_filter, gzip)
 
     if (phenotype_description is None and phenotype_metadata_path is not None) or (
                     phenotype_description is not None and phenotype_metadata_path is None):
@@ -317,7 +748,7 @@ def from_contigs(contig_list_path, output_path, kmer_size, filter_singleton, phe
     h5py_file.attrs[
         "phenotype_metadata_source"] = phenotype_metadata_path if phenotype_metadata_path is not None else "NA"
     h5py_file.attrs["filter"] = filter_singleton
-    h5py_file.attrs["compression"] = "gzip (level %d)" % gzip
+    h5py_file.attrs["compression"] = _compression_description(compression_filter, gzip)
 
     # Extract/write the metadata
     if phenotype_description is not None:
@@ -343,65 +774,235 @@ def from_contigs(contig_list_path, output_path, kmer_size, filter_singleton, phe
     logging.debug("Creating the genome identifier dataset.")
     h5py_file.create_dataset("genome_identifiers",
                              data=genome_ids,
-                             compression=compression,
-                             compression_opts=compression_opts)
+                             **compression_kwargs)
 
     # Write labels tags
     logging.debug("Creating the phenotype tags dataset.")
     h5py_file.create_dataset("phenotype_tags",
                              data=labels_tags,
-                             compression=compression,
-                             compression_opts=compression_opts)
-
-    h5py_file.close()
+                             **compression_kwargs)
+
+    # The prevalence filter is applied after the k-mers are counted, so it is not a parameter of the work directory
+    min_prevalence, max_prevalence, filter_prevalence = _prevalence_bounds(min_prevalence, max_prevalence,
+                                                                           len(genome_ids), error_callback)
+
+    # The work of an interrupted run is only reused if it was done with the same parameters and genomic data
+    temp_dir, manifest = _work_dir(temp_dir=temp_dir,
+                                   output_path=output_path,
+                                   resume=resume,
+                                   parameters=dict(genome_source_type="contigs",
+                                                   genomes=[(str(g_id), contig_file_by_genome_id[g_id],
+                                                             getmtime(contig_file_by_genome_id[g_id]))
+                                                            for g_id in genome_ids],
+                                                   kmer_size=int(kmer_size),
+                                                   kmer_counter=kmer_counter,
+                                                   dsk_compression=int(gzip) if kmer_counter == "dsk" else None,
+                                                   filter=filter_singleton))
+
+    if kmer_counter == "python":
+        logging.debug("Counting the k-mers with the python k-mer counter.")
+        completed_genomes, checkpoint_callback = None, None
+        if manifest is not None:
+            completed_genomes = set(i for i, g_id in enumerate(genome_ids)
+                                    if str(g_id) in manifest.completed_genomes)
+            checkpoint_callback = lambda i: manifest.mark_genomes_completed([str(genome_ids[i])])
+        genome_kmer_files = count_kmers(fasta_path_by_genome=[contig_file_by_genome_id[g_id] for g_id in genome_ids],
+                                        kmer_size=int(kmer_size),
+                                        out_dir=temp_dir,
+                                        n_cpu=int(nb_cores),
+                                        progress_callback=progress_callback,
+                                        completed_genomes=completed_genomes,
+                                        checkpoint_callback=checkpoint_callback)
+        logging.debug("K-mers counting completed.")
+
+        min_genome_count = 2 if filter_singleton == "singleton" else 1
+        if manifest is not None:
+            ranges = merge_ranges(genome_kmer_files)
+            merge_pending_ranges = lambda pending: (list(build_packed_matrix(genome_kmer_files,
+                                                                             min_genome_count=min_genome_count,
+                                                                             pack_size=KMER_MATRIX_PACKING_SIZE,
+                                                                             ranges=[ranges[i]]))
+                                                    for i in pending)
+            blocks = _checkpointed_blocks(len(ranges), merge_pending_ranges, temp_dir, manifest)
+        else:
+            blocks = build_packed_matrix(genome_kmer_files, min_genome_count=min_genome_count,
+                                         pack_size=KMER_MATRIX_PACKING_SIZE)
+        removal_counts = new_removal_counts()
+        _write_merged_kmer_matrix(h5py_file=h5py_file,
+                                  n_genomes=len(genome_kmer_files),
+                                  blocks=blocks,
+                                  kmer_size=int(kmer_size),
+                                  kmer_encoding=kmer_encoding,
+                                  chunk_policy=chunk_policy,
+                                  compression_kwargs=compression_kwargs,
+                                  progress_callback=progress_callback,
+                                  error_callback=error_callback,
+                                  prevalence_filter=(min_prevalence, max_prevalence, removal_counts)
+                                                    if filter_prevalence else None,
+                                  expected_kmer_count=_largest_genome_kmer_count(genome_kmer_files))
+        h5py_file.close()
+        _complete_kmer_columns(output_path=output_path,
+                               min_prevalence=min_prevalence,
+                               max_prevalence=max_prevalence,
+                               apply_prevalence_filter=False,
+                               deduplicate=deduplicate_kmers,
+                               compression_kwargs=compression_kwargs,
+                               removal_counts=removal_counts)
+
+        logging.debug("Removing temporary files.")
+        rmtree(temp_dir)
+        write_summary(output_path)
+        logging.debug("Dataset creation completed.")
+        return
 
     logging.debug("Initializing DSK.")
 
-    # Preparing input file for multidsk
-    files_sorted = ["%s\n" % contig_file_by_genome_id[id] for id in genome_ids]
-    open(join(temp_dir, "list_contigs_files"), "w").writelines(files_sorted)
-
     # Calling multidsk
-    contigs_count_kmers(file_path=join(temp_dir, "list_contigs_files"),
-                        out_dir=temp_dir,
-                        kmer_size=kmer_size,
-                        out_compress=gzip,
-                        nb_cores=nb_cores,
-                        verbose=int(verbose),
-                        progress=progress)
+    files_sorted = ["%s\n" % contig_file_by_genome_id[id] for id in genome_ids]
+    list_contigs = [join(temp_dir, basename(splitext(file)[0]) + ".h5") for file in files_sorted]
+    _count_kmers_dsk(count_function=contigs_count_kmers,
+                     input_lines=files_sorted,
+                     output_files=list_contigs,
+                     genome_ids=genome_ids,
+                     work_dir=temp_dir,
+                     manifest=manifest,
+                     error_callback=error_callback,
+                     kmer_size=kmer_size,
+                     out_compress=gzip,
+                     nb_cores=nb_cores,
+                     verbose=int(verbose),
+                     progress=progress)
     logging.debug("K-mers counting completed.")
 
-    # Preparing input file for dsk2kover
-    list_contigs = [join(temp_dir, basename(splitext(file)[0]) + ".h5") for file in files_sorted]
-    file_dsk_output = open(join(temp_dir, "list_h5"), "w")
-    for line in list_contigs:
-        file_dsk_output.write(line + "\n")
-    file_dsk_output.close()
-
-    # Calling dsk2kover
-    logging.debug("Initializing DSK2Kover.")
-    contigs_pack_kmers(file_path=join(temp_dir, "list_h5"),
-                       out_path=output_path,
-                       filter_singleton=filter_singleton,
-                       kmer_length=kmer_size,
-                       compression=gzip,
-                       chunk_size=BLOCK_SIZE,
-                       nb_genomes=len(genome_ids),
-                       progress=progress)
+    logging.debug("Merging the k-mers counted by DSK.")
+    genome_kmer_files, blocks = _pack_dsk_kmers(pack_function=contigs_pack_kmers,
+                                                dsk_files=list_contigs,
+                                                work_dir=temp_dir,
+                                                manifest=manifest,
+                                                kmer_size=kmer_size,
+                                                filter_singleton=filter_singleton,
+                                                nb_cores=nb_cores,
+                                                progress_callback=progress_callback)
+    removal_counts = new_removal_counts()
+    _write_merged_kmer_matrix(h5py_file=h5py_file,
+                              n_genomes=len(genome_kmer_files),
+                              blocks=blocks,
+                              kmer_size=int(kmer_size),
+                              kmer_encoding=kmer_encoding,
+                              chunk_policy=chunk_policy,
+                              compression_kwargs=compression_kwargs,
+                              progress_callback=progress_callback,
+                              error_callback=error_callback,
+                              prevalence_filter=(min_prevalence, max_prevalence, removal_counts)
+                                                if filter_prevalence else None,
+                              expected_kmer_count=_largest_genome_kmer_count(genome_kmer_files))
+    h5py_file.close()
+    _complete_kmer_columns(output_path=output_path,
+                           min_prevalence=min_prevalence,
+                           max_prevalence=max_prevalence,
+                           apply_prevalence_filter=False,
+                           deduplicate=deduplicate_kmers,
+                           compression_kwargs=compression_kwargs,
+                           removal_counts=removal_counts)
 
     logging.debug("Removing temporary files.")
     rmtree(temp_dir)
-
-    # progress_callback("dsk2kover", 1)
+    write_summary(output_path)
     logging.debug("Dataset creation completed.")
 
 
+def _largest_genome_kmer_count(genome_kmer_files):
+    # There are at least as many k-mers as in the genome that has the most k-mers
+    return max(len(np.load(f, mmap_mode="r")) for f in genome_kmer_files)
+
+
+def _write_merged_kmer_matrix(h5py_file, n_genomes, blocks, kmer_size, kmer_encoding, chunk_policy,
+                              compression_kwargs, progress_callback, error_callback, prevalence_filter=None,
+                              expected_kmer_count=None):
+    """
+    Writes the k-mer sequences and the packed k-mer matrix built by merging the sorted k-mers of the genomes.
+
+    Parameters:
+    -----------
+    n_genomes: int
+        The number of genomes (rows) of the k-mer matrix.
+    blocks: iterable
+        The merged blocks of k-mers and packed rows. The k-mers are either the 2-bit codes of the python k-mer counter
+        (see build_packed_matrix) or sequences (see merge_genome_kmers).
+    prevalence_filter: tuple
+        The minimum and maximum prevalence of the k-mers that are written, and the removal counts that are updated (see
+        prevalence_mask). None to write all the k-mers.
+    expected_kmer_count: int
+        A lower bound on the number of k-mers, used to select the chunk shape of the k-mer matrix.
+    """
+    # The number of k-mers is unknown until they are merged, so the datasets grow as the blocks are written
+    logging.debug("Creating the kmer sequence dataset.")
+    kmers = _create_kmer_sequences(h5py_file=h5py_file,
+                                   kmer_size=kmer_size,
+                                   kmer_encoding=kmer_encoding,
+                                   n_kmers=0,
+                                   compression_kwargs=compression_kwargs,
+                                   chunks=(BLOCK_SIZE,))
+
+    n_packed_rows = int(ceil(1.0 * n_genomes / KMER_MATRIX_PACKING_SIZE))
+    kmer_matrix = None
+
+    logging.debug("Merging the k-mers of the genomes.")
+    progress_callback("Creating", 0.)
+    kmer_count = 0
+    n_blocks = 0
+    for block_kmers, block_packed in blocks:
+        if kmer_matrix is None:
+            kmer_matrix = _create_kmer_matrix(h5py_file=h5py_file,
+                                              n_genomes=n_genomes,
+                                              n_kmers=0,
+                                              expected_n_kmers=expected_kmer_count,
+                                              chunk_policy=chunk_policy,
+                                              sample=block_packed[:, :BLOCK_SIZE],
+                                              compression_kwargs=compression_kwargs,
+                                              temp_dir=dirname(abspath(h5py_file.filename)))
+        if prevalence_filter is not None:
+            keep = prevalence_mask(block_packed, *prevalence_filter)
+            block_kmers = block_kmers[keep]
+            block_packed = block_packed[:, keep]
+        block_start = kmer_count
+        kmer_count += len(block_kmers)
+        kmers.resize(kmer_count, axis=0)
+        if block_kmers.dtype.kind == "S":
+            kmers[block_start:kmer_count] = _encode_kmer_sequences(block_kmers, kmer_size, kmer_encoding,
+                                                                   error_callback)
+        else:
+            # The 2-bit codes of the counter are those of the 2-bit encoding (k <= MAX_PYTHON_KMER_SIZE is a single word)
+            kmers[block_start:kmer_count] = decode_kmers(block_kmers, kmer_size) if kmer_encoding == "ascii" else \
+                                            block_kmers.reshape(-1, 1)
+        kmer_matrix.resize((n_packed_rows, kmer_count))
+        kmer_matrix[:, block_start:kmer_count] = block_packed
+        n_blocks += 1
+        logging.debug("Wrote merged block %d (%d k-mers)." % (n_blocks, kmer_count))
+    if kmer_matrix is None:
+        _create_kmer_matrix(h5py_file=h5py_file,
+                            n_genomes=n_genomes,
+                            n_kmers=0,
+                            chunk_policy="row",
+                            sample=np.zeros((n_packed_rows, 0), dtype=KMER_MATRIX_DTYPE),
+                            compression_kwargs=compression_kwargs)
+
+    logging.debug("Creating the kmer sequence/matrix column mapping dataset.")
+    kmer_by_matrix_column_dtype = _minimum_uint_size(kmer_count)
+    h5py_file.create_dataset("kmer_by_matrix_column",
+                             data=np.arange(kmer_count, dtype=kmer_by_matrix_column_dtype),
+                             maxshape=(None,),
+                             dtype=kmer_by_matrix_column_dtype,
+                             **compression_kwargs)
+    progress_callback("Creating", 1.0)
+
+
 def from_reads(reads_folders_list_path, output_path, kmer_size, abundance_min, filter_singleton, phenotype_description,
-               phenotype_metadata_path, gzip, temp_dir, nb_cores, verbose, progress, warning_callback=None,
-                 error_callback=None):
+               phenotype_metadata_path, gzip, temp_dir, nb_cores, verbose, progress, chunk_policy="row",
+               compression_filter="gzip", kmer_encoding="ascii", resume=False, min_prevalence=None,
+               max_prevalence=None, deduplicate_kmers=False, warning_callback=None, error_callback=None,
+               progress_callback=None):
     supported_extensions = ['.fastq','.fastq.gz']
-    compression = "gzip" if gzip > 0 else None
-    compression_opts = gzip if gzip > 0 else None
 
     # Execution callback functions
     if warning_callback is None:
@@ -410,11 +1011,19 @@ def from_reads(reads_folders_list_path, output_path, kmer_size, abundance_min, f
         def normal_raise(exception):
             raise exception
         error_callback = normal_raise
+    if progress_callback is None:
+        progress_callback = lambda t, p: None
 
-    # Make sure that the tmp data is unique to the current process
-    temp_dir = join(temp_dir, str(getpid()))
-    if not exists(temp_dir):
-        mkdir(temp_dir)
+    if chunk_policy not in CHUNK_POLICIES:
+        error_callback(ValueError("Unknown chunk layout policy: %s. The available policies are %s." %
+                                  (chunk_policy, ", ".join(CHUNK_POLICIES))))
+    if compression_filter not in COMPRESSION_FILTERS:
+        error_callback(ValueError("Unknown compression filter: %s. The available filters are %s." %
+                                  (compression_filter, ", ".join(COMPRESSION_FILTERS))))
+    if kmer_encoding not in KMER_ENCODINGS:
+        error_callback(ValueError("Unknown k-mer encoding: %s. The available encodings are %s." %
+                                  (kmer_encoding, ", ".join(KMER_ENCODINGS))))
+    compression_kwargs = _compression_kwargs(compression_filter, gzip)
 
     if (phenotype_description is None and phenotype_metadata_path is not None) or (
                     phenotype_description is not None and phenotype_metadata_path is None):
@@ -439,7 +1048,7 @@ def from_reads(reads_folders_list_path, output_path, kmer_size, abundance_min, f
     h5py_file.attrs[
         "phenotype_metadata_source"] = phenotype_metadata_path if phenotype_metadata_path is not None else "NA"
     h5py_file.attrs["filter"] = filter_singleton
-    h5py_file.attrs["compression"] = "gzip (level %d)" % gzip
+    h5py_file.attrs["compression"] = _compression_description(compression_filter, gzip)
 
     # Extract/write the metadata
     if phenotype_description is not None:
@@ -464,17 +1073,30 @@ def from_reads(reads_folders_list_path, output_path, kmer_size, abundance_min, f
     logging.debug("Creating the genome identifier dataset.")
     h5py_file.create_dataset("genome_identifiers",
                              data=genome_ids,
-                             compression=compression,
-                             compression_opts=compression_opts)
+                             **compression_kwargs)
 
     # Write labels tags
     logging.debug("Creating the phenotype tags dataset.")
     h5py_file.create_dataset("phenotype_tags",
                              data=labels_tags,
-                             compression=compression,
-                             compression_opts=compression_opts)
-
-    h5py_file.close()
+                             **compression_kwargs)
+
+    # The prevalence filter is applied after the k-mers are counted, so it is not a parameter of the work directory
+    min_prevalence, max_prevalence, filter_prevalence = _prevalence_bounds(min_prevalence, max_prevalence,
+                                                                           len(genome_ids), error_callback)
+
+    # The work of an interrupted run is only reused if it was done with the same parameters and genomic data
+    temp_dir, manifest = _work_dir(temp_dir=temp_dir,
+                                   output_path=output_path,
+                                   resume=resume,
+                                   parameters=dict(genome_source_type="reads",
+                                                   genomes=[(str(g_id), reads_folder_by_genome_id[g_id],
+                                                             getmtime(reads_folder_by_genome_id[g_id]))
+                                                            for g_id in genome_ids],
+                                                   kmer_size=int(kmer_size),
+                                                   abundance_min=int(abundance_min),
+                                                   dsk_compression=int(gzip),
+                                                   filter=filter_singleton))
 
     logging.debug("Initializing DSK.")
 
@@ -486,38 +1108,55 @@ def from_reads(reads_folders_list_path, output_path, kmer_size, abundance_min, f
                  if file.endswith(tuple(supported_extensions))]  # Supported extensions
         files_sorted.append(",".join(files) + "\n")
         list_reads_dsk_output.append(join(temp_dir, basename(splitext(files[-1])[0]) + ".h5"))
-    open(join(temp_dir, "list_reads_files"), "w").writelines(files_sorted)
 
     # Calling multidsk
-    reads_count_kmers(file_path=join(temp_dir, "list_reads_files"),
-                      out_dir=temp_dir,
-                      kmer_size=kmer_size,
-                      abundance_min=abundance_min,
-                      out_compress=gzip,
-                      nb_cores=nb_cores,
-                      verbose=int(verbose),
-                      progress=progress)
+    _count_kmers_dsk(count_function=reads_count_kmers,
+                     input_lines=files_sorted,
+                     output_files=list_reads_dsk_output,
+                     genome_ids=genome_ids,
+                     work_dir=temp_dir,
+                     manifest=manifest,
+                     error_callback=error_callback,
+                     kmer_size=kmer_size,
+                     abundance_min=abundance_min,
+                     out_compress=gzip,
+                     nb_cores=nb_cores,
+                     verbose=int(verbose),
+                     progress=progress)
     logging.debug("K-mers counting completed.")
 
-    # Preparing input file for dsk2kover
-    file_dsk_output = open(join(temp_dir, "list_h5"), "w")
-    for line in list_reads_dsk_output:
-        file_dsk_output.write(line + "\n")
-    file_dsk_output.close()
-
-    # Calling dsk2kover
-    logging.debug("Initializing DSK2Kover.")
-    reads_pack_kmers(file_path=join(temp_dir, "list_h5"),
-                     out_path=output_path,
-                     filter_singleton=filter_singleton,
-                     kmer_length=kmer_size,
-                     compression=gzip,
-                     chunk_size=BLOCK_SIZE,
-                     nb_genomes=len(genome_ids),
-                     progress=progress)
+    logging.debug("Merging the k-mers counted by DSK.")
+    genome_kmer_files, blocks = _pack_dsk_kmers(pack_function=reads_pack_kmers,
+                                                dsk_files=list_reads_dsk_output,
+                                                work_dir=temp_dir,
+                                                manifest=manifest,
+                                                kmer_size=kmer_size,
+                                                filter_singleton=filter_singleton,
+                                                nb_cores=nb_cores,
+                                                progress_callback=progress_callback)
+    removal_counts = new_removal_counts()
+    _write_merged_kmer_matrix(h5py_file=h5py_file,
+                              n_genomes=len(genome_kmer_files),
+                              blocks=blocks,
+                              kmer_size=int(kmer_size),
+                              kmer_encoding=kmer_encoding,
+                              chunk_policy=chunk_policy,
+                              compression_kwargs=compression_kwargs,
+                              progress_callback=progress_callback,
+                              error_callback=error_callback,
+                              prevalence_filter=(min_prevalence, max_prevalence, removal_counts)
+                                                if filter_prevalence else None,
+                              expected_kmer_count=_largest_genome_kmer_count(genome_kmer_files))
+    h5py_file.close()
+    _complete_kmer_columns(output_path=output_path,
+                           min_prevalence=min_prevalence,
+                           max_prevalence=max_prevalence,
+                           apply_prevalence_filter=False,
+                           deduplicate=deduplicate_kmers,
+                           compression_kwargs=compression_kwargs,
+                           removal_counts=removal_counts)
 
     logging.debug("Removing temporary files.")
     rmtree(temp_dir)
-
-    # progress_callback("dsk2kover", 1)
+    write_summary(output_path)
     logging.debug("Dataset creation completed.")
@@ -18,15 +18,158 @@
 """
 
 import numpy as np
-from functools import partial
 
+from h5py.h5f import ACC_RDONLY
+from os import getpid
+from os.path import abspath, getmtime
+
+from ..learning.common.rules import CHUNK_CACHE_POLICIES
 from ..utils import _hdf5_open_no_chunk_cache
+from .tools.flat_matrix import load_flat_kmer_matrix
+from .tools.kmer_classes import read_kmer_class_members, KMER_CLASSES_GROUP
+from .tools.kmer_engine import unpack_kmer_sequences
+from .tools.kmer_index import lookup_kmers
+from .tools.shards import open_sharded_kmer_matrix, SHARDS_GROUP
+from .tools.sparse_matrix import open_hybrid_kmer_matrix, SPARSE_GROUP
+
+APPEND_IN_PROGRESS = "append_in_progress"  # The attribute of a dataset to which genomes are being appended
+KMER_DECODING_BLOCK_SIZE = 100000
+SPLIT_DESCRIPTION = "%(name)s   Train genomes: %(train_genome_count)d (%(train_proportion).3f)   " \
+					"Test genomes: %(test_genome_count)d (%(test_proportion).3f)   Folds: %(fold_count)d   " \
+					"Random Seed: %(random_seed)d"
+
+# The files of the datasets opened by this process, shared by the KoverDataset objects of each file: path -> [file,
+# number of KoverDataset objects that use it]. HDF5 handles cannot be used across fork, so the child processes (e.g.,
+# the workers of the cross-validation) start with an empty pool and open their own handles.
+_open_files = {}
+_open_files_pid = None
+
+# The small arrays of the datasets read by this process (e.g., the phenotype labels and the genome indices of the
+# splits), which the learning algorithms index in their loops: (uuid, modification time, name) -> read-only array. An
+# array is read again when the dataset is modified.
+_cached_arrays = {}
+
+
+def _forget_cached_arrays(uuid):
+	for key in [key for key in _cached_arrays if key[0] == uuid]:
+		del _cached_arrays[key]
+
+
+def _process_open_files():
+	global _open_files, _open_files_pid
+	if _open_files_pid != getpid():
+		_open_files = {}
+		_open_files_pid = getpid()
+	return _open_files
 
 
 class KoverDataset(object):
-	def __init__(self, file):
+	def __init__(self, file, flat_kmer_matrix_file=None, chunk_cache="auto", chunk_cache_size=None):
+		"""
+		Parameters:
+		-----------
+		file: str
+			The path to the dataset.
+		flat_kmer_matrix_file: str
+			A flat file exported from the dataset (see kover dataset export-flat). If provided, the k-mer matrix is
+			mapped in memory from this file instead of being read from the dataset.
+		chunk_cache: str
+			The policy of the cache of the chunks of the k-mer matrix read by the learning algorithms: none, lru or
+			auto (see kover.learning.common.rules.chunk_cache_bytes).
+		chunk_cache_size: int
+			The size of the cache of the lru policy, in bytes.
+		"""
+		if chunk_cache not in CHUNK_CACHE_POLICIES:
+			raise ValueError("Unknown chunk cache policy %s. The supported policies are %s." %
+							 (chunk_cache, ", ".join(CHUNK_CACHE_POLICIES)))
 		self.path = file
-		self.dataset_open = partial(_hdf5_open_no_chunk_cache, file)
+		self.flat_kmer_matrix_file = flat_kmer_matrix_file
+		self.chunk_cache = chunk_cache
+		self.chunk_cache_size = chunk_cache_size
+		self._flat_kmer_matrix = None
+		self._file_key = abspath(file)
+		self._file_pid = None  # The process in which the object uses the shared file
+		self._kmer_matrix = None  # The file, the process and the k-mer matrix read from the file
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+	def dataset_open(self, access_type=ACC_RDONLY):
+		"""
+		The HDF5 file of the dataset. It is opened once and shared by all the KoverDataset objects of the file in the
+		process, until they are closed.
+
+		Parameters:
+		-----------
+		access_type: int
+			The access to the file (h5py.h5f.ACC_RDONLY or h5py.h5f.ACC_RDWR). If the file is open for reading only and
+			write access is required, the file is reopened for writing, since HDF5 cannot open a file for writing while
+			it is open for reading only.
+
+		Datasets whose append of genomes was interrupted are refused: an IOError is raised.
+		"""
+		open_files = _process_open_files()
+		if self._file_pid != getpid():
+			open_files.setdefault(self._file_key, [None, 0])[1] += 1
+			self._file_pid = getpid()
+		open_file = open_files[self._file_key]
+		h5py_file = open_file[0]
+		if h5py_file is not None and h5py_file.id.valid:
+			if access_type == ACC_RDONLY or h5py_file.id.get_intent() != ACC_RDONLY:
+				return h5py_file
+			h5py_file.close()
+		open_file[0] = _hdf5_open_no_chunk_cache(self.path, access_type)
+		if APPEND_IN_PROGRESS in open_file[0].attrs:
+			# The append of genomes to the dataset was interrupted (see kover.dataset.append.append_contigs)
+			open_file[0].close()
+			open_file[0] = None
+			raise IOError("The dataset %s is incomplete, since the append of genomes to it was interrupted. Create it "
+						  "again." % self.path)
+		if access_type != ACC_RDONLY:
+			_forget_cached_arrays(open_file[0].attrs["uuid"])
+		return open_file[0]
+
+	def _read_cached_array(self, name):
+		"""
+		A small array of the dataset, read once and kept in memory (see _cached_arrays). The array is read-only.
+		"""
+		dataset = self.dataset_open()
+		if dataset.id.get_intent() != ACC_RDONLY:
+			# The modification time of a file open for writing is not updated until the file is closed
+			return dataset[name][...]
+		uuid = dataset.attrs["uuid"]
+		key = (uuid, getmtime(self.path), name)
+		if key not in _cached_arrays:
+			for stale_key in [k for k in _cached_arrays if k[0] == uuid and k[2] == name]:
+				del _cached_arrays[stale_key]
+			array = dataset[name][...]
+			array.flags.writeable = False
+			_cached_arrays[key] = array
+		return _cached_arrays[key]
+
+	def close(self):
+		"""
+		Stops using the file of the dataset. The file is closed when no other KoverDataset object of the process uses
+		it. The objects read from the dataset (e.g., the k-mer matrix) must not be used after the file is closed. The
+		file is reopened if the dataset is used again.
+		"""
+		if self._kmer_matrix is not None and self._kmer_matrix[1] == getpid() and \
+				hasattr(self._kmer_matrix[2], "close"):
+			self._kmer_matrix[2].close()
+		self._kmer_matrix = None
+		self._flat_kmer_matrix = None
+		if self._file_pid == getpid():
+			open_files = _process_open_files()
+			open_file = open_files[self._file_key]
+			open_file[1] -= 1
+			if open_file[1] == 0:
+				if open_file[0] is not None and open_file[0].id.valid:
+					open_file[0].close()
+				del open_files[self._file_key]
+		self._file_pid = None
 
 	@property
 	def classification_type(self):
@@ -55,8 +198,7 @@ class KoverDataset(object):
 
 	@property
 	def genome_identifiers(self):
-		dataset = self.dataset_open()
-		return dataset["genome_identifiers"]
+		return self._read_cached_array("genome_identifiers")
 
 	@property
 	def genome_source(self):
@@ -73,26 +215,106 @@ class KoverDataset(object):
 		dataset = self.dataset_open()
 		return dataset["kmer_by_matrix_column"]
 
+	@property
+	def kmer_class_member_count(self):
+		"""
+		The number of k-mers that are in the equivalence class of a column of the k-mer matrix, in addition to the k-mer
+		of the column. These k-mers are not included in kmer_count.
+		"""
+		dataset = self.dataset_open()
+		if KMER_CLASSES_GROUP not in dataset:
+			return 0
+		return dataset[KMER_CLASSES_GROUP]["columns"].shape[0]
+
+	@property
+	def kmer_class_sequences(self):
+		"""
+		The sequences of the k-mers that are in the equivalence class of a column of the k-mer matrix, in addition to
+		the k-mer of the column.
+		"""
+		dataset = self.dataset_open()
+		if KMER_CLASSES_GROUP not in dataset:
+			return []
+		if self.kmer_encoding == "2bit":
+			return PackedKmerSequences(dataset[KMER_CLASSES_GROUP]["kmer_sequences"], self.kmer_length)
+		return dataset[KMER_CLASSES_GROUP]["kmer_sequences"]
+
 	@property
 	def kmer_count(self):
 		dataset = self.dataset_open()
 		return dataset["kmer_sequences"].shape[0]
 
+	@property
+	def kmer_encoding(self):
+		dataset = self.dataset_open()
+		# Datasets created before the 2-bit encoding was introduced store the k-mers as strings
+		return dataset["kmer_sequences"].attrs.get("encoding", "ascii")
+
 	@property
 	def kmer_length(self):
 		dataset = self.dataset_open()
+		if self.kmer_encoding == "2bit":
+			return int(dataset["kmer_sequences"].attrs["kmer_length"])
 		return len(dataset["kmer_sequences"][0])
 
+	@property
+	def is_sharded(self):
+		dataset = self.dataset_open()
+		return SHARDS_GROUP in dataset
+
+	@property
+	def is_sparse(self):
+		"""
+		Whether the rare k-mers of the dataset are stored as genome lists (see kover dataset sparsify).
+		"""
+		dataset = self.dataset_open()
+		return SPARSE_GROUP in dataset
+
 	@property
 	def kmer_matrix(self):
+		"""
+		The packed k-mer matrix. It is mapped in memory if a flat k-mer matrix file was provided, its shards are read
+		concurrently if the dataset is sharded (see kover dataset shard), and its genome lists are packed when they are
+		read if the dataset is sparse (see kover dataset sparsify).
+		"""
+		if self.flat_kmer_matrix_file is not None:
+			if self._flat_kmer_matrix is None:
+				self._flat_kmer_matrix = load_flat_kmer_matrix(self.flat_kmer_matrix_file, uuid=self.uuid)
+			return self._flat_kmer_matrix
 		dataset = self.dataset_open()
-		return dataset["kmer_matrix"]
+		if self._kmer_matrix is not None and self._kmer_matrix[0] is dataset and self._kmer_matrix[1] == getpid():
+			return self._kmer_matrix[2]
+		if self._kmer_matrix is not None and self._kmer_matrix[1] == getpid() and \
+				hasattr(self._kmer_matrix[2], "close"):
+			# The file was reopened
+			self._kmer_matrix[2].close()
+		kmer_matrix = open_sharded_kmer_matrix(dataset)
+		if kmer_matrix is None:
+			kmer_matrix = open_hybrid_kmer_matrix(dataset)
+		if kmer_matrix is None:
+			kmer_matrix = dataset["kmer_matrix"]
+		self._kmer_matrix = (dataset, getpid(), kmer_matrix)
+		return kmer_matrix
 
 	@property
 	def kmer_sequences(self):
 		dataset = self.dataset_open()
+		if self.kmer_encoding == "2bit":
+			return PackedKmerSequences(dataset["kmer_sequences"], self.kmer_length)
 		return dataset["kmer_sequences"]
 
+	@property
+	def prevalence_filter(self):
+		"""
+		The prevalence thresholds of the k-mers and the number of k-mers that they removed, or None if the dataset was
+		created without prevalence filter.
+		"""
+		dataset = self.dataset_open()
+		if "min_prevalence" not in dataset.attrs:
+			return None
+		return dict((key, int(dataset.attrs[key])) for key in ["min_prevalence", "max_prevalence",
+		                                                      "rare_kmers_removed", "common_kmers_removed"])
+
 	@property
 	def phenotype(self):
 		dataset = self.dataset_open()
@@ -102,21 +324,25 @@ class KoverDataset(object):
 		except:
 			description = dataset.attrs["phenotype_name"]
 
-		try:
-			tags = dataset["phenotype_tags"]
-		except:
+		if "phenotype_tags" in dataset:
+			tags = self._read_cached_array("phenotype_tags")
+		else:
 			tags = np.array(['0', '1'])
 
 		return KoverDatasetPhenotype(description=description,
 									 tags=tags,
-									 metadata=dataset["phenotype"],
+									 metadata=self._read_cached_array("phenotype"),
 									 metadata_source=dataset.attrs["phenotype_metadata_source"])
 
 	@property
 	def splits(self):
+		return [self.get_split(split_name) for split_name in self.split_names]
+
+	@property
+	def split_names(self):
 		dataset = self.dataset_open()
 		if "splits" in dataset:
-			return [self.get_split(split_name) for split_name in dataset["splits"]]
+			return list(dataset["splits"])
 		else:
 			return []
 
@@ -125,27 +351,87 @@ class KoverDataset(object):
 		dataset = self.dataset_open()
 		return dataset.attrs["uuid"]
 
+	def lookup_kmers(self, sequences):
+		"""
+		Finds the matrix column of k-mer sequences using the k-mer index of the dataset.
+
+		Parameters:
+		-----------
+		sequences: list
+			The k-mer sequences to find.
+
+		Returns:
+		--------
+		columns: numpy_array, dtype=int64
+			The matrix column of each k-mer, or -1 if the k-mer is not in the dataset.
+		"""
+		dataset = self.dataset_open()
+		return lookup_kmers(dataset, sequences)
+
+	def get_kmer_class_members(self, columns):
+		"""
+		Finds the k-mers whose presence/absence is identical to that of the k-mer of columns of the k-mer matrix, in
+		datasets where such k-mers are grouped into equivalence classes.
+
+		Parameters:
+		-----------
+		columns: list
+			The columns of the k-mer matrix.
+
+		Returns:
+		--------
+		members: dict
+			The sequences of the k-mers of the equivalence class of each column, excluding the k-mer of the column.
+			Columns without other k-mers are not included.
+		"""
+		dataset = self.dataset_open()
+		member_idx, member_columns = read_kmer_class_members(dataset, columns)
+		members = {}
+		if len(member_idx) > 0:
+			for column, sequence in zip(member_columns, self.kmer_class_sequences[member_idx.tolist()]):
+				members.setdefault(int(column), []).append(sequence)
+		return members
+
 	def get_split(self, name):
+		"""
+		The split is read lazily: its fields and its folds are read from the dataset when they are accessed (see
+		KoverDatasetSplit).
+		"""
 		dataset = self.dataset_open()
-		split = dataset["splits"][name]
-		return KoverDatasetSplit(name,
-								 split.attrs["train_proportion"],
-								 # Backwards compatibility with datasets without test_proportion
-								 split.attrs["test_proportion"] if "test_proportion" in split.attrs else
-																1.0 - split.attrs["train_proportion"],
-								 split["train_genome_idx"],
-								 split["test_genome_idx"],
-								 split["unique_risks"],
-								 split["unique_risk_by_kmer"],
-								 split["unique_risk_by_anti_kmer"],
-								 [] if not "folds" in split
-								 else [KoverDatasetFold(fold_name,
-														fold["train_genome_idx"],
-														fold["test_genome_idx"],
-														fold["unique_risks"],
-														fold["unique_risk_by_kmer"],
-														fold["unique_risk_by_anti_kmer"]) for fold_name, fold in split["folds"].iteritems()],
-								 split.attrs["random_seed"])
+		if "splits" not in dataset or name not in dataset["splits"]:
+			raise KeyError("The dataset has no split named %s." % name)
+		return KoverDatasetSplit(self, name)
+
+class PackedKmerSequences(object):
+	"""
+	The k-mer sequences of a dataset that stores them with the 2-bit encoding. The k-mers are decoded when they are
+	accessed, so that only the k-mers that are used (e.g., the k-mers of the model rules) are converted to strings.
+	Indexing works as for the string dataset of the other datasets.
+	"""
+	def __init__(self, h5py_dataset, kmer_length):
+		self.h5py_dataset = h5py_dataset
+		self.kmer_length = kmer_length
+
+	@property
+	def dtype(self):
+		return np.dtype("S%d" % self.kmer_length)
+
+	@property
+	def shape(self):
+		return self.h5py_dataset.shape[:1]
+
+	def __len__(self):
+		return self.h5py_dataset.shape[0]
+
+	def __getitem__(self, key):
+		if isinstance(key, (int, long, np.integer)):
+			return unpack_kmer_sequences(self.h5py_dataset[key], self.kmer_length)[0]
+		return unpack_kmer_sequences(self.h5py_dataset[key], self.kmer_length)
+
+	def __iter__(self):
+		for block_start in xrange(0, len(self), KMER_DECODING_BLOCK_SIZE):
+			for kmer in self[block_start: block_start + KMER_DECODING_BLOCK_SIZE]:
+				yield kmer
 
 class KoverDatasetPhenotype(object):
 	def __init__(self, description, tags, metadata, metadata_source):
@@ -154,36 +440,82 @@ class KoverDatasetPhenotype(object):
 		self.metadata = metadata
 		self.metadata_source = metadata_source
 
-class KoverDatasetSplit(object):
-	def __init__(self, name, train_proportion, test_proportion, train_genome_idx, test_genome_idx, unique_risks,
-				 unique_risk_by_kmer, unique_risk_by_anti_kmer, folds, random_seed):
+class _LazyDatasetGroup(object):
+	"""
+	A group of a dataset (e.g., a split) whose fields are read when they are first accessed, and then kept. The HDF5
+	datasets are not kept: they are looked up in the file at each access, since they become invalid when the file of
+	the dataset is closed or reopened. The fields can be assigned, for example to replace an HDF5 dataset by its
+	content.
+	"""
+	_attribute_fields = []  # Read from the attributes of the group
+	_array_fields = []  # Small arrays, read with KoverDataset._read_cached_array
+	_dataset_fields = []  # HDF5 datasets, read when they are indexed
+	_computed_fields = []  # Read by _read_field of the subclass
+
+	def __init__(self, dataset, path, name):
+		self.dataset = dataset
+		self.path = path
 		self.name = name
-		self.train_proportion = train_proportion
-		self.test_proportion = test_proportion
-		self.train_genome_idx = train_genome_idx
-		self.test_genome_idx = test_genome_idx
-		self.unique_risks = unique_risks
-		self.unique_risk_by_kmer = unique_risk_by_kmer
-		self.unique_risk_by_anti_kmer = unique_risk_by_anti_kmer
-		self.folds = folds
-		self.random_seed = random_seed
+
+	@property
+	def group(self):
+		return self.dataset.dataset_open()[self.path]
+
+	def _read_field(self, name):
+		if name in self._attribute_fields:
+			return self.group.attrs[name]
+		elif name in self._array_fields:
+			return self.dataset._read_cached_array(self.path + "/" + name)
+		return self.group[name]
+
+	def __getattr__(self, name):
+		# Only called for the fields that have not been read yet, and for the HDF5 datasets
+		if name.startswith("_") or name not in self._attribute_fields + self._array_fields + self._dataset_fields + \
+				self._computed_fields:
+			raise AttributeError(name)
+		value = self._read_field(name)
+		if name not in self._dataset_fields:
+			setattr(self, name, value)
+		return value
+
+class KoverDatasetSplit(_LazyDatasetGroup):
+	_attribute_fields = ["train_proportion", "test_proportion", "random_seed"]
+	_array_fields = ["train_genome_idx", "test_genome_idx", "unique_risks"]
+	_dataset_fields = ["unique_risk_by_kmer", "unique_risk_by_anti_kmer"]
+	_computed_fields = ["fold_names", "folds"]
+
+	def __init__(self, dataset, name):
+		super(KoverDatasetSplit, self).__init__(dataset, "splits/%s" % name, name)
+
+	def _read_field(self, name):
+		if name == "test_proportion" and "test_proportion" not in self.group.attrs:
+			# Backwards compatibility with datasets without test_proportion
+			return 1.0 - self.train_proportion
+		elif name == "fold_names":
+			return list(self.group["folds"]) if "folds" in self.group else []
+		elif name == "folds":
+			return [KoverDatasetFold(self.dataset, self.name, fold_name) for fold_name in self.fold_names]
+		return super(KoverDatasetSplit, self)._read_field(name)
+
+	def describe(self):
+		"""
+		The fields of the description of the split (see SPLIT_DESCRIPTION).
+		"""
+		# The sizes are read from the shapes, so that the splits can be listed without reading their genomes
+		return {"name": self.name,
+				"train_genome_count": int(self.group["train_genome_idx"].shape[0]),
+				"train_proportion": float(self.train_proportion),
+				"test_genome_count": int(self.group["test_genome_idx"].shape[0]),
+				"test_proportion": float(self.test_proportion),
+				"fold_count": len(self.fold_names),
+				"random_seed": int(self.random_seed)}
 
 	def __str__(self):
-		return "%s   Train genomes: %d (%.3f)   Test genomes: %d (%.3f)   Folds: %d   Random Seed: %d" % \
-			   (self.name,
-				len(self.train_genome_idx),
-				self.train_proportion,
-				len(self.test_genome_idx),
-				self.test_proportion,
-				len(self.folds),
-				self.random_seed)
-
-class KoverDatasetFold(object):
-	def __init__(self, name, train_genome_idx, test_genome_idx, unique_risks, unique_risk_by_kmer,
-				 unique_risk_by_anti_kmer):
-		self.name = name
-		self.train_genome_idx = train_genome_idx
-		self.test_genome_idx = test_genome_idx
-		self.unique_risks = unique_risks
-		self.unique_risk_by_kmer = unique_risk_by_kmer
-		self.unique_risk_by_anti_kmer = unique_risk_by_anti_kmer
+		return SPLIT_DESCRIPTION % self.describe()
+
+class KoverDatasetFold(_LazyDatasetGroup):
+	_array_fields = ["train_genome_idx", "test_genome_idx", "unique_risks"]
+	_dataset_fields = ["unique_risk_by_kmer", "unique_risk_by_anti_kmer"]
+
+	def __init__(self, dataset, split_name, name):
+		super(KoverDatasetFold, self).__init__(dataset, "splits/%s/folds/%s" % (split_name, name), name)
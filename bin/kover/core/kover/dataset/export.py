@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import h5py as h
+import logging
+
+from os.path import abspath, exists
+
+from ..utils import _init_callback_functions
+from .tools.flat_matrix import write_flat_kmer_matrix
+from .tools.sparse_matrix import open_kmer_matrix
+
+
+def export_flat_kmer_matrix(dataset_path, output_path, warning_callback=None, error_callback=None,
+                            progress_callback=None):
+    """
+    Writes the packed k-mer matrix of a dataset to a flat file that can be mapped in memory by the learning
+    algorithms. The file contains a small JSON header, padded to the page size, followed by the raw uint64 values of the
+    matrix. When several processes learn from the same flat file, they share the pages of the operating system cache.
+
+    Parameters:
+    -----------
+    dataset_path: str
+        The dataset to export.
+    output_path: str
+        The flat file to be created.
+
+    Notes:
+    ------
+    The flat file records the identifier of the dataset. It can only be used with the dataset from which it was
+    exported.
+    """
+    warning_callback, error_callback, progress_callback = _init_callback_functions(warning_callback, error_callback,
+                                                                                   progress_callback)
+
+    if abspath(dataset_path) == abspath(output_path):
+        error_callback(ValueError("The flat k-mer matrix must be written to a new file."))
+    if exists(output_path):
+        warning_callback("The output file %s exists and will be overwritten." % output_path)
+
+    dataset = h.File(dataset_path, "r")
+    kmer_matrix = open_kmer_matrix(dataset)
+    logging.debug("Exporting a k-mer matrix of shape %s." % str(kmer_matrix.shape))
+    with open(output_path, "w+b") as output_file:
+        try:
+            write_flat_kmer_matrix(kmer_matrix=kmer_matrix,
+                                   output_file=output_file,
+                                   uuid=dataset.attrs["uuid"],
+                                   progress_callback=progress_callback)
+        except ValueError as e:
+            dataset.close()
+            error_callback(e)
+    dataset.close()
+
+    logging.debug("Flat k-mer matrix export completed.")
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import h5py as h
+import logging
+
+from os.path import abspath, exists
+from time import time
+from uuid import uuid1
+
+from ..utils import _init_callback_functions
+from .summary import write_summary
+from .tools.prevalence import copy_filtered_dataset, prevalence_bounds
+
+
+def filter_dataset(dataset_path, output_path, min_prevalence=None, max_prevalence=None, deduplicate_kmers=False,
+                   warning_callback=None, error_callback=None, progress_callback=None):
+    """
+    Writes a copy of a dataset without the k-mers that are present in too few or too many genomes. Such k-mers
+    separate few genomes from the others, so they are rarely useful rules, but they are read at each iteration of the
+    learning algorithms. Optionally, the k-mers that are present in exactly the same genomes are grouped into
+    equivalence classes that share a single column of the k-mer matrix.
+
+    Parameters:
+    -----------
+    dataset_path: str
+        The dataset to filter.
+    output_path: str
+        The filtered dataset to be created.
+    min_prevalence: int
+        The minimum number of genomes in which a k-mer must be present. None means that there is no minimum.
+    max_prevalence: int
+        The maximum number of genomes in which a k-mer can be present. None means that there is no maximum.
+    deduplicate_kmers: bool
+        Whether to group the k-mers with identical columns into equivalence classes.
+
+    Notes:
+    ------
+    Datasets that contain splits are rejected, since the splits store data for each k-mer. Create the splits of the
+    filtered dataset.
+
+    The thresholds and the number of k-mers that they removed are recorded in the attributes of the filtered dataset.
+    The k-mer matrix of the filtered dataset is packed, even if the rare k-mers of the dataset are stored as genome
+    lists (see kover dataset sparsify).
+    """
+    warning_callback, error_callback, progress_callback = _init_callback_functions(warning_callback, error_callback,
+                                                                                   progress_callback)
+
+    if abspath(dataset_path) == abspath(output_path):
+        error_callback(ValueError("The filtered dataset must be written to a new file."))
+    if exists(output_path):
+        warning_callback("The output file %s exists and will be overwritten." % output_path)
+
+    source_file = h.File(dataset_path, "r")
+    if "splits" in source_file and len(source_file["splits"]) > 0:
+        split_names = ", ".join(source_file["splits"].keys())
+        source_file.close()
+        error_callback(Exception("A dataset that contains splits (%s) cannot be filtered, since the splits store data "
+                                 "for each k-mer." % split_names))
+
+    n_genomes = source_file["genome_identifiers"].shape[0]
+    try:
+        min_prevalence, max_prevalence, is_active = prevalence_bounds(min_prevalence, max_prevalence, n_genomes)
+    except ValueError as e:
+        source_file.close()
+        error_callback(e)
+    if not is_active and not deduplicate_kmers:
+        warning_callback("The prevalence thresholds do not remove any k-mer. The dataset will be copied unchanged.")
+
+    logging.debug("Filtering the k-mers present in less than %d or more than %d genomes." % (min_prevalence,
+                                                                                           max_prevalence))
+    destination_file = h.File(output_path, "w")
+    removal_counts = copy_filtered_dataset(source_file=source_file,
+                                           destination_file=destination_file,
+                                           min_prevalence=min_prevalence,
+                                           max_prevalence=max_prevalence,
+                                           deduplicate=deduplicate_kmers,
+                                           progress_callback=progress_callback)
+    source_file.close()
+
+    # The content of the dataset changed, so it gets a new identifier
+    destination_file.attrs["uuid"] = str(uuid1())
+    destination_file.attrs["filtered"] = time()
+    destination_file.attrs["filtered_from"] = abspath(dataset_path)
+    destination_file.close()
+
+    logging.debug("Removed %d rare and %d common k-mers. %d columns were added to the equivalence class of another "
+                  "column." % (removal_counts["rare"], removal_counts["common"], removal_counts["duplicate"]))
+    write_summary(output_path)
+    logging.debug("Dataset filtering completed.")
@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import h5py as h
+import logging
+import numpy as np
+
+from math import ceil
+from os.path import abspath, exists
+from time import time
+from uuid import uuid1
+
+from ..utils import _init_callback_functions
+from .create import _complete_kmer_columns, _create_hdf5_file_no_chunk_caching, _prevalence_bounds, \
+                    _write_merged_kmer_matrix, KMER_ENCODINGS, KMER_MATRIX_DTYPE, KMER_MATRIX_PACKING_SIZE, \
+                    PHENOTYPE_LABEL_DTYPE
+from .summary import write_summary
+from .tools.chunk_layout import CHUNK_POLICIES
+from .tools.kmer_index import _kmer_count, _kmer_length, _sorted_index, canonical_index_keys, KMER_INDEX_BLOCK_SIZE, \
+                              KMER_INDEX_GROUP
+from .tools.kmer_union import place_packed_rows, read_kmer_columns, union_kmer_indexes
+from .tools.prevalence import new_removal_counts
+from .tools.sparse_matrix import open_kmer_matrix
+
+
+def _kmer_index(h5py_file):
+    """
+    The sorted keys of the k-mers of a dataset and their matrix column. The index of datasets created before the k-mer
+    index was introduced is computed in memory.
+    """
+    if KMER_INDEX_GROUP in h5py_file:
+        return h5py_file[KMER_INDEX_GROUP]["kmers"], h5py_file[KMER_INDEX_GROUP]["columns"]
+    logging.debug("%s has no k-mer index. Computing it." % h5py_file.filename)
+    return _sorted_index(h5py_file)
+
+
+def _canonical_kmer_index(h5py_file, kmer_size, block_size=KMER_INDEX_BLOCK_SIZE):
+    """
+    The k-mer index of a dataset, keyed by the canonical form of the k-mers (see canonical_index_keys). The index is
+    streamed from the file if the k-mers of the dataset are already in canonical form (e.g., created with the python
+    k-mer counter). Otherwise (e.g., created with DSK), the canonical keys are computed and sorted in memory.
+    """
+    keys, columns = _kmer_index(h5py_file)
+    for block_start in xrange(0, keys.shape[0], block_size):
+        block = np.asarray(keys[block_start: block_start + block_size])
+        if (canonical_index_keys(block, kmer_size) != block).any():
+            break
+    else:
+        return keys, columns
+    logging.debug("The k-mers of %s are not in canonical form. Computing their canonical keys." % h5py_file.filename)
+    keys = canonical_index_keys(keys[...], kmer_size)
+    order = np.argsort(keys, kind="mergesort")
+    return keys[order], np.asarray(columns[...])[order]
+
+
+def _merged_blocks(source_files, indexes, genome_offsets, n_genomes, merge_counts, progress_callback):
+    """
+    Builds the blocks of the packed k-mer matrix of the merged dataset, in the sorted order of the k-mers. The number
+    of k-mers of the union and the number of k-mers of each dataset that were placed in the blocks are counted in
+    merge_counts.
+    """
+    n_packed_rows = int(ceil(1.0 * n_genomes / KMER_MATRIX_PACKING_SIZE))
+    kmer_matrices = [open_kmer_matrix(f) for f in source_files]
+    for keys, dataset_columns in union_kmer_indexes(indexes, progress_callback=progress_callback):
+        merge_counts["union"] += len(keys)
+        block = np.zeros((n_packed_rows, len(keys)), dtype=KMER_MATRIX_DTYPE)
+        for i, (kmer_matrix, genome_offset, (positions, columns)) in enumerate(zip(kmer_matrices, genome_offsets,
+                                                                                   dataset_columns)):
+            merge_counts["placed"][i] += len(positions)
+            if len(positions) == 0:
+                continue
+            # The k-mers that are not in a dataset are absent from its genomes
+            packed = np.zeros((kmer_matrix.shape[0], len(keys)), dtype=KMER_MATRIX_DTYPE)
+            packed[:, positions] = read_kmer_columns(kmer_matrix, columns)
+            place_packed_rows(block, packed, genome_offset, KMER_MATRIX_PACKING_SIZE)
+        yield keys, block
+
+
+def merge_datasets(dataset_paths, output_path, kmer_encoding=None, chunk_policy="row", min_prevalence=None,
+                   max_prevalence=None, deduplicate_kmers=False, warning_callback=None, error_callback=None,
+                   progress_callback=None):
+    """
+    Merges datasets with k-mers of the same length into a dataset that contains all their genomes, without counting
+    the k-mers again. The k-mers of the merged dataset are the union of the k-mers of the datasets, which is computed
+    in sorted order by a streaming merge of their k-mer indexes. The genomes are in the order of the datasets.
+
+    Parameters:
+    -----------
+    dataset_paths: list
+        The datasets to merge.
+    output_path: str
+        The merged dataset to be created.
+    kmer_encoding: str
+        The storage of the k-mer sequences (see KMER_ENCODINGS). Defaults to the encoding of the first dataset.
+    chunk_policy: str
+        The chunk layout policy of the k-mer matrix (see CHUNK_POLICIES).
+    min_prevalence: int
+        The minimum number of genomes in which a k-mer must be present. None means that there is no minimum.
+    max_prevalence: int
+        The maximum number of genomes in which a k-mer can be present. None means that there is no maximum.
+    deduplicate_kmers: bool
+        Whether to group the k-mers with identical columns into equivalence classes.
+
+    Notes:
+    ------
+    The k-mers that were removed from a dataset by a filter (e.g., the singleton filter) are absent from its genomes in
+    the merged dataset. The k-mers of the equivalence classes of the datasets get their own column. The splits of the
+    datasets are not merged.
+    """
+    warning_callback, error_callback, progress_callback = _init_callback_functions(warning_callback, error_callback,
+                                                                                   progress_callback)
+
+    if len(dataset_paths) < 2:
+        error_callback(ValueError("At least two datasets are required."))
+    if abspath(output_path) in [abspath(p) for p in dataset_paths]:
+        error_callback(ValueError("The merged dataset must be written to a new file."))
+    if kmer_encoding is not None and kmer_encoding not in KMER_ENCODINGS:
+        error_callback(ValueError("Unknown k-mer encoding: %s. The available encodings are %s." %
+                                  (kmer_encoding, ", ".join(KMER_ENCODINGS))))
+    if chunk_policy not in CHUNK_POLICIES:
+        error_callback(ValueError("Unknown chunk layout policy: %s. The available policies are %s." %
+                                  (chunk_policy, ", ".join(CHUNK_POLICIES))))
+    if exists(output_path):
+        warning_callback("The output file %s exists and will be overwritten." % output_path)
+
+    source_files = [h.File(p, "r") for p in dataset_paths]
+    output_file = []
+
+    def close_and_raise(exception):
+        for f in source_files + output_file:
+            f.close()
+        error_callback(exception)
+
+    kmer_sizes = [_kmer_length(f["kmer_sequences"]) for f in source_files]
+    if len(set(kmer_sizes)) > 1:
+        close_and_raise(ValueError("The datasets have k-mers of different lengths (%s)." %
+                                   ", ".join(str(k) for k in kmer_sizes)))
+    kmer_size = kmer_sizes[0]
+    if kmer_encoding is None:
+        kmer_encoding = source_files[0]["kmer_sequences"].attrs.get("encoding", "ascii")
+
+    genome_ids = np.hstack([f["genome_identifiers"][...] for f in source_files])
+    if len(np.unique(genome_ids)) < len(genome_ids):
+        close_and_raise(Exception("The datasets contain genomes with the same identifier."))
+    genome_counts = [f["genome_identifiers"].shape[0] for f in source_files]
+    genome_offsets = np.hstack(([0], np.cumsum(genome_counts)[:-1])).tolist()
+
+    has_phenotype = ["phenotype" in f for f in source_files]
+    if any(has_phenotype) and not all(has_phenotype):
+        close_and_raise(Exception("Some of the datasets do not have phenotypic metadata."))
+    if all(has_phenotype):
+        tags = [f["phenotype_tags"][...].tolist() for f in source_files]
+        if any(t != tags[0] for t in tags[1:]):
+            close_and_raise(Exception("The phenotype tags of the datasets are different. The labels of the genomes "
+                                      "would not have the same meaning."))
+        descriptions = set(f.attrs["phenotype_description"] for f in source_files)
+        if len(descriptions) > 1:
+            warning_callback("The phenotype descriptions of the datasets are different (%s). The description of the "
+                             "first dataset is used." % ", ".join(str(d) for d in descriptions))
+
+    for path, f in zip(dataset_paths, source_files):
+        if "splits" in f and len(f["splits"]) > 0:
+            warning_callback("The splits of %s are not merged. Create the splits of the merged dataset." % path)
+        if f.attrs.get("filter", "nothing") == "singleton" or "min_prevalence" in f.attrs and \
+                (f.attrs["min_prevalence"] > 1 or f.attrs["max_prevalence"] < f["genome_identifiers"].shape[0]):
+            warning_callback("The k-mers of %s were filtered. The k-mers that were removed are absent from its "
+                             "genomes in the merged dataset." % path)
+
+    # The k-mers that contain other nucleotides than A, C, G and T are not in the k-mer index (see _sorted_index). They
+    # would be missing from the merged dataset.
+    indexes = [_canonical_kmer_index(f, kmer_size) for f in source_files]
+    for path, f, (index_keys, _) in zip(dataset_paths, source_files, indexes):
+        n_unindexed = _kmer_count(f) - index_keys.shape[0]
+        if n_unindexed > 0:
+            close_and_raise(Exception("%s contains %d k-mers with other nucleotides than A, C, G and T. Such k-mers "
+                                      "cannot be merged." % (path, n_unindexed)))
+
+    n_genomes = len(genome_ids)
+    min_prevalence, max_prevalence, filter_prevalence = _prevalence_bounds(min_prevalence, max_prevalence, n_genomes,
+                                                                           close_and_raise)
+
+    # The merged dataset is compressed like the first dataset
+    first_matrix = open_kmer_matrix(source_files[0])
+    compression_kwargs = dict(compression=first_matrix.compression, compression_opts=first_matrix.compression_opts,
+                              shuffle=first_matrix.shuffle)
+
+    logging.debug("Merging %d datasets (%s genomes)." % (len(source_files), ", ".join(str(c) for c in genome_counts)))
+    h5py_file = _create_hdf5_file_no_chunk_caching(output_path)
+    output_file.append(h5py_file)
+    h5py_file.attrs["created"] = time()
+    h5py_file.attrs["uuid"] = str(uuid1())
+    h5py_file.attrs["merged_from"] = [abspath(p) for p in dataset_paths]
+    for attribute in ["genome_source_type", "genomic_data", "phenotype_metadata_source"]:
+        values = [str(f.attrs[attribute]) for f in source_files if attribute in f.attrs]
+        if len(values) > 0:
+            h5py_file.attrs[attribute] = values[0] if len(set(values)) == 1 else ", ".join(values)
+    for attribute in ["phenotype_description", "classification_type", "filter", "compression"]:
+        if attribute in source_files[0].attrs:
+            h5py_file.attrs[attribute] = source_files[0].attrs[attribute]
+
+    logging.debug("Creating the genome identifier dataset.")
+    h5py_file.create_dataset("genome_identifiers", data=genome_ids, **compression_kwargs)
+    if all(has_phenotype):
+        logging.debug("Creating the phenotype metadata dataset.")
+        phenotype = h5py_file.create_dataset("phenotype",
+                                             data=np.hstack([f["phenotype"][...] for f in source_files]),
+                                             dtype=PHENOTYPE_LABEL_DTYPE)
+        phenotype.attrs["description"] = source_files[0].attrs["phenotype_description"]
+        h5py_file.create_dataset("phenotype_tags", data=source_files[0]["phenotype_tags"][...], **compression_kwargs)
+
+    # The merged blocks contain the canonical keys of the k-mers (see _canonical_kmer_index): the 2-bit code of the
+    # k-mers of length at most MAX_KMER_SIZE and the sequences of the longer k-mers. The k-mers of the merged dataset
+    # are thus in the canonical form of the python k-mer counter, whatever the counter of the datasets.
+    removal_counts = new_removal_counts()
+    merge_counts = {"union": 0, "placed": [0] * len(source_files)}
+    _write_merged_kmer_matrix(h5py_file=h5py_file,
+                              n_genomes=n_genomes,
+                              blocks=_merged_blocks(source_files, indexes, genome_offsets, n_genomes, merge_counts,
+                                                    progress_callback),
+                              kmer_size=kmer_size,
+                              kmer_encoding=kmer_encoding,
+                              chunk_policy=chunk_policy,
+                              compression_kwargs=compression_kwargs,
+                              progress_callback=progress_callback,
+                              error_callback=close_and_raise,
+                              prevalence_filter=(min_prevalence, max_prevalence, removal_counts)
+                                                if filter_prevalence else None,
+                              expected_kmer_count=max(open_kmer_matrix(f).shape[1] for f in source_files))
+
+    # Every k-mer of the datasets must be in the union, and every k-mer of the union must be written or filtered
+    for path, f, n_placed in zip(dataset_paths, source_files, merge_counts["placed"]):
+        if n_placed != _kmer_count(f):
+            close_and_raise(Exception("Only %d of the %d k-mers of %s were merged." % (n_placed, _kmer_count(f), path)))
+    n_merged = h5py_file["kmer_sequences"].shape[0] + removal_counts["rare"] + removal_counts["common"]
+    if n_merged != merge_counts["union"]:
+        close_and_raise(Exception("The merged dataset contains %d k-mers, but the union of the k-mers of the datasets "
+                                  "contains %d k-mers." % (n_merged, merge_counts["union"])))
+    h5py_file.close()
+    for f in source_files:
+        f.close()
+
+    _complete_kmer_columns(output_path=output_path,
+                           min_prevalence=min_prevalence,
+                           max_prevalence=max_prevalence,
+                           apply_prevalence_filter=False,
+                           deduplicate=deduplicate_kmers,
+                           compression_kwargs=compression_kwargs,
+                           removal_counts=removal_counts)
+    write_summary(output_path)
+    logging.debug("Dataset merging completed.")
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import h5py as h
+import logging
+
+from os.path import abspath, exists, isdir
+from time import time
+from uuid import uuid1
+
+from ..utils import _init_callback_functions
+from .summary import write_summary
+from .tools.shards import shard_path, supports_virtual_datasets, write_kmer_matrix_shards, SHARDS_GROUP
+from .tools.sparse_matrix import open_kmer_matrix, SPARSE_GROUP
+
+
+def shard_dataset(dataset_path, output_path, n_shards, shard_dirs=None, warning_callback=None, error_callback=None,
+                  progress_callback=None):
+    """
+    Writes a copy of a dataset whose k-mer matrix is split by ranges of k-mers into several files (shards). The copy
+    contains the other data of the dataset and links the shards with a virtual k-mer matrix. The learning algorithms
+    read the shards concurrently, and the shards can be spread over several disks.
+
+    Parameters:
+    -----------
+    dataset_path: str
+        The dataset to shard.
+    output_path: str
+        The sharded dataset to be created.
+    n_shards: int
+        The number of shards.
+    shard_dirs: list
+        The directories in which the shards are written, in turn. By default, the shards are written next to the
+        sharded dataset.
+
+    Notes:
+    ------
+    The shards that are next to the sharded dataset are found relative to it, so they can be moved along with it. The
+    shards that are written to other directories are found by their absolute path. The shards of a dataset whose rare
+    k-mers are stored as genome lists (see kover dataset sparsify) are packed.
+    """
+    warning_callback, error_callback, progress_callback = _init_callback_functions(warning_callback, error_callback,
+                                                                                   progress_callback)
+
+    if not supports_virtual_datasets():
+        error_callback(RuntimeError("Sharded datasets require h5py >= 2.9 and HDF5 >= 1.10."))
+    if n_shards < 1:
+        error_callback(ValueError("The number of shards must be at least 1."))
+    if abspath(dataset_path) == abspath(output_path):
+        error_callback(ValueError("The sharded dataset must be written to a new file."))
+    if shard_dirs is not None:
+        for shard_dir in shard_dirs:
+            if not isdir(shard_dir):
+                error_callback(IOError("The shard directory %s does not exist." % shard_dir))
+    if exists(output_path):
+        warning_callback("The output file %s exists and will be overwritten." % output_path)
+
+    shard_paths = [shard_path(output_path, i, shard_dirs[i % len(shard_dirs)] if shard_dirs else None)
+                   for i in xrange(n_shards)]
+    if abspath(dataset_path) in [abspath(p) for p in shard_paths]:
+        error_callback(ValueError("A shard cannot overwrite the dataset to shard."))
+
+    source_file = h.File(dataset_path, "r")
+    destination_file = h.File(output_path, "w")
+    for key, value in source_file.attrs.iteritems():
+        destination_file.attrs[key] = value
+    for name in source_file:
+        if name not in ["kmer_matrix", SHARDS_GROUP, SPARSE_GROUP]:
+            source_file.copy(name, destination_file)
+    # The content of the k-mer matrix is unchanged, but the shards must be told apart from those of other copies
+    uuid = str(uuid1())
+    destination_file.attrs["uuid"] = uuid
+    destination_file.attrs["sharded"] = time()
+    destination_file.attrs["sharded_from"] = abspath(dataset_path)
+
+    kmer_matrix = open_kmer_matrix(source_file)
+    logging.debug("Writing a k-mer matrix of shape %s to %d shards." % (str(kmer_matrix.shape), n_shards))
+    column_starts = write_kmer_matrix_shards(kmer_matrix=kmer_matrix,
+                                             destination_file=destination_file,
+                                             shard_paths=shard_paths,
+                                             uuid=uuid,
+                                             progress_callback=progress_callback)
+    source_file.close()
+    destination_file.close()
+
+    logging.debug("The shards start at the columns %s." % ", ".join(str(c) for c in column_starts[:-1]))
+    write_summary(output_path)
+    logging.debug("Dataset sharding completed.")
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import h5py as h
+import logging
+
+from os.path import abspath, exists
+from time import time
+from uuid import uuid1
+
+from ..utils import _init_callback_functions
+from .summary import write_summary
+from .tools.shards import SHARDS_GROUP
+from .tools.sparse_matrix import default_max_sparse_prevalence, write_hybrid_kmer_matrix, SPARSE_GROUP
+
+
+def sparsify_dataset(dataset_path, output_path, max_sparse_prevalence=None, warning_callback=None,
+                     error_callback=None, progress_callback=None):
+    """
+    Writes a copy of a dataset whose k-mer matrix has the hybrid layout: the k-mers that are present in few genomes
+    are stored as the list of these genomes, and the other k-mers are packed, as in the dense layout. In datasets of
+    many genomes, most of the k-mers of the accessory genome are rare, and their genome lists are much smaller than
+    their packed columns. The learning algorithms count the genomes in the genome lists instead of counting the bits
+    of the packed columns.
+
+    Parameters:
+    -----------
+    dataset_path: str
+        The dataset to sparsify.
+    output_path: str
+        The sparsified dataset to be created.
+    max_sparse_prevalence: int
+        The k-mers that are present in at most this number of genomes are stored as genome lists. By default, the
+        k-mers whose genome list is smaller than their packed column are stored as genome lists.
+
+    Notes:
+    ------
+    The k-mer matrix of a sharded dataset is read through its shards, and the copy is not sharded.
+    """
+    warning_callback, error_callback, progress_callback = _init_callback_functions(warning_callback, error_callback,
+                                                                                   progress_callback)
+
+    if abspath(dataset_path) == abspath(output_path):
+        error_callback(ValueError("The sparsified dataset must be written to a new file."))
+    if max_sparse_prevalence is not None and max_sparse_prevalence < 0:
+        error_callback(ValueError("The maximum prevalence of the sparse k-mers must be at least 0."))
+    if exists(output_path):
+        warning_callback("The output file %s exists and will be overwritten." % output_path)
+
+    source_file = h.File(dataset_path, "r")
+    if SPARSE_GROUP in source_file:
+        source_file.close()
+        error_callback(Exception("The rare k-mers of the dataset are already stored as genome lists."))
+
+    n_genomes = source_file["genome_identifiers"].shape[0]
+    if max_sparse_prevalence is None:
+        max_sparse_prevalence = default_max_sparse_prevalence(n_genomes)
+
+    destination_file = h.File(output_path, "w")
+    for key, value in source_file.attrs.iteritems():
+        destination_file.attrs[key] = value
+    for name in source_file:
+        if name not in ["kmer_matrix", SHARDS_GROUP]:
+            source_file.copy(name, destination_file)
+    destination_file.attrs["uuid"] = str(uuid1())
+    destination_file.attrs["sparsified"] = time()
+    destination_file.attrs["sparsified_from"] = abspath(dataset_path)
+
+    logging.debug("Storing the k-mers present in at most %d of %d genomes as genome lists." % (max_sparse_prevalence,
+                                                                                            n_genomes))
+    n_sparse_columns = write_hybrid_kmer_matrix(kmer_matrix=source_file["kmer_matrix"],
+                                                destination_file=destination_file,
+                                                n_genomes=n_genomes,
+                                                max_sparse_prevalence=max_sparse_prevalence,
+                                                progress_callback=progress_callback)
+    logging.debug("%d of %d columns are stored as genome lists." % (n_sparse_columns,
+                                                                  source_file["kmer_matrix"].shape[1]))
+    source_file.close()
+    destination_file.close()
+
+    write_summary(output_path)
+    logging.debug("Dataset sparsification completed.")
@@ -26,6 +26,7 @@ from math import ceil
 from ..dataset import KoverDataset
 from ..learning.common.rules import KmerRuleClassifications
 from ..utils import _hdf5_open_no_chunk_cache, _minimum_uint_size
+from .summary import write_summary
 
 
 def split_with_ids(input, split_name, train_ids_file, test_ids_file, random_seed, n_folds, warning_callback=None,
@@ -81,6 +82,8 @@ def split_with_ids(input, split_name, train_ids_file, test_ids_file, random_seed
            warning_callback=warning_callback,
            error_callback=error_callback,
            progress_callback=progress_callback)
+    dataset.close()
+    write_summary(input)
 
 
 def split_with_proportion(input, split_name, train_prop, random_seed, n_folds, warning_callback=None, error_callback=None,
@@ -119,6 +122,8 @@ def split_with_proportion(input, split_name, train_prop, random_seed, n_folds, w
            warning_callback=warning_callback,
            error_callback=error_callback,
            progress_callback=progress_callback)
+    dataset.close()
+    write_summary(input)
 
 
 def _split(dataset, split_name, random_generator, random_seed, train_idx, test_idx, warning_callback,
@@ -146,7 +151,7 @@ def _split(dataset, split_name, random_generator, random_seed, train_idx, test_i
 
     dataset_hdf5 = dataset.dataset_open(ACC_RDWR)  # The hdf5 file of the dataset, use dataset for high-level operations
 
-    if len(dataset.splits) == 0:
+    if "splits" not in dataset_hdf5:
         dataset_hdf5.create_group("splits")
 
     splits = dataset_hdf5["splits"]
@@ -235,7 +240,7 @@ def _validate_split(dataset, split_name, train_idx, test_idx, n_folds, warning_c
     if dataset.phenotype.description == "NA":
         error_callback(Exception("A dataset must contain phenotypic metadata to be split."))
 
-    if split_name in (split.name for split in dataset.splits):
+    if split_name in dataset.split_names:
         error_callback(Exception("A split with the identifier \"%s\" already exists in the dataset." % split_name))
 
     if n_folds > len(train_idx):
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import logging
+
+from os import chmod, close, remove, rename, stat
+from os.path import dirname, getmtime, getsize
+from tempfile import mkstemp
+
+from .ds import KoverDataset
+
+SUMMARY_SUFFIX = ".summary.json"
+SUMMARY_VERSION = 1
+
+
+def summary_path(dataset_path):
+    """
+    The path of the summary of a dataset, which is written next to the dataset.
+    """
+    return dataset_path + SUMMARY_SUFFIX
+
+
+def compute_summary(dataset_path):
+    """
+    Reads the fields of the summary of a dataset (the fields printed by kover dataset info, except the genome
+    identifiers and the k-mer sequences).
+
+    Returns:
+    --------
+    summary: dict
+        The fields of the summary, and the modification time and the size of the dataset file when they were read.
+    """
+    # The file is stated first, so that a summary read while the dataset is modified is seen as outdated
+    dataset_mtime, dataset_size = getmtime(dataset_path), getsize(dataset_path)
+    dataset = KoverDataset(dataset_path)
+    try:
+        phenotype = dataset.phenotype
+        prevalence_filter = dataset.prevalence_filter
+        summary = {"version": SUMMARY_VERSION,
+                   "dataset_mtime": dataset_mtime,
+                   "dataset_size": dataset_size,
+                   "uuid": str(dataset.uuid),
+                   "genome_source_type": str(dataset.genome_source_type),
+                   "genome_source": str(dataset.genome_source),
+                   "genome_count": int(dataset.genome_count),
+                   "kmer_length": int(dataset.kmer_length),
+                   "kmer_count": int(dataset.kmer_count),
+                   "kmer_class_member_count": int(dataset.kmer_class_member_count),
+                   "phenotype_description": str(phenotype.description),
+                   "phenotype_metadata_source": str(phenotype.metadata_source),
+                   "phenotype_tags": [str(tag) for tag in phenotype.tags],
+                   "compression": str(dataset.compression),
+                   "classification_type": str(dataset.classification_type),
+                   "prevalence_filter": prevalence_filter,
+                   "splits": [split.describe() for split in dataset.splits]}
+    finally:
+        dataset.close()
+    return summary
+
+
+def write_summary(dataset_path):
+    """
+    Writes the summary of a dataset (see compute_summary) next to the dataset. It must be written again when the dataset
+    is modified, otherwise it is ignored (see read_summary).
+
+    Returns:
+    --------
+    summary: dict
+        The summary that was written.
+    """
+    summary = compute_summary(dataset_path)
+    # The summary is replaced atomically, so that it is never read partially written
+    fd, temp_path = mkstemp(suffix=SUMMARY_SUFFIX, dir=dirname(summary_path(dataset_path)) or ".")
+    close(fd)
+    try:
+        with open(temp_path, "w") as f:
+            json.dump(summary, f, indent=1, sort_keys=True)
+        # mkstemp creates the file readable by its owner only: the summary is as readable as the dataset
+        chmod(temp_path, stat(dataset_path).st_mode & 0666)
+        rename(temp_path, summary_path(dataset_path))
+    except:
+        remove(temp_path)
+        raise
+    return summary
+
+
+def _encode_strings(value):
+    # The strings of a JSON file are read as unicode strings, and the dataset fields are byte strings
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    elif isinstance(value, list):
+        return [_encode_strings(v) for v in value]
+    elif isinstance(value, dict):
+        return dict((_encode_strings(k), _encode_strings(v)) for k, v in value.iteritems())
+    return value
+
+
+def read_summary(dataset_path):
+    """
+    Reads the summary written next to a dataset.
+
+    Returns:
+    --------
+    summary: dict
+        The summary, or None if there is no summary or if the dataset was modified after the summary was written.
+    """
+    try:
+        with open(summary_path(dataset_path), "r") as f:
+            summary = _encode_strings(json.load(f))
+    except (IOError, ValueError):
+        return None
+    if summary.get("version") != SUMMARY_VERSION or summary.get("dataset_mtime") != getmtime(dataset_path) or \
+            summary.get("dataset_size") != getsize(dataset_path):
+        return None
+    return summary
+
+
+def load_summary(dataset_path):
+    """
+    The summary of a dataset. It is read from the summary file if it is up to date, otherwise it is read from the
+    dataset and the summary file is written again if possible (e.g., the dataset can be in a read-only directory).
+    """
+    summary = read_summary(dataset_path)
+    if summary is None:
+        try:
+            summary = write_summary(dataset_path)
+        except (IOError, OSError) as e:
+            logging.debug("The summary of the dataset could not be written: %s" % e)
+            summary = compute_summary(dataset_path)
+    return summary
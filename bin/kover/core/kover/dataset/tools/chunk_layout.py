@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import h5py as h
+import logging
+import numpy as np
+
+from os import close, remove
+from tempfile import mkstemp
+from time import time
+
+from ...learning.common.rules import KmerRuleClassifications
+from ...utils import _hdf5_open_no_chunk_cache
+
+CHUNK_POLICIES = ["row", "tile", "autotune"]
+ROW_CHUNK_COLUMNS = 100000  # Columns in each chunk of the "row" policy (one packed row per chunk)
+TILE_CHUNK_BYTES = 1024 * 1024  # Size of the chunks of the "tile" policy (all the packed rows per chunk)
+AUTOTUNE_TILE_CHUNK_BYTES = [256 * 1024, 1024 * 1024, 4 * 1024 * 1024]
+AUTOTUNE_SUM_ROWS_CALLS = 10  # Full passes of sum_rows in the simulated workload (split, folds and SCM iterations)
+AUTOTUNE_GET_COLUMNS_CALLS = 100  # Calls to get_columns in the simulated workload (model rules and predictions)
+AUTOTUNE_GET_COLUMNS_SIZE = 5  # Number of columns requested by each call to get_columns
+
+
+def row_chunks(n_rows, n_columns, chunk_columns=ROW_CHUNK_COLUMNS):
+    """
+    One packed row per chunk. sum_rows reads the rows it needs and nothing else, but get_columns reads one chunk per
+    packed row for each column. This is the layout of the datasets created before chunk policies were introduced.
+    """
+    return 1, max(1, min(n_columns, chunk_columns))
+
+
+def tile_chunks(n_rows, n_columns, chunk_bytes=TILE_CHUNK_BYTES, item_size=8):
+    """
+    All the packed rows in each chunk. get_columns reads a single chunk per column, while sum_rows reads all the rows
+    of the chunks, even those that it does not need.
+    """
+    columns = max(1, chunk_bytes / (item_size * max(n_rows, 1)))
+    return max(n_rows, 1), max(1, min(n_columns, columns))
+
+
+def _simulate_workload(path, n_genomes, random_generator):
+    """
+    Times the accesses that learning makes to the k-mer matrix through KmerRuleClassifications.
+
+    Returns:
+    --------
+    sum_rows_time: float
+        The best time of a call to sum_rows on a random half of the genomes (a training set).
+    get_columns_time: float
+        The average time taken by a call to get_columns.
+    """
+    h5py_file = _hdf5_open_no_chunk_cache(path)
+    matrix = KmerRuleClassifications(h5py_file["kmer_matrix"], n_genomes)
+    n_columns = h5py_file["kmer_matrix"].shape[1]
+
+    train_rows = np.sort(random_generator.choice(n_genomes, max(1, n_genomes / 2), replace=False))
+    sum_rows_time = np.infty
+    for _ in xrange(3):
+        t = time()
+        matrix.sum_rows(train_rows)
+        sum_rows_time = min(sum_rows_time, time() - t)
+
+    n_calls = 10
+    t = time()
+    for _ in xrange(n_calls):
+        columns = np.sort(random_generator.choice(2 * n_columns, min(AUTOTUNE_GET_COLUMNS_SIZE, n_columns),
+                                                  replace=False))
+        matrix.get_columns(columns.tolist())
+    get_columns_time = (time() - t) / n_calls
+
+    h5py_file.close()
+    return sum_rows_time, get_columns_time
+
+
+def autotune_chunks(sample, n_genomes, n_columns, compression_kwargs, temp_dir=None, random_seed=42):
+    """
+    Selects the chunk shape of the k-mer matrix by timing the access patterns of KmerRuleClassifications on a sample of
+    the matrix stored with each candidate shape.
+
+    The estimated cost of a layout is the time of AUTOTUNE_SUM_ROWS_CALLS calls to sum_rows over the whole matrix
+    (extrapolated from the sample) plus AUTOTUNE_GET_COLUMNS_CALLS calls to get_columns.
+
+    Parameters:
+    -----------
+    sample: numpy_array, shape=(n_packed_rows, n_sample_columns)
+        The first columns of the packed k-mer matrix.
+    n_genomes: int
+        The number of genomes in the matrix.
+    n_columns: int
+        The number of columns in the complete matrix.
+    compression_kwargs: dict
+        The compression arguments of the k-mer matrix (e.g., compression, compression_opts and shuffle).
+    temp_dir: str
+        The directory where the candidate layouts are written. Defaults to the system's temp dir.
+
+    Returns:
+    --------
+    chunks: tuple
+        The selected chunk shape.
+    costs: dict
+        The estimated cost (in seconds) of each candidate chunk shape.
+    """
+    n_rows, n_sample_columns = sample.shape
+    candidates = [row_chunks(n_rows, n_columns)] + [tile_chunks(n_rows, n_columns, b) for b in AUTOTUNE_TILE_CHUNK_BYTES]
+    candidates = sorted(set(candidates), key=candidates.index)
+
+    costs = {}
+    for chunks in candidates:
+        fd, path = mkstemp(suffix=".h5", dir=temp_dir)
+        close(fd)
+        try:
+            h5py_file = h.File(path, "w")
+            h5py_file.create_dataset("kmer_matrix",
+                                     data=sample,
+                                     chunks=(chunks[0], min(chunks[1], n_sample_columns)),
+                                     **compression_kwargs)
+            h5py_file.close()
+            sum_rows_time, get_columns_time = _simulate_workload(path, n_genomes, np.random.RandomState(random_seed))
+        finally:
+            remove(path)
+        costs[chunks] = AUTOTUNE_SUM_ROWS_CALLS * sum_rows_time * n_columns / n_sample_columns + \
+                        AUTOTUNE_GET_COLUMNS_CALLS * get_columns_time
+        logging.debug("Chunk shape %s: sum_rows %.4fs, get_columns %.4fs, estimated cost %.2fs." %
+                      (str(chunks), sum_rows_time, get_columns_time, costs[chunks]))
+
+    chunks = min(candidates, key=lambda c: costs[c])
+    return chunks, costs
+
+
+def choose_chunks(policy, sample, n_genomes, n_columns, compression_kwargs, temp_dir=None):
+    """
+    Returns the chunk shape of the k-mer matrix for a chunk layout policy.
+
+    Parameters:
+    -----------
+    policy: str
+        One of CHUNK_POLICIES: "row" (one packed row per chunk), "tile" (all the packed rows in chunks of about
+        TILE_CHUNK_BYTES) or "autotune" (the candidate that is the fastest for the access patterns of learning).
+    sample: numpy_array, shape=(n_packed_rows, n_sample_columns)
+        The first columns of the packed k-mer matrix.
+    n_genomes: int
+        The number of genomes in the matrix.
+    n_columns: int
+        The number of columns in the complete matrix.
+    """
+    n_rows = sample.shape[0]
+    if policy == "row":
+        return row_chunks(n_rows, n_columns)
+    elif policy == "tile":
+        return tile_chunks(n_rows, n_columns)
+    elif policy == "autotune":
+        chunks, _ = autotune_chunks(sample, n_genomes, n_columns, compression_kwargs, temp_dir=temp_dir)
+        return chunks
+    else:
+        raise ValueError("Unknown chunk layout policy: %s. The available policies are %s." %
+                         (policy, ", ".join(CHUNK_POLICIES)))
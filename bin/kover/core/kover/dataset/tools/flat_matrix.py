@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import numpy as np
+
+# A flat k-mer matrix file starts with a JSON header that is padded with spaces to a multiple of the page size. The
+# packed k-mer matrix follows as raw little-endian uint64 values in row-major order, so that it can be mapped in memory.
+FLAT_MATRIX_FORMAT = "kover-flat-kmer-matrix"
+FLAT_MATRIX_VERSION = 1
+FLAT_MATRIX_ALIGNMENT = 4096
+FLAT_MATRIX_DTYPE = np.dtype("<u8")
+FLAT_MATRIX_BLOCK_SIZE = 100000  # Number of columns copied at a time
+
+
+def _header_size(header):
+    # Leave room for the offset, which is added to the header once it is known
+    header_bytes = len(json.dumps(header, sort_keys=True)) + len(', "offset": ') + 20 + 1
+    return int(np.ceil(float(header_bytes) / FLAT_MATRIX_ALIGNMENT)) * FLAT_MATRIX_ALIGNMENT
+
+
+def write_flat_kmer_matrix(kmer_matrix, output_file, uuid, progress_callback=None,
+                           block_size=FLAT_MATRIX_BLOCK_SIZE):
+    """
+    Writes the packed k-mer matrix of a dataset to a flat file.
+
+    Parameters:
+    -----------
+    kmer_matrix: h5py.Dataset
+        The packed k-mer matrix of the dataset.
+    output_file: file
+        The flat file, opened in binary read/write mode.
+    uuid: str
+        The identifier of the dataset, used to validate that the flat file matches the dataset.
+    block_size: int
+        The number of columns copied at a time.
+
+    Returns:
+    --------
+    header: dict
+        The header of the flat file.
+    """
+    if progress_callback is None:
+        progress_callback = lambda t, p: None
+
+    if kmer_matrix.dtype != np.uint64:
+        raise ValueError("Only the k-mer matrices packed in 64-bit integers can be exported to a flat file.")
+
+    n_packed_rows, n_columns = kmer_matrix.shape
+    header = {"format": FLAT_MATRIX_FORMAT,
+              "version": FLAT_MATRIX_VERSION,
+              "dtype": FLAT_MATRIX_DTYPE.str,
+              "order": "C",
+              "shape": [int(n_packed_rows), int(n_columns)],
+              "uuid": str(uuid)}
+    header["offset"] = _header_size(header)
+    encoded_header = json.dumps(header, sort_keys=True) + "\n"
+    output_file.write(encoded_header.ljust(header["offset"]))
+
+    # The HDF5 matrix is read in blocks of columns, which are scattered in the rows of a memory mapping of the file
+    output_file.truncate(header["offset"] + n_packed_rows * n_columns * FLAT_MATRIX_DTYPE.itemsize)
+    output_file.flush()
+    if n_packed_rows * n_columns == 0:
+        progress_callback("Exporting", 1.0)
+        return header
+    flat_matrix = np.memmap(output_file, dtype=FLAT_MATRIX_DTYPE, mode="r+", offset=header["offset"],
+                            shape=(n_packed_rows, n_columns), order="C")
+    block_size = max(1, block_size)
+    for block_start in xrange(0, n_columns, block_size):
+        block_stop = min(block_start + block_size, n_columns)
+        flat_matrix[:, block_start:block_stop] = kmer_matrix[:, block_start:block_stop]
+        progress_callback("Exporting", 1.0 * block_stop / n_columns)
+    flat_matrix.flush()
+    del flat_matrix
+
+    return header
+
+
+def read_flat_kmer_matrix_header(path):
+    """
+    Reads the header of a flat k-mer matrix file.
+
+    Parameters:
+    -----------
+    path: str
+        The path to the flat file.
+
+    Returns:
+    --------
+    header: dict
+        The header of the flat file.
+    """
+    with open(path, "rb") as f:
+        first_line = f.readline(FLAT_MATRIX_ALIGNMENT)
+    try:
+        header = json.loads(first_line)
+    except ValueError:
+        raise ValueError("%s is not a flat k-mer matrix file." % path)
+    if not isinstance(header, dict) or header.get("format") != FLAT_MATRIX_FORMAT:
+        raise ValueError("%s is not a flat k-mer matrix file." % path)
+    if header["version"] > FLAT_MATRIX_VERSION:
+        raise ValueError("The flat k-mer matrix file %s was written by a more recent version of Kover." % path)
+    return header
+
+
+def load_flat_kmer_matrix(path, uuid=None):
+    """
+    Maps a flat k-mer matrix file in memory. The pages of the file are loaded on demand and are shared by all the
+    processes that map the file.
+
+    Parameters:
+    -----------
+    path: str
+        The path to the flat file.
+    uuid: str
+        The identifier of the dataset that the flat file must match. None to skip the validation.
+
+    Returns:
+    --------
+    kmer_matrix: np.memmap, dtype=uint64, shape=(n_packed_rows, n_columns)
+        The read-only packed k-mer matrix.
+    """
+    header = read_flat_kmer_matrix_header(path)
+    if uuid is not None and header["uuid"] != str(uuid):
+        raise ValueError("The flat k-mer matrix file %s was not exported from this dataset." % path)
+    dtype = np.dtype(str(header["dtype"]))
+    shape = tuple(header["shape"])
+    if shape[0] * shape[1] == 0:
+        # Empty files cannot be mapped in memory
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=header["offset"], shape=shape, order=str(header["order"]))
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+
+# K-mers whose column of the k-mer matrix is identical to the column of another k-mer are stored in this group, along
+# with the column of their equivalence class, instead of having their own column.
+KMER_CLASSES_GROUP = "kmer_classes"
+
+# Two independent 64-bit hashes are computed for each column, so that collisions are negligible
+_HASH_SEEDS = (np.uint64(0x9E3779B97F4A7C15), np.uint64(0xC2B2AE3D27D4EB4F))
+_HASH_MULTIPLIERS = (np.uint64(0xBF58476D1CE4E5B9), np.uint64(0x94D049BB133111EB))
+_HASH_SHIFTS = (np.uint64(31), np.uint64(29))
+
+
+def column_hashes(packed):
+    """
+    Hashes the columns of a block of the packed k-mer matrix.
+
+    Parameters:
+    -----------
+    packed: numpy_array, dtype=uint64, shape=(n_packed_rows, n_kmers)
+        The packed presence/absence of the k-mers.
+
+    Returns:
+    --------
+    hashes: numpy_array, dtype=uint64, shape=(2, n_kmers)
+        The hashes of each column. Identical columns have identical hashes.
+    """
+    hashes = np.empty((2, packed.shape[1]), dtype=np.uint64)
+    for i in xrange(2):
+        h = np.empty(packed.shape[1], dtype=np.uint64)
+        h.fill(_HASH_SEEDS[i])
+        for row in packed:
+            h ^= row
+            h *= _HASH_MULTIPLIERS[i]
+            h ^= h >> _HASH_SHIFTS[i]
+        hashes[i] = h
+    return hashes
+
+
+def find_kmer_classes(hashes):
+    """
+    Groups columns of the k-mer matrix that have the same hashes into equivalence classes. Each class is represented
+    by its first column.
+
+    Parameters:
+    -----------
+    hashes: numpy_array, dtype=uint64, shape=(2, n_columns)
+        The hashes of the columns (see column_hashes).
+
+    Returns:
+    --------
+    representatives: numpy_array, dtype=int64
+        The column that represents the class of each column.
+    """
+    n_columns = hashes.shape[1]
+    if n_columns == 0:
+        return np.zeros(0, dtype=np.int64)
+    # The sort is stable, so the first column of each class comes first
+    sorter = np.lexsort((hashes[1], hashes[0]))
+    sorted_hashes = hashes[:, sorter]
+    is_class_start = np.ones(n_columns, dtype=np.bool)
+    is_class_start[1:] = (sorted_hashes[:, 1:] != sorted_hashes[:, :-1]).any(axis=0)
+    class_by_sorted_column = np.cumsum(is_class_start) - 1
+    representatives = np.empty(n_columns, dtype=np.int64)
+    representatives[sorter] = sorter[is_class_start][class_by_sorted_column]
+    return representatives
+
+
+def read_kmer_class_members(h5py_file, columns):
+    """
+    Finds the k-mers that are in the equivalence class of columns of the k-mer matrix, in addition to the k-mer of the
+    column.
+
+    Parameters:
+    -----------
+    h5py_file: h5py.File
+        The dataset.
+    columns: list
+        The columns of the k-mer matrix.
+
+    Returns:
+    --------
+    member_idx: numpy_array, dtype=int64
+        The index of the member k-mers in the k-mer sequences of the class group.
+    member_columns: numpy_array
+        The column of each member k-mer.
+    """
+    if KMER_CLASSES_GROUP not in h5py_file:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    member_columns = h5py_file[KMER_CLASSES_GROUP]["columns"][...]
+    member_idx = np.flatnonzero(np.in1d(member_columns, columns))
+    return member_idx, member_columns[member_idx]
@@ -0,0 +1,388 @@
+# -*- coding: utf-8 -*-
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+
+from functools import partial
+from multiprocessing import Pool, cpu_count
+from os import rename
+from os.path import join
+
+from ...utils import _read_sequences
+
+MAX_KMER_SIZE = 32  # A k-mer is 2-bit encoded in a single uint64
+KMER_CODE_DTYPE = np.uint64
+INVALID_NUCLEOTIDE = 255
+NUCLEOTIDES = np.array(["A", "C", "G", "T"])
+MERGE_BLOCK_SIZE = 10000000  # Number of (genome, k-mer) entries merged at a time when building the matrix
+
+_nucleotide_codes = np.empty(256, dtype=np.uint8)
+_nucleotide_codes.fill(INVALID_NUCLEOTIDE)
+for _code, _nucleotide in enumerate("ACGT"):
+    _nucleotide_codes[ord(_nucleotide)] = _code
+    _nucleotide_codes[ord(_nucleotide.lower())] = _code
+
+
+def encode_canonical_kmers(sequence, kmer_size):
+    """
+    Computes the 2-bit encoding of the canonical form of every k-mer of a sequence. The canonical form of a k-mer is
+    the smallest of its encoding and of the encoding of its reverse complement. K-mers that contain a nucleotide other
+    than A, C, G or T are skipped.
+
+    Parameters:
+    -----------
+    sequence: str
+        The nucleotide sequence.
+    kmer_size: int
+        The length of the k-mers (at most MAX_KMER_SIZE).
+
+    Returns:
+    --------
+    kmers: numpy_array, dtype=uint64
+        The encoded canonical k-mers, in their order of appearance in the sequence.
+    """
+    codes = _nucleotide_codes[np.frombuffer(sequence, dtype=np.uint8)]
+    n_kmers = len(codes) - kmer_size + 1
+    if n_kmers <= 0:
+        return np.array([], dtype=KMER_CODE_DTYPE)
+
+    # The k-mers must not overlap an invalid nucleotide
+    invalid = np.zeros(len(codes) + 1, dtype=np.int64)
+    np.cumsum(codes == INVALID_NUCLEOTIDE, out=invalid[1:])
+    is_valid = invalid[kmer_size:] == invalid[:n_kmers]
+    codes[codes == INVALID_NUCLEOTIDE] = 0
+
+    forward_codes = codes.astype(KMER_CODE_DTYPE)
+    reverse_codes = 3 - forward_codes
+    two = KMER_CODE_DTYPE(2)
+
+    # Rolling windows: the nucleotide at offset j of each window is shifted into place one offset at a time
+    forward = np.zeros(n_kmers, dtype=KMER_CODE_DTYPE)
+    reverse = np.zeros(n_kmers, dtype=KMER_CODE_DTYPE)
+    for j in xrange(kmer_size):
+        forward <<= two
+        forward |= forward_codes[j: j + n_kmers]
+        reverse <<= two
+        reverse |= reverse_codes[kmer_size - 1 - j: kmer_size - 1 - j + n_kmers]
+
+    np.minimum(forward, reverse, out=forward)
+    return forward[is_valid]
+
+
+def encode_kmer_sequences(sequences, kmer_size):
+    """
+    Computes the 2-bit encoding of the canonical form of k-mer sequences (e.g., the kmer_sequences of a dataset).
+
+    Returns:
+    --------
+    kmers: numpy_array, dtype=uint64
+        The encoded canonical k-mers.
+    is_valid: numpy_array, dtype=bool
+        Whether each sequence only contains the nucleotides A, C, G and T. The code of invalid sequences is undefined.
+    """
+    codes = _nucleotide_codes[np.ascontiguousarray(sequences, dtype="S%d" % kmer_size).view(np.uint8)]
+    codes = codes.reshape(-1, kmer_size)
+    is_valid = (codes != INVALID_NUCLEOTIDE).all(axis=1)
+    codes[codes == INVALID_NUCLEOTIDE] = 0
+
+    two = KMER_CODE_DTYPE(2)
+    forward = np.zeros(codes.shape[0], dtype=KMER_CODE_DTYPE)
+    reverse = np.zeros(codes.shape[0], dtype=KMER_CODE_DTYPE)
+    for j in xrange(kmer_size):
+        forward <<= two
+        forward |= codes[:, j]
+        reverse <<= two
+        reverse |= 3 - codes[:, kmer_size - 1 - j]
+
+    np.minimum(forward, reverse, out=forward)
+    return forward, is_valid
+
+
+def decode_kmers(kmers, kmer_size):
+    """
+    Converts 2-bit encoded k-mers back to their nucleotide sequences.
+
+    Returns:
+    --------
+    sequences: numpy_array, dtype=S{kmer_size}
+        The nucleotide sequence of each k-mer.
+    """
+    kmers = np.asarray(kmers, dtype=KMER_CODE_DTYPE)
+    characters = np.empty((len(kmers), kmer_size), dtype="S1")
+    for j in xrange(kmer_size):
+        characters[:, j] = NUCLEOTIDES[((kmers >> KMER_CODE_DTYPE(2 * (kmer_size - 1 - j))) &
+                                        KMER_CODE_DTYPE(3)).astype(np.uint8)]
+    return characters.view("S%d" % kmer_size).reshape(-1)
+
+
+def canonical_kmers(kmers, kmer_size):
+    """
+    Returns the canonical form (the smallest of the k-mer and of its reverse complement) of 2-bit encoded k-mers.
+    """
+    forward = np.asarray(kmers, dtype=KMER_CODE_DTYPE)
+    reverse = np.zeros(len(forward), dtype=KMER_CODE_DTYPE)
+    remaining = forward.copy()
+    two = KMER_CODE_DTYPE(2)
+    for _ in xrange(kmer_size):
+        reverse <<= two
+        reverse |= KMER_CODE_DTYPE(3) - (remaining & KMER_CODE_DTYPE(3))
+        remaining >>= two
+    return np.minimum(forward, reverse)
+
+
+def kmer_word_count(kmer_size):
+    """
+    Returns the number of 2-bit encoded words used to store a k-mer of length kmer_size.
+    """
+    return int(np.ceil(1.0 * kmer_size / MAX_KMER_SIZE))
+
+
+def pack_kmer_sequences(sequences, kmer_size):
+    """
+    Computes the 2-bit encoding of k-mer sequences, as they are written (not in canonical form). A k-mer is stored in
+    kmer_word_count(kmer_size) words: the first word contains the first MAX_KMER_SIZE nucleotides, the second word the
+    next MAX_KMER_SIZE nucleotides, and so on.
+
+    Returns:
+    --------
+    words: numpy_array, shape=(n_kmers, n_words), dtype=uint64
+        The encoded k-mers.
+    is_valid: numpy_array, dtype=bool
+        Whether each sequence only contains the nucleotides A, C, G and T. The code of invalid sequences is undefined.
+    """
+    codes = _nucleotide_codes[np.ascontiguousarray(sequences, dtype="S%d" % kmer_size).view(np.uint8)]
+    codes = codes.reshape(-1, kmer_size)
+    is_valid = (codes != INVALID_NUCLEOTIDE).all(axis=1)
+    codes[codes == INVALID_NUCLEOTIDE] = 0
+
+    two = KMER_CODE_DTYPE(2)
+    words = np.zeros((codes.shape[0], kmer_word_count(kmer_size)), dtype=KMER_CODE_DTYPE)
+    for j in xrange(kmer_size):
+        word = words[:, j / MAX_KMER_SIZE]
+        word <<= two
+        word |= codes[:, j]
+    return words, is_valid
+
+
+def unpack_kmer_sequences(words, kmer_size):
+    """
+    Converts k-mers encoded by pack_kmer_sequences back to their nucleotide sequences.
+
+    Returns:
+    --------
+    sequences: numpy_array, dtype=S{kmer_size}
+        The nucleotide sequence of each k-mer.
+    """
+    words = np.asarray(words, dtype=KMER_CODE_DTYPE).reshape(-1, kmer_word_count(kmer_size))
+    characters = np.empty((words.shape[0], kmer_size), dtype="S1")
+    for j in xrange(kmer_size):
+        word_idx, position = divmod(j, MAX_KMER_SIZE)
+        word_length = min(MAX_KMER_SIZE, kmer_size - word_idx * MAX_KMER_SIZE)
+        characters[:, j] = NUCLEOTIDES[((words[:, word_idx] >> KMER_CODE_DTYPE(2 * (word_length - 1 - position))) &
+                                        KMER_CODE_DTYPE(3)).astype(np.uint8)]
+    return characters.view("S%d" % kmer_size).reshape(-1)
+
+
+def count_genome_kmers(job, kmer_size, out_dir):
+    """
+    Extracts the distinct canonical k-mers of a genome and saves them, sorted, to out_dir/{genome_idx}.npy.
+
+    Parameters:
+    -----------
+    job: tuple
+        The index of the genome and the path to its contigs in FASTA format.
+    kmer_size: int
+        The length of the k-mers.
+    out_dir: str
+        The directory where the k-mers are saved.
+
+    Returns:
+    --------
+    path: str
+        The file that contains the k-mers.
+    kmer_count: int
+        The number of distinct k-mers in the genome.
+    """
+    genome_idx, fasta_path = job
+    kmers = [np.unique(encode_canonical_kmers(contig, kmer_size)) for contig in _read_sequences(fasta_path)]
+    kmers = np.unique(np.hstack(kmers)) if len(kmers) > 0 else np.array([], dtype=KMER_CODE_DTYPE)
+    path = join(out_dir, "%d.npy" % genome_idx)
+    # Write to a temporary file first, so that an interrupted run never leaves a truncated file behind
+    np.save(path + ".tmp.npy", kmers.astype(KMER_CODE_DTYPE))
+    rename(path + ".tmp.npy", path)
+    return path, len(kmers)
+
+
+def _count_indexed_genome_kmers(job, kmer_size, out_dir):
+    return job[0], count_genome_kmers(job, kmer_size, out_dir)
+
+
+def _merge_boundaries(genome_kmers, n_blocks):
+    """
+    Splits the k-mer code space into ranges that contain a similar number of (genome, k-mer) entries.
+    """
+    sample = np.unique(np.hstack([k[np.linspace(0, len(k) - 1, num=min(len(k), 1000)).astype(np.int64)]
+                                  for k in genome_kmers if len(k) > 0]))
+    boundaries = np.unique(sample[np.linspace(0, len(sample) - 1, num=n_blocks + 1).astype(np.int64)[1:-1]])
+    return [None] + boundaries.tolist() + [None]
+
+
+def merge_ranges(genome_kmer_files, merge_block_size=MERGE_BLOCK_SIZE):
+    """
+    Splits the k-mer code space into the ranges that build_packed_matrix merges one after the other. The ranges only
+    depend on the content of the files, so they are the same every time that the same genomes are merged.
+
+    Returns:
+    --------
+    ranges: list
+        The (low, high) bounds of each range. A bound of None means that the range is unbounded on that side.
+    """
+    genome_kmers = [np.load(f, mmap_mode="r") for f in genome_kmer_files]
+    n_entries = sum(len(k) for k in genome_kmers)
+    if n_entries == 0:
+        return []
+    n_blocks = max(1, int(np.ceil(1.0 * n_entries / merge_block_size)))
+    boundaries = _merge_boundaries(genome_kmers, n_blocks)
+    return zip(boundaries[:-1], boundaries[1:])
+
+
+def build_packed_matrix(genome_kmer_files, min_genome_count=1, pack_size=64, merge_block_size=MERGE_BLOCK_SIZE,
+                        first_genome_idx=0, ranges=None):
+    """
+    Builds the packed presence/absence matrix of the k-mers from the sorted k-mers of each genome.
+
+    The k-mer code space is split into ranges that are merged one after the other, so that only a fraction of the
+    k-mers are held in memory at a time.
+
+    Parameters:
+    -----------
+    genome_kmer_files: list
+        The files produced by count_genome_kmers, in the order of the genomes in the dataset.
+    min_genome_count: int
+        The minimum number of genomes in which a k-mer must occur to be kept.
+    pack_size: int
+        The number of genomes packed in each integer (32 or 64).
+    merge_block_size: int
+        The approximate number of (genome, k-mer) entries in each range.
+    first_genome_idx: int
+        The index of the first genome in the k-mer matrix. This is used to pack genomes that are appended to an
+        existing matrix.
+    ranges: list
+        The ranges of k-mer codes to merge (see merge_ranges). Defaults to all the ranges.
+
+    Returns:
+    --------
+    A generator that yields, for each range of k-mer codes, a tuple containing:
+    kmers: numpy_array, dtype=uint64
+        The encoded k-mers of the range, sorted.
+    packed: numpy_array, shape=(n_packed_rows, n_kmers)
+        The packed presence/absence of the k-mers in the genomes. The first row is the packed row of the matrix that
+        contains genome first_genome_idx.
+    """
+    n_genomes = len(genome_kmer_files)
+    first_packed_row = first_genome_idx / pack_size
+    n_packed_rows = int(np.ceil(1.0 * (first_genome_idx + n_genomes) / pack_size)) - first_packed_row
+    packed_dtype = np.uint64 if pack_size == 64 else np.uint32
+    if ranges is None:
+        ranges = merge_ranges(genome_kmer_files, merge_block_size)
+    genome_kmers = [np.load(f, mmap_mode="r") for f in genome_kmer_files]
+
+    for low, high in ranges:
+        # Find the k-mers of each genome that fall in [low, high)
+        block_kmers = []
+        for kmers in genome_kmers:
+            start = np.searchsorted(kmers, KMER_CODE_DTYPE(low)) if low is not None else 0
+            stop = np.searchsorted(kmers, KMER_CODE_DTYPE(high)) if high is not None else len(kmers)
+            block_kmers.append(np.asarray(kmers[start: stop]))
+
+        kmers, columns, genome_counts = np.unique(np.hstack(block_kmers), return_inverse=True, return_counts=True)
+        keep = genome_counts >= min_genome_count
+        column_by_kmer = np.cumsum(keep) - 1
+
+        packed = np.zeros((n_packed_rows, keep.sum()), dtype=packed_dtype)
+        offset = 0
+        for genome_idx, genome_block in enumerate(block_kmers, first_genome_idx):
+            genome_columns = columns[offset: offset + len(genome_block)]
+            offset += len(genome_block)
+            genome_columns = column_by_kmer[genome_columns[keep[genome_columns]]]
+            packed[genome_idx / pack_size - first_packed_row, genome_columns] |= packed_dtype(1) << \
+                                                              packed_dtype(pack_size - 1 - genome_idx % pack_size)
+        del block_kmers, columns
+
+        if keep.any():
+            yield kmers[keep], packed
+
+
+def count_kmers(fasta_path_by_genome, kmer_size, out_dir, n_cpu=None, progress_callback=None, completed_genomes=None,
+                checkpoint_callback=None):
+    """
+    Extracts the distinct canonical k-mers of each genome with a pool of processes.
+
+    Parameters:
+    -----------
+    fasta_path_by_genome: list
+        The path to the contigs of each genome, in the order of the genomes in the dataset.
+    kmer_size: int
+        The length of the k-mers (at most MAX_KMER_SIZE).
+    out_dir: str
+        The directory where the k-mers of each genome are saved.
+    n_cpu: int
+        The number of processes used. Defaults to all the cores.
+    progress_callback: function
+        Called with the name of the task and the fraction of the genomes that were processed.
+    completed_genomes: set
+        The indices of the genomes whose k-mers were already saved in out_dir by a previous run. They are not counted
+        again.
+    checkpoint_callback: function
+        Called with the index of each genome as soon as its k-mers are saved.
+
+    Returns:
+    --------
+    genome_kmer_files: list
+        The file that contains the sorted k-mers of each genome.
+    """
+    if kmer_size > MAX_KMER_SIZE:
+        raise ValueError("The built-in k-mer counter supports k-mers of length at most %d." % MAX_KMER_SIZE)
+    if n_cpu is None or n_cpu < 1:
+        n_cpu = cpu_count()
+
+    if completed_genomes is None:
+        completed_genomes = set()
+
+    count = partial(_count_indexed_genome_kmers, kmer_size=kmer_size, out_dir=out_dir)
+    genome_kmer_files = [join(out_dir, "%d.npy" % i) for i in xrange(len(fasta_path_by_genome))]
+    jobs = [(i, f) for i, f in enumerate(fasta_path_by_genome) if i not in completed_genomes]
+    pool = Pool(processes=n_cpu) if n_cpu > 1 and len(jobs) > 1 else None
+    results = pool.imap_unordered(count, jobs) if pool is not None else (count(job) for job in jobs)
+
+    n_counted = len(fasta_path_by_genome) - len(jobs)
+    if progress_callback is not None:
+        progress_callback("Counting k-mers", 1.0 * n_counted / max(1, len(fasta_path_by_genome)))
+    for genome_idx, _ in results:
+        n_counted += 1
+        if checkpoint_callback is not None:
+            checkpoint_callback(genome_idx)
+        if progress_callback is not None:
+            progress_callback("Counting k-mers", 1.0 * n_counted / len(fasta_path_by_genome))
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    return genome_kmer_files
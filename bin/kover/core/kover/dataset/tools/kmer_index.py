@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import numpy as np
+
+from .kmer_classes import KMER_CLASSES_GROUP
+from .kmer_engine import canonical_kmers, pack_kmer_sequences, unpack_kmer_sequences, MAX_KMER_SIZE
+from ...utils import _minimum_uint_size
+
+KMER_INDEX_GROUP = "kmer_index"
+KMER_INDEX_BLOCK_SIZE = 1000000
+KMER_INDEX_POINT_READS = 10000  # Above this number of k-mers, lookup_kmers reads all the columns of the index
+
+_complement_codes = np.arange(256, dtype=np.uint8)
+for _nucleotide, _complement in zip("ACGTacgt", "TGCAtgca"):
+    _complement_codes[ord(_nucleotide)] = ord(_complement)
+
+
+def _kmer_length(kmer_sequences):
+    if kmer_sequences.attrs.get("encoding", "ascii") == "2bit":
+        return int(kmer_sequences.attrs["kmer_length"])
+    return kmer_sequences.dtype.itemsize
+
+
+def _kmer_count(h5py_file):
+    """
+    The number of k-mers of a dataset, including the k-mers of the equivalence classes of the columns.
+    """
+    kmer_count = h5py_file["kmer_sequences"].shape[0]
+    if KMER_CLASSES_GROUP in h5py_file:
+        kmer_count += h5py_file[KMER_CLASSES_GROUP]["kmer_sequences"].shape[0]
+    return kmer_count
+
+
+def _index_keys(sequences, kmer_size):
+    """
+    Converts k-mer sequences to the keys of the index. K-mers of length at most MAX_KMER_SIZE are 2-bit encoded in a
+    single integer, which sorts in the same order as the sequences. Longer k-mers are kept as strings.
+
+    Returns:
+    --------
+    keys: numpy_array
+        The key of each k-mer.
+    is_valid: numpy_array, dtype=bool
+        Whether each k-mer can be indexed (only contains the nucleotides A, C, G and T).
+    """
+    if kmer_size <= MAX_KMER_SIZE:
+        words, is_valid = pack_kmer_sequences(sequences, kmer_size)
+        return words[:, 0], is_valid
+    sequences = np.asarray(sequences, dtype="S%d" % kmer_size)
+    return sequences, np.ones(len(sequences), dtype=np.bool)
+
+
+def canonical_index_keys(keys, kmer_size):
+    """
+    The canonical form of keys of the index: the smallest of the key of a k-mer and of the key of its reverse
+    complement, in the order A, C, G, T. The k-mers counted by DSK are stored in their canonical form in another order
+    (A, C, T, G), so the same k-mer can have different keys in datasets created with different k-mer counters.
+
+    Returns:
+    --------
+    keys: numpy_array
+        The canonical keys, in the same order (they are not sorted).
+    """
+    if kmer_size <= MAX_KMER_SIZE:
+        return canonical_kmers(keys, kmer_size)
+    keys = np.asarray(keys, dtype="S%d" % kmer_size)
+    codes = np.ascontiguousarray(keys).view(np.uint8).reshape(-1, kmer_size)
+    reverse_complements = np.ascontiguousarray(_complement_codes[codes[:, ::-1]]).view("S%d" % kmer_size).reshape(-1)
+    return np.where(reverse_complements < keys, reverse_complements, keys)
+
+
+def _read_keys(kmer_sequences, kmer_size, block_size=KMER_INDEX_BLOCK_SIZE):
+    """
+    Reads the index keys of all the k-mers of a dataset, block by block.
+    """
+    is_2bit_encoded = kmer_sequences.attrs.get("encoding", "ascii") == "2bit"
+    n_kmers = kmer_sequences.shape[0]
+    keys = np.empty(n_kmers, dtype=np.uint64 if kmer_size <= MAX_KMER_SIZE else "S%d" % kmer_size)
+    is_valid = np.ones(n_kmers, dtype=np.bool)
+    for block_start in xrange(0, n_kmers, block_size):
+        block_stop = min(block_start + block_size, n_kmers)
+        block = kmer_sequences[block_start:block_stop]
+        if is_2bit_encoded and kmer_size <= MAX_KMER_SIZE:
+            # The 2-bit encoding of the dataset is the key
+            keys[block_start:block_stop] = block[:, 0]
+        else:
+            if is_2bit_encoded:
+                block = unpack_kmer_sequences(block, kmer_size)
+            keys[block_start:block_stop], is_valid[block_start:block_stop] = _index_keys(block, kmer_size)
+    return keys, is_valid
+
+
+def _column_by_kmer(h5py_file):
+    """
+    The matrix column of each k-mer of the k-mer sequences of a dataset. Each k-mer is in a single column.
+    """
+    kmer_by_matrix_column = h5py_file["kmer_by_matrix_column"][...]
+    column_by_kmer = np.empty(h5py_file["kmer_sequences"].shape[0],
+                              dtype=_minimum_uint_size(max(len(kmer_by_matrix_column), 1)))
+    column_by_kmer[kmer_by_matrix_column] = np.arange(len(kmer_by_matrix_column))
+    return column_by_kmer
+
+
+def _sorted_index(h5py_file):
+    """
+    Computes the sorted keys of the k-mers of a dataset and the matrix column of each key. The k-mers of the
+    equivalence classes of the columns are indexed with the column of their class.
+    """
+    kmer_sequences = h5py_file["kmer_sequences"]
+    kmer_size = _kmer_length(kmer_sequences)
+    keys, is_valid = _read_keys(kmer_sequences, kmer_size)
+    column_by_kmer = _column_by_kmer(h5py_file)
+
+    if KMER_CLASSES_GROUP in h5py_file:
+        member_keys, member_is_valid = _read_keys(h5py_file[KMER_CLASSES_GROUP]["kmer_sequences"], kmer_size)
+        keys = np.hstack((keys, member_keys))
+        is_valid = np.hstack((is_valid, member_is_valid))
+        column_by_kmer = np.hstack((column_by_kmer,
+                                    h5py_file[KMER_CLASSES_GROUP]["columns"][...].astype(column_by_kmer.dtype)))
+        del member_keys, member_is_valid
+
+    indexed_kmers = np.flatnonzero(is_valid)
+    if len(indexed_kmers) < len(keys):
+        logging.debug("%d k-mers contain other nucleotides than A, C, G and T and are not indexed. They are found by "
+                      "comparing their sequence (see lookup_kmers)." % (len(keys) - len(indexed_kmers)))
+    indexed_kmers = indexed_kmers[np.argsort(keys[indexed_kmers], kind="mergesort")]
+    return keys[indexed_kmers], column_by_kmer[indexed_kmers]
+
+
+def build_kmer_index(h5py_file, compression_kwargs):
+    """
+    Writes the k-mer index of a dataset: the k-mers sorted by sequence and the matrix column of each one of them. An
+    existing index is replaced, so this must be called whenever the k-mers or the columns of the matrix change.
+
+    Parameters:
+    -----------
+    h5py_file: h5py.File
+        The dataset, opened for writing.
+    compression_kwargs: dict
+        The compression arguments of the index datasets (e.g., compression, compression_opts and shuffle).
+    """
+    logging.debug("Building the k-mer index.")
+    keys, columns = _sorted_index(h5py_file)
+    if KMER_INDEX_GROUP in h5py_file:
+        del h5py_file[KMER_INDEX_GROUP]
+    group = h5py_file.create_group(KMER_INDEX_GROUP)
+    # h5py cannot create empty chunked datasets
+    chunked_kwargs = compression_kwargs if len(keys) > 0 else {}
+    group.create_dataset("kmers", data=keys, **chunked_kwargs)
+    group.create_dataset("columns", data=columns, **chunked_kwargs)
+
+
+def _scan_kmers(h5py_file, sequences, block_size=KMER_INDEX_BLOCK_SIZE):
+    """
+    Finds the matrix column of k-mer sequences by comparing them to the sequence of every k-mer of a dataset, block by
+    block. This is used for the k-mers that the index cannot hold, which contain other nucleotides than A, C, G and T.
+    Such k-mers can only be stored in the ascii encoding.
+
+    Returns:
+    --------
+    columns: numpy_array, dtype=int64
+        The matrix column of each k-mer, or -1 if the k-mer is not in the dataset.
+    """
+    columns = np.empty(len(sequences), dtype=np.int64)
+    columns.fill(-1)
+    sources = [(h5py_file["kmer_sequences"], _column_by_kmer(h5py_file))]
+    if KMER_CLASSES_GROUP in h5py_file:
+        sources.append((h5py_file[KMER_CLASSES_GROUP]["kmer_sequences"], h5py_file[KMER_CLASSES_GROUP]["columns"][...]))
+
+    kmer_size = _kmer_length(h5py_file["kmer_sequences"])
+    sequences = np.asarray(sequences, dtype="S%d" % kmer_size)
+    for kmer_sequences, column_by_kmer in sources:
+        if kmer_sequences.attrs.get("encoding", "ascii") == "2bit":
+            continue
+        for block_start in xrange(0, kmer_sequences.shape[0], block_size):
+            block = kmer_sequences[block_start: min(block_start + block_size, kmer_sequences.shape[0])]
+            sorter = np.argsort(block)
+            positions = np.minimum(np.searchsorted(block, sequences, sorter=sorter), len(block) - 1)
+            found = np.flatnonzero((columns == -1) & (block[sorter[positions]] == sequences))
+            columns[found] = column_by_kmer[block_start + sorter[positions[found]]]
+    return columns
+
+
+def lookup_kmers(h5py_file, sequences):
+    """
+    Finds the matrix column of k-mer sequences with a binary search in the k-mer index of a dataset. If the dataset
+    has no index (e.g., it was created with an older version of Kover), the index is computed in memory. The k-mers
+    that the index cannot hold (other nucleotides than A, C, G and T) are found by comparing their sequence to those
+    of the dataset.
+
+    Parameters:
+    -----------
+    h5py_file: h5py.File
+        The dataset.
+    sequences: list
+        The k-mer sequences to find. They must have the same length as the k-mers of the dataset.
+
+    Returns:
+    --------
+    columns: numpy_array, dtype=int64
+        The matrix column of each k-mer, or -1 if the k-mer is not in the dataset.
+    """
+    kmer_size = _kmer_length(h5py_file["kmer_sequences"])
+    if KMER_INDEX_GROUP in h5py_file:
+        index_keys = h5py_file[KMER_INDEX_GROUP]["kmers"][...]
+        index_columns = h5py_file[KMER_INDEX_GROUP]["columns"]
+    else:
+        logging.debug("The dataset has no k-mer index. Computing it.")
+        index_keys, index_columns = _sorted_index(h5py_file)
+
+    columns = np.empty(len(sequences), dtype=np.int64)
+    columns.fill(-1)
+    if len(sequences) == 0:
+        return columns
+
+    has_kmer_size = np.array([len(s) == kmer_size for s in sequences], dtype=np.bool)
+    keys, is_valid = _index_keys(sequences, kmer_size)
+    unindexed = np.flatnonzero(has_kmer_size & ~is_valid)
+    if len(unindexed) > 0:
+        columns[unindexed] = _scan_kmers(h5py_file, [sequences[i] for i in unindexed])
+    if len(index_keys) == 0:
+        return columns
+
+    positions = np.minimum(np.searchsorted(index_keys, keys), len(index_keys) - 1)
+    found = np.flatnonzero(has_kmer_size & is_valid & (index_keys[positions] == keys))
+    if len(found) > 0:
+        # Read the columns of the k-mers that were found only (h5py requires increasing indices)
+        unique_positions, inverse = np.unique(positions[found], return_inverse=True)
+        if len(unique_positions) > KMER_INDEX_POINT_READS:
+            index_columns = index_columns[...]
+        columns[found] = np.asarray(index_columns[unique_positions.tolist()], dtype=np.int64)[inverse]
+    return columns
@@ -17,23 +17,387 @@
 	along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-from subprocess import call
-from os.path import abspath, dirname, join
-
-def contigs_pack_kmers(file_path, out_path, filter_singleton, kmer_length, compression, chunk_size, nb_genomes, progress):
-
-	dir_path = dirname(abspath(__file__))
-
-	# Calling DSK2Kover tool
-	call([str(join(dir_path, "kmer_tools", "dsk2kover")),
-					"-file", str(file_path),
-					"-out", str(out_path),
-					"-filter", str(filter_singleton),
-					"-kmer-length", str(kmer_length),
-					"-compression", str(compression),
-					"-chunk-size", str(chunk_size),
-					"-nb-genomes", str(nb_genomes),
-					"-verbose", str(progress)])
+import h5py as h
+import logging
+import numpy as np
+
+from collections import deque
+from functools import partial
+from multiprocessing import Pool, cpu_count
+from os import rename
+from os.path import join
+
+from .kmer_engine import merge_ranges
+
+DSK_SOLID_KMERS = "dsk/solid"  # The group of a DSK output file that contains the partitions of solid k-mers
+# GATB encodes the nucleotides in 2 bits in the order A, C, T, G, with the first nucleotide of a k-mer in the most
+# significant bits of its value. The keys use the order A, C, G, T instead, so that they sort like the sequences.
+KEY_NUCLEOTIDES = np.array(["A", "C", "G", "T"])
+GATB_TO_KEY_MASK = np.uint64(0x5555555555555555)
+PACK_BLOCK_SIZE = 100000  # Number of k-mers (columns) in each packed block
+MERGE_CHUNK_SIZE = 1000000  # Number of k-mers of each genome held in memory at a time by the merge
+MERGE_RANGE_SIZE = 10000000  # Approximate number of (genome, k-mer) entries in each range merged by a process
+
+
+def _kmer_keys(values):
+	"""
+	Converts the values of k-mers counted by DSK to keys that sort like the k-mer sequences. The codes of T and G are
+	swapped by flipping the low bit of each nucleotide whose high bit is set. The keys of k-mers of length at most 32
+	are single words. Longer k-mers span several words, stored least significant word first, so their words are
+	reversed and stored as big-endian bytes, which compare like the k-mers.
+	"""
+	values = np.asarray(values, dtype=np.uint64)
+	values = values ^ ((values >> np.uint64(1)) & GATB_TO_KEY_MASK)
+	if values.ndim == 1:
+		return values
+	n_words = values.shape[1]
+	return np.ascontiguousarray(values[:, ::-1]).astype(">u8").view("S%d" % (8 * n_words)).reshape(-1)
+
+
+def _key_dtype(value_dtype):
+	n_words = int(np.prod(value_dtype.shape)) if value_dtype.shape else 1
+	return np.dtype(np.uint64) if n_words == 1 else np.dtype("S%d" % (8 * n_words))
+
+
+def decode_dsk_kmers(keys, kmer_length):
+	"""
+	Converts the keys of k-mers counted by DSK to their sequences.
+
+	Parameters:
+	-----------
+	keys: numpy_array
+		The keys of the k-mers (see sort_dsk_kmers).
+	kmer_length: int
+		The length of the k-mers.
+
+	Returns:
+	--------
+	sequences: numpy_array, dtype=S{kmer_length}
+		The k-mer sequences.
+	"""
+	if keys.dtype.kind == "S":
+		words = np.frombuffer(np.ascontiguousarray(keys).tobytes(), dtype=">u8").reshape(len(keys), -1)
+	else:
+		words = keys.reshape(-1, 1)
+	n_words = words.shape[1]
+	characters = np.empty((len(keys), kmer_length), dtype="S1")
+	for j in xrange(kmer_length):
+		bit = 2 * (kmer_length - 1 - j)
+		word = words[:, n_words - 1 - bit / 64]
+		characters[:, j] = KEY_NUCLEOTIDES[((word >> np.uint64(bit % 64)) & np.uint64(3)).astype(np.uint8)]
+	return characters.view("S%d" % kmer_length).reshape(-1)
+
+
+def sort_dsk_kmers(job, out_dir):
+	"""
+	Reads the solid k-mers that DSK counted in a genome and saves their keys, sorted, to out_dir/{genome_idx}.npy.
+
+	Parameters:
+	-----------
+	job: tuple
+		The index of the genome and the path to the DSK output file of the genome.
+	out_dir: str
+		The directory where the sorted k-mers are saved.
+
+	Returns:
+	--------
+	genome_idx: int
+		The index of the genome.
+	path: str
+		The file that contains the sorted k-mers.
+	"""
+	genome_idx, dsk_path = job
+	dsk_file = h.File(dsk_path, "r")
+	keys = []
+	key_dtype = np.dtype(np.uint64)
+	for partition in dsk_file[DSK_SOLID_KMERS].itervalues():
+		if not isinstance(partition, h.Dataset):
+			continue
+		value_dtype = partition.dtype["value"] if partition.dtype.names is not None else partition.dtype
+		key_dtype = _key_dtype(value_dtype)
+		if partition.shape[0] > 0:
+			keys.append(_kmer_keys(partition["value"] if partition.dtype.names is not None else partition[...]))
+	dsk_file.close()
+	keys = np.unique(np.hstack(keys)) if len(keys) > 0 else np.zeros(0, dtype=key_dtype)
+
+	path = join(out_dir, "%d.npy" % genome_idx)
+	# Write to a temporary file first, so that an interrupted run never leaves a truncated file behind
+	np.save(path + ".tmp.npy", keys)
+	rename(path + ".tmp.npy", path)
+	return genome_idx, path
+
+
+def _pack_merged_kmers(genome_parts, genome_indexes, min_genome_count, n_packed_rows, pack_size):
+	"""
+	Packs the presence of the k-mers of some genomes. The k-mers of each genome must be sorted and unique.
+	"""
+	kmers, columns, genome_counts = np.unique(np.hstack(genome_parts), return_inverse=True, return_counts=True)
+	keep = genome_counts >= min_genome_count
+	column_by_kmer = np.cumsum(keep) - 1
+	genomes = np.repeat(np.asarray(genome_indexes, dtype=np.int64), [len(part) for part in genome_parts])
+	is_kept = keep[columns]
+	genomes = genomes[is_kept]
+	packed_dtype = np.uint64 if pack_size == 64 else np.uint32
+	packed = np.zeros((n_packed_rows, keep.sum()), dtype=packed_dtype)
+	# The genomes of a k-mer are unique, so adding their bits sets them
+	np.add.at(packed, (genomes / pack_size, column_by_kmer[columns[is_kept]]),
+	          np.left_shift(packed_dtype(1), (pack_size - 1 - genomes % pack_size).astype(packed_dtype)))
+	return kmers[keep], packed
+
+
+def merge_kmer_range(kmer_range, genome_kmer_files, kmer_length, min_genome_count=1, pack_size=64,
+                     chunk_size=MERGE_CHUNK_SIZE, block_size=PACK_BLOCK_SIZE):
+	"""
+	Merges the sorted k-mers of the genomes that fall in a range of keys and packs their presence in the genomes.
+
+	The k-mers of each genome are read in chunks of chunk_size k-mers. At each step, the median of the last k-mers of
+	the current chunks of the genomes is a frontier: the genomes whose chunk ends before it read their next chunks
+	until they reach it, so the k-mers up to the frontier are final and are packed together. Each step consumes the
+	chunks of at least half of the genomes, so the number of steps does not grow with the number of genomes, and only
+	the genomes whose chunk starts before the frontier are touched. Thus, about one chunk per genome is held in memory.
+
+	Parameters:
+	-----------
+	kmer_range: tuple
+		The (low, high) bounds of the keys (see merge_ranges). A bound of None means that the range is unbounded.
+	genome_kmer_files: list
+		The files produced by sort_dsk_kmers, in the order of the genomes in the dataset.
+	kmer_length: int
+		The length of the k-mers.
+	min_genome_count: int
+		The minimum number of genomes in which a k-mer must occur to be kept.
+	pack_size: int
+		The number of genomes packed in each integer (32 or 64).
+	chunk_size: int
+		The number of k-mers of each genome read at a time.
+	block_size: int
+		The number of k-mers in each packed block.
+
+	Returns:
+	--------
+	blocks: list
+		The packed blocks of the range, in order. Each block is a tuple that contains the k-mer sequences (dtype
+		S{kmer_length}) and the packed presence/absence of the k-mers, of shape (n_packed_rows, n_kmers).
+	"""
+	low, high = kmer_range
+	n_genomes = len(genome_kmer_files)
+	n_packed_rows = int(np.ceil(1.0 * n_genomes / pack_size))
+	genome_kmers = [np.load(f, mmap_mode="r") for f in genome_kmer_files]
+	cursors = []
+	stops = []
+	for kmers in genome_kmers:
+		cursors.append(np.searchsorted(kmers, np.array(low, dtype=kmers.dtype)) if low is not None else 0)
+		stops.append(np.searchsorted(kmers, np.array(high, dtype=kmers.dtype)) if high is not None else len(kmers))
+
+	chunks = [np.zeros(0, dtype=kmers.dtype) for kmers in genome_kmers]
+
+	def read_next_chunk(genome_idx):
+		start = cursors[genome_idx]
+		stop = min(start + chunk_size, stops[genome_idx])
+		if stop > start:
+			chunks[genome_idx] = np.hstack((chunks[genome_idx], genome_kmers[genome_idx][start: stop]))
+			cursors[genome_idx] = stop
+			return True
+		return False
+
+	# The genomes that have k-mers left in the range
+	active_genomes = [genome_idx for genome_idx in xrange(n_genomes) if read_next_chunk(genome_idx)]
+
+	blocks = []
+	pending_kmers = []
+	pending_packed = []
+	n_pending = 0
+	while len(active_genomes) > 0:
+		chunk_ends = np.array([chunks[genome_idx][-1] for genome_idx in active_genomes])
+		frontier = np.partition(chunk_ends, len(chunk_ends) / 2)[len(chunk_ends) / 2]
+		genome_parts = []
+		genome_indexes = []
+		next_active_genomes = []
+		for genome_idx in active_genomes:
+			chunk = chunks[genome_idx]
+			if chunk[0] > frontier:
+				next_active_genomes.append(genome_idx)
+				continue
+			while chunks[genome_idx][-1] < frontier and read_next_chunk(genome_idx):
+				pass
+			chunk = chunks[genome_idx]
+			n_final = np.searchsorted(chunk, frontier, side="right")
+			genome_parts.append(chunk[:n_final])
+			genome_indexes.append(genome_idx)
+			chunks[genome_idx] = chunk[n_final:]
+			# The genomes whose k-mers were all merged leave the merge
+			if len(chunks[genome_idx]) > 0 or read_next_chunk(genome_idx):
+				next_active_genomes.append(genome_idx)
+		active_genomes = next_active_genomes
+
+		kmers, packed = _pack_merged_kmers(genome_parts, genome_indexes, min_genome_count, n_packed_rows, pack_size)
+		del genome_parts
+		pending_kmers.append(kmers)
+		pending_packed.append(packed)
+		n_pending += len(kmers)
+
+		# Emit the complete blocks
+		is_last = len(active_genomes) == 0
+		if n_pending >= block_size or (is_last and n_pending > 0):
+			kmers = np.hstack(pending_kmers)
+			packed = np.hstack(pending_packed)
+			n_emitted = len(kmers) if is_last else len(kmers) - len(kmers) % block_size
+			for block_start in xrange(0, n_emitted, block_size):
+				block_stop = min(block_start + block_size, n_emitted)
+				blocks.append((decode_dsk_kmers(kmers[block_start: block_stop], kmer_length),
+				               packed[:, block_start: block_stop]))
+			pending_kmers = [kmers[n_emitted:]]
+			pending_packed = [packed[:, n_emitted:]]
+			n_pending = len(kmers) - n_emitted
+
+	return blocks
+
+
+def sort_genome_kmers(dsk_files, out_dir, n_cpu=None, progress_callback=None):
+	"""
+	Sorts the k-mers counted by DSK in each genome, in parallel (see sort_dsk_kmers).
+
+	Parameters:
+	-----------
+	dsk_files: list
+		The DSK output file of each genome, in the order of the genomes in the dataset.
+	out_dir: str
+		The directory where the sorted k-mers of the genomes are saved.
+	n_cpu: int
+		The number of processes used. Defaults to all the cores.
+
+	Returns:
+	--------
+	genome_kmer_files: list
+		The file that contains the sorted k-mers of each genome, in the order of the genomes.
+	"""
+	if n_cpu is None or n_cpu < 1:
+		n_cpu = cpu_count()
+	if progress_callback is None:
+		progress_callback = lambda t, p: None
+
+	logging.debug("Sorting the k-mers of %d genomes." % len(dsk_files))
+	genome_kmer_files = [None] * len(dsk_files)
+	progress_callback("Sorting k-mers", 0.0)
+	pool = Pool(processes=n_cpu)
+	for n_sorted, (genome_idx, path) in enumerate(pool.imap_unordered(partial(sort_dsk_kmers, out_dir=out_dir),
+	                                                                  enumerate(dsk_files)), 1):
+		genome_kmer_files[genome_idx] = path
+		progress_callback("Sorting k-mers", 1.0 * n_sorted / len(dsk_files))
+	pool.close()
+	pool.join()
+	return genome_kmer_files
+
+
+def merge_kmer_ranges(genome_kmer_files, ranges, kmer_length, filter_singleton, n_cpu=None, progress_callback=None):
+	"""
+	Merges ranges of the sorted k-mers of the genomes (see merge_kmer_range) in a pool of processes. The ranges are
+	yielded in order, as soon as they are merged, and the number of ranges in flight is bounded to limit the memory
+	usage.
+
+	Parameters:
+	-----------
+	genome_kmer_files: list
+		The files produced by sort_genome_kmers, in the order of the genomes in the dataset.
+	ranges: list
+		The ranges of keys to merge (see merge_ranges).
+	kmer_length: int
+		The length of the k-mers.
+	filter_singleton: str
+		"singleton" to remove the k-mers that occur in a single genome, or "nothing".
+	n_cpu: int
+		The number of processes used. Defaults to all the cores.
+
+	Returns:
+	--------
+	A generator that yields the list of the packed blocks of each range (see merge_kmer_range), in order.
+	"""
+	if n_cpu is None or n_cpu < 1:
+		n_cpu = cpu_count()
+	if progress_callback is None:
+		progress_callback = lambda t, p: None
+
+	logging.debug("Merging the k-mers in %d ranges." % len(ranges))
+	merge = partial(merge_kmer_range,
+	                genome_kmer_files=genome_kmer_files,
+	                kmer_length=int(kmer_length),
+	                min_genome_count=2 if filter_singleton == "singleton" else 1)
+	progress_callback("Packing k-mers", 0.0)
+	pool = Pool(processes=n_cpu)
+	pending_ranges = deque()
+	n_merged = 0
+	for kmer_range in ranges + [None]:
+		if kmer_range is not None:
+			pending_ranges.append(pool.apply_async(merge, (kmer_range,)))
+		while len(pending_ranges) > 0 and (len(pending_ranges) > 2 * n_cpu or kmer_range is None):
+			yield pending_ranges.popleft().get()
+			n_merged += 1
+			progress_callback("Packing k-mers", 1.0 * n_merged / len(ranges))
+	pool.close()
+	pool.join()
+
+
+def merge_genome_kmers(genome_kmer_files, kmer_length, filter_singleton, n_cpu=None, progress_callback=None,
+                       merge_range_size=MERGE_RANGE_SIZE):
+	"""
+	Merges the sorted k-mers of the genomes into packed blocks of the k-mer matrix.
+
+	The union of the k-mers is merged (see merge_kmer_ranges) in ranges of keys that contain about merge_range_size
+	(genome, k-mer) entries, which are distributed to a pool of processes.
+
+	Parameters:
+	-----------
+	genome_kmer_files: list
+		The files produced by sort_genome_kmers, in the order of the genomes in the dataset.
+	kmer_length: int
+		The length of the k-mers.
+	filter_singleton: str
+		"singleton" to remove the k-mers that occur in a single genome, or "nothing".
+	n_cpu: int
+		The number of processes used. Defaults to all the cores.
+	merge_range_size: int
+		The approximate number of (genome, k-mer) entries in each range.
+
+	Returns:
+	--------
+	A generator that yields, for each block of k-mers in sorted order, a tuple containing:
+	kmers: numpy_array, dtype=S{kmer_length}
+		The k-mer sequences of the block.
+	packed: numpy_array, dtype=uint64, shape=(n_packed_rows, n_kmers)
+		The packed presence/absence of the k-mers in the genomes.
+	"""
+	ranges = merge_ranges(genome_kmer_files, merge_block_size=merge_range_size)
+	for range_blocks in merge_kmer_ranges(genome_kmer_files=genome_kmer_files,
+	                                      ranges=ranges,
+	                                      kmer_length=kmer_length,
+	                                      filter_singleton=filter_singleton,
+	                                      n_cpu=n_cpu,
+	                                      progress_callback=progress_callback):
+		for block in range_blocks:
+			yield block
+
+
+def contigs_pack_kmers(dsk_files, out_dir, kmer_length, filter_singleton, n_cpu=None, progress_callback=None):
+	"""
+	Packs the k-mers counted by DSK in the genomes into blocks of the k-mer matrix. The k-mers of each genome are
+	sorted (see sort_genome_kmers) and then merged (see merge_genome_kmers).
+
+	Returns:
+	--------
+	genome_kmer_files: list
+		The file that contains the sorted k-mers of each genome.
+	blocks: generator
+		The packed blocks of the k-mer matrix, in sorted order (see merge_genome_kmers).
+	"""
+	genome_kmer_files = sort_genome_kmers(dsk_files=dsk_files,
+	                                      out_dir=out_dir,
+	                                      n_cpu=n_cpu,
+	                                      progress_callback=progress_callback)
+	return genome_kmer_files, merge_genome_kmers(genome_kmer_files=genome_kmer_files,
+	                                             kmer_length=kmer_length,
+	                                             filter_singleton=filter_singleton,
+	                                             n_cpu=n_cpu,
+	                                             progress_callback=progress_callback)
 
 
 reads_pack_kmers = contigs_pack_kmers
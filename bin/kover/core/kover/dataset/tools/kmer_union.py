@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+
+UNION_READ_SIZE = 1000000  # Number of entries of the k-mer index of each dataset read at a time
+UNION_BLOCK_SIZE = 100000  # Maximum number of k-mers in each block of the union
+# The columns of a block are read as a contiguous range of the k-mer matrix if the range is at most this many times
+# larger than the number of columns. Otherwise, only the columns are read.
+COLUMN_SPAN_FACTOR = 4
+
+
+class _IndexCursor(object):
+    """
+    Reads the sorted keys of a k-mer index and the matrix column of each key, one chunk at a time.
+    """
+    def __init__(self, keys, columns, read_size):
+        self.keys = keys
+        self.columns = columns
+        self.read_size = read_size
+        self.position = 0
+        self.buffer_keys = np.zeros(0, dtype=keys.dtype)
+        self.buffer_columns = np.zeros(0, dtype=np.int64)
+        self.refill()
+
+    @property
+    def has_unread(self):
+        return self.position < self.keys.shape[0]
+
+    def refill(self):
+        if len(self.buffer_keys) == 0 and self.has_unread:
+            stop = min(self.position + self.read_size, self.keys.shape[0])
+            self.buffer_keys = np.asarray(self.keys[self.position:stop])
+            self.buffer_columns = np.asarray(self.columns[self.position:stop], dtype=np.int64)
+            self.position = stop
+
+    def take(self, frontier):
+        """
+        Removes the buffered keys up to the frontier (all the buffered keys if the frontier is None).
+        """
+        n_taken = len(self.buffer_keys) if frontier is None else \
+                  np.searchsorted(self.buffer_keys, np.asarray(frontier, dtype=self.buffer_keys.dtype), side="right")
+        keys, columns = self.buffer_keys[:n_taken], self.buffer_columns[:n_taken]
+        self.buffer_keys, self.buffer_columns = self.buffer_keys[n_taken:], self.buffer_columns[n_taken:]
+        self.refill()
+        return keys, columns
+
+
+def union_kmer_indexes(indexes, block_size=UNION_BLOCK_SIZE, read_size=UNION_READ_SIZE, progress_callback=None):
+    """
+    Computes the union of the k-mers of several datasets from their k-mer indexes, in sorted order.
+
+    The indexes are read in chunks. The smallest of the last keys of the chunks of the indexes that are not completely
+    read is a frontier: the next chunks only contain larger keys, so the union of the keys up to the frontier is final.
+    Only one chunk of each index is held in memory.
+
+    Parameters:
+    -----------
+    indexes: list
+        The sorted keys of the k-mers of each dataset and the matrix column of each key (see build_kmer_index). They
+        can be h5py datasets or numpy arrays. The keys of all the datasets must have the same type.
+    block_size: int
+        The maximum number of k-mers in each block of the union.
+    read_size: int
+        The number of entries of each index read at a time.
+
+    Returns:
+    --------
+    A generator that yields, for each block of the union in sorted order, a tuple containing:
+    keys: numpy_array
+        The keys of the k-mers of the block.
+    dataset_columns: list
+        For each dataset, a tuple containing the positions in the block of the k-mers that are in the dataset and the
+        matrix column of these k-mers in the dataset.
+    """
+    if progress_callback is None:
+        progress_callback = lambda t, p: None
+
+    cursors = [_IndexCursor(keys, columns, read_size) for keys, columns in indexes]
+    n_entries = sum(keys.shape[0] for keys, _ in indexes)
+    progress_callback("Merging", 0.0)
+    while any(len(c.buffer_keys) > 0 for c in cursors):
+        unread = [c.buffer_keys[-1] for c in cursors if c.has_unread]
+        frontier = min(unread) if len(unread) > 0 else None
+        taken = [c.take(frontier) for c in cursors]
+        keys = np.unique(np.hstack([k for k, _ in taken]))
+        positions = [np.searchsorted(keys, k) for k, _ in taken]
+
+        for block_start in xrange(0, len(keys), block_size):
+            block_stop = min(block_start + block_size, len(keys))
+            dataset_columns = []
+            for (_, columns), p in zip(taken, positions):
+                in_block = (p >= block_start) & (p < block_stop)
+                dataset_columns.append((p[in_block] - block_start, columns[in_block]))
+            yield keys[block_start:block_stop], dataset_columns
+        progress_callback("Merging", 1.0 * sum(c.position - len(c.buffer_keys) for c in cursors) / max(1, n_entries))
+
+
+def read_kmer_columns(kmer_matrix, columns, span_factor=COLUMN_SPAN_FACTOR):
+    """
+    Reads columns of a packed k-mer matrix, in any order and with repetitions.
+
+    Returns:
+    --------
+    packed: numpy_array, shape=(n_packed_rows, len(columns))
+        The packed columns.
+    """
+    if len(columns) == 0:
+        return np.zeros((kmer_matrix.shape[0], 0), dtype=kmer_matrix.dtype)
+    unique, inverse = np.unique(columns, return_inverse=True)
+    span_start, span_stop = unique[0], unique[-1] + 1
+    if span_stop - span_start <= span_factor * len(unique):
+        # The k-mers of datasets whose k-mers are sorted (e.g., created from contigs or reads) are in contiguous columns
+        packed = kmer_matrix[:, span_start:span_stop][:, unique - span_start]
+    else:
+        packed = kmer_matrix[:, unique.tolist()]
+    return packed[:, inverse]
+
+
+def place_packed_rows(destination, packed, genome_offset, pack_size=64):
+    """
+    Adds the packed rows of a group of genomes to the packed rows of a larger group, in which the genomes start at a
+    given offset. The offset does not need to be a multiple of the packing size: the bits of the genomes are shifted
+    across the packed integers.
+
+    Parameters:
+    -----------
+    destination: numpy_array, shape=(n_destination_packed_rows, n_columns)
+        The packed rows of the larger group, updated in place.
+    packed: numpy_array, shape=(n_packed_rows, n_columns)
+        The packed rows of the group of genomes. The bits after the last genome must be unset.
+    genome_offset: int
+        The index of the first genome of the group in the larger group.
+    """
+    first_row, shift = divmod(genome_offset, pack_size)
+    n_rows = min(packed.shape[0], destination.shape[0] - first_row)
+    if shift == 0:
+        destination[first_row:first_row + n_rows] |= packed[:n_rows]
+        return
+    shift = packed.dtype.type(shift)
+    destination[first_row:first_row + n_rows] |= packed[:n_rows] >> shift
+    # The last genomes of each packed row overflow into the next row
+    n_overflow_rows = min(packed.shape[0], destination.shape[0] - first_row - 1)
+    destination[first_row + 1:first_row + 1 + n_overflow_rows] |= packed[:n_overflow_rows] << \
+                                                                    (packed.dtype.type(pack_size) - shift)
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import logging
+
+from hashlib import md5
+from os import listdir, makedirs, remove, rename
+from os.path import abspath, exists, isdir, join
+from shutil import rmtree
+
+MANIFEST_FILE = "manifest.json"
+
+
+def resumable_work_dir(temp_dir, output_path):
+    """
+    Returns a work directory that is the same for every run that creates the same output dataset.
+    """
+    return join(temp_dir, "kover_work_%s" % md5(abspath(output_path)).hexdigest()[:16])
+
+
+class CreationManifest(object):
+    """
+    Records the work completed during the creation of a dataset, so that an interrupted creation can be resumed.
+
+    The manifest is stored in the work directory and is rewritten atomically each time that a step is completed. The
+    work of a previous run is only reused if it was done with the same parameters. Otherwise, the work directory is
+    emptied.
+
+    Parameters:
+    -----------
+    work_dir: str
+        The work directory of the dataset creation.
+    parameters: dict
+        The parameters that determine the content of the work directory (must be JSON serializable).
+    """
+    def __init__(self, work_dir, parameters):
+        self.work_dir = work_dir
+        self.parameters = json.loads(json.dumps(parameters))  # Normalize the types (e.g., tuples to lists)
+        self._path = join(work_dir, MANIFEST_FILE)
+        self._state = None
+
+        if exists(self._path):
+            with open(self._path, "r") as f:
+                state = json.load(f)
+            if state["parameters"] == self.parameters:
+                logging.debug("Resuming from the work directory %s." % work_dir)
+                self._state = state
+            else:
+                logging.debug("The work directory %s was created with different parameters. It will be emptied." %
+                              work_dir)
+
+        if self._state is None:
+            if isdir(work_dir):
+                for name in listdir(work_dir):
+                    path = join(work_dir, name)
+                    rmtree(path) if isdir(path) else remove(path)
+            else:
+                makedirs(work_dir)
+            self._state = {"parameters": self.parameters, "completed_genomes": [], "completed_blocks": [],
+                           "completed_steps": []}
+            self._save()
+
+    def _save(self):
+        tmp_path = self._path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._state, f)
+        rename(tmp_path, self._path)  # Atomic, so the manifest is never partially written
+
+    @property
+    def completed_blocks(self):
+        return list(self._state["completed_blocks"])
+
+    @property
+    def completed_genomes(self):
+        return set(self._state["completed_genomes"])
+
+    def is_step_completed(self, step):
+        return step in self._state["completed_steps"]
+
+    def mark_block_completed(self, block_idx):
+        self._state["completed_blocks"].append(block_idx)
+        self._save()
+
+    def mark_genomes_completed(self, genome_ids):
+        self._state["completed_genomes"] += list(genome_ids)
+        self._save()
+
+    def mark_step_completed(self, step):
+        self._state["completed_steps"].append(step)
+        self._save()
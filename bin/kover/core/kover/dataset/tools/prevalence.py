@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import numpy as np
+
+from .kmer_classes import column_hashes, find_kmer_classes, KMER_CLASSES_GROUP
+from .kmer_index import build_kmer_index, KMER_INDEX_GROUP
+from .shards import SHARDS_GROUP
+from .sparse_matrix import open_kmer_matrix, SPARSE_GROUP
+from ...utils import _minimum_uint_size
+
+PREVALENCE_BLOCK_SIZE = 100000
+KMER_DATASETS = ["kmer_sequences", "kmer_matrix", "kmer_by_matrix_column", KMER_CLASSES_GROUP, KMER_INDEX_GROUP,
+                 SHARDS_GROUP, SPARSE_GROUP]
+_popcount_by_byte = np.array([bin(i).count("1") for i in xrange(256)], dtype=np.uint8)
+
+
+def column_prevalence(packed):
+    """
+    Counts the genomes in which each k-mer of a block of the packed k-mer matrix is present.
+
+    Parameters:
+    -----------
+    packed: numpy_array, shape=(n_packed_rows, n_kmers)
+        The packed presence/absence of the k-mers. The padding bits of the last row must be 0.
+
+    Returns:
+    --------
+    prevalence: numpy_array, dtype=int64
+        The number of genomes that contain each k-mer.
+    """
+    packed = np.ascontiguousarray(packed)
+    n_packed_rows, n_kmers = packed.shape
+    bit_counts = _popcount_by_byte[packed.view(np.uint8)].reshape(n_packed_rows, n_kmers, packed.dtype.itemsize)
+    return bit_counts.sum(axis=(0, 2), dtype=np.int64)
+
+
+def prevalence_bounds(min_prevalence, max_prevalence, n_genomes):
+    """
+    Resolves the prevalence thresholds of a dataset of n_genomes genomes. None means that there is no threshold.
+
+    Returns:
+    --------
+    min_prevalence, max_prevalence: int
+        The thresholds.
+    is_active: bool
+        Whether the thresholds can remove k-mers.
+    """
+    min_prevalence = 0 if min_prevalence is None else int(min_prevalence)
+    max_prevalence = n_genomes if max_prevalence is None else int(max_prevalence)
+    if min_prevalence < 0 or max_prevalence < min_prevalence:
+        raise ValueError("Invalid prevalence thresholds: the minimum (%d) must be positive and at most the maximum "
+                         "(%d)." % (min_prevalence, max_prevalence))
+    return min_prevalence, max_prevalence, min_prevalence > 0 or max_prevalence < n_genomes
+
+
+def new_removal_counts():
+    return {"rare": 0, "common": 0}
+
+
+def prevalence_mask(packed, min_prevalence, max_prevalence, removal_counts):
+    """
+    Finds the k-mers of a block of the packed k-mer matrix that pass the prevalence filter and counts those that do
+    not.
+
+    Parameters:
+    -----------
+    min_prevalence: int
+        The minimum number of genomes in which a k-mer must be present.
+    max_prevalence: int
+        The maximum number of genomes in which a k-mer can be present.
+    removal_counts: dict
+        The numbers of k-mers removed because they are present in too few ("rare") or too many ("common") genomes.
+        Updated in place.
+
+    Returns:
+    --------
+    keep: numpy_array, dtype=bool
+        Whether each k-mer passes the filter.
+    """
+    prevalence = column_prevalence(packed)
+    is_rare = prevalence < min_prevalence
+    is_common = prevalence > max_prevalence
+    removal_counts["rare"] += int(is_rare.sum())
+    removal_counts["common"] += int(is_common.sum())
+    return ~(is_rare | is_common)
+
+
+def record_prevalence_filter(h5py_file, min_prevalence, max_prevalence, removal_counts):
+    """
+    Records the prevalence thresholds and the number of k-mers that they removed in the attributes of a dataset. The
+    thresholds and the counts are combined with those of previous filters of the dataset. Thresholds that cannot
+    remove any k-mer (see prevalence_bounds) are not recorded, so that the dataset is reported as unfiltered.
+    """
+    if not prevalence_bounds(min_prevalence, max_prevalence, h5py_file["genome_identifiers"].shape[0])[2]:
+        return
+    attrs = h5py_file.attrs
+    attrs["min_prevalence"] = max(min_prevalence, attrs.get("min_prevalence", 0))
+    attrs["max_prevalence"] = min(max_prevalence, attrs.get("max_prevalence", max_prevalence))
+    attrs["rare_kmers_removed"] = removal_counts["rare"] + attrs.get("rare_kmers_removed", 0)
+    attrs["common_kmers_removed"] = removal_counts["common"] + attrs.get("common_kmers_removed", 0)
+    logging.debug("The prevalence filter removed %d rare and %d common k-mers." % (removal_counts["rare"],
+                                                                                 removal_counts["common"]))
+
+
+def _dataset_kwargs(h5py_dataset, shape, chunks):
+    kwargs = dict(shape=shape, maxshape=(None,) * len(shape), dtype=h5py_dataset.dtype)
+    # h5py cannot create empty chunked datasets
+    if shape[0] > 0 and (len(shape) == 1 or shape[1] > 0):
+        kwargs.update(chunks=chunks, compression=h5py_dataset.compression,
+                      compression_opts=h5py_dataset.compression_opts, shuffle=h5py_dataset.shuffle)
+    return kwargs
+
+
+def _clipped_chunks(chunks, shape):
+    if chunks is None:
+        return True
+    return tuple(max(1, min(c, s)) for c, s in zip(chunks, shape))
+
+
+def _create_like(h5py_group, name, h5py_dataset, n_rows):
+    shape = (n_rows,) + h5py_dataset.shape[1:]
+    created = h5py_group.create_dataset(name, **_dataset_kwargs(h5py_dataset, shape,
+                                                                _clipped_chunks(h5py_dataset.chunks, shape)))
+    for key, value in h5py_dataset.attrs.iteritems():
+        created.attrs[key] = value
+    return created
+
+
+def _copy_selected_rows(source, destination, selected, block_size, destination_start=0):
+    """
+    Copies the selected rows of a dataset to consecutive rows of another dataset, block by block.
+    """
+    position = destination_start
+    for block_start in xrange(0, source.shape[0], block_size):
+        block_stop = min(block_start + block_size, source.shape[0])
+        block_selected = selected[block_start:block_stop]
+        n_block_selected = int(block_selected.sum())
+        if n_block_selected > 0:
+            destination[position: position + n_block_selected] = source[block_start:block_stop][block_selected]
+            position += n_block_selected
+    return position
+
+
+def _class_of_columns(class_by_column, columns):
+    classes = np.empty(len(columns), dtype=np.int64)
+    classes.fill(-1)
+    is_valid = columns >= 0
+    classes[is_valid] = class_by_column[columns[is_valid]]
+    return classes
+
+
+def filter_kmer_columns(source_file, destination_file, min_prevalence, max_prevalence, deduplicate=False,
+                        progress_callback=None, block_size=PREVALENCE_BLOCK_SIZE):
+    """
+    Writes the k-mer sequences, the k-mer matrix and the k-mer/column mapping of a dataset to another dataset, without
+    the k-mers that do not pass the prevalence filter. The datasets keep their type, compression and chunk shape.
+
+    Parameters:
+    -----------
+    source_file: h5py.File
+        The dataset to filter.
+    destination_file: h5py.File
+        The dataset to which the k-mers are written, opened for writing. It must not contain k-mers.
+    min_prevalence: int
+        The minimum number of genomes in which a k-mer must be present.
+    max_prevalence: int
+        The maximum number of genomes in which a k-mer can be present.
+    deduplicate: bool
+        Whether to keep a single column for each set of identical columns. The k-mers of the other columns of the set
+        are added to its equivalence class (see KMER_CLASSES_GROUP). The equivalence classes of the source dataset are
+        always kept.
+
+    Returns:
+    --------
+    removal_counts: dict
+        The numbers of k-mers removed because they are present in too few ("rare") or too many ("common") genomes,
+        including the k-mers of their equivalence class, and the number of columns that were added to the equivalence
+        class of another column ("duplicate").
+    """
+    if progress_callback is None:
+        progress_callback = lambda t, p: None
+
+    kmer_matrix = open_kmer_matrix(source_file)
+    kmer_sequences = source_file["kmer_sequences"]
+    n_packed_rows, n_columns = kmer_matrix.shape
+    kmer_by_matrix_column = source_file["kmer_by_matrix_column"][...]
+
+    # Find the columns to keep
+    prevalence = np.zeros(n_columns, dtype=np.int64)
+    hashes = np.zeros((2, n_columns if deduplicate else 0), dtype=np.uint64)
+    for block_start in xrange(0, n_columns, block_size):
+        block_stop = min(block_start + block_size, n_columns)
+        block = kmer_matrix[:, block_start:block_stop]
+        prevalence[block_start:block_stop] = column_prevalence(block)
+        if deduplicate:
+            hashes[:, block_start:block_stop] = column_hashes(block)
+        progress_callback("Filtering", 0.5 * block_stop / n_columns)
+    keep_column = (prevalence >= min_prevalence) & (prevalence <= max_prevalence)
+
+    # The k-mers of the equivalence classes of the source dataset are removed with their column
+    source_classes = source_file[KMER_CLASSES_GROUP] if KMER_CLASSES_GROUP in source_file else None
+    source_member_columns = source_classes["columns"][...] if source_classes is not None else \
+                            np.zeros(0, dtype=np.int64)
+    kmer_prevalence = np.hstack((prevalence, prevalence[source_member_columns]))
+    removal_counts = new_removal_counts()
+    removal_counts["rare"] = int((kmer_prevalence < min_prevalence).sum())
+    removal_counts["common"] = int((kmer_prevalence > max_prevalence).sum())
+    del prevalence, kmer_prevalence
+
+    # The class of each column is the column that represents it (-1 for the columns that are removed)
+    class_by_column = np.empty(n_columns, dtype=np.int64)
+    class_by_column.fill(-1)
+    kept_columns = np.flatnonzero(keep_column)
+    class_by_column[kept_columns] = kept_columns[find_kmer_classes(hashes[:, kept_columns])] if deduplicate else \
+                                    kept_columns
+    del hashes, kept_columns
+    is_representative = class_by_column == np.arange(n_columns)
+    removal_counts["duplicate"] = int(keep_column.sum() - is_representative.sum())
+    n_kept = int(is_representative.sum())
+    new_column = np.cumsum(is_representative) - 1
+    new_class_by_column = _class_of_columns(new_column, class_by_column)
+    del class_by_column, new_column, keep_column
+    logging.debug("Keeping %d of %d columns (%d columns are in the class of another column)." %
+                  (n_kept, n_columns, removal_counts["duplicate"]))
+
+    # The k-mers keep their relative order. The k-mers of the representative columns stay in the k-mer sequences and
+    # those of the other kept columns become members of the equivalence class of their representative.
+    n_kmers = kmer_sequences.shape[0]
+    column_by_kmer = np.empty(n_kmers, dtype=np.int64)
+    column_by_kmer.fill(-1)
+    column_by_kmer[kmer_by_matrix_column] = np.arange(n_columns)
+    kmer_class = _class_of_columns(new_class_by_column, column_by_kmer)
+    keep_kmer = np.zeros(n_kmers, dtype=np.bool)
+    keep_kmer[kmer_by_matrix_column[is_representative]] = True
+    is_member = (kmer_class >= 0) & ~keep_kmer
+    new_kmer_idx = np.cumsum(keep_kmer) - 1
+    new_kmer_by_matrix_column = new_kmer_idx[kmer_by_matrix_column[is_representative]]
+    del column_by_kmer, kmer_by_matrix_column, new_kmer_idx
+
+    kept_sequences = _create_like(destination_file, "kmer_sequences", kmer_sequences, n_kept)
+    _copy_selected_rows(kmer_sequences, kept_sequences, keep_kmer, block_size)
+    del keep_kmer
+
+    # The members of the existing equivalence classes follow the k-mers that became members
+    member_columns = [kmer_class[is_member]]
+    del kmer_class
+    if source_classes is not None:
+        source_member_class = new_class_by_column[source_member_columns]
+        is_source_member = source_member_class >= 0
+        member_columns.append(source_member_class[is_source_member])
+        del source_member_class, source_member_columns
+    member_columns = np.hstack(member_columns)
+    if deduplicate or source_classes is not None:
+        classes = destination_file.create_group(KMER_CLASSES_GROUP)
+        members = _create_like(classes, "kmer_sequences", kmer_sequences, len(member_columns))
+        position = _copy_selected_rows(kmer_sequences, members, is_member, block_size)
+        if source_classes is not None:
+            _copy_selected_rows(source_classes["kmer_sequences"], members, is_source_member, block_size, position)
+        member_columns = member_columns.astype(_minimum_uint_size(n_kept))
+        classes.create_dataset("columns", data=member_columns,
+                               **_dataset_kwargs(source_file["kmer_by_matrix_column"], member_columns.shape, True))
+    del is_member, member_columns
+
+    shape = (n_packed_rows, n_kept)
+    kept_matrix = destination_file.create_dataset("kmer_matrix",
+                                                  **_dataset_kwargs(kmer_matrix, shape,
+                                                                    _clipped_chunks(kmer_matrix.chunks, shape)))
+    position = 0
+    for block_start in xrange(0, n_columns, block_size):
+        block_stop = min(block_start + block_size, n_columns)
+        block_keep = is_representative[block_start:block_stop]
+        n_block_kept = int(block_keep.sum())
+        if n_block_kept > 0:
+            kept_matrix[:, position: position + n_block_kept] = kmer_matrix[:, block_start:block_stop][:, block_keep]
+            position += n_block_kept
+        progress_callback("Filtering", 0.5 + 0.5 * block_stop / n_columns)
+
+    kmer_by_matrix_column_dtype = _minimum_uint_size(n_kept)
+    shape = (n_kept,)
+    destination_file.create_dataset("kmer_by_matrix_column",
+                                    data=new_kmer_by_matrix_column.astype(kmer_by_matrix_column_dtype),
+                                    **_dataset_kwargs(source_file["kmer_by_matrix_column"], shape, True))
+    progress_callback("Filtering", 1.0)
+    return removal_counts
+
+
+def copy_filtered_dataset(source_file, destination_file, min_prevalence, max_prevalence, deduplicate=False,
+                          progress_callback=None):
+    """
+    Copies a dataset without the k-mers that do not pass the prevalence filter and, optionally, with a single column
+    for each set of identical columns (see filter_kmer_columns). The genomes, the phenotypes and the attributes are
+    copied unchanged, the filters are recorded in the attributes of the copy and its k-mer index is rebuilt.
+
+    Parameters:
+    -----------
+    source_file: h5py.File
+        The dataset to filter. It must not contain splits, since they store data for each k-mer.
+    destination_file: h5py.File
+        The empty dataset to which the copy is written.
+    min_prevalence: int
+        The minimum number of genomes in which a k-mer must be present.
+    max_prevalence: int
+        The maximum number of genomes in which a k-mer can be present.
+    deduplicate: bool
+        Whether to group the k-mers with identical columns into equivalence classes.
+
+    Returns:
+    --------
+    removal_counts: dict
+        The numbers of k-mers removed because they are present in too few ("rare") or too many ("common") genomes and
+        the number of columns that were added to the equivalence class of another column ("duplicate").
+    """
+    for key, value in source_file.attrs.iteritems():
+        destination_file.attrs[key] = value
+    for name in source_file:
+        if name not in KMER_DATASETS:
+            source_file.copy(name, destination_file)
+    removal_counts = filter_kmer_columns(source_file=source_file,
+                                         destination_file=destination_file,
+                                         min_prevalence=min_prevalence,
+                                         max_prevalence=max_prevalence,
+                                         deduplicate=deduplicate,
+                                         progress_callback=progress_callback)
+    record_prevalence_filter(destination_file, min_prevalence, max_prevalence, removal_counts)
+    if deduplicate:
+        destination_file.attrs["deduplicated"] = True
+    kmer_sequences = source_file["kmer_sequences"]
+    build_kmer_index(destination_file, dict(compression=kmer_sequences.compression,
+                                            compression_opts=kmer_sequences.compression_opts,
+                                            shuffle=kmer_sequences.shuffle))
+    return removal_counts
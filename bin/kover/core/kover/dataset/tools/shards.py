@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import h5py as h
+import numpy as np
+
+from multiprocessing import current_process, cpu_count, Pool
+from os.path import abspath, basename, dirname, isabs, join, relpath, splitext
+
+from ...utils import _hdf5_open_no_chunk_cache
+
+# The k-mer matrix of a sharded dataset is split by ranges of columns (k-mers) into shard files. This group of the
+# dataset lists the shard files and the first column of each shard. The dataset also contains a virtual k-mer matrix
+# that maps the shards, so that the tools that read the whole matrix do not need to know about the shards.
+SHARDS_GROUP = "kmer_matrix_shards"
+SHARD_BLOCK_SIZE = 100000  # Number of columns copied at a time
+
+
+def supports_virtual_datasets():
+    """
+    Virtual datasets require h5py >= 2.9 and HDF5 >= 1.10.
+    """
+    return hasattr(h, "VirtualLayout") and h.version.hdf5_version_tuple >= (1, 10, 0)
+
+
+def shard_path(dataset_path, shard_idx, shard_dir=None):
+    """
+    The path of a shard file of a dataset. The shards are written next to the dataset, unless a directory is given.
+    """
+    name, extension = splitext(basename(dataset_path))
+    return join(shard_dir if shard_dir is not None else dirname(abspath(dataset_path)),
+                "%s.shard-%03d%s" % (name, shard_idx, extension))
+
+
+def shard_column_starts(n_columns, n_shards):
+    """
+    Splits the columns of the k-mer matrix into n_shards ranges of similar sizes.
+
+    Returns:
+    --------
+    column_starts: numpy_array, dtype=int64, shape=(n_shards + 1,)
+        The first column of each shard, followed by the number of columns.
+    """
+    return np.linspace(0, n_columns, num=n_shards + 1).astype(np.int64)
+
+
+def write_kmer_matrix_shards(kmer_matrix, destination_file, shard_paths, uuid, progress_callback=None,
+                             block_size=SHARD_BLOCK_SIZE):
+    """
+    Writes the k-mer matrix of a dataset to shard files and links them to a dataset.
+
+    Parameters:
+    -----------
+    kmer_matrix: h5py.Dataset
+        The packed k-mer matrix to shard.
+    destination_file: h5py.File
+        The dataset to which the shards are linked. It must not contain a k-mer matrix.
+    shard_paths: list
+        The path of each shard file. The k-mer matrix is split into as many ranges of columns as there are paths.
+    uuid: str
+        The identifier of the dataset, used to validate that the shards match the dataset.
+    block_size: int
+        The number of columns copied at a time.
+
+    Returns:
+    --------
+    column_starts: numpy_array, dtype=int64, shape=(n_shards + 1,)
+        The first column of each shard, followed by the number of columns.
+    """
+    if progress_callback is None:
+        progress_callback = lambda t, p: None
+
+    n_packed_rows, n_columns = kmer_matrix.shape
+    column_starts = shard_column_starts(n_columns, len(shard_paths))
+    chunks = kmer_matrix.chunks
+    compression_kwargs = dict(compression=kmer_matrix.compression, compression_opts=kmer_matrix.compression_opts,
+                              shuffle=kmer_matrix.shuffle)
+    for shard_idx, path in enumerate(shard_paths):
+        column_start, column_stop = column_starts[shard_idx], column_starts[shard_idx + 1]
+        n_shard_columns = column_stop - column_start
+        shard_file = h.File(path, "w")
+        shard_file.attrs["uuid"] = uuid
+        shard_file.attrs["column_start"] = column_start
+        shard_file.attrs["column_stop"] = column_stop
+        # h5py cannot create empty chunked datasets
+        shard_chunks = (chunks[0], max(1, min(chunks[1], n_shard_columns))) if chunks is not None and \
+                                                                                n_shard_columns > 0 else None
+        shard = shard_file.create_dataset("kmer_matrix",
+                                          shape=(n_packed_rows, n_shard_columns),
+                                          dtype=kmer_matrix.dtype,
+                                          chunks=shard_chunks,
+                                          **(compression_kwargs if shard_chunks is not None else {}))
+        for block_start in xrange(0, n_shard_columns, block_size):
+            block_stop = min(block_start + block_size, n_shard_columns)
+            shard[:, block_start:block_stop] = kmer_matrix[:, column_start + block_start:column_start + block_stop]
+            progress_callback("Sharding", 1.0 * (column_start + block_stop) / max(1, n_columns))
+        shard_file.close()
+
+    # The shards that are next to the dataset are found relative to it, so that the files can be moved together
+    dataset_dir = dirname(abspath(destination_file.filename))
+    linked_paths = [relpath(abspath(p), dataset_dir) if dirname(abspath(p)) == dataset_dir else abspath(p)
+                    for p in shard_paths]
+    shards = destination_file.create_group(SHARDS_GROUP)
+    shards.create_dataset("paths", data=np.array(linked_paths, dtype=object), dtype=h.special_dtype(vlen=str))
+    shards.create_dataset("column_starts", data=column_starts)
+
+    layout = h.VirtualLayout(shape=(n_packed_rows, n_columns), dtype=kmer_matrix.dtype)
+    for shard_idx, path in enumerate(linked_paths):
+        column_start, column_stop = column_starts[shard_idx], column_starts[shard_idx + 1]
+        if column_stop > column_start:
+            layout[:, column_start:column_stop] = h.VirtualSource(path, "kmer_matrix",
+                                                                  shape=(n_packed_rows, column_stop - column_start))
+    destination_file.create_virtual_dataset("kmer_matrix", layout, fillvalue=0)
+    progress_callback("Sharding", 1.0)
+    return column_starts
+
+
+def open_sharded_kmer_matrix(h5py_file, n_processes=None):
+    """
+    Opens the shards of the k-mer matrix of a dataset.
+
+    Parameters:
+    -----------
+    h5py_file: h5py.File
+        The dataset.
+    n_processes: int
+        The number of processes that read the shards concurrently (see ShardedKmerMatrix).
+
+    Returns:
+    --------
+    kmer_matrix: ShardedKmerMatrix
+        The sharded k-mer matrix, or None if the k-mer matrix of the dataset is not sharded.
+    """
+    if SHARDS_GROUP not in h5py_file:
+        return None
+    dataset_dir = dirname(abspath(h5py_file.filename))
+    paths = [p if isabs(p) else join(dataset_dir, p) for p in h5py_file[SHARDS_GROUP]["paths"][...]]
+    return ShardedKmerMatrix(shard_paths=paths,
+                             column_starts=h5py_file[SHARDS_GROUP]["column_starts"][...],
+                             uuid=h5py_file.attrs["uuid"],
+                             n_processes=n_processes)
+
+
+# The shards opened by each process of the pool of a sharded k-mer matrix
+_process_shards = {}
+
+
+def _open_shard(path, uuid):
+    shard_file = _hdf5_open_no_chunk_cache(path)
+    if shard_file.attrs["uuid"] != uuid:
+        shard_file.close()
+        raise ValueError("The shard %s does not belong to this dataset." % path)
+    return shard_file["kmer_matrix"]
+
+
+def _apply_to_shard(job):
+    path, uuid, function, args = job
+    if path not in _process_shards:
+        _process_shards[path] = _open_shard(path, uuid)
+    return function(_process_shards[path], *args)
+
+
+class ShardedKmerMatrix(object):
+    """
+    The packed k-mer matrix of a sharded dataset. It is indexed like the h5py dataset of an unsharded k-mer matrix, for
+    the patterns used by the learning algorithms: [rows, columns] where the columns are an integer, a slice or a sorted
+    list of integers.
+
+    Computations that process the whole matrix (e.g., the sums of KmerRuleClassifications) are applied to each shard
+    with map_shards. The shards are processed concurrently by a pool of processes, each of which reads its own shard
+    files.
+    """
+    def __init__(self, shard_paths, column_starts, uuid, n_processes=None):
+        """
+        Parameters:
+        -----------
+        shard_paths: list
+            The path of each shard file.
+        column_starts: numpy_array, dtype=int64, shape=(n_shards + 1,)
+            The first column of each shard, followed by the number of columns.
+        uuid: str
+            The identifier of the dataset. The shards must have been written for this dataset.
+        n_processes: int
+            The number of processes that read the shards concurrently. Defaults to the number of shards, up to the
+            number of cores. The shards are read sequentially in processes that cannot have children (e.g., the
+            workers of the cross-validation).
+        """
+        self.shard_paths = list(shard_paths)
+        self.column_starts = np.asarray(column_starts, dtype=np.int64)
+        self.uuid = uuid
+        if n_processes is None:
+            n_processes = min(len(self.shard_paths), cpu_count())
+        self.n_processes = n_processes
+        self._shards = [None] * len(self.shard_paths)
+        self._pool = None
+
+    @property
+    def chunks(self):
+        return self.get_shard(0).chunks
+
+    @property
+    def compression(self):
+        return self.get_shard(0).compression
+
+    @property
+    def dtype(self):
+        return self.get_shard(0).dtype
+
+    @property
+    def n_shards(self):
+        return len(self.shard_paths)
+
+    @property
+    def shape(self):
+        return self.get_shard(0).shape[0], int(self.column_starts[-1])
+
+    def get_shard(self, shard_idx):
+        """
+        The k-mer matrix of a shard, as an h5py dataset.
+        """
+        if self._shards[shard_idx] is None:
+            self._shards[shard_idx] = _open_shard(self.shard_paths[shard_idx], self.uuid)
+        return self._shards[shard_idx]
+
+    def __getitem__(self, key):
+        rows, columns = key if isinstance(key, tuple) else (key, slice(None))
+
+        if hasattr(columns, "__index__"):
+            column = columns.__index__()
+            column = column + self.shape[1] if column < 0 else column
+            shard_idx = np.searchsorted(self.column_starts, column, side="right") - 1
+            return self.get_shard(shard_idx)[rows, column - self.column_starts[shard_idx]]
+
+        blocks = []
+        if isinstance(columns, slice):
+            start, stop, step = columns.indices(self.shape[1])
+            if step != 1:
+                raise ValueError("Only contiguous slices of columns are supported.")
+            for shard_idx in xrange(self.n_shards):
+                shard_start, shard_stop = self.column_starts[shard_idx], self.column_starts[shard_idx + 1]
+                if max(start, shard_start) < min(stop, shard_stop):
+                    blocks.append(self.get_shard(shard_idx)[rows, max(start, shard_start) - shard_start:
+                                                                  min(stop, shard_stop) - shard_start])
+        else:
+            columns = np.asarray(columns, dtype=np.int64)
+            shard_by_column = np.searchsorted(self.column_starts, columns, side="right") - 1
+            for shard_idx in np.unique(shard_by_column):
+                local_columns = columns[shard_by_column == shard_idx] - self.column_starts[shard_idx]
+                blocks.append(self.get_shard(shard_idx)[rows, local_columns.tolist()])
+
+        if len(blocks) == 0:
+            row_shape = np.zeros(self.shape[0])[rows].shape
+            return np.zeros(row_shape + (0,), dtype=self.dtype)
+        return np.concatenate(blocks, axis=-1)
+
+    def map_shards(self, function, *args):
+        """
+        Applies a function to the k-mer matrix of each shard.
+
+        Parameters:
+        -----------
+        function: function
+            A module-level function, called as function(shard_kmer_matrix, *args).
+
+        Returns:
+        --------
+        results: list
+            The result for each shard, in the order of the columns.
+        """
+        if self.n_processes > 1 and self.n_shards > 1 and not current_process().daemon:
+            if self._pool is None:
+                self._pool = Pool(processes=self.n_processes)
+            return self._pool.map(_apply_to_shard, [(path, self.uuid, function, args) for path in self.shard_paths])
+        return [function(self.get_shard(i), *args) for i in xrange(self.n_shards)]
+
+    def close(self):
+        """
+        Terminates the processes that read the shards and closes the shard files.
+        """
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+        for shard in self._shards:
+            if shard is not None:
+                shard.file.close()
+        self._shards = [None] * len(self.shard_paths)
+
+    def __del__(self):
+        if self._pool is not None:
+            self._pool.terminate()
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+
+from ...utils import _minimum_uint_size, _unpack_binary_bytes_from_ints
+from .kmer_union import read_kmer_columns
+
+# In the hybrid layout, the columns of the k-mer matrix of the k-mers that are present in many genomes are packed, as
+# in the dense layout, and those of the k-mers that are present in few genomes (most of the accessory genome) are
+# stored as the list of the genomes in which they are present, in compressed sparse column (CSC) form. The group
+# replaces the k-mer matrix of the dataset:
+#   dense_columns: the columns stored packed, in increasing order
+#   dense: the packed columns, shape=(n_packed_rows, len(dense_columns))
+#   sparse_columns: the columns stored as genome lists, in increasing order
+#   indptr: the genomes of sparse_columns[i] are genomes[indptr[i]:indptr[i + 1]], shape=(len(sparse_columns) + 1,)
+#   genomes: the sorted genome indices of each sparse column, one after the other
+SPARSE_GROUP = "kmer_matrix_sparse"
+SPARSE_BLOCK_VALUES = 1024 * 1024 * 16  # Maximum number of genome x column values unpacked at a time
+SPARSE_READ_SIZE = 1000000  # Number of genome indices read at a time by the sums
+SPARSE_CHUNK_SIZE = 65536  # Number of genome indices per chunk
+SPAN_FACTOR = 4  # The genome lists of several columns are read as one range if it is at most this many times larger
+
+
+def default_max_sparse_prevalence(n_genomes):
+    """
+    The largest number of genomes for which the genome list of a k-mer is smaller than its packed column.
+    """
+    n_packed_rows = (n_genomes + 63) / 64
+    return n_packed_rows * np.dtype(np.uint64).itemsize / np.dtype(_minimum_uint_size(n_genomes)).itemsize
+
+
+def write_hybrid_kmer_matrix(kmer_matrix, destination_file, n_genomes, max_sparse_prevalence=None,
+                             progress_callback=None):
+    """
+    Writes the k-mer matrix of a dataset in the hybrid layout (see SPARSE_GROUP).
+
+    Parameters:
+    -----------
+    kmer_matrix: h5py.Dataset
+        The packed k-mer matrix.
+    destination_file: h5py.File
+        The dataset to which the matrix is written. It must not contain a k-mer matrix.
+    n_genomes: int
+        The number of genomes of the dataset.
+    max_sparse_prevalence: int
+        The k-mers that are present in at most this number of genomes are stored as genome lists. Defaults to the
+        number for which the genome lists are smaller than the packed columns (see default_max_sparse_prevalence).
+
+    Returns:
+    --------
+    n_sparse_columns: int
+        The number of columns stored as genome lists.
+    """
+    if progress_callback is None:
+        progress_callback = lambda t, p: None
+    if max_sparse_prevalence is None:
+        max_sparse_prevalence = default_max_sparse_prevalence(n_genomes)
+
+    n_packed_rows, n_columns = kmer_matrix.shape
+    compression_kwargs = dict(compression=kmer_matrix.compression, compression_opts=kmer_matrix.compression_opts,
+                              shuffle=kmer_matrix.shuffle)
+    column_dtype = _minimum_uint_size(n_columns)
+    genome_dtype = _minimum_uint_size(n_genomes)
+
+    group = destination_file.create_group(SPARSE_GROUP)
+    group.attrs["max_sparse_prevalence"] = max_sparse_prevalence
+    group.attrs["n_columns"] = n_columns
+    dense_chunks = (kmer_matrix.chunks[0], kmer_matrix.chunks[1]) if kmer_matrix.chunks is not None else \
+                   (n_packed_rows, max(1, min(n_columns, SPARSE_BLOCK_VALUES / (64 * n_packed_rows))))
+    dense = group.create_dataset("dense", shape=(n_packed_rows, 0), maxshape=(n_packed_rows, None),
+                                 dtype=kmer_matrix.dtype, chunks=dense_chunks, **compression_kwargs)
+    genomes = group.create_dataset("genomes", shape=(0,), maxshape=(None,), dtype=genome_dtype,
+                                   chunks=(SPARSE_CHUNK_SIZE,), **compression_kwargs)
+
+    # Blocks of whole chunks are read, and unpacked to find the genomes of the sparse columns
+    block_size = max(1, SPARSE_BLOCK_VALUES / (64 * n_packed_rows))
+    if kmer_matrix.chunks is not None:
+        block_size = max(1, block_size / kmer_matrix.chunks[1]) * kmer_matrix.chunks[1]
+    dense_columns = []
+    sparse_columns = []
+    genome_counts = []
+    for block_start in xrange(0, n_columns, block_size):
+        block_stop = min(block_start + block_size, n_columns)
+        block = kmer_matrix[:, block_start:block_stop]
+        bits = _unpack_binary_bytes_from_ints(block)[:n_genomes]
+        prevalence = bits.sum(axis=0)
+        is_sparse = prevalence <= max_sparse_prevalence
+
+        block_dense_columns = np.flatnonzero(~is_sparse)
+        if len(block_dense_columns) > 0:
+            n_dense = dense.shape[1]
+            dense.resize((n_packed_rows, n_dense + len(block_dense_columns)))
+            dense[:, n_dense:] = block[:, block_dense_columns]
+            dense_columns.append(block_start + block_dense_columns)
+
+        block_sparse_columns = np.flatnonzero(is_sparse)
+        if len(block_sparse_columns) > 0:
+            # The genomes of each column, in increasing order, one column after the other
+            block_genomes = np.nonzero(bits[:, block_sparse_columns].T)[1].astype(genome_dtype)
+            n_genomes_written = genomes.shape[0]
+            genomes.resize((n_genomes_written + len(block_genomes),))
+            genomes[n_genomes_written:] = block_genomes
+            sparse_columns.append(block_start + block_sparse_columns)
+            genome_counts.append(prevalence[block_sparse_columns])
+        progress_callback("Sparsifying", 1.0 * block_stop / n_columns)
+
+    dense_columns = np.hstack(dense_columns).astype(column_dtype) if len(dense_columns) > 0 else \
+                    np.zeros(0, dtype=column_dtype)
+    sparse_columns = np.hstack(sparse_columns).astype(column_dtype) if len(sparse_columns) > 0 else \
+                     np.zeros(0, dtype=column_dtype)
+    indptr = np.hstack(([0], np.cumsum(np.hstack(genome_counts)))) if len(genome_counts) > 0 else np.zeros(1)
+    indptr = indptr.astype(_minimum_uint_size(indptr[-1]))
+    for name, data in [("dense_columns", dense_columns), ("sparse_columns", sparse_columns), ("indptr", indptr)]:
+        # h5py cannot create empty chunked datasets
+        group.create_dataset(name, data=data, **(compression_kwargs if len(data) > 0 else {}))
+    progress_callback("Sparsifying", 1.0)
+    return len(sparse_columns)
+
+
+def open_hybrid_kmer_matrix(h5py_file):
+    """
+    The k-mer matrix of a dataset that has the hybrid layout, as a HybridKmerMatrix, or None if the dataset has the
+    dense layout.
+    """
+    if SPARSE_GROUP not in h5py_file:
+        return None
+    return HybridKmerMatrix(h5py_file[SPARSE_GROUP])
+
+
+def open_kmer_matrix(h5py_file):
+    """
+    The k-mer matrix of a dataset, whatever its layout. It is indexed like the h5py dataset of a dense k-mer matrix.
+    """
+    hybrid_kmer_matrix = open_hybrid_kmer_matrix(h5py_file)
+    if hybrid_kmer_matrix is not None:
+        return hybrid_kmer_matrix
+    return h5py_file["kmer_matrix"]
+
+
+class HybridKmerMatrix(object):
+    """
+    The k-mer matrix of a dataset that has the hybrid layout (see SPARSE_GROUP). It is indexed like the h5py dataset of
+    a dense k-mer matrix, for the patterns used by the learning algorithms and the dataset tools: [rows, columns] where
+    the columns are an integer, a slice or a list of integers. The sparse columns are packed when they are read.
+
+    The sums of KmerRuleClassifications are computed separately on the packed columns (see dense) and on the genome
+    lists (see sum_sparse_columns), without packing the sparse columns.
+    """
+    def __init__(self, h5py_group):
+        self.group = h5py_group
+        self.dense = h5py_group["dense"]
+        self.max_sparse_prevalence = int(h5py_group.attrs["max_sparse_prevalence"])
+        self._n_columns = int(h5py_group.attrs["n_columns"])
+        self._dense_columns = None
+        self._sparse_columns = None
+        self._indptr = None
+
+    @property
+    def chunks(self):
+        return self.dense.chunks
+
+    @property
+    def compression(self):
+        return self.dense.compression
+
+    @property
+    def compression_opts(self):
+        return self.dense.compression_opts
+
+    @property
+    def dense_columns(self):
+        if self._dense_columns is None:
+            self._dense_columns = self.group["dense_columns"][...].astype(np.int64)
+        return self._dense_columns
+
+    @property
+    def dtype(self):
+        return self.dense.dtype
+
+    @property
+    def indptr(self):
+        if self._indptr is None:
+            self._indptr = self.group["indptr"][...].astype(np.int64)
+        return self._indptr
+
+    @property
+    def shape(self):
+        return self.dense.shape[0], self._n_columns
+
+    @property
+    def shuffle(self):
+        return self.dense.shuffle
+
+    @property
+    def sparse_columns(self):
+        if self._sparse_columns is None:
+            self._sparse_columns = self.group["sparse_columns"][...].astype(np.int64)
+        return self._sparse_columns
+
+    def _read_genomes(self, positions):
+        """
+        The genomes of sparse columns, given by their position in sparse_columns, one column after the other.
+        """
+        starts, stops = self.indptr[positions], self.indptr[positions + 1]
+        n_genomes = int((stops - starts).sum())
+        if n_genomes == 0:
+            return np.zeros(0, dtype=self.group["genomes"].dtype)
+        span_start, span_stop = starts.min(), stops.max()
+        if span_stop - span_start <= SPAN_FACTOR * n_genomes:
+            span = self.group["genomes"][span_start:span_stop]
+            return np.hstack([span[start - span_start:stop - span_start] for start, stop in zip(starts, stops)])
+        return np.hstack([self.group["genomes"][start:stop] for start, stop in zip(starts, stops) if stop > start])
+
+    def __getitem__(self, key):
+        rows, columns = key if isinstance(key, tuple) else (key, slice(None))
+
+        is_int = hasattr(columns, "__index__")
+        if is_int:
+            column = columns.__index__()
+            columns = np.array([column + self.shape[1] if column < 0 else column], dtype=np.int64)
+        elif isinstance(columns, slice):
+            columns = np.arange(*columns.indices(self.shape[1]), dtype=np.int64)
+        else:
+            columns = np.asarray(columns, dtype=np.int64)
+
+        packed = np.zeros((self.shape[0], len(columns)), dtype=self.dtype)
+        dense_positions = np.searchsorted(self.dense_columns, columns)
+        is_dense = dense_positions < len(self.dense_columns)
+        is_dense[is_dense] = self.dense_columns[dense_positions[is_dense]] == columns[is_dense]
+        if is_dense.any():
+            packed[:, is_dense] = read_kmer_columns(self.dense, dense_positions[is_dense])
+
+        if not is_dense.all():
+            sparse_positions = np.searchsorted(self.sparse_columns, columns[~is_dense])
+            genomes = self._read_genomes(sparse_positions).astype(np.int64)
+            packed_columns = np.repeat(np.flatnonzero(~is_dense),
+                                       self.indptr[sparse_positions + 1] - self.indptr[sparse_positions])
+            pack_size = self.dtype.itemsize * 8
+            # The genomes of a column are unique, so adding their bits sets them
+            np.add.at(packed, (genomes / pack_size, packed_columns),
+                      np.left_shift(self.dtype.type(1), (pack_size - 1 - genomes % pack_size).astype(self.dtype)))
+
+        if is_int:
+            return packed[rows, 0]
+        return packed[rows]
+
+    def sum_sparse_columns(self, genome_mask, read_size=SPARSE_READ_SIZE):
+        """
+        Counts the genomes of a mask in which each k-mer of the sparse columns is present.
+
+        Parameters:
+        -----------
+        genome_mask: numpy_array, dtype=bool, shape=(n_genomes,)
+            The genomes to count.
+
+        Returns:
+        --------
+        sums: numpy_array, dtype=int64, shape=(len(sparse_columns),)
+            The number of genomes counted for each sparse column, in the order of sparse_columns.
+        """
+        indptr = self.indptr
+        n_sparse = len(indptr) - 1
+        sums = np.zeros(n_sparse, dtype=np.int64)
+        block_start = 0
+        while block_start < n_sparse:
+            # Read the genome lists of as many columns as possible, and at least one column
+            block_stop = max(block_start + 1, np.searchsorted(indptr, indptr[block_start] + read_size, side="right") - 1)
+            block_stop = min(block_stop, n_sparse)
+            offset = indptr[block_start]
+            counted = genome_mask[self.group["genomes"][offset:indptr[block_stop]]]
+            cumulative_counts = np.hstack(([0], np.cumsum(counted, dtype=np.int64)))
+            sums[block_start:block_stop] = cumulative_counts[indptr[block_start + 1:block_stop + 1] - offset] - \
+                                           cumulative_counts[indptr[block_start:block_stop] - offset]
+            block_start = block_stop
+        return sums
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import numpy as np
+
+TEXT_EXPORT_FORMATS = ["fasta", "tsv", "json"]
+WRITE_BLOCK_SIZE = 100000  # Number of values formatted and written at a time
+
+
+def _blocks(sources, block_size):
+    """
+    The blocks of values of sources that can be sliced (e.g., h5py datasets, numpy arrays or PackedKmerSequences), one
+    source after the other.
+    """
+    for source in sources:
+        for block_start in xrange(0, len(source), block_size):
+            yield np.asarray(source[block_start:block_start + block_size])
+
+
+def _numbered_records(values, first_number, prefix, separator):
+    """
+    Formats fixed-width byte strings as records "{prefix}{number}{separator}{value}\\n", with consecutive numbers. The
+    records are assembled as a matrix of bytes, without formatting each value.
+    """
+    value_bytes = np.frombuffer(values.tobytes(), dtype=np.uint8).reshape(len(values), values.dtype.itemsize)
+    numbers = np.arange(first_number, first_number + len(values), dtype=np.int64)
+    records = []
+    # The numbers of a group have the same number of digits
+    n_digits = np.searchsorted(10 ** np.arange(1, 19, dtype=np.int64), numbers, side="right") + 1
+    for digits in np.unique(n_digits):
+        group_numbers = numbers[n_digits == digits]
+        powers = 10 ** np.arange(digits - 1, -1, -1, dtype=np.int64)
+        digit_bytes = (group_numbers.reshape(-1, 1) / powers % 10 + ord("0")).astype(np.uint8)
+        group = np.empty((len(group_numbers), len(prefix) + digits + len(separator) + values.dtype.itemsize + 1),
+                         dtype=np.uint8)
+        group[:, :len(prefix)] = np.frombuffer(prefix, dtype=np.uint8)
+        group[:, len(prefix):len(prefix) + digits] = digit_bytes
+        group[:, len(prefix) + digits:len(prefix) + digits + len(separator)] = np.frombuffer(separator, dtype=np.uint8)
+        group[:, len(prefix) + digits + len(separator):-1] = value_bytes[n_digits == digits]
+        group[:, -1] = ord("\n")
+        records.append(group.tobytes())
+    return "".join(records)
+
+
+def _is_fixed_width(values):
+    # Shorter strings are padded with null bytes in numpy arrays of strings
+    return values.dtype.kind == "S" and values.dtype.itemsize > 0 and \
+           np.all(np.frombuffer(values.tobytes(), dtype=np.uint8)[values.dtype.itemsize - 1::values.dtype.itemsize])
+
+
+def write_kmer_sequences(sources, output, export_format="fasta", block_size=WRITE_BLOCK_SIZE):
+    """
+    Writes k-mer sequences to a file, in blocks of values. The k-mers are named k1, k2, ... in the order of the sources.
+
+    Parameters:
+    -----------
+    sources: list
+        The k-mer sequences, as h5py datasets, numpy arrays of strings or PackedKmerSequences.
+    output: file
+        The file to which the k-mers are written (e.g., sys.stdout).
+    export_format: str
+        fasta (">k1\\nSEQUENCE\\n"), tsv ("k1\\tSEQUENCE\\n") or json (a list of sequences).
+    """
+    if export_format not in TEXT_EXPORT_FORMATS:
+        raise ValueError("Unknown export format %s. The supported formats are %s." %
+                         (export_format, ", ".join(TEXT_EXPORT_FORMATS)))
+    if export_format == "json":
+        _write_json_list(sources, output, block_size)
+        return
+
+    prefix, separator = (">k", "\n") if export_format == "fasta" else ("k", "\t")
+    first_number = 1
+    for block in _blocks(sources, block_size):
+        if _is_fixed_width(block):
+            output.write(_numbered_records(block, first_number, prefix, separator))
+        else:
+            output.write("".join("%s%d%s%s\n" % (prefix, first_number + i, separator, value)
+                                 for i, value in enumerate(block.tolist())))
+        first_number += len(block)
+
+
+def write_values(sources, output, export_format="tsv", block_size=WRITE_BLOCK_SIZE):
+    """
+    Writes strings (e.g., the genome identifiers) to a file, in blocks of values.
+
+    Parameters:
+    -----------
+    sources: list
+        The values, as h5py datasets or numpy arrays of strings.
+    output: file
+        The file to which the values are written (e.g., sys.stdout).
+    export_format: str
+        tsv (one value per line) or json (a list of values). fasta is not supported.
+    """
+    if export_format == "json":
+        _write_json_list(sources, output, block_size)
+    elif export_format == "tsv":
+        for block in _blocks(sources, block_size):
+            if len(block) > 0:
+                output.write("\n".join(block.tolist()) + "\n")
+    else:
+        raise ValueError("The values can only be written in the tsv and json formats.")
+
+
+def _write_json_list(sources, output, block_size):
+    output.write("[")
+    is_first = True
+    for block in _blocks(sources, block_size):
+        if len(block) > 0:
+            # The brackets of the list of each block are removed
+            output.write(("" if is_first else ", ") + json.dumps(block.tolist())[1:-1])
+            is_first = False
+    output.write("]\n")
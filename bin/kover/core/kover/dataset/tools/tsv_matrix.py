@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import mmap
+import numpy as np
+import os
+import stat
+
+from functools import partial
+from multiprocessing import Pool, cpu_count
+from os.path import getsize
+
+from ...utils import _pack_binary_bytes_to_ints
+
+NEWLINE = ord("\n")
+CARRIAGE_RETURN = ord("\r")
+TAB = ord("\t")
+ZERO = ord("0")
+SCAN_CHUNK_SIZE = 64 * 1024 * 1024  # Bytes scanned by each worker when searching for line boundaries
+PARSE_BATCH_VALUES = 8 * 1024 * 1024  # Values parsed at a time in a block (bounds the size of the tab positions)
+STREAM_BLOCK_BYTES = 32 * 1024 * 1024  # Maximum number of bytes in each block of lines read from a stream
+
+
+def _open_mmap(path):
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def read_tsv_header(path):
+    """
+    Reads the header of a k-mer matrix in the format kmers{tab}GENOME_1{tab}...{tab}GENOME_N
+
+    Returns:
+    --------
+    header_size: int
+        The number of bytes occupied by the header (including the line break).
+    genome_ids: numpy_array
+        The identifier of the genome associated to each column of the matrix.
+    """
+    with open(path, "rb") as f:
+        header = f.readline()
+    return len(header), np.array(header.rstrip("\r\n").split("\t")[1:])
+
+
+def is_tsv_stream(path):
+    """
+    Whether a k-mer matrix must be read as a stream, in a single pass. This is the case of the standard input ("-"),
+    named pipes (FIFOs) and character devices, which cannot be mapped in memory or read twice.
+    """
+    if path == "-":
+        return True
+    mode = os.stat(path).st_mode
+    return stat.S_ISFIFO(mode) or stat.S_ISCHR(mode)
+
+
+def read_tsv_stream_header(stream):
+    """
+    Reads the header of a k-mer matrix stream (see read_tsv_header). The stream is left at the first line of data.
+
+    Returns:
+    --------
+    genome_ids: numpy_array
+        The identifier of the genome associated to each column of the matrix.
+    """
+    return np.array(stream.readline().rstrip("\r\n").split("\t")[1:])
+
+
+def read_tsv_stream_blocks(stream, block_size, max_block_bytes=STREAM_BLOCK_BYTES):
+    """
+    Reads the lines of a k-mer matrix stream in blocks, as they arrive. A block ends after block_size lines or once it
+    contains max_block_bytes bytes, whichever comes first, so that wide matrices (many genomes) do not produce huge
+    blocks. A block always contains at least one line.
+
+    Returns:
+    --------
+    blocks: generator
+        The lines of each block, as a string that contains complete lines.
+    """
+    lines = []
+    n_bytes = 0
+    for line in stream:
+        lines.append(line)
+        n_bytes += len(line)
+        if len(lines) >= block_size or n_bytes >= max_block_bytes:
+            yield "".join(lines)
+            lines = []
+            n_bytes = 0
+    if len(lines) > 0:
+        lines = "".join(lines)
+        if not lines.endswith("\n"):
+            lines += "\n"
+        yield lines
+
+
+def _scan_line_ends(chunk, path):
+    """
+    Returns the absolute position of the line breaks that end a non-empty line in the byte range [start, stop) of a
+    file. A line that only contains \\r (a blank line with a CRLF line break) is empty. The byte range must not start
+    at the beginning of the file.
+    """
+    start, stop = chunk
+    mm = _open_mmap(path)
+    # Also load the two previous bytes to detect empty lines at the beginning of the range
+    n_previous = min(start, 2)
+    data = np.frombuffer(mm, dtype=np.uint8, count=stop - start + n_previous, offset=start - n_previous)
+    if n_previous < 2:
+        data = np.hstack(([NEWLINE], data))
+    is_line_end = data[2:] == NEWLINE
+    is_line_end &= data[1:-1] != NEWLINE
+    is_line_end &= ~((data[1:-1] == CARRIAGE_RETURN) & (data[:-2] == NEWLINE))
+    positions = np.flatnonzero(is_line_end).astype(np.uint64)
+    positions += start
+    del data, is_line_end
+    mm.close()
+    return positions
+
+
+def find_block_offsets(path, data_start, block_size, n_cpu=None):
+    """
+    Finds the byte offset at which each block of block_size lines starts. The file is split into chunks that are
+    scanned for line breaks in parallel, so lines can have any length.
+
+    Parameters:
+    -----------
+    path: str
+        The path to the k-mer matrix file.
+    data_start: int
+        The offset of the first line to consider (i.e., the size of the header).
+    block_size: int
+        The number of lines in each block.
+    n_cpu: int
+        The number of processes used to scan the file. Defaults to all the cores.
+
+    Returns:
+    --------
+    line_count: int
+        The number of non-empty lines after data_start.
+    block_offsets: numpy_array, dtype=uint64
+        The start of each block, followed by the end of the data. Block i spans [block_offsets[i], block_offsets[i + 1]).
+    """
+    if n_cpu is None or n_cpu < 1:
+        n_cpu = cpu_count()
+
+    file_size = getsize(path)
+    chunks = [(start, min(start + SCAN_CHUNK_SIZE, file_size)) for start in xrange(data_start, file_size,
+                                                                                      SCAN_CHUNK_SIZE)]
+    scan = partial(_scan_line_ends, path=path)
+    pool = Pool(processes=n_cpu) if n_cpu > 1 and len(chunks) > 1 else None
+    chunk_line_ends = pool.imap(scan, chunks) if pool is not None else (scan(c) for c in chunks)
+
+    line_count = 0
+    block_offsets = [data_start]
+    data_stop = data_start
+    for line_ends in chunk_line_ends:
+        if len(line_ends) == 0:
+            continue
+        # A block starts right after the line break of every block_size-th line
+        first_block_end = (block_size - 1 - line_count % block_size) % block_size
+        block_offsets += (line_ends[first_block_end:: block_size] + 1).tolist()
+        line_count += len(line_ends)
+        data_stop = int(line_ends[-1]) + 1
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    # Account for a last line that is not followed by a line break
+    if file_size > data_stop:
+        mm = _open_mmap(path)
+        has_content = mm[data_stop:file_size].strip() != ""
+        mm.close()
+        if has_content:
+            line_count += 1
+        data_stop = file_size
+
+    if block_offsets[-1] != data_stop:
+        block_offsets.append(data_stop)
+    return line_count, np.array(block_offsets, dtype=np.uint64)
+
+
+def _parse_tsv_data(data, n_file_genomes, genome_columns, pack_size, location):
+    """
+    Parses lines of a k-mer matrix held in an array of bytes (see parse_tsv_block). The location describes the lines
+    in the error messages.
+    """
+    genome_columns = np.asarray(genome_columns)
+
+    line_ends = np.flatnonzero(data == NEWLINE)
+    if len(line_ends) == 0 or line_ends[-1] != len(data) - 1:
+        line_ends = np.append(line_ends, len(data))
+    line_starts = np.hstack(([0], line_ends[:-1] + 1))
+    # Blank lines are empty or only contain the \r of a CRLF line break
+    line_lengths = line_ends - line_starts
+    non_empty = line_lengths > 1
+    non_empty[line_lengths == 1] = data[line_starts[line_lengths == 1]] != CARRIAGE_RETURN
+    line_starts = line_starts[non_empty]
+    line_ends = line_ends[non_empty]
+    n_lines = len(line_starts)
+
+    if n_lines == 0:
+        return np.array([], dtype="S1"), np.zeros((0, 0), dtype=np.uint64)
+
+    # All the k-mers have the length of the first one
+    kmer_len = int(np.flatnonzero(data[line_starts[0]: line_ends[0]] == TAB)[0])
+    kmers = np.empty(n_lines, dtype="S%d" % kmer_len)
+    values = np.empty((n_lines, len(genome_columns)), dtype=np.uint8)
+
+    # Process the lines in batches to bound the size of the tab position arrays
+    lines_per_batch = max(1, PARSE_BATCH_VALUES / max(n_file_genomes, 1))
+    for batch_start in xrange(0, n_lines, lines_per_batch):
+        batch_stop = min(batch_start + lines_per_batch, n_lines)
+        batch_offset = line_starts[batch_start]
+        batch = data[batch_offset: line_ends[batch_stop - 1]]
+        batch_line_starts = line_starts[batch_start: batch_stop] - batch_offset
+
+        tabs = np.flatnonzero(batch == TAB)
+        if len(tabs) != (batch_stop - batch_start) * n_file_genomes:
+            raise ValueError("The lines in %s do not all contain %d values." % (location, n_file_genomes))
+        tabs = tabs.reshape(-1, n_file_genomes)
+
+        # The k-mer spans from the beginning of the line to the first tab
+        if (tabs[:, 0] - batch_line_starts != kmer_len).any():
+            raise ValueError("The k-mers in %s are not all of length %d." % (location, kmer_len))
+        kmers[batch_start: batch_stop] = \
+            batch[batch_line_starts.reshape(-1, 1) + np.arange(kmer_len)].view("S%d" % kmer_len).reshape(-1)
+
+        # Each value is the character that follows a tab
+        values[batch_start: batch_stop] = batch[tabs[:, genome_columns] + 1]
+        del batch, tabs
+
+    values -= ZERO
+    if (values > 1).any():
+        raise ValueError("The k-mer matrix contains values other than 0 and 1 in %s." % location)
+
+    return kmers, _pack_binary_bytes_to_ints(values.T, pack_size=pack_size)
+
+
+def parse_tsv_block(block, path, n_file_genomes, genome_columns, pack_size=64):
+    """
+    Parses a block of lines of a k-mer matrix and packs the presence/absence values.
+
+    Each line must have the format KMER{tab}V{tab}...{tab}V, where each V is a single 0 or 1 character. The line
+    breaks can be \\n or \\r\\n and the lines do not need to be of the same length. Empty lines are ignored.
+
+    Parameters:
+    -----------
+    block: tuple
+        The byte range (start, stop) of the block. It must contain only complete lines.
+    path: str
+        The path to the k-mer matrix file.
+    n_file_genomes: int
+        The number of genomes (columns) in the file.
+    genome_columns: array-like
+        The column of the file associated to each genome of the dataset, in the order of the dataset.
+    pack_size: int
+        The number of genomes packed in each integer (32 or 64).
+
+    Returns:
+    --------
+    kmers: numpy_array, dtype=S{k}
+        The k-mer sequence of each line.
+    packed: numpy_array, shape=(ceil(n_genomes / pack_size), n_lines)
+        The packed presence/absence of the k-mers in the genomes.
+    """
+    start, stop = int(block[0]), int(block[1])
+    mm = _open_mmap(path)
+    data = np.frombuffer(mm, dtype=np.uint8, count=stop - start, offset=start)
+    try:
+        return _parse_tsv_data(data, n_file_genomes, genome_columns, pack_size,
+                               location="byte range [%d, %d)" % (start, stop))
+    finally:
+        del data
+        mm.close()
+
+
+def parse_tsv_lines(lines, n_file_genomes, genome_columns, pack_size=64):
+    """
+    Parses lines of a k-mer matrix read from a stream and packs the presence/absence values (see parse_tsv_block).
+
+    Parameters:
+    -----------
+    lines: str
+        Complete lines of the k-mer matrix (see read_tsv_stream_blocks).
+
+    Returns:
+    --------
+    kmers: numpy_array, dtype=S{k}
+        The k-mer sequence of each line.
+    packed: numpy_array, shape=(ceil(n_genomes / pack_size), n_lines)
+        The packed presence/absence of the k-mers in the genomes.
+    """
+    data = np.frombuffer(lines, dtype=np.uint8)
+    return _parse_tsv_data(data, n_file_genomes, genome_columns, pack_size,
+                           location="the block of lines that starts with %s" % lines[:lines.find("\t")])
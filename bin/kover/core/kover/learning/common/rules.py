@@ -19,11 +19,19 @@
 
 import numpy as np
 
+from collections import OrderedDict
 from math import ceil
 
 from .popcount import inplace_popcount_32, inplace_popcount_64
 from ...utils import _minimum_uint_size, _unpack_binary_bytes_from_ints
 
+READ_BLOCK_VALUES = 1024 * 1024  # Minimum number of packed values read at a time by sum_rows (whole chunks are read)
+CHUNK_CACHE_POLICIES = ["auto", "lru", "none"]
+CHUNK_CACHE_OPERATIONS = ["get_columns", "sum_rows"]
+DEFAULT_CHUNK_CACHE_SIZE = 64 * 1024 * 1024  # Size of the cache of the "lru" policy, in bytes
+AUTO_CHUNK_CACHE_BLOCKS = 8  # Number of column blocks kept by the "auto" policy
+AUTO_CHUNK_CACHE_MAX_SIZE = 128 * 1024 * 1024  # Maximum size of the cache of the "auto" policy, in bytes
+
 class KmerRule(object):
     def __init__(self, kmer_index, kmer_sequence, type):
         """
@@ -78,6 +86,221 @@ class LazyKmerRuleList(object):
     def __len__(self):
         return self.n_rules
 
+
+def add_kmer_class_rules(rules, members_by_kmer_index, blacklisted_kmers_by_kmer_index=None):
+    """
+    Adds, after each rule, the rules of the same type on the k-mers of the equivalence class of its k-mer. These rules
+    are equivalent, since the k-mers of a class are present in the same genomes.
+
+    Parameters:
+    -----------
+    rules: list
+        The k-mer rules.
+    members_by_kmer_index: dict
+        The sequences of the other k-mers of the class of each k-mer index (see KoverDataset.get_kmer_class_members).
+    blacklisted_kmers_by_kmer_index: dict
+        The blacklisted sequences of the classes that are only partly blacklisted (see _find_rule_blacklist). The
+        rules on these k-mers are left out.
+
+    Returns:
+    --------
+    rules: list
+        The rules, each one followed by the rules on the other k-mers of its class.
+    """
+    if blacklisted_kmers_by_kmer_index is None:
+        blacklisted_kmers_by_kmer_index = {}
+    expanded_rules = []
+    for rule in rules:
+        blacklisted = blacklisted_kmers_by_kmer_index.get(rule.kmer_index, ())
+        if rule.kmer_sequence not in blacklisted:
+            expanded_rules.append(rule)
+        expanded_rules += [KmerRule(rule.kmer_index, kmer_sequence, rule.type)
+                           for kmer_sequence in members_by_kmer_index.get(rule.kmer_index, [])
+                           if kmer_sequence not in blacklisted]
+    return expanded_rules
+
+def replace_blacklisted_kmers(rules, members_by_kmer_index, blacklisted_kmers_by_kmer_index):
+    """
+    Makes the rules on a blacklisted k-mer use another k-mer of its equivalence class. A column is only blacklisted
+    with all the k-mers of its class, so the class of such a rule has a k-mer that is not blacklisted. The rules are
+    updated in place.
+
+    Parameters:
+    -----------
+    rules: list
+        The k-mer rules (e.g., the rules of a model).
+    members_by_kmer_index: dict
+        The sequences of the other k-mers of the class of each k-mer index (see KoverDataset.get_kmer_class_members).
+    blacklisted_kmers_by_kmer_index: dict
+        The blacklisted sequences of the classes that are only partly blacklisted (see _find_rule_blacklist).
+    """
+    for rule in rules:
+        blacklisted = blacklisted_kmers_by_kmer_index.get(rule.kmer_index, ())
+        if rule.kmer_sequence in blacklisted:
+            rule.kmer_sequence = next(kmer_sequence for kmer_sequence in members_by_kmer_index[rule.kmer_index]
+                                      if kmer_sequence not in blacklisted)
+
+def _default_block_size(dataset):
+    """
+    The shape of the blocks of a packed matrix read at a time by sum_rows.
+    """
+    if isinstance(dataset, np.ndarray):
+        # In-memory or memory-mapped matrices (e.g., np.memmap of a flat k-mer matrix file) are stored in row-major
+        # order, so whole rows are read at a time
+        return max(1, READ_BLOCK_VALUES / max(1, dataset.shape[1])), dataset.shape[1]
+    elif dataset.chunks is None:
+        return 1, dataset.shape[1]
+    else:
+        # Read several chunks at a time when the chunks are small (e.g., tiles that contain all the rows)
+        chunk_rows, chunk_columns = dataset.chunks
+        return chunk_rows, chunk_columns * max(1, READ_BLOCK_VALUES / (chunk_rows * chunk_columns))
+
+
+def _sum_packed_columns(dataset, row_mask, rows_to_load, block_size, result_dtype):
+    """
+    Counts the bits of the rows of a packed matrix that are set in a row mask, for each column.
+
+    Parameters:
+    -----------
+    dataset: h5py.Dataset or numpy_array
+        The packed matrix.
+    row_mask: numpy_array, shape=(n_packed_rows,)
+        The bits to count in each packed row.
+    rows_to_load: numpy_array
+        The packed rows whose mask is not 0.
+    block_size: tuple
+        The shape of the blocks read at a time, or None for the default shape (see _default_block_size).
+    result_dtype: numpy dtype
+        The data type of the sums.
+
+    Returns:
+    --------
+    sums: numpy_array, dtype=result_dtype, shape=(n_columns,)
+        The number of bits counted in each column.
+    """
+    if block_size is None:
+        block_size = _default_block_size(dataset)
+    inplace_popcount = inplace_popcount_32 if dataset.dtype == np.uint32 else inplace_popcount_64
+    n_columns = dataset.shape[1]
+    result = np.zeros(n_columns, dtype=result_dtype)
+
+    # For each dataset load the rows for which the mask is not 0. Support column slicing aswell
+    n_col_blocks = int(ceil(1.0 * n_columns / block_size[1]))
+    n_row_blocks = int(ceil(1.0 * len(rows_to_load) / block_size[0]))
+
+    for row_block in xrange(n_row_blocks):
+        block_row_mask = row_mask[rows_to_load[row_block * block_size[0]:(row_block + 1) * block_size[0]]]
+
+        for col_block in xrange(n_col_blocks):
+
+            # Load the appropriate rows/columns based on the block sizes
+            block = dataset[rows_to_load[row_block * block_size[0]:(row_block + 1) * block_size[0]],
+                            col_block * block_size[1]:(col_block + 1) * block_size[1]]
+
+            # Popcount
+            if len(block.shape) == 1:
+                block = block.reshape(1, -1)
+            if not block.flags.writeable:
+                # The popcount is done in place, so the blocks of read-only memory maps are copied
+                block = block.copy()
+            inplace_popcount(block, block_row_mask)
+
+            # Increment the sum
+            result[col_block * block_size[1]:min((col_block + 1) * block_size[1], n_columns)] += np.sum(block, axis=0)
+
+    return result
+
+def _column_block_shape(dataset):
+    """
+    The shape of the blocks of whole chunk columns of a packed matrix, or None if the matrix is not chunked.
+    """
+    chunks = getattr(dataset, "chunks", None)
+    if chunks is None:
+        return None
+    return dataset.shape[0], min(chunks[1], dataset.shape[1])
+
+
+def chunk_cache_bytes(dataset, policy, operation, cache_size=None):
+    """
+    The size of the cache of column blocks used by an operation of KmerRuleClassifications on a packed matrix.
+
+    A column of a chunked matrix is read by decompressing every chunk that contains it, so the cache keeps the whole
+    chunk columns that were read (see _ColumnBlockCache) for the next reads of the same or of nearby columns. sum_rows
+    reads each chunk once per call, so it never uses the cache.
+
+    Parameters:
+    -----------
+    dataset: h5py.Dataset, numpy_array, ShardedKmerMatrix or HybridKmerMatrix
+        The packed matrix.
+    policy: str
+        The cache policy: "none" (no cache), "lru" (a cache of cache_size bytes that discards the least recently used
+        blocks) or "auto" (a cache of a few blocks if the matrix has compressed chunks, otherwise no cache).
+    operation: str
+        The operation that reads the matrix (see CHUNK_CACHE_OPERATIONS).
+    cache_size: int
+        The size of the cache of the "lru" policy, in bytes. Defaults to DEFAULT_CHUNK_CACHE_SIZE.
+
+    Returns:
+    --------
+    size: int
+        The size of the cache in bytes, or 0 if the operation must not use a cache.
+    """
+    if policy not in CHUNK_CACHE_POLICIES:
+        raise ValueError("Unknown chunk cache policy %s. The supported policies are %s." %
+                         (policy, ", ".join(CHUNK_CACHE_POLICIES)))
+    if operation not in CHUNK_CACHE_OPERATIONS:
+        raise ValueError("Unknown operation %s." % operation)
+
+    block_shape = _column_block_shape(dataset)
+    if policy == "none" or operation == "sum_rows" or block_shape is None:
+        return 0
+    if policy == "lru":
+        return DEFAULT_CHUNK_CACHE_SIZE if cache_size is None else cache_size
+
+    # The columns of uncompressed chunks are read without reading the rest of the chunks, and the columns of a hybrid
+    # k-mer matrix are not stored in the order of its chunks
+    if getattr(dataset, "compression", None) is None or hasattr(dataset, "sum_sparse_columns"):
+        return 0
+    block_bytes = block_shape[0] * block_shape[1] * dataset.dtype.itemsize
+    return min(AUTO_CHUNK_CACHE_BLOCKS, AUTO_CHUNK_CACHE_MAX_SIZE / block_bytes) * block_bytes
+
+
+class _ColumnBlockCache(object):
+    """
+    The blocks of whole chunk columns of a packed matrix that were read last, up to a size in bytes. The least recently
+    used blocks are discarded first.
+    """
+    def __init__(self, dataset, max_size):
+        self.dataset = dataset
+        self.max_size = max_size
+        self.block_columns = _column_block_shape(dataset)[1]
+        self._blocks = OrderedDict()
+        self._size = 0
+
+    def _get_block(self, block_idx):
+        block = self._blocks.pop(block_idx, None)
+        if block is None:
+            block = self.dataset[:, block_idx * self.block_columns:(block_idx + 1) * self.block_columns]
+            self._size += block.nbytes
+            while self._size > self.max_size:
+                self._size -= self._blocks.popitem(last=False)[1].nbytes
+        self._blocks[block_idx] = block
+        return block
+
+    def __getitem__(self, columns):
+        """
+        The packed columns, for a sorted list of columns (all the rows are returned).
+        """
+        columns = np.asarray(columns, dtype=np.int64)
+        result = np.empty((self.dataset.shape[0], len(columns)), dtype=self.dataset.dtype)
+        block_by_column = columns / self.block_columns
+        for block_idx in np.unique(block_by_column):
+            is_in_block = block_by_column == block_idx
+            block = self._get_block(int(block_idx))
+            result[:, is_in_block] = block[:, columns[is_in_block] - block_idx * self.block_columns]
+        return result
+
+
 class BaseRuleClassifications(object):
     def __init__(self):
         pass
@@ -99,21 +322,26 @@ class BaseRuleClassifications(object):
 class KmerRuleClassifications(BaseRuleClassifications):
     """
     Methods involving columns account for presence and absence rules
+
+    The packed k-mer matrix can be an h5py dataset, an np.memmap of a flat k-mer matrix file (see
+    kover dataset export-flat), the ShardedKmerMatrix of a sharded dataset (see kover dataset shard) or the
+    HybridKmerMatrix of a dataset whose rare k-mers are stored as genome lists (see kover dataset sparsify).
+
+    The chunk cache policy is applied to each type of call (see chunk_cache_bytes): get_columns is called repeatedly on
+    the same few columns (the rules of the models and the predictions), while sum_rows streams through the matrix.
     """
     # TODO: Clean up. Get rid of the code to handle deleted rows. We don't need this.
-    def __init__(self, dataset, n_rows, block_size=None):
+    def __init__(self, dataset, n_rows, block_size=None, chunk_cache="auto", chunk_cache_size=None):
         self.dataset = dataset
         self.dataset_initial_n_rows = n_rows
         self.dataset_n_rows = n_rows
         self.dataset_removed_rows = []
         self.dataset_removed_rows_mask = np.zeros(self.dataset_initial_n_rows, dtype=np.bool)
         self.block_size = (None, None)
+        self._is_default_block_size = block_size is None
 
         if block_size is None:
-            if self.dataset.chunks is None:
-                self.block_size = (1, self.dataset.shape[1])
-            else:
-                self.block_size = self.dataset.chunks
+            self.block_size = _default_block_size(self.dataset)
         else:
             if len(block_size) != 2 or not isinstance(block_size[0], int) or not isinstance(block_size[1], int):
                 raise ValueError("The block size must be a tuple of 2 integers.")
@@ -130,6 +358,13 @@ class KmerRuleClassifications(BaseRuleClassifications):
             raise ValueError("Unsupported data type for packed attribute classifications array. The supported data" +
                              " types are np.uint32 and np.uint64.")
 
+        # The columns are read through a cache only if it can hold at least one block
+        self._column_cache = None
+        cache_size = chunk_cache_bytes(self.dataset, chunk_cache, "get_columns", chunk_cache_size)
+        block_shape = _column_block_shape(self.dataset)
+        if cache_size > 0 and cache_size >= block_shape[0] * block_shape[1] * self.dataset.dtype.itemsize:
+            self._column_cache = _ColumnBlockCache(self.dataset, cache_size)
+
         super(BaseRuleClassifications, self).__init__()
 
     def get_columns(self, columns):
@@ -161,7 +396,11 @@ class KmerRuleClassifications(BaseRuleClassifications):
 
         # h5py requires that the column indices are sorted
         unique, inverse = np.unique(columns, return_inverse=True)
-        result = _unpack_binary_bytes_from_ints(self.dataset[:, unique.tolist()])[row_mask]
+        if self._column_cache is not None:
+            packed = self._column_cache[unique]
+        else:
+            packed = self.dataset[:, unique.tolist()]
+        result = _unpack_binary_bytes_from_ints(packed)[row_mask]
         result = result[:, inverse]
         result[:, invert_result] = 1 - result[:, invert_result]
 
@@ -212,54 +451,43 @@ class KmerRuleClassifications(BaseRuleClassifications):
                 raise ValueError("Unsupported mask format. Use 8, 16, 32, 64 or 128 bits.")
 
             n_masks = int(ceil(float(n_examples) / mask_n_bits))
-            masks = [0] * n_masks
+            masks = np.zeros(n_masks, dtype="u" + str(mask_n_bits / 8))
 
-            for idx in example_idx:
-                example_mask = idx / mask_n_bits
-                example_mask_idx = mask_n_bits - (idx - mask_n_bits * example_mask) - 1
-                masks[example_mask] |= 1 << example_mask_idx
+            example_idx = np.asarray(example_idx, dtype=np.int64)
+            example_bits = np.left_shift(masks.dtype.type(1),
+                                         (mask_n_bits - 1 - example_idx % mask_n_bits).astype(masks.dtype))
+            np.bitwise_or.at(masks, example_idx / mask_n_bits, example_bits)
 
-            return np.array(masks, dtype="u" + str(mask_n_bits / 8))
+            return masks
 
-        # Find the rows that occur in each dataset and their relative index
+        # Find the rows that occur in each dataset and their relative index: the requested row i is the i-th row that
+        # has not been removed
         rows = np.sort(rows)
-        dataset_relative_rows = []
-        for row_idx in rows:
-            # Find which row in the dataset corresponds to the requested row
-            # TODO: This is inefficient! Could exploit the fact that rows is sorted to reuse previous iterations.
-            current_idx = -1
-            n_active_elements_seen = 0
-            while n_active_elements_seen <= row_idx:
-                current_idx += 1
-                if not self.dataset_removed_rows_mask[current_idx]:
-                    n_active_elements_seen += 1
-            dataset_relative_rows.append(current_idx)
+        dataset_relative_rows = np.flatnonzero(~self.dataset_removed_rows_mask)[rows]
 
         # Create a row mask for each dataset
         row_mask = build_row_mask(dataset_relative_rows, self.dataset_initial_n_rows, self.dataset_pack_size)
         del dataset_relative_rows
 
-        # For each dataset load the rows for which the mask is not 0. Support column slicing aswell
-        n_col_blocks = int(ceil(1.0 * self.dataset.shape[1] / self.block_size[1]))
         rows_to_load = np.where(row_mask != 0)[0]
-        n_row_blocks = int(ceil(1.0 * len(rows_to_load) / self.block_size[0]))
-
-        for row_block in xrange(n_row_blocks):
-            block_row_mask = row_mask[rows_to_load[row_block * self.block_size[0]:(row_block + 1) * self.block_size[0]]]
-
-            for col_block in xrange(n_col_blocks):
-
-                # Load the appropriate rows/columns based on the block sizes
-                block = self.dataset[rows_to_load[row_block * self.block_size[0]:(row_block + 1) * self.block_size[0]],
-                                     col_block * self.block_size[1]:(col_block + 1) * self.block_size[1]]
-
-                # Popcount
-                if len(block.shape) == 1:
-                    block = block.reshape(1, -1)
-                self.inplace_popcount(block, block_row_mask)
-
-                # Increment the sum
-                result[col_block * self.block_size[1]:min((col_block + 1) * self.block_size[1], self.dataset.shape[1])] += np.sum(block, axis=0)
+        if hasattr(self.dataset, "map_shards"):
+            # The shards of a sharded k-mer matrix are summed concurrently. Each shard has its own chunk layout, so the
+            # default block size is chosen for each shard.
+            shard_sums = self.dataset.map_shards(_sum_packed_columns, row_mask, rows_to_load,
+                                                 None if self._is_default_block_size else self.block_size,
+                                                 result_dtype)
+            result[: self.dataset.shape[1]] = np.hstack(shard_sums)
+        elif hasattr(self.dataset, "sum_sparse_columns"):
+            # The packed columns of a hybrid k-mer matrix are summed like a dense matrix, and the genomes are counted
+            # in the genome lists of the sparse columns
+            result[self.dataset.dense_columns] = _sum_packed_columns(self.dataset.dense, row_mask, rows_to_load,
+                                                                     None if self._is_default_block_size
+                                                                     else self.block_size, result_dtype)
+            genome_mask = _unpack_binary_bytes_from_ints(row_mask)[: self.dataset_initial_n_rows].astype(np.bool)
+            result[self.dataset.sparse_columns] = self.dataset.sum_sparse_columns(genome_mask)
+        else:
+            result[: self.dataset.shape[1]] = _sum_packed_columns(self.dataset, row_mask, rows_to_load,
+                                                                  self.block_size, result_dtype)
 
         # Compute the sum for absence rules
         result[self.dataset.shape[1] : ] = len(rows) - result[: self.dataset.shape[1]]
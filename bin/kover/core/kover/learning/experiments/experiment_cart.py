@@ -32,7 +32,7 @@ from scipy.misc import comb
 from ...dataset.ds import KoverDataset
 from ..learners.cart import DecisionTreeClassifier, _prune_tree
 from ..common.models import CARTModel
-from ..common.rules import LazyKmerRuleList, KmerRuleClassifications
+from ..common.rules import add_kmer_class_rules, replace_blacklisted_kmers, LazyKmerRuleList, KmerRuleClassifications
 from ...utils import _duplicate_last_element, _init_callback_functions, _unpack_binary_bytes_from_ints, _parse_kmer_blacklist
 from ..experiments.metrics import _get_binary_metrics, _get_multiclass_metrics
 
@@ -205,7 +205,8 @@ def _bound(train_predictions, train_answers, train_example_idx, model, delta,
                                                   (216 * delta))))
 
 
-def _learn_pruned_tree_bound(hps, dataset_file, split_name, delta, max_genome_size, rule_blacklist):
+def _learn_pruned_tree_bound(hps, dataset_file, split_name, delta, max_genome_size, rule_blacklist,
+                             flat_kmer_matrix_file=None, chunk_cache="auto", chunk_cache_size=None):
     """
     Learns a cost-complexity pruned decision tree for a fixed set of hyperparameters and returns an estimate of its
     generalization error.
@@ -222,6 +223,13 @@ def _learn_pruned_tree_bound(hps, dataset_file, split_name, delta, max_genome_si
         A dictionnary of hyperparameter values (one value per key)
     rule_blacklist: list
         A list giving the rules to blacklist all the time.
+    flat_kmer_matrix_file: str
+        A flat file exported from the dataset, from which the k-mer matrix is mapped in memory. None to read the k-mer
+        matrix from the dataset.
+    chunk_cache: str
+        The chunk cache policy of the k-mer matrix (see KoverDataset).
+    chunk_cache_size: int
+        The size of the cache of the lru policy, in bytes.
 
     Returns:
     --------
@@ -240,61 +248,66 @@ def _learn_pruned_tree_bound(hps, dataset_file, split_name, delta, max_genome_si
     """
     # Open the dataset and load some stuff info into memory
     logging.debug("Loading the kover dataset information")
-    dataset = KoverDataset(dataset_file)
-    split = dataset.get_split(split_name)
-    split.train_genome_idx = split.train_genome_idx[...]
-    example_labels = dataset.phenotype.metadata[...]
-    n_classes = len(dataset.phenotype.tags)
-    rules = LazyKmerRuleList(dataset.kmer_sequences, dataset.kmer_by_matrix_column)
-    rule_classifications = KmerRuleClassifications(dataset.kmer_matrix, dataset.genome_count)
-
-    # Initialize the tree to be grown
-    master_predictor = DecisionTreeClassifier(criterion=hps["criterion"],
-                                              max_depth=hps["max_depth"],
-                                              min_samples_split=hps["min_samples_split"],
-                                              class_importance=hps["class_importance"])
-
-    # Build an overgrown decision tree on the entire dataset
-    logging.debug("Growing the overgrown master tree")
-    master_predictor.fit(rules=rules,
-                         rule_classifications=rule_classifications,
-                         example_idx = {c: split.train_genome_idx[example_labels[split.train_genome_idx] == c]\
-                                           for c in range(n_classes)},
-                         rule_blacklist=rule_blacklist,
-                         tiebreaker=partial(_tiebreaker, rule_kmer_occurrences=rule_classifications.sum_rows(split.train_genome_idx)),
-                         level_callback=None,
-                         split_callback=_split_callback)
-
-    logging.debug("Pruning the master tree using minimum cost-complexity pruning and the sample-compression bound")
-    min_score = np.infty
-    min_score_tree = None
-    train_answers = example_labels[split.train_genome_idx]
-    for alpha, tree in zip(*_prune_tree(master_predictor.decision_tree)):
-        train_predictions = _predictions(decision_tree=tree,
-                                         kmer_matrix=dataset.kmer_matrix,
-                                         train_example_idx=split.train_genome_idx,
-                                         test_example_idx=[])[0]
-
-        bound_value = _bound(train_predictions=train_predictions,
-                             train_answers=train_answers,
-                             train_example_idx=split.train_genome_idx,
-                             model=tree,
-                             delta=delta,
-                             max_genome_size=max_genome_size,
-                             rule_classifications=KmerRuleClassifications(dataset.kmer_matrix, dataset.genome_count),
-                             n_classes=len(dataset.phenotype.tags))
-
-        if bound_value <= min_score:  # Note: assumes that alphas are sorted in increasing order (so we are always preferring trees that are more pruned)
-            min_score = bound_value
-            min_score_tree = tree
-            hps["pruning_alpha"] = alpha  # Save the best value of alpha
-    logging.debug("Pruning completed.")
-
-    # Return the best tree and its error estimate
-    return hps, min_score, min_score_tree
-
-
-def _learn_pruned_tree_cv(hps, dataset_file, split_name, rule_blacklist):
+    with KoverDataset(dataset_file, flat_kmer_matrix_file, chunk_cache, chunk_cache_size) as dataset:
+        split = dataset.get_split(split_name)
+        split.train_genome_idx = split.train_genome_idx[...]
+        example_labels = dataset.phenotype.metadata[...]
+        n_classes = len(dataset.phenotype.tags)
+        rules = LazyKmerRuleList(dataset.kmer_sequences, dataset.kmer_by_matrix_column)
+        rule_classifications = KmerRuleClassifications(dataset.kmer_matrix, dataset.genome_count,
+                                                       chunk_cache=dataset.chunk_cache,
+                                                       chunk_cache_size=dataset.chunk_cache_size)
+
+        # Initialize the tree to be grown
+        master_predictor = DecisionTreeClassifier(criterion=hps["criterion"],
+                                                  max_depth=hps["max_depth"],
+                                                  min_samples_split=hps["min_samples_split"],
+                                                  class_importance=hps["class_importance"])
+
+        # Build an overgrown decision tree on the entire dataset
+        logging.debug("Growing the overgrown master tree")
+        master_predictor.fit(rules=rules,
+                             rule_classifications=rule_classifications,
+                             example_idx = {c: split.train_genome_idx[example_labels[split.train_genome_idx] == c]\
+                                               for c in range(n_classes)},
+                             rule_blacklist=rule_blacklist,
+                             tiebreaker=partial(_tiebreaker, rule_kmer_occurrences=rule_classifications.sum_rows(split.train_genome_idx)),
+                             level_callback=None,
+                             split_callback=_split_callback)
+
+        logging.debug("Pruning the master tree using minimum cost-complexity pruning and the sample-compression bound")
+        min_score = np.infty
+        min_score_tree = None
+        train_answers = example_labels[split.train_genome_idx]
+        for alpha, tree in zip(*_prune_tree(master_predictor.decision_tree)):
+            train_predictions = _predictions(decision_tree=tree,
+                                             kmer_matrix=dataset.kmer_matrix,
+                                             train_example_idx=split.train_genome_idx,
+                                             test_example_idx=[])[0]
+
+            bound_value = _bound(train_predictions=train_predictions,
+                                 train_answers=train_answers,
+                                 train_example_idx=split.train_genome_idx,
+                                 model=tree,
+                                 delta=delta,
+                                 max_genome_size=max_genome_size,
+                                 rule_classifications=KmerRuleClassifications(dataset.kmer_matrix, dataset.genome_count,
+                                                                              chunk_cache=dataset.chunk_cache,
+                                                                              chunk_cache_size=dataset.chunk_cache_size),
+                                 n_classes=len(dataset.phenotype.tags))
+
+            if bound_value <= min_score:  # Note: assumes that alphas are sorted in increasing order (so we are always preferring trees that are more pruned)
+                min_score = bound_value
+                min_score_tree = tree
+                hps["pruning_alpha"] = alpha  # Save the best value of alpha
+        logging.debug("Pruning completed.")
+
+        # Return the best tree and its error estimate
+        return hps, min_score, min_score_tree
+
+
+def _learn_pruned_tree_cv(hps, dataset_file, split_name, rule_blacklist, flat_kmer_matrix_file=None,
+                          chunk_cache="auto", chunk_cache_size=None):
     """
     Learns a cost-complexity pruned decision tree for a fixed set of hyperparameters and returns an estimate of its
     generalization error.
@@ -311,6 +324,13 @@ def _learn_pruned_tree_cv(hps, dataset_file, split_name, rule_blacklist):
         A dictionnary of hyperparameter values (one value per key)
     rule_blacklist: list
         A dictionnary giving the rules to blacklist all the time.
+    flat_kmer_matrix_file: str
+        A flat file exported from the dataset, from which the k-mer matrix is mapped in memory. None to read the k-mer
+        matrix from the dataset.
+    chunk_cache: str
+        The chunk cache policy of the k-mer matrix (see KoverDataset).
+    chunk_cache_size: int
+        The size of the cache of the lru policy, in bytes.
 
     Returns:
     --------
@@ -330,113 +350,116 @@ def _learn_pruned_tree_cv(hps, dataset_file, split_name, rule_blacklist):
     """
     # Open the dataset and load some stuff info into memory
     logging.debug("Loading the kover dataset information")
-    dataset = KoverDataset(dataset_file)
-    split = dataset.get_split(split_name)
-    split.train_genome_idx = split.train_genome_idx[...]
-    example_labels = dataset.phenotype.metadata[...]
-    n_classes = len(dataset.phenotype.tags)
-    rules = LazyKmerRuleList(dataset.kmer_sequences, dataset.kmer_by_matrix_column)
-    rule_classifications = KmerRuleClassifications(dataset.kmer_matrix, dataset.genome_count)
-
-    # Initialize the trees to be grown
-    logging.debug("Planting seeds")
-    fold_predictors = [DecisionTreeClassifier(criterion=hps["criterion"],
-                                              max_depth=hps["max_depth"],
-                                              min_samples_split=hps["min_samples_split"],
-                                              class_importance=hps["class_importance"])
-                                              for _ in xrange(len(split.folds))]
-
-    master_predictor = DecisionTreeClassifier(criterion=hps["criterion"],
-                                              max_depth=hps["max_depth"],
-                                              min_samples_split=hps["min_samples_split"],
-                                              class_importance=hps["class_importance"])
-
-    # For each fold, build an overgrown decision tree
-    logging.debug("Growing the cross-validation fold trees")
-    for i, fold in enumerate(split.folds):
-        logging.debug("Growing the tree for fold %d" % (i + 1))
-        # Load stuff into memory
-        fold.train_genome_idx = fold.train_genome_idx[...]
-        fold.test_genome_idx = fold.test_genome_idx[...]
-
-        # Fit the decision tree
-        fold_predictors[i].fit(rules=rules,
-                               rule_classifications=rule_classifications,
-                               example_idx = {c: fold.train_genome_idx[example_labels[fold.train_genome_idx] == c]\
-                                                                                            for c in range(n_classes)},
-                               rule_blacklist=rule_blacklist,
-                               tiebreaker=partial(_tiebreaker, rule_kmer_occurrences=rule_classifications.sum_rows(fold.train_genome_idx)),
-                               level_callback=None,
-                               split_callback=None)
-
-    # Also build an overgrown decision tree on the entire dataset
-    logging.debug("Growing the master tree")
-    master_predictor.fit(rules=rules,
-                         rule_classifications=rule_classifications,
-                         example_idx = {c: split.train_genome_idx[example_labels[split.train_genome_idx] == c]\
-                                                                                            for c in range(n_classes)},
-                         rule_blacklist=rule_blacklist,
-                         tiebreaker=partial(_tiebreaker, rule_kmer_occurrences=rule_classifications.sum_rows(split.train_genome_idx)),
-                         level_callback=None,
-                         split_callback=_split_callback)
-
-    # Get the pruned master and cross-validation trees
-    master_alphas, master_pruned_trees = _prune_tree(master_predictor.decision_tree)
-    fold_alphas = []
-    fold_pruned_trees = []
-    for i in xrange(len(split.folds)):
-        alphas, trees = _prune_tree(fold_predictors[i].decision_tree)
-        fold_alphas.append(alphas)
-        fold_pruned_trees.append(trees)
-
-    # Compute the test risk for all pruned trees of each fold
-    fold_scores_by_alpha = []
-    for i, fold in enumerate(split.folds):
-        fold_test_example_idx = fold.test_genome_idx[...]
-        fold_example_labels = example_labels[fold_test_example_idx]
-        fold_test_risks = []
-        bro = BetweenDict()
-        for j, t in enumerate(fold_pruned_trees[i]):
-            fold_test_risk = _get_binary_metrics(predictions=_predictions(decision_tree=t,
-                                                                          kmer_matrix=dataset.kmer_matrix,
-                                                                          train_example_idx=[],
-                                                                          test_example_idx=fold_test_example_idx)[1],
-                                                 answers=fold_example_labels)["risk"][0]
-
-            fold_test_risks.append(fold_test_risk)
-            if j < len(fold_alphas[i]) - 1:
-                key = (fold_alphas[i][j], fold_alphas[i][j + 1])
-            else:
-                key = (fold_alphas[i][j], np.infty)
-            bro[key] = fold_test_risk
-        fold_scores_by_alpha.append(bro)
+    with KoverDataset(dataset_file, flat_kmer_matrix_file, chunk_cache, chunk_cache_size) as dataset:
+        split = dataset.get_split(split_name)
+        split.train_genome_idx = split.train_genome_idx[...]
+        example_labels = dataset.phenotype.metadata[...]
+        n_classes = len(dataset.phenotype.tags)
+        rules = LazyKmerRuleList(dataset.kmer_sequences, dataset.kmer_by_matrix_column)
+        rule_classifications = KmerRuleClassifications(dataset.kmer_matrix, dataset.genome_count,
+                                                       chunk_cache=dataset.chunk_cache,
+                                                       chunk_cache_size=dataset.chunk_cache_size)
+
+        # Initialize the trees to be grown
+        logging.debug("Planting seeds")
+        fold_predictors = [DecisionTreeClassifier(criterion=hps["criterion"],
+                                                  max_depth=hps["max_depth"],
+                                                  min_samples_split=hps["min_samples_split"],
+                                                  class_importance=hps["class_importance"])
+                                                  for _ in xrange(len(split.folds))]
+
+        master_predictor = DecisionTreeClassifier(criterion=hps["criterion"],
+                                                  max_depth=hps["max_depth"],
+                                                  min_samples_split=hps["min_samples_split"],
+                                                  class_importance=hps["class_importance"])
+
+        # For each fold, build an overgrown decision tree
+        logging.debug("Growing the cross-validation fold trees")
+        for i, fold in enumerate(split.folds):
+            logging.debug("Growing the tree for fold %d" % (i + 1))
+            # Load stuff into memory
+            fold.train_genome_idx = fold.train_genome_idx[...]
+            fold.test_genome_idx = fold.test_genome_idx[...]
+
+            # Fit the decision tree
+            fold_predictors[i].fit(rules=rules,
+                                   rule_classifications=rule_classifications,
+                                   example_idx = {c: fold.train_genome_idx[example_labels[fold.train_genome_idx] == c]\
+                                                                                                for c in range(n_classes)},
+                                   rule_blacklist=rule_blacklist,
+                                   tiebreaker=partial(_tiebreaker, rule_kmer_occurrences=rule_classifications.sum_rows(fold.train_genome_idx)),
+                                   level_callback=None,
+                                   split_callback=None)
+
+        # Also build an overgrown decision tree on the entire dataset
+        logging.debug("Growing the master tree")
+        master_predictor.fit(rules=rules,
+                             rule_classifications=rule_classifications,
+                             example_idx = {c: split.train_genome_idx[example_labels[split.train_genome_idx] == c]\
+                                                                                                for c in range(n_classes)},
+                             rule_blacklist=rule_blacklist,
+                             tiebreaker=partial(_tiebreaker, rule_kmer_occurrences=rule_classifications.sum_rows(split.train_genome_idx)),
+                             level_callback=None,
+                             split_callback=_split_callback)
+
+        # Get the pruned master and cross-validation trees
+        master_alphas, master_pruned_trees = _prune_tree(master_predictor.decision_tree)
+        fold_alphas = []
+        fold_pruned_trees = []
+        for i in xrange(len(split.folds)):
+            alphas, trees = _prune_tree(fold_predictors[i].decision_tree)
+            fold_alphas.append(alphas)
+            fold_pruned_trees.append(trees)
+
+        # Compute the test risk for all pruned trees of each fold
+        fold_scores_by_alpha = []
+        for i, fold in enumerate(split.folds):
+            fold_test_example_idx = fold.test_genome_idx[...]
+            fold_example_labels = example_labels[fold_test_example_idx]
+            fold_test_risks = []
+            bro = BetweenDict()
+            for j, t in enumerate(fold_pruned_trees[i]):
+                fold_test_risk = _get_binary_metrics(predictions=_predictions(decision_tree=t,
+                                                                              kmer_matrix=dataset.kmer_matrix,
+                                                                              train_example_idx=[],
+                                                                              test_example_idx=fold_test_example_idx)[1],
+                                                     answers=fold_example_labels)["risk"][0]
+
+                fold_test_risks.append(fold_test_risk)
+                if j < len(fold_alphas[i]) - 1:
+                    key = (fold_alphas[i][j], fold_alphas[i][j + 1])
+                else:
+                    key = (fold_alphas[i][j], np.infty)
+                bro[key] = fold_test_risk
+            fold_scores_by_alpha.append(bro)
 
-    # Prune the master tree based on the CV estimates
-    min_score = np.infty
-    min_score_tree = None
+        # Prune the master tree based on the CV estimates
+        min_score = np.infty
+        min_score_tree = None
 
-    logging.debug("The master alphas are: " + str(master_alphas))
-    for i, t in enumerate(master_pruned_trees):
+        logging.debug("The master alphas are: " + str(master_alphas))
+        for i, t in enumerate(master_pruned_trees):
 
-        if i < len(master_alphas) - 1:
-            geo_mean_alpha_k = sqrt(master_alphas[i] * master_alphas[i + 1])
-        else:
-            geo_mean_alpha_k = np.infty
+            if i < len(master_alphas) - 1:
+                geo_mean_alpha_k = sqrt(master_alphas[i] * master_alphas[i + 1])
+            else:
+                geo_mean_alpha_k = np.infty
 
-        cv_score = np.mean([fold_scores_by_alpha[j][geo_mean_alpha_k] for j in xrange(len(split.folds))])
+            cv_score = np.mean([fold_scores_by_alpha[j][geo_mean_alpha_k] for j in xrange(len(split.folds))])
 
-        if cv_score <= min_score:  # Note: assumes that alphas are sorted in increasing order (so we are always preferring trees that are more pruned)
-            min_score = cv_score
-            min_score_tree = t
-            hps["pruning_alpha"] = geo_mean_alpha_k  # Save the best value of alpha
+            if cv_score <= min_score:  # Note: assumes that alphas are sorted in increasing order (so we are always preferring trees that are more pruned)
+                min_score = cv_score
+                min_score_tree = t
+                hps["pruning_alpha"] = geo_mean_alpha_k  # Save the best value of alpha
 
-    # Return the best tree and its error estimate
-    return hps, min_score, min_score_tree
+        # Return the best tree and its error estimate
+        return hps, min_score, min_score_tree
 
 
 def train_tree(dataset_file, split_name, criterion, class_importance, max_depth,
                min_samples_split, rule_blacklist, n_cpu, progress_callback,
-               warning_callback, error_callback, hp_search_func, hp_search_type):
+               warning_callback, error_callback, hp_search_func, hp_search_type, flat_kmer_matrix_file=None,
+               chunk_cache="auto", chunk_cache_size=None):
     """
     Train a decision tree classifier with the best hyperparameter values, which
     are selected according to hp_search_func.
@@ -448,7 +471,9 @@ def train_tree(dataset_file, split_name, criterion, class_importance, max_depth,
 
     logging.debug("Using %d CPUs." % n_cpu)
     pool = Pool(n_cpu)
-    _hp_eval_func = partial(hp_search_func, dataset_file=dataset_file, split_name=split_name, rule_blacklist=rule_blacklist)
+    _hp_eval_func = partial(hp_search_func, dataset_file=dataset_file, split_name=split_name, rule_blacklist=rule_blacklist,
+                            flat_kmer_matrix_file=flat_kmer_matrix_file, chunk_cache=chunk_cache,
+                            chunk_cache_size=chunk_cache_size)
     best_hps = None
     best_score = np.infty
     best_master_tree = None
@@ -489,158 +514,200 @@ def train_tree(dataset_file, split_name, criterion, class_importance, max_depth,
 
 def _find_rule_blacklist(dataset_file, kmer_blacklist_file, warning_callback):
     """
-    Finds the index of the rules that must be blacklisted.
+    Finds the index of the rules that must be blacklisted, and the blacklisted k-mers of the columns that are not
+    blacklisted since other k-mers of their equivalence class are not (column -> set of sequences). Such k-mers must
+    not be reported as rules.
     """
-    dataset = KoverDataset(dataset_file)
-
-    # Find all rules to blacklist
-    rule_blacklist = []
-    if kmer_blacklist_file is not None:
-        kmers_to_blacklist = _parse_kmer_blacklist(kmer_blacklist_file, dataset.kmer_length)
-
-        if kmers_to_blacklist:
-            # XXX: the k-mers are assumed to be upper-cased in the dataset
-            kmer_sequences = dataset.kmer_sequences[...].tolist()
-            kmer_by_matrix_column = dataset.kmer_by_matrix_column[...].tolist() # XXX: each k-mer is there only once (see wiki)
-            n_kmers = len(kmer_sequences)
-
-            kmers_not_found = []
-            for k in kmers_to_blacklist:
-                k = k.upper()
-                try:
-                    rule_blacklist.append(kmer_by_matrix_column.index(kmer_sequences.index(k))) # XXX: We only consider presence rules
-                except ValueError:
-                    kmers_not_found.append(k)
-
-            if(len(kmers_not_found) > 0):
-                warning_callback("The following kmers could not be found in the dataset: " + ", ".join(kmers_not_found))
-
-    return rule_blacklist
+    with KoverDataset(dataset_file) as dataset:
+
+        # Find all rules to blacklist
+        rule_blacklist = []
+        blacklisted_kmers_by_column = {}
+        if kmer_blacklist_file is not None:
+            kmers_to_blacklist = _parse_kmer_blacklist(kmer_blacklist_file, dataset.kmer_length)
+
+            if kmers_to_blacklist:
+                # XXX: the k-mers are assumed to be upper-cased in the dataset
+                kmers_to_blacklist = [k.upper() for k in kmers_to_blacklist]
+                rule_idx = dataset.lookup_kmers(kmers_to_blacklist)  # The rule of a k-mer is its matrix column
+
+                # The column of a k-mer is shared by the other k-mers of its equivalence class (if any), so it is only
+                # blacklisted if all the k-mers of the class are
+                blacklisted_by_rule_idx = defaultdict(set)
+                for k, idx in zip(kmers_to_blacklist, rule_idx):
+                    if idx >= 0:
+                        blacklisted_by_rule_idx[int(idx)].add(k)
+                class_members = dataset.get_kmer_class_members(sorted(blacklisted_by_rule_idx))
+
+                kmers_not_found = []
+                kmers_not_blacklisted = []
+                for k, idx in zip(kmers_to_blacklist, rule_idx):
+                    if idx < 0:
+                        kmers_not_found.append(k)
+                    elif len(blacklisted_by_rule_idx[int(idx)]) <= len(class_members.get(int(idx), [])):
+                        kmers_not_blacklisted.append(k)
+                        blacklisted_kmers_by_column[int(idx)] = blacklisted_by_rule_idx[int(idx)]
+                    else:
+                        rule_blacklist.append(int(idx)) # XXX: We only consider presence rules
+
+                if(len(kmers_not_found) > 0):
+                    warning_callback("The following kmers could not be found in the dataset: " + ", ".join(kmers_not_found))
+                if len(kmers_not_blacklisted) > 0:
+                    warning_callback("The following kmers were not blacklisted, since other kmers of their equivalence "
+                                     "class (present in exactly the same genomes) are not blacklisted: " +
+                                     ", ".join(kmers_not_blacklisted))
+
+        return rule_blacklist, blacklisted_kmers_by_column
 
 
 def learn_CART(dataset_file, split_name, criterion, max_depth, min_samples_split,
                class_importance, bound_delta, bound_max_genome_size, kmer_blacklist_file,
                parameter_selection, n_cpu, authorized_rules,
-               progress_callback=None, warning_callback=None, error_callback=None):
+               progress_callback=None, warning_callback=None, error_callback=None, flat_kmer_matrix_file=None,
+               chunk_cache="auto", chunk_cache_size=None):
     """
     Cross-validate the best hyper-parameters (criterion, max_depth, min_samples_split and class_importance)
     to grow a pruned decision tree.
 
+    If flat_kmer_matrix_file is provided, the k-mer matrix is mapped in memory from this flat file, which must have
+    been exported from the dataset. chunk_cache and chunk_cache_size are the chunk cache policy of the k-mer matrix and
+    the size of the cache of the lru policy (see KoverDataset).
+
     """
     # Initialize callback functions
     warning_callback, error_callback, progress_callback = _init_callback_functions(warning_callback, error_callback,
                                                                                    progress_callback)
     logging.debug("Searching for blacklisted rules.")
-    rule_blacklist = _find_rule_blacklist(dataset_file=dataset_file,
-                                          kmer_blacklist_file=kmer_blacklist_file,
-                                          warning_callback=warning_callback)
+    rule_blacklist, blacklisted_kmers_by_column = _find_rule_blacklist(dataset_file=dataset_file,
+                                                                       kmer_blacklist_file=kmer_blacklist_file,
+                                                                       warning_callback=warning_callback)
                                           
     # Load the dataset info
-    dataset = KoverDataset(dataset_file)
-
-    # Check and initialize (hyper)parameters
-    if n_cpu is None:
-        n_cpu = cpu_count()
-    criterion = np.unique(criterion)
-    class_importance = np.unique(class_importance)
-    max_depth = np.unique(max_depth)
-    min_samples_split = np.unique(min_samples_split)
-
-    if parameter_selection == "bound":
-        func = partial(_learn_pruned_tree_bound, delta=bound_delta,
-                                                 max_genome_size=bound_max_genome_size)
-        best_hp_score, best_hps, best_master_tree = \
-            train_tree(hp_search_func=func,
-                       hp_search_type="bound selection",
-                       dataset_file=dataset_file,
-                       split_name=split_name,
-                       criterion=criterion,
-                       class_importance=class_importance,
-                       max_depth=max_depth,
-                       min_samples_split=min_samples_split,
-                       rule_blacklist=rule_blacklist,
-                       n_cpu=n_cpu,
-                       progress_callback=progress_callback,
-                       warning_callback=warning_callback,
-                       error_callback=error_callback)
-
-    elif parameter_selection == "cv":
-        n_folds = len(dataset.get_split(split_name).folds)
-        if n_folds < 1:
-            error_callback(Exception("Cross-validation cannot be performed on a split with no folds."))
-
-        best_hp_score, best_hps, best_master_tree = \
-            train_tree(hp_search_func=_learn_pruned_tree_cv,
-                       hp_search_type="cross-validation",
-                       dataset_file=dataset_file,
-                       split_name=split_name,
-                       criterion=criterion,
-                       class_importance=class_importance,
-                       max_depth=max_depth,
-                       min_samples_split=min_samples_split,
-                       rule_blacklist=rule_blacklist,
-                       n_cpu=n_cpu,
-                       progress_callback=progress_callback,
-                       warning_callback=warning_callback,
-                       error_callback=error_callback)
+    with KoverDataset(dataset_file, flat_kmer_matrix_file, chunk_cache, chunk_cache_size) as dataset:
+        if flat_kmer_matrix_file is not None:
+            try:
+                dataset.kmer_matrix
+            except (IOError, ValueError) as e:
+                error_callback(e)
+
+        # Check and initialize (hyper)parameters
+        if n_cpu is None:
+            n_cpu = cpu_count()
+        criterion = np.unique(criterion)
+        class_importance = np.unique(class_importance)
+        max_depth = np.unique(max_depth)
+        min_samples_split = np.unique(min_samples_split)
+
+        if parameter_selection == "bound":
+            func = partial(_learn_pruned_tree_bound, delta=bound_delta,
+                                                     max_genome_size=bound_max_genome_size)
+            best_hp_score, best_hps, best_master_tree = \
+                train_tree(hp_search_func=func,
+                           hp_search_type="bound selection",
+                           dataset_file=dataset_file,
+                           split_name=split_name,
+                           criterion=criterion,
+                           class_importance=class_importance,
+                           max_depth=max_depth,
+                           min_samples_split=min_samples_split,
+                           rule_blacklist=rule_blacklist,
+                           n_cpu=n_cpu,
+                           progress_callback=progress_callback,
+                           warning_callback=warning_callback,
+                           error_callback=error_callback,
+                           flat_kmer_matrix_file=flat_kmer_matrix_file,
+                           chunk_cache=chunk_cache,
+                           chunk_cache_size=chunk_cache_size)
+
+        elif parameter_selection == "cv":
+            n_folds = len(dataset.get_split(split_name).folds)
+            if n_folds < 1:
+                error_callback(Exception("Cross-validation cannot be performed on a split with no folds."))
+
+            best_hp_score, best_hps, best_master_tree = \
+                train_tree(hp_search_func=_learn_pruned_tree_cv,
+                           hp_search_type="cross-validation",
+                           dataset_file=dataset_file,
+                           split_name=split_name,
+                           criterion=criterion,
+                           class_importance=class_importance,
+                           max_depth=max_depth,
+                           min_samples_split=min_samples_split,
+                           rule_blacklist=rule_blacklist,
+                           n_cpu=n_cpu,
+                           progress_callback=progress_callback,
+                           warning_callback=warning_callback,
+                           error_callback=error_callback,
+                           flat_kmer_matrix_file=flat_kmer_matrix_file,
+                           chunk_cache=chunk_cache,
+                           chunk_cache_size=chunk_cache_size)
+
+        else:
+            error_callback(ValueError("Unknown hyperparameter selection strategy specified."))
+
+        # Load some split info into memory
+        logging.debug("Loading split information into memory")
+        split = dataset.get_split(split_name)
+        split.train_genome_idx = split.train_genome_idx[...]
+        split.test_genome_idx = split.test_genome_idx[...]
+        example_labels = dataset.phenotype.metadata[...]
+        phenotype_tags = dataset.phenotype.tags[...]
+
+        # Using the best hyperparameters, compute predictions and metrics
+        train_predictions, test_predictions = _predictions(decision_tree=best_master_tree,
+                                                           kmer_matrix=dataset.kmer_matrix,
+                                                           train_example_idx=split.train_genome_idx,
+                                                           test_example_idx=split.test_genome_idx,
+                                                           progress_callback=progress_callback)
+
+        train_answers = example_labels[split.train_genome_idx]
+        test_answers = example_labels[split.test_genome_idx]
 
-    else:
-        error_callback(ValueError("Unknown hyperparameter selection strategy specified."))
-
-    # Open the dataset and load some split info into memory
-    logging.debug("Opening the Kover dataset and loading split information into memory")
-    dataset = KoverDataset(dataset_file)
-    split = dataset.get_split(split_name)
-    split.train_genome_idx = split.train_genome_idx[...]
-    split.test_genome_idx = split.test_genome_idx[...]
-    example_labels = dataset.phenotype.metadata[...]
-    phenotype_tags = dataset.phenotype.tags[...]
-
-    # Using the best hyperparameters, compute predictions and metrics
-    train_predictions, test_predictions = _predictions(decision_tree=best_master_tree,
-                                                       kmer_matrix=dataset.kmer_matrix,
-                                                       train_example_idx=split.train_genome_idx,
-                                                       test_example_idx=split.test_genome_idx,
-                                                       progress_callback=progress_callback)
-
-    train_answers = example_labels[split.train_genome_idx]
-    test_answers = example_labels[split.test_genome_idx]
-
-    if dataset.classification_type == "binary":
-        train_metrics = _get_binary_metrics(train_predictions, train_answers)
-    else:
-        train_metrics = _get_multiclass_metrics(train_predictions, train_answers, len(phenotype_tags))
-    if len(split.test_genome_idx) > 0:
         if dataset.classification_type == "binary":
-            test_metrics = _get_binary_metrics(test_predictions, test_answers)
+            train_metrics = _get_binary_metrics(train_predictions, train_answers)
         else:
-            test_metrics = _get_multiclass_metrics(test_predictions, test_answers, len(phenotype_tags))
-    else:
-        test_metrics = None
-
-    # Get the idx of the training/testing examples that are correctly/incorrectly classified by the model
-    classifications = defaultdict(list)
-    classifications["train_correct"] = dataset.genome_identifiers[split.train_genome_idx[train_predictions == \
-                                                train_answers].tolist()].tolist() if train_metrics["risk"][0] < 1.0 else []
-    classifications["train_errors"] = dataset.genome_identifiers[split.train_genome_idx[train_predictions != \
-                                                train_answers].tolist()].tolist() if train_metrics["risk"][0] > 0 else []
-    if len(split.test_genome_idx) > 0:
-        classifications["test_correct"] = dataset.genome_identifiers[split.test_genome_idx[test_predictions == \
-                                                test_answers].tolist()].tolist() if test_metrics["risk"][0] < 1.0 else []
-        classifications["test_errors"] = dataset.genome_identifiers[split.test_genome_idx[test_predictions != \
-                                                test_answers].tolist()].tolist() if test_metrics["risk"][0] > 0 else []
-
-    best_model = CARTModel(class_tags=phenotype_tags)
-    best_model.decision_tree = best_master_tree
-
-    # Extract all the equivalent rules for the nodes in the model
-    rules = LazyKmerRuleList(dataset.kmer_sequences, dataset.kmer_by_matrix_column)
-    model_equivalent_rules = {r: [rules[i] for i in r.equivalent_rules_idx] for r in best_master_tree.rules}
-
-    # Extract the importance of each node in the model and normalize it
-    rule_importance_sum = float(sum(r.importance for r in best_master_tree.rules))
-    rule_importances = {r: r.importance / rule_importance_sum for r in best_master_tree.rules}
-
-    return best_hps, best_hp_score, train_metrics, test_metrics, best_model,\
-           rule_importances, model_equivalent_rules, \
-           classifications
+            train_metrics = _get_multiclass_metrics(train_predictions, train_answers, len(phenotype_tags))
+        if len(split.test_genome_idx) > 0:
+            if dataset.classification_type == "binary":
+                test_metrics = _get_binary_metrics(test_predictions, test_answers)
+            else:
+                test_metrics = _get_multiclass_metrics(test_predictions, test_answers, len(phenotype_tags))
+        else:
+            test_metrics = None
+
+        # Get the idx of the training/testing examples that are correctly/incorrectly classified by the model
+        classifications = defaultdict(list)
+        classifications["train_correct"] = dataset.genome_identifiers[split.train_genome_idx[train_predictions == \
+                                                    train_answers].tolist()].tolist() if train_metrics["risk"][0] < 1.0 else []
+        classifications["train_errors"] = dataset.genome_identifiers[split.train_genome_idx[train_predictions != \
+                                                    train_answers].tolist()].tolist() if train_metrics["risk"][0] > 0 else []
+        if len(split.test_genome_idx) > 0:
+            classifications["test_correct"] = dataset.genome_identifiers[split.test_genome_idx[test_predictions == \
+                                                    test_answers].tolist()].tolist() if test_metrics["risk"][0] < 1.0 else []
+            classifications["test_errors"] = dataset.genome_identifiers[split.test_genome_idx[test_predictions != \
+                                                    test_answers].tolist()].tolist() if test_metrics["risk"][0] > 0 else []
+
+        best_model = CARTModel(class_tags=phenotype_tags)
+        best_model.decision_tree = best_master_tree
+
+        # Extract all the equivalent rules for the nodes in the model
+        rules = LazyKmerRuleList(dataset.kmer_sequences, dataset.kmer_by_matrix_column)
+        model_equivalent_rules = {r: [rules[i] for i in r.equivalent_rules_idx] for r in best_master_tree.rules}
+        # The k-mers that share the column of an equivalent rule are equivalent too (except the blacklisted ones). A
+        # rule on a blacklisted k-mer whose column is not blacklisted is reported with another k-mer of its class.
+        if dataset.kmer_class_member_count > 0:
+            members = dataset.get_kmer_class_members(np.unique([equivalent_rule.kmer_index
+                                                                for equiv in model_equivalent_rules.values()
+                                                                for equivalent_rule in equiv] +
+                                                               [r.kmer_index for r in best_master_tree.rules]))
+            model_equivalent_rules = {r: add_kmer_class_rules(equiv, members, blacklisted_kmers_by_column)
+                                      for r, equiv in model_equivalent_rules.iteritems()}
+            replace_blacklisted_kmers(best_master_tree.rules, members, blacklisted_kmers_by_column)
+
+        # Extract the importance of each node in the model and normalize it
+        rule_importance_sum = float(sum(r.importance for r in best_master_tree.rules))
+        rule_importances = {r: r.importance / rule_importance_sum for r in best_master_tree.rules}
+
+        return best_hps, best_hp_score, train_metrics, test_metrics, best_model,\
+               rule_importances, model_equivalent_rules, \
+               classifications
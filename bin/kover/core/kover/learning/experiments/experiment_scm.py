@@ -30,7 +30,12 @@ from scipy.misc import comb
 
 from ...dataset.ds import KoverDataset
 from ..common.models import ConjunctionModel, DisjunctionModel
-from ..common.rules import LazyKmerRuleList, KmerRuleClassifications
+from ..common.rules import (
+    add_kmer_class_rules,
+    replace_blacklisted_kmers,
+    LazyKmerRuleList,
+    KmerRuleClassifications,
+)
 from ..learners.scm import SetCoveringMachine
 from ...utils import (
     _duplicate_last_element,
@@ -99,98 +104,127 @@ def _predictions(
     return train_predictions, test_predictions
 
 
-def _cv_score_hp(hp_values, max_rules, dataset_file, split_name, rule_blacklist):
+def _cv_score_hp(
+    hp_values,
+    max_rules,
+    dataset_file,
+    split_name,
+    rule_blacklist,
+    flat_kmer_matrix_file=None,
+    chunk_cache="auto",
+    chunk_cache_size=None,
+):
     model_type = hp_values[0]
     p = hp_values[1]
 
-    dataset = KoverDataset(dataset_file)
-    folds = dataset.get_split(split_name).folds
-    rules = LazyKmerRuleList(dataset.kmer_sequences, dataset.kmer_by_matrix_column)
-    rule_classifications = KmerRuleClassifications(
-        dataset.kmer_matrix, dataset.genome_count
-    )
-
-    def _iteration_callback(
-        iteration_infos, tmp_model, test_predictions_by_model_length, test_example_idx
-    ):
-        tmp_model.add(iteration_infos["selected_rule"])
-        _, test_predictions = _predictions(
-            tmp_model, dataset.kmer_matrix, [], test_example_idx
+    with KoverDataset(
+        dataset_file, flat_kmer_matrix_file, chunk_cache, chunk_cache_size
+    ) as dataset:
+        folds = dataset.get_split(split_name).folds
+        rules = LazyKmerRuleList(dataset.kmer_sequences, dataset.kmer_by_matrix_column)
+        rule_classifications = KmerRuleClassifications(
+            dataset.kmer_matrix,
+            dataset.genome_count,
+            chunk_cache=dataset.chunk_cache,
+            chunk_cache_size=dataset.chunk_cache_size,
         )
-        test_predictions_by_model_length.append(test_predictions)
-
-    def _tiebreaker(best_utility_idx, rule_risks, model_type):
-        logging.debug("There are %d candidate rules." % len(best_utility_idx))
-        tie_rule_risks = rule_risks[best_utility_idx]
-        if model_type == "conjunction":
-            result = best_utility_idx[np.isclose(tie_rule_risks, tie_rule_risks.min())]
-        else:
-            # Use max instead of min, since in the disjunction case the risks = 1.0 - conjunction risks (inverted ys)
-            result = best_utility_idx[np.isclose(tie_rule_risks, tie_rule_risks.max())]
-        return result
-
-    fold_score_by_model_length = np.ones((len(folds), max_rules + 1)) * np.infty
-    for i, fold in enumerate(folds):
-        logging.debug("Fold: %s" % fold.name)
-        rule_risks = np.hstack(
-            (fold.unique_risk_by_kmer[...], fold.unique_risk_by_anti_kmer[...])
-        )  # Too bad that we need to load each time. Maybe invert the loops (all hp for each fold)
 
-        train_example_idx = fold.train_genome_idx
-        test_example_idx = fold.test_genome_idx
-        positive_example_idx = train_example_idx[
-            dataset.phenotype.metadata[train_example_idx] == 1
-        ].reshape(-1)
-        negative_example_idx = train_example_idx[
-            dataset.phenotype.metadata[train_example_idx] == 0
-        ].reshape(-1)
-        tiebreaker = partial(_tiebreaker, rule_risks=rule_risks, model_type=model_type)
-        test_predictions_by_model_length = []
-        tmp_model = (
-            ConjunctionModel() if model_type == "conjunction" else DisjunctionModel()
-        )
-        iteration_callback = partial(
-            _iteration_callback,
-            tmp_model=tmp_model,
-            test_predictions_by_model_length=test_predictions_by_model_length,
-            test_example_idx=test_example_idx,
-        )
+        def _iteration_callback(
+            iteration_infos,
+            tmp_model,
+            test_predictions_by_model_length,
+            test_example_idx,
+        ):
+            tmp_model.add(iteration_infos["selected_rule"])
+            _, test_predictions = _predictions(
+                tmp_model, dataset.kmer_matrix, [], test_example_idx
+            )
+            test_predictions_by_model_length.append(test_predictions)
+
+        def _tiebreaker(best_utility_idx, rule_risks, model_type):
+            logging.debug("There are %d candidate rules." % len(best_utility_idx))
+            tie_rule_risks = rule_risks[best_utility_idx]
+            if model_type == "conjunction":
+                result = best_utility_idx[
+                    np.isclose(tie_rule_risks, tie_rule_risks.min())
+                ]
+            else:
+                # Use max instead of min, since in the disjunction case the risks = 1.0 - conjunction risks (inverted ys)
+                result = best_utility_idx[
+                    np.isclose(tie_rule_risks, tie_rule_risks.max())
+                ]
+            return result
+
+        fold_score_by_model_length = np.ones((len(folds), max_rules + 1)) * np.infty
+        for i, fold in enumerate(folds):
+            logging.debug("Fold: %s" % fold.name)
+            rule_risks = np.hstack(
+                (fold.unique_risk_by_kmer[...], fold.unique_risk_by_anti_kmer[...])
+            )  # Too bad that we need to load each time. Maybe invert the loops (all hp for each fold)
+
+            train_example_idx = fold.train_genome_idx
+            test_example_idx = fold.test_genome_idx
+            positive_example_idx = train_example_idx[
+                dataset.phenotype.metadata[train_example_idx] == 1
+            ].reshape(-1)
+            negative_example_idx = train_example_idx[
+                dataset.phenotype.metadata[train_example_idx] == 0
+            ].reshape(-1)
+            tiebreaker = partial(
+                _tiebreaker, rule_risks=rule_risks, model_type=model_type
+            )
+            test_predictions_by_model_length = []
+            tmp_model = (
+                ConjunctionModel()
+                if model_type == "conjunction"
+                else DisjunctionModel()
+            )
+            iteration_callback = partial(
+                _iteration_callback,
+                tmp_model=tmp_model,
+                test_predictions_by_model_length=test_predictions_by_model_length,
+                test_example_idx=test_example_idx,
+            )
 
-        predictor = SetCoveringMachine(model_type=model_type, p=p, max_rules=max_rules)
+            predictor = SetCoveringMachine(
+                model_type=model_type, p=p, max_rules=max_rules
+            )
 
-        # Empty model predictions (length = 0)
-        # Do this before fitting in case there are no predictive features in the data
-        test_predictions_by_model_length.append(
-            _predictions(tmp_model, dataset.kmer_matrix, [], test_example_idx)[1]
-        )
+            # Empty model predictions (length = 0)
+            # Do this before fitting in case there are no predictive features in the
+            # data
+            test_predictions_by_model_length.append(
+                _predictions(tmp_model, dataset.kmer_matrix, [], test_example_idx)[1]
+            )
 
-        predictor.fit(
-            rules=rules,
-            rule_classifications=rule_classifications,
-            positive_example_idx=positive_example_idx,
-            negative_example_idx=negative_example_idx,
-            rule_blacklist=rule_blacklist,
-            tiebreaker=tiebreaker,
-            iteration_callback=iteration_callback,
-        )
+            predictor.fit(
+                rules=rules,
+                rule_classifications=rule_classifications,
+                positive_example_idx=positive_example_idx,
+                negative_example_idx=negative_example_idx,
+                rule_blacklist=rule_blacklist,
+                tiebreaker=tiebreaker,
+                iteration_callback=iteration_callback,
+            )
 
-        # Calcule the risk for each model length
-        # Note: If the model stopped adding rules before the max, then we use the score
-        #       for the last added rule as the score for all subsequent lengths.
-        test_predictions_by_model_length = np.array(
-            _duplicate_last_element(test_predictions_by_model_length, max_rules + 1)
-        )
-        fold_score_by_model_length[i] = _get_binary_metrics(
-            predictions=test_predictions_by_model_length,
-            answers=dataset.phenotype.metadata[test_example_idx],
-        )["risk"]
+            # Calcule the risk for each model length
+            # Note: If the model stopped adding rules before the max, then we use the
+            #       score for the last added rule as the score for all subsequent
+            #       lengths.
+            test_predictions_by_model_length = np.array(
+                _duplicate_last_element(test_predictions_by_model_length, max_rules + 1)
+            )
+            fold_score_by_model_length[i] = _get_binary_metrics(
+                predictions=test_predictions_by_model_length,
+                answers=dataset.phenotype.metadata[test_example_idx],
+            )["risk"]
 
-    score_by_model_length = np.mean(fold_score_by_model_length, axis=0)
-    best_score_idx = np.argmin(score_by_model_length)
-    best_hp_score = score_by_model_length[best_score_idx]
-    best_model_length = best_score_idx
+        score_by_model_length = np.mean(fold_score_by_model_length, axis=0)
+        best_score_idx = np.argmin(score_by_model_length)
+        best_hp_score = score_by_model_length[best_score_idx]
+        best_model_length = best_score_idx
 
-    return (model_type, p, best_model_length), best_hp_score
+        return (model_type, p, best_model_length), best_hp_score
 
 
 def _cross_validation(
@@ -204,6 +238,9 @@ def _cross_validation(
     progress_callback,
     warning_callback,
     error_callback,
+    flat_kmer_matrix_file=None,
+    chunk_cache="auto",
+    chunk_cache_size=None,
 ):
     """
     Returns the best parameter combination and its cv score
@@ -221,6 +258,9 @@ def _cross_validation(
         split_name=split_name,
         max_rules=max_rules,
         rule_blacklist=rule_blacklist,
+        flat_kmer_matrix_file=flat_kmer_matrix_file,
+        chunk_cache=chunk_cache,
+        chunk_cache_size=chunk_cache_size,
     )
 
     best_hp_score = 1.0
@@ -302,7 +342,10 @@ def _full_train(
 
     rules = LazyKmerRuleList(dataset.kmer_sequences, dataset.kmer_by_matrix_column)
     rule_classifications = KmerRuleClassifications(
-        dataset.kmer_matrix, dataset.genome_count
+        dataset.kmer_matrix,
+        dataset.genome_count,
+        chunk_cache=dataset.chunk_cache,
+        chunk_cache_size=dataset.chunk_cache_size,
     )
     split = dataset.get_split(split_name)
 
@@ -408,161 +451,173 @@ def _bound_score_hp(
     bound_delta,
     bound_max_genome_size,
     random_generator,
+    flat_kmer_matrix_file=None,
+    chunk_cache="auto",
+    chunk_cache_size=None,
 ):
     model_type = hp_values[0]
     p = hp_values[1]
 
-    dataset = KoverDataset(dataset_file)
-    rules = LazyKmerRuleList(dataset.kmer_sequences, dataset.kmer_by_matrix_column)
-    rule_classifications = KmerRuleClassifications(
-        dataset.kmer_matrix, dataset.genome_count
-    )
-
-    def _iteration_callback(
-        iteration_infos,
-        tmp_model,
-        train_example_idx,
-        train_answers,
-        score_by_length,
-        model_by_length,
-        equivalent_rules,
-        rule_importances,
-        rule_classifications,
-    ):
-        tmp_model.add(iteration_infos["selected_rule"])
-        model_by_length.append(deepcopy(tmp_model))
-        rule_importances.append(iteration_infos["rule_importances"])
+    with KoverDataset(
+        dataset_file, flat_kmer_matrix_file, chunk_cache, chunk_cache_size
+    ) as dataset:
+        rules = LazyKmerRuleList(dataset.kmer_sequences, dataset.kmer_by_matrix_column)
+        rule_classifications = KmerRuleClassifications(
+            dataset.kmer_matrix,
+            dataset.genome_count,
+            chunk_cache=dataset.chunk_cache,
+            chunk_cache_size=dataset.chunk_cache_size,
+        )
 
-        # Store equivalent rules
-        # Ensure that there are no more equivalent rules than the specified maximum
-        if len(iteration_infos["equivalent_rules_idx"]) > max_equiv_rules:
-            logging.debug(
-                "There are more equivalent rules than the allowed maximum. Subsampling %d rules."
-                % max_equiv_rules
+        def _iteration_callback(
+            iteration_infos,
+            tmp_model,
+            train_example_idx,
+            train_answers,
+            score_by_length,
+            model_by_length,
+            equivalent_rules,
+            rule_importances,
+            rule_classifications,
+        ):
+            tmp_model.add(iteration_infos["selected_rule"])
+            model_by_length.append(deepcopy(tmp_model))
+            rule_importances.append(iteration_infos["rule_importances"])
+
+            # Store equivalent rules
+            # Ensure that there are no more equivalent rules than the specified maximum
+            if len(iteration_infos["equivalent_rules_idx"]) > max_equiv_rules:
+                logging.debug(
+                    "There are more equivalent rules than the allowed maximum. Subsampling %d rules."
+                    % max_equiv_rules
+                )
+                random_idx = random_generator.choice(
+                    len(iteration_infos["equivalent_rules_idx"]),
+                    max_equiv_rules,
+                    replace=False,
+                )
+                random_idx.sort()
+                iteration_infos["equivalent_rules_idx"] = iteration_infos[
+                    "equivalent_rules_idx"
+                ][random_idx]
+
+            # Adjust and store the equivalent rule indices
+            if model_type == "disjunction":
+                n_kmers = rule_classifications.shape[1] / 2
+                iteration_infos["equivalent_rules_idx"] += n_kmers
+                iteration_infos["equivalent_rules_idx"] %= 2 * n_kmers
+                equivalent_rules.append(iteration_infos["equivalent_rules_idx"])
+            else:
+                equivalent_rules.append(iteration_infos["equivalent_rules_idx"])
+
+            # Compute the bound value for the current model length
+            _, train_predictions = _predictions(
+                tmp_model, dataset.kmer_matrix, [], train_example_idx
             )
-            random_idx = random_generator.choice(
-                len(iteration_infos["equivalent_rules_idx"]),
-                max_equiv_rules,
-                replace=False,
+            score_by_length[iteration_infos["iteration_number"] - 1] = _bound(
+                train_predictions=train_predictions,
+                train_answers=train_answers,
+                train_example_idx=train_example_idx,
+                model=tmp_model,
+                delta=bound_delta,
+                max_genome_size=bound_max_genome_size,
+                rule_classifications=rule_classifications,
             )
-            random_idx.sort()
-            iteration_infos["equivalent_rules_idx"] = iteration_infos[
-                "equivalent_rules_idx"
-            ][random_idx]
 
-        # Adjust and store the equivalent rule indices
-        if model_type == "disjunction":
-            n_kmers = rule_classifications.shape[1] / 2
-            iteration_infos["equivalent_rules_idx"] += n_kmers
-            iteration_infos["equivalent_rules_idx"] %= 2 * n_kmers
-            equivalent_rules.append(iteration_infos["equivalent_rules_idx"])
-        else:
-            equivalent_rules.append(iteration_infos["equivalent_rules_idx"])
+        def _tiebreaker(best_utility_idx, rule_risks, model_type):
+            logging.debug("There are %d candidate rules." % len(best_utility_idx))
+            tie_rule_risks = rule_risks[best_utility_idx]
+            if model_type == "conjunction":
+                result = best_utility_idx[
+                    np.isclose(tie_rule_risks, tie_rule_risks.min())
+                ]
+            else:
+                # Use max instead of min, since in the disjunction case the risks = 1.0 - conjunction risks (inverted ys)
+                result = best_utility_idx[
+                    np.isclose(tie_rule_risks, tie_rule_risks.max())
+                ]
+            return result
+
+        split = dataset.get_split(split_name)
+        rule_risks = np.hstack(
+            (split.unique_risk_by_kmer[...], split.unique_risk_by_anti_kmer[...])
+        )
+        train_example_idx = split.train_genome_idx
+        positive_example_idx = train_example_idx[
+            dataset.phenotype.metadata[train_example_idx] == 1
+        ].reshape(-1)
+        negative_example_idx = train_example_idx[
+            dataset.phenotype.metadata[train_example_idx] == 0
+        ].reshape(-1)
+        train_answers = dataset.phenotype.metadata[train_example_idx]
+
+        tiebreaker = partial(_tiebreaker, rule_risks=rule_risks, model_type=model_type)
 
-        # Compute the bound value for the current model length
-        _, train_predictions = _predictions(
-            tmp_model, dataset.kmer_matrix, [], train_example_idx
+        tmp_model = (
+            ConjunctionModel() if model_type == "conjunction" else DisjunctionModel()
         )
-        score_by_length[iteration_infos["iteration_number"] - 1] = _bound(
-            train_predictions=train_predictions,
-            train_answers=train_answers,
+        score_by_length = np.ones(max_rules)
+        model_by_length = []
+        equivalent_rules = []
+        rule_importances = []
+        iteration_callback = partial(
+            _iteration_callback,
+            tmp_model=tmp_model,
             train_example_idx=train_example_idx,
-            model=tmp_model,
-            delta=bound_delta,
-            max_genome_size=bound_max_genome_size,
+            train_answers=train_answers,
+            score_by_length=score_by_length,
+            model_by_length=model_by_length,
+            equivalent_rules=equivalent_rules,
+            rule_importances=rule_importances,
             rule_classifications=rule_classifications,
         )
 
-    def _tiebreaker(best_utility_idx, rule_risks, model_type):
-        logging.debug("There are %d candidate rules." % len(best_utility_idx))
-        tie_rule_risks = rule_risks[best_utility_idx]
-        if model_type == "conjunction":
-            result = best_utility_idx[np.isclose(tie_rule_risks, tie_rule_risks.min())]
-        else:
-            # Use max instead of min, since in the disjunction case the risks = 1.0 - conjunction risks (inverted ys)
-            result = best_utility_idx[np.isclose(tie_rule_risks, tie_rule_risks.max())]
-        return result
-
-    split = dataset.get_split(split_name)
-    rule_risks = np.hstack(
-        (split.unique_risk_by_kmer[...], split.unique_risk_by_anti_kmer[...])
-    )
-    train_example_idx = split.train_genome_idx
-    positive_example_idx = train_example_idx[
-        dataset.phenotype.metadata[train_example_idx] == 1
-    ].reshape(-1)
-    negative_example_idx = train_example_idx[
-        dataset.phenotype.metadata[train_example_idx] == 0
-    ].reshape(-1)
-    train_answers = dataset.phenotype.metadata[train_example_idx]
-
-    tiebreaker = partial(_tiebreaker, rule_risks=rule_risks, model_type=model_type)
-
-    tmp_model = (
-        ConjunctionModel() if model_type == "conjunction" else DisjunctionModel()
-    )
-    score_by_length = np.ones(max_rules)
-    model_by_length = []
-    equivalent_rules = []
-    rule_importances = []
-    iteration_callback = partial(
-        _iteration_callback,
-        tmp_model=tmp_model,
-        train_example_idx=train_example_idx,
-        train_answers=train_answers,
-        score_by_length=score_by_length,
-        model_by_length=model_by_length,
-        equivalent_rules=equivalent_rules,
-        rule_importances=rule_importances,
-        rule_classifications=rule_classifications,
-    )
-
-    predictor = SetCoveringMachine(model_type=model_type, p=p, max_rules=max_rules)
-    predictor.fit(
-        rules=rules,
-        rule_classifications=rule_classifications,
-        positive_example_idx=positive_example_idx,
-        negative_example_idx=negative_example_idx,
-        rule_blacklist=rule_blacklist,
-        tiebreaker=tiebreaker,
-        iteration_callback=iteration_callback,
-        iteration_rule_importances=True,
-    )
-
-    # Handle edge case where no rules were added to the model
-    if len(tmp_model) == 0:
-        _, train_predictions = _predictions(
-            tmp_model, dataset.kmer_matrix, [], train_example_idx
-        )
-        bound_value = _bound(
-            train_predictions=train_predictions,
-            train_answers=train_answers,
-            train_example_idx=train_example_idx,
-            model=tmp_model,
-            delta=bound_delta,
-            max_genome_size=bound_max_genome_size,
+        predictor = SetCoveringMachine(model_type=model_type, p=p, max_rules=max_rules)
+        predictor.fit(
+            rules=rules,
             rule_classifications=rule_classifications,
+            positive_example_idx=positive_example_idx,
+            negative_example_idx=negative_example_idx,
+            rule_blacklist=rule_blacklist,
+            tiebreaker=tiebreaker,
+            iteration_callback=iteration_callback,
+            iteration_rule_importances=True,
+        )
+
+        # Handle edge case where no rules were added to the model
+        if len(tmp_model) == 0:
+            _, train_predictions = _predictions(
+                tmp_model, dataset.kmer_matrix, [], train_example_idx
+            )
+            bound_value = _bound(
+                train_predictions=train_predictions,
+                train_answers=train_answers,
+                train_example_idx=train_example_idx,
+                model=tmp_model,
+                delta=bound_delta,
+                max_genome_size=bound_max_genome_size,
+                rule_classifications=rule_classifications,
+            )
+            best_model_length = 0
+            best_hp_score = bound_value
+            best_model = tmp_model
+            best_rule_importances = np.array([])
+            best_equivalent_rules = np.array([])
+        else:
+            best_score_idx = np.argmin(score_by_length)
+            best_hp_score = score_by_length[best_score_idx]
+            best_model = model_by_length[best_score_idx]
+            best_rule_importances = rule_importances[best_score_idx]
+            best_equivalent_rules = equivalent_rules[: best_score_idx + 1]
+            best_model_length = best_score_idx + 1
+
+        return (
+            (model_type, p, best_model_length),
+            best_hp_score,
+            best_model,
+            best_rule_importances,
+            best_equivalent_rules,
         )
-        best_model_length = 0
-        best_hp_score = bound_value
-        best_model = tmp_model
-        best_rule_importances = np.array([])
-        best_equivalent_rules = np.array([])
-    else:
-        best_score_idx = np.argmin(score_by_length)
-        best_hp_score = score_by_length[best_score_idx]
-        best_model = model_by_length[best_score_idx]
-        best_rule_importances = rule_importances[best_score_idx]
-        best_equivalent_rules = equivalent_rules[: best_score_idx + 1]
-        best_model_length = best_score_idx + 1
-
-    return (
-        (model_type, p, best_model_length),
-        best_hp_score,
-        best_model,
-        best_rule_importances,
-        best_equivalent_rules,
-    )
 
 
 def _bound_selection(
@@ -580,6 +635,9 @@ def _bound_selection(
     progress_callback,
     warning_callback,
     error_callback,
+    flat_kmer_matrix_file=None,
+    chunk_cache="auto",
+    chunk_cache_size=None,
 ):
     n_hp_combinations = len(model_types) * len(p_values)
     logging.debug(
@@ -598,6 +656,9 @@ def _bound_selection(
         bound_delta=bound_delta,
         bound_max_genome_size=bound_max_genome_size,
         random_generator=random_generator,
+        flat_kmer_matrix_file=flat_kmer_matrix_file,
+        chunk_cache=chunk_cache,
+        chunk_cache_size=chunk_cache_size,
     )
 
     best_hp_score = 1.0
@@ -631,44 +692,67 @@ def _bound_selection(
 
 def _find_rule_blacklist(dataset_file, kmer_blacklist_file, warning_callback):
     """
-    Finds the index of the rules that must be blacklisted.
+    Finds the index of the rules that must be blacklisted, and the blacklisted k-mers of
+    the columns that are not blacklisted since other k-mers of their equivalence class
+    are not (column -> set of sequences). Such k-mers must not be reported as rules.
     """
-    dataset = KoverDataset(dataset_file)
+    with KoverDataset(dataset_file) as dataset:
+
+        # Find all rules to blacklist
+        rule_blacklist = []
+        blacklisted_kmers_by_column = {}
+        if kmer_blacklist_file is not None:
+            kmers_to_blacklist = _parse_kmer_blacklist(
+                kmer_blacklist_file, dataset.kmer_length
+            )
 
-    # Find all rules to blacklist
-    rule_blacklist = []
-    if kmer_blacklist_file is not None:
-        kmers_to_blacklist = _parse_kmer_blacklist(
-            kmer_blacklist_file, dataset.kmer_length
-        )
+            if kmers_to_blacklist:
+                # XXX: the k-mers are assumed to be upper-cased in the dataset
+                kmers_to_blacklist = [k.upper() for k in kmers_to_blacklist]
+                # The presence rule of a k-mer is its matrix column
+                presence_rule_idx = dataset.lookup_kmers(kmers_to_blacklist)
+                n_kmers = dataset.kmer_count
+
+                # The column of a k-mer is shared by the other k-mers of its equivalence
+                # class (if any), so it is only blacklisted with the whole class
+                blacklisted_by_rule_idx = defaultdict(set)
+                for k, rule_idx in zip(kmers_to_blacklist, presence_rule_idx):
+                    if rule_idx >= 0:
+                        blacklisted_by_rule_idx[int(rule_idx)].add(k)
+                class_members = dataset.get_kmer_class_members(
+                    sorted(blacklisted_by_rule_idx)
+                )
 
-        if kmers_to_blacklist:
-            # XXX: the k-mers are assumed to be upper-cased in the dataset
-            kmer_sequences = dataset.kmer_sequences[...].tolist()
-            kmer_by_matrix_column = dataset.kmer_by_matrix_column[
-                ...
-            ].tolist()  # XXX: each k-mer is there only once (see wiki)
-            n_kmers = len(kmer_sequences)
-
-            kmers_not_found = []
-            for k in kmers_to_blacklist:
-                k = k.upper()
-                try:
-                    presence_rule_idx = kmer_by_matrix_column.index(
-                        kmer_sequences.index(k)
+                kmers_not_found = []
+                kmers_not_blacklisted = []
+                for k, rule_idx in zip(kmers_to_blacklist, presence_rule_idx):
+                    if rule_idx < 0:
+                        kmers_not_found.append(k)
+                    elif len(blacklisted_by_rule_idx[int(rule_idx)]) <= len(
+                        class_members.get(int(rule_idx), [])
+                    ):
+                        kmers_not_blacklisted.append(k)
+                        blacklisted_kmers_by_column[int(rule_idx)] = (
+                            blacklisted_by_rule_idx[int(rule_idx)]
+                        )
+                    else:
+                        absence_rule_idx = rule_idx + n_kmers
+                        rule_blacklist += [int(rule_idx), int(absence_rule_idx)]
+
+                if len(kmers_not_found) > 0:
+                    warning_callback(
+                        "The following kmers could not be found in the dataset: "
+                        + ", ".join(kmers_not_found)
+                    )
+                if len(kmers_not_blacklisted) > 0:
+                    warning_callback(
+                        "The following kmers were not blacklisted, since other kmers "
+                        "of their equivalence class (present in exactly the same "
+                        "genomes) are not blacklisted: "
+                        + ", ".join(kmers_not_blacklisted)
                     )
-                    absence_rule_idx = presence_rule_idx + n_kmers
-                    rule_blacklist += [presence_rule_idx, absence_rule_idx]
-                except ValueError:
-                    kmers_not_found.append(k)
-
-            if len(kmers_not_found) > 0:
-                warning_callback(
-                    "The following kmers could not be found in the dataset: "
-                    + ", ".join(kmers_not_found)
-                )
 
-    return rule_blacklist
+        return rule_blacklist, blacklisted_kmers_by_column
 
 
 def learn_SCM(
@@ -688,9 +772,14 @@ def learn_SCM(
     progress_callback=None,
     warning_callback=None,
     error_callback=None,
+    flat_kmer_matrix_file=None,
+    chunk_cache="auto",
+    chunk_cache_size=None,
 ):
     """
     parameter_selection: bound, cv, none (use first value of each if multiple)
+    flat_kmer_matrix_file: a flat file exported from the dataset, from which the k-mer matrix is mapped in memory
+    chunk_cache, chunk_cache_size: the chunk cache policy of the k-mer matrix and its size (see KoverDataset)
     """
     # Execution callback functions
     if warning_callback is None:
@@ -713,177 +802,211 @@ def learn_SCM(
     p = np.unique(p)
 
     logging.debug("Searching for blacklisted rules.")
-    rule_blacklist = _find_rule_blacklist(
+    rule_blacklist, blacklisted_kmers_by_column = _find_rule_blacklist(
         dataset_file=dataset_file,
         kmer_blacklist_file=kmer_blacklist_file,
         warning_callback=warning_callback,
     )
 
-    dataset = KoverDataset(dataset_file)
-
-    # Score the hyperparameter combinations
-    # ------------------------------------------------------------------------------------------------------------------
-    if parameter_selection == "bound":
-        if bound_delta is None or bound_max_genome_size is None:
-            error_callback(
-                Exception(
-                    "Bound selection cannot be performed without delta and the maximum genome length."
+    with KoverDataset(
+        dataset_file, flat_kmer_matrix_file, chunk_cache, chunk_cache_size
+    ) as dataset:
+        if flat_kmer_matrix_file is not None:
+            try:
+                dataset.kmer_matrix
+            except (IOError, ValueError) as e:
+                error_callback(e)
+
+        # Score the hyperparameter combinations
+        # ------------------------------------------------------------------------------------------------------------------
+        if parameter_selection == "bound":
+            if bound_delta is None or bound_max_genome_size is None:
+                error_callback(
+                    Exception(
+                        "Bound selection cannot be performed without delta and the maximum genome length."
+                    )
                 )
-            )
 
-        # For bound selection, there is no need to retrain the algorithm after selecting the best hyperparameters.
-        # The model is already obtained from all the training data. This is why we save the model here.
-        (
-            best_hp_score,
-            best_hp,
-            best_model,
-            best_rule_importances,
-            best_predictor_equiv_rules,
-        ) = _bound_selection(
-            dataset_file=dataset_file,
-            split_name=split_name,
-            model_types=model_type,
-            p_values=p,
-            max_rules=max_rules,
-            rule_blacklist=rule_blacklist,
-            max_equiv_rules=max_equiv_rules,
-            bound_delta=bound_delta,
-            bound_max_genome_size=bound_max_genome_size,
-            n_cpu=n_cpu,
-            random_generator=random_generator,
-            progress_callback=progress_callback,
-            warning_callback=warning_callback,
-            error_callback=error_callback,
-        )
+            # For bound selection, there is no need to retrain the algorithm after selecting the best hyperparameters.
+            # The model is already obtained from all the training data. This is why we save the model here.
+            (
+                best_hp_score,
+                best_hp,
+                best_model,
+                best_rule_importances,
+                best_predictor_equiv_rules,
+            ) = _bound_selection(
+                dataset_file=dataset_file,
+                split_name=split_name,
+                model_types=model_type,
+                p_values=p,
+                max_rules=max_rules,
+                rule_blacklist=rule_blacklist,
+                max_equiv_rules=max_equiv_rules,
+                bound_delta=bound_delta,
+                bound_max_genome_size=bound_max_genome_size,
+                n_cpu=n_cpu,
+                random_generator=random_generator,
+                progress_callback=progress_callback,
+                warning_callback=warning_callback,
+                error_callback=error_callback,
+                flat_kmer_matrix_file=flat_kmer_matrix_file,
+                chunk_cache=chunk_cache,
+                chunk_cache_size=chunk_cache_size,
+            )
 
-    elif parameter_selection == "cv":
-        n_folds = len(dataset.get_split(split_name).folds)
-        if n_folds < 1:
-            error_callback(
-                Exception(
-                    "Cross-validation cannot be performed on a split with no folds."
+        elif parameter_selection == "cv":
+            n_folds = len(dataset.get_split(split_name).folds)
+            if n_folds < 1:
+                error_callback(
+                    Exception(
+                        "Cross-validation cannot be performed on a split with no folds."
+                    )
                 )
+            best_hp_score, best_hp = _cross_validation(
+                dataset_file=dataset_file,
+                split_name=split_name,
+                model_types=model_type,
+                p_values=p,
+                max_rules=max_rules,
+                rule_blacklist=rule_blacklist,
+                n_cpu=n_cpu,
+                progress_callback=progress_callback,
+                warning_callback=warning_callback,
+                error_callback=error_callback,
+                flat_kmer_matrix_file=flat_kmer_matrix_file,
+                chunk_cache=chunk_cache,
+                chunk_cache_size=chunk_cache_size,
             )
-        best_hp_score, best_hp = _cross_validation(
-            dataset_file=dataset_file,
-            split_name=split_name,
-            model_types=model_type,
-            p_values=p,
-            max_rules=max_rules,
-            rule_blacklist=rule_blacklist,
-            n_cpu=n_cpu,
-            progress_callback=progress_callback,
-            warning_callback=warning_callback,
-            error_callback=error_callback,
-        )
 
-    else:
-        # Use the first value provided for each parameter
-        best_hp = {"model_type": model_type[0], "p": p[0], "max_rules": max_rules}
-        best_hp_score = None
-
-    # Use the best hyperparameters to train/test on the split
-    # ------------------------------------------------------------------------------------------------------------------
-    if parameter_selection == "bound":
-        model = best_model
-        equivalent_rules = best_predictor_equiv_rules
-        rule_importances = best_rule_importances
-    else:
-        model, rule_importances, equivalent_rules = _full_train(
-            dataset=dataset,
-            split_name=split_name,
-            model_type=best_hp["model_type"],
-            p=best_hp["p"],
-            max_rules=best_hp["max_rules"],
-            max_equiv_rules=max_equiv_rules,
-            rule_blacklist=rule_blacklist,
-            random_generator=random_generator,
+        else:
+            # Use the first value provided for each parameter
+            best_hp = {"model_type": model_type[0], "p": p[0], "max_rules": max_rules}
+            best_hp_score = None
+
+        # Use the best hyperparameters to train/test on the split
+        # ------------------------------------------------------------------------------------------------------------------
+        if parameter_selection == "bound":
+            model = best_model
+            equivalent_rules = best_predictor_equiv_rules
+            rule_importances = best_rule_importances
+        else:
+            model, rule_importances, equivalent_rules = _full_train(
+                dataset=dataset,
+                split_name=split_name,
+                model_type=best_hp["model_type"],
+                p=best_hp["p"],
+                max_rules=best_hp["max_rules"],
+                max_equiv_rules=max_equiv_rules,
+                rule_blacklist=rule_blacklist,
+                random_generator=random_generator,
+                progress_callback=progress_callback,
+            )
+
+        split = dataset.get_split(split_name)
+        train_example_idx = split.train_genome_idx
+        test_example_idx = split.test_genome_idx
+
+        train_predictions, test_predictions = _predictions(
+            model=model,
+            kmer_matrix=dataset.kmer_matrix,
+            train_example_idx=train_example_idx,
+            test_example_idx=test_example_idx,
             progress_callback=progress_callback,
         )
 
-    split = dataset.get_split(split_name)
-    train_example_idx = split.train_genome_idx
-    test_example_idx = split.test_genome_idx
-
-    train_predictions, test_predictions = _predictions(
-        model=model,
-        kmer_matrix=dataset.kmer_matrix,
-        train_example_idx=train_example_idx,
-        test_example_idx=test_example_idx,
-        progress_callback=progress_callback,
-    )
+        train_answers = dataset.phenotype.metadata[train_example_idx]
+        train_metrics = _get_binary_metrics(train_predictions, train_answers)
 
-    train_answers = dataset.phenotype.metadata[train_example_idx]
-    train_metrics = _get_binary_metrics(train_predictions, train_answers)
+        # No need to recompute the bound if bound selection was used
+        if parameter_selection == "bound":
+            train_metrics["bound"] = best_hp_score
+        else:
+            train_metrics["bound"] = _bound(
+                train_predictions=train_predictions,
+                train_answers=train_answers,
+                train_example_idx=train_example_idx,
+                model=model,
+                delta=bound_delta,
+                max_genome_size=bound_max_genome_size,
+                rule_classifications=KmerRuleClassifications(
+                    dataset.kmer_matrix,
+                    dataset.genome_count,
+                    chunk_cache=dataset.chunk_cache,
+                    chunk_cache_size=dataset.chunk_cache_size,
+                ),
+            )
 
-    # No need to recompute the bound if bound selection was used
-    if parameter_selection == "bound":
-        train_metrics["bound"] = best_hp_score
-    else:
-        train_metrics["bound"] = _bound(
-            train_predictions=train_predictions,
-            train_answers=train_answers,
-            train_example_idx=train_example_idx,
-            model=model,
-            delta=bound_delta,
-            max_genome_size=bound_max_genome_size,
-            rule_classifications=KmerRuleClassifications(
-                dataset.kmer_matrix, dataset.genome_count
-            ),
-        )
+        # Test metrics are computed only if there is a testing set
+        if len(test_example_idx) > 0:
+            test_answers = dataset.phenotype.metadata[test_example_idx]
+            test_metrics = _get_binary_metrics(test_predictions, test_answers)
+        else:
+            test_metrics = None
 
-    # Test metrics are computed only if there is a testing set
-    if len(test_example_idx) > 0:
-        test_answers = dataset.phenotype.metadata[test_example_idx]
-        test_metrics = _get_binary_metrics(test_predictions, test_answers)
-    else:
-        test_metrics = None
-
-    # Get the idx of the training/testing examples that are correctly/incorrectly classified by the model
-    classifications = defaultdict(list)
-    classifications["train_correct"] = (
-        dataset.genome_identifiers[
-            train_example_idx[train_predictions == train_answers].tolist()
-        ].tolist()
-        if train_metrics["risk"][0] < 1.0
-        else []
-    )
-    classifications["train_errors"] = (
-        dataset.genome_identifiers[
-            train_example_idx[train_predictions != train_answers].tolist()
-        ].tolist()
-        if train_metrics["risk"][0] > 0
-        else []
-    )
-    if len(test_example_idx) > 0:
-        classifications["test_correct"] = (
+        # Get the idx of the training/testing examples that are correctly/incorrectly classified by the model
+        classifications = defaultdict(list)
+        classifications["train_correct"] = (
             dataset.genome_identifiers[
-                test_example_idx[test_predictions == test_answers].tolist()
+                train_example_idx[train_predictions == train_answers].tolist()
             ].tolist()
-            if test_metrics["risk"][0] < 1.0
+            if train_metrics["risk"][0] < 1.0
             else []
         )
-        classifications["test_errors"] = (
+        classifications["train_errors"] = (
             dataset.genome_identifiers[
-                test_example_idx[test_predictions != test_answers].tolist()
+                train_example_idx[train_predictions != train_answers].tolist()
             ].tolist()
-            if test_metrics["risk"][0] > 0
+            if train_metrics["risk"][0] > 0
             else []
         )
+        if len(test_example_idx) > 0:
+            classifications["test_correct"] = (
+                dataset.genome_identifiers[
+                    test_example_idx[test_predictions == test_answers].tolist()
+                ].tolist()
+                if test_metrics["risk"][0] < 1.0
+                else []
+            )
+            classifications["test_errors"] = (
+                dataset.genome_identifiers[
+                    test_example_idx[test_predictions != test_answers].tolist()
+                ].tolist()
+                if test_metrics["risk"][0] > 0
+                else []
+            )
 
-    # Convert the equivalent rule indexes to rule objects
-    rules = LazyKmerRuleList(dataset.kmer_sequences, dataset.kmer_by_matrix_column)
-    model_equivalent_rules = [
-        [rules[i] for i in equiv_idx] for equiv_idx in equivalent_rules
-    ]
-
-    return (
-        best_hp,
-        best_hp_score,
-        train_metrics,
-        test_metrics,
-        model,
-        rule_importances,
-        model_equivalent_rules,
-        classifications,
-    )
+        # Convert the equivalent rule indexes to rule objects
+        rules = LazyKmerRuleList(dataset.kmer_sequences, dataset.kmer_by_matrix_column)
+        model_equivalent_rules = [
+            [rules[i] for i in equiv_idx] for equiv_idx in equivalent_rules
+        ]
+
+        # The k-mers that share the column of an equivalent rule are equivalent too
+        # (except the blacklisted ones). A rule on a blacklisted k-mer whose column is
+        # not blacklisted is reported with another k-mer of its class.
+        if dataset.kmer_class_member_count > 0:
+            members = dataset.get_kmer_class_members(
+                np.unique(
+                    [r.kmer_index for equiv in model_equivalent_rules for r in equiv]
+                    + [r.kmer_index for r in model.rules]
+                )
+            )
+            model_equivalent_rules = [
+                add_kmer_class_rules(equiv, members, blacklisted_kmers_by_column)
+                for equiv in model_equivalent_rules
+            ]
+            replace_blacklisted_kmers(
+                model.rules, members, blacklisted_kmers_by_column
+            )
+
+        return (
+            best_hp,
+            best_hp_score,
+            train_metrics,
+            test_metrics,
+            model,
+            rule_importances,
+            model_equivalent_rules,
+            classifications,
+        )
@@ -17,12 +17,17 @@
     along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import gzip
 import h5py as h
 import logging
 import numpy as np
 
 from math import ceil
 
+GZIP_MAGIC_NUMBER = "\x1f\x8b"
+SEQUENCE_READ_BLOCK_SIZE = 4 * 1024 * 1024
+_SEQUENCE_WHITESPACE = " \t\r\n"
+
 
 def _class_to_string(instance):
     """
@@ -54,27 +59,108 @@ def _duplicate_last_element(l, length):
     return l
     
 
-def _fasta_to_sequences(path):
+def _open_sequence_file(path):
     """
-    Reads a FASTA file extracts all the sequences (contigs) that it contains.
+    Opens a plain or gzip-compressed sequence file. Compressed files are recognized by their magic number.
     """
-    contigs = []
-    buffer = None
-    for l in open(path, "r"):
-        if l.startswith(">"):
-            if buffer is not None:
-                contigs.append(buffer.upper())
-                buffer = ""
+    with open(path, "rb") as f:
+        is_gzip = f.read(2) == GZIP_MAGIC_NUMBER
+    return gzip.open(path, "rb") if is_gzip else open(path, "rb")
+
+
+def _iter_blocks(f, block_size, first_block=""):
+    # Upper case once per block rather than once per sequence
+    if first_block:
+        yield first_block.upper()
+    for block in iter(lambda: f.read(block_size), ""):
+        yield block.upper()
+
+
+def _fasta_sequences(blocks):
+    """
+    Yields the sequences of a FASTA file. The sequence lines of each record are accumulated as pieces of the blocks
+    and joined once, so that reading a sequence is linear in its length.
+    """
+    pieces = None  # The pieces of the current sequence (None before the first header)
+    in_header = False
+    for block in blocks:
+        position = 0
+        while position < len(block):
+            if in_header:
+                header_end = block.find("\n", position)
+                if header_end == -1:
+                    break
+                in_header = False
+                position = header_end + 1
+                continue
+
+            # ">" is not a valid sequence character, so it can only mark the start of a header
+            header_start = block.find(">", position)
+            piece_end = header_start if header_start != -1 else len(block)
+            if pieces is not None:
+                pieces.append(block[position: piece_end].translate(None, _SEQUENCE_WHITESPACE))
+            if header_start == -1:
+                break
+            if pieces:
+                sequence = "".join(pieces)
+                if sequence:
+                    yield sequence
+            pieces = []
+            in_header = True
+            position = header_start + 1
+
+    if pieces:
+        sequence = "".join(pieces)
+        if sequence:
+            yield sequence
+
+
+def _fastq_sequences(blocks):
+    """
+    Yields the sequences of a FASTQ file (four lines per record).
+    """
+    remainder = ""
+    line_idx = 0
+    for block in blocks:
+        lines = (remainder + block).split("\n")
+        remainder = lines.pop()
+        for line in lines:
+            if line_idx % 4 == 1:
+                yield line.rstrip("\r")
+            line_idx += 1
+    if remainder and line_idx % 4 == 1:
+        yield remainder.rstrip("\r")
+
+
+def _read_sequences(path, block_size=SEQUENCE_READ_BLOCK_SIZE):
+    """
+    Streams the sequences (contigs or reads) of a FASTA or FASTQ file, one at a time. The file can be gzip-compressed.
+
+    Parameters:
+    -----------
+    path: str
+        The path to the sequence file. The format is determined by the first character of the file.
+    block_size: int
+        The number of bytes read at a time.
+
+    Returns:
+    --------
+    A generator that yields each sequence as an upper case byte string, without line breaks.
+    """
+    with _open_sequence_file(path) as f:
+        first_block = f.read(block_size)
+        stripped = first_block.lstrip()
+        if stripped.startswith("@"):
+            parser = _fastq_sequences
+        elif stripped.startswith(">") or stripped == "":
+            parser = _fasta_sequences
         else:
-            if buffer is None:
-                buffer = l.strip()
-            else:
-                buffer += l.strip()
-    if buffer is not None and buffer != "":
-        contigs.append(buffer.upper())
-    return contigs
-    
-    
+            raise ValueError("%s is not a FASTA or FASTQ file." % path)
+
+        for sequence in parser(_iter_blocks(f, block_size, first_block)):
+            yield sequence
+
+
 def _hdf5_open_no_chunk_cache(filename, access_type=h.h5f.ACC_RDONLY):
     fid = h.h5f.open(filename, access_type)
     access_property_list = fid.get_access_plist()
@@ -130,9 +216,14 @@ def _minimum_uint_size(max_value):
         return np.uint128
 
 
-def _pack_binary_bytes_to_ints(a, pack_size):
+def _pack_binary_bytes_to_ints(a, pack_size, column_block_size=8192):
     """
     Packs binary values stored in bytes into ints
+
+    Row i of the input is stored in bit (pack_size - 1 - i % pack_size) of row i / pack_size of the output, i.e., the
+    first row of each group is the most significant bit. The columns are processed in blocks: each block is transposed
+    so that np.packbits can work along the contiguous axis, and each group of pack_size / 8 bytes is then
+    reinterpreted as a big-endian integer.
     """
     if pack_size == 64:
         type = np.uint64
@@ -141,20 +232,20 @@ def _pack_binary_bytes_to_ints(a, pack_size):
     else:
         raise ValueError("Supported data types are 32-bit and 64-bit integers.")
 
-    b = np.zeros((int(ceil(1.0 * a.shape[0] / pack_size)), a.shape[1]), dtype=type)
-    packed_rows = 0
-    packing_row = 0
-    for i in xrange(a.shape[0]):
-        if packed_rows == pack_size:
-            packed_rows = 0
-            packing_row += 1
-        tmp = np.asarray(a[i], dtype=type)
-        tmp = np.left_shift(tmp, type(pack_size - packed_rows - 1))
-        np.bitwise_or(b[packing_row], tmp, out=b[packing_row])
-        packed_rows += 1
+    n_rows, n_columns = a.shape
+    n_packed_rows = int(ceil(1.0 * n_rows / pack_size))
+    big_endian_type = ">u%d" % (pack_size / 8)
 
-    return b
+    b = np.empty((n_packed_rows, n_columns), dtype=type)
+    # The padding bits of the last packed row are always 0
+    transposed_block = np.zeros((min(column_block_size, n_columns), n_packed_rows * pack_size), dtype=np.uint8)
+    for block_start in xrange(0, n_columns, column_block_size):
+        block_stop = min(block_start + column_block_size, n_columns)
+        block = transposed_block[: block_stop - block_start]
+        block[:, :n_rows] = a[:, block_start:block_stop].T
+        b[:, block_start:block_stop] = np.packbits(block, axis=1).view(big_endian_type).T
 
+    return b
 
 def _unpack_binary_bytes_from_ints(a):
     """
@@ -169,30 +260,26 @@ def _unpack_binary_bytes_from_ints(a):
     else:
         raise ValueError("Supported data types are 32-bit and 64-bit integers.")
 
-    unpacked_n_rows = a.shape[0] * pack_size
-    unpacked_n_columns = a.shape[1] if len(a.shape) > 1 else 1
-    b = np.zeros((unpacked_n_rows, a.shape[1]) if len(a.shape) > 1 else unpacked_n_rows, dtype=np.uint8)
-
-    packed_rows = 0
-    packing_row = 0
-    for i in xrange(b.shape[0]):
-        if packed_rows == pack_size:
-            packed_rows = 0
-            packing_row += 1
-        tmp = np.left_shift(np.ones(unpacked_n_columns, dtype=type), pack_size - (i - pack_size * packing_row)-1)
-        np.bitwise_and(a[packing_row], tmp, tmp)
-        b[i] = tmp > 0
-        packed_rows += 1
+    bytes_per_int = pack_size / 8
+    big_endian = np.ascontiguousarray(a, dtype=">u%d" % bytes_per_int)
 
-    return b
+    if len(a.shape) == 1:
+        return np.unpackbits(big_endian.view(np.uint8))
+
+    n_packed_rows, n_columns = a.shape
+    # (n_packed_rows, n_columns, bytes_per_int) -> (n_packed_rows * bytes_per_int, n_columns) bytes, most significant first
+    packed_bytes = big_endian.view(np.uint8).reshape(n_packed_rows, n_columns, bytes_per_int).transpose(0, 2, 1)
+    packed_bytes = packed_bytes.reshape(n_packed_rows * bytes_per_int, n_columns)
+    return np.unpackbits(packed_bytes, axis=0)
 
 def _parse_kmer_blacklist(blacklist_path, expected_kmer_len):
     data = []
     
-    # Fasta file format
+    # Fasta file format (possibly gzip-compressed)
     fasta_extensions = [".fasta", ".fa", ".fas", ".fna"]
-    if any(blacklist_path.endswith(extension) for extension in fasta_extensions):
-        data = _fasta_to_sequences(blacklist_path)
+    if any(blacklist_path.endswith(extension) or blacklist_path.endswith(extension + ".gz")
+           for extension in fasta_extensions):
+        data = list(_read_sequences(blacklist_path))
             
     # Other file format (one kmer per line)
     else:
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+Tests of kover dataset append: appending genomes to a dataset gives the dataset created from scratch with all the
+genomes, and a dataset whose append was interrupted is refused.
+
+Usage: python -m unittest discover -s tests
+"""
+
+import numpy as np
+import os
+import unittest
+
+from os.path import join, realpath
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from kover.dataset import append
+from kover.dataset.append import append_contigs
+from kover.dataset.create import from_contigs
+from kover.dataset.ds import KoverDataset
+from test_merge import _genomes_by_kmer
+
+N_GENOMES = 30
+GENOME_LENGTH = 1000
+KMER_SIZE = 15
+
+
+def _write_genomes(directory):
+	"""
+	Writes the contigs of genomes that share most of their k-mers, with a list and a phenotype file for the first
+	genomes, the last genomes and all the genomes.
+	"""
+	random_generator = np.random.RandomState(42)
+	ancestor = random_generator.choice(list("ACGT"), GENOME_LENGTH)
+	genome_ids = ["genome_%d" % i for i in xrange(N_GENOMES)]
+	for genome_id in genome_ids:
+		genome = ancestor.copy()
+		mutations = random_generator.randint(0, GENOME_LENGTH, 20)
+		genome[mutations] = random_generator.choice(list("ACGT"), len(mutations))
+		with open(join(directory, genome_id + ".fa"), "w") as f:
+			f.write(">contig_1\n%s\n>contig_2\n%s\n" % ("".join(genome[:GENOME_LENGTH / 2]),
+			                                            "".join(genome[GENOME_LENGTH / 2:])))
+	half = N_GENOMES / 2
+	for name, ids in [("first", genome_ids[:half]), ("last", genome_ids[half:]), ("all", genome_ids)]:
+		with open(join(directory, name + ".tsv"), "w") as f:
+			f.writelines("%s\t%s\n" % (genome_id, join(directory, genome_id + ".fa")) for genome_id in ids)
+		with open(join(directory, name + ".metadata.tsv"), "w") as f:
+			f.writelines("%s\t%d\n" % (genome_id, int(genome_id.split("_")[1]) % 2) for genome_id in ids)
+
+
+class AppendTests(unittest.TestCase):
+	def setUp(self):
+		self.directory = mkdtemp()
+		_write_genomes(self.directory)
+
+	def tearDown(self):
+		rmtree(self.directory)
+
+	def _create(self, name):
+		# The k-mers that occur in a single genome are kept (kover dataset create from-contigs --singleton-kmers)
+		dataset_path = join(self.directory, name + ".kover")
+		from_contigs(contig_list_path=join(self.directory, name + ".tsv"), output_path=dataset_path,
+		             kmer_size=KMER_SIZE, filter_singleton="nothing", phenotype_description="phenotype",
+		             phenotype_metadata_path=join(self.directory, name + ".metadata.tsv"), gzip=4,
+		             temp_dir=self.directory, nb_cores=1, verbose=False, progress=False, kmer_counter="python")
+		return dataset_path
+
+	def _append(self, dataset_path, name):
+		append_contigs(dataset_path, join(self.directory, name + ".tsv"),
+		               join(self.directory, name + ".metadata.tsv"), self.directory, 1)
+
+	def _open_descriptors(self, path):
+		fd_directory = "/proc/self/fd"
+		return [fd for fd in os.listdir(fd_directory) if realpath(join(fd_directory, fd)) == realpath(path)]
+
+	def test_append_of_singleton_kmers(self):
+		dataset_path = self._create("first")
+		self._append(dataset_path, "last")
+		self.assertEqual(_genomes_by_kmer(dataset_path), _genomes_by_kmer(self._create("all")))
+		with KoverDataset(dataset_path) as dataset:
+			self.assertEqual(dataset.genome_count, N_GENOMES)
+
+	def test_interrupted_append(self):
+		dataset_path = self._create("first")
+		build_kmer_index = append.build_kmer_index
+
+		def interrupted_build_kmer_index(*args, **kwargs):
+			raise KeyboardInterrupt()
+		append.build_kmer_index = interrupted_build_kmer_index
+		try:
+			self.assertRaises(KeyboardInterrupt, self._append, dataset_path, "last")
+		finally:
+			append.build_kmer_index = build_kmer_index
+		self.assertEqual(self._open_descriptors(dataset_path), [])
+
+		dataset = KoverDataset(dataset_path)
+		self.assertRaises(IOError, lambda: dataset.genome_count)
+		dataset.close()
+		self.assertRaises(Exception, self._append, dataset_path, "last")
+		self.assertEqual(self._open_descriptors(dataset_path), [])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+Tests of the HDF5 handles of the datasets (see KoverDataset.dataset_open): each process opens the file of a dataset once,
+however many times the learning algorithms read it, and the handles are released when the datasets are closed.
+
+Usage: python -m unittest discover -s tests
+"""
+
+import h5py as h
+import numpy as np
+import os
+import unittest
+
+from collections import Counter
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from kover.dataset import ds
+from kover.dataset.create import from_tsv
+from kover.dataset.ds import KoverDataset
+from kover.dataset.split import split_with_proportion
+from kover.learning.experiments.experiment_cart import learn_CART
+from kover.learning.experiments.experiment_scm import learn_SCM
+
+N_GENOMES = 60
+N_KMERS = 400
+KMER_SIZE = 15
+
+
+def _write_dataset(directory):
+	random_generator = np.random.RandomState(42)
+	genome_ids = ["genome_%d" % i for i in xrange(N_GENOMES)]
+	labels = random_generator.randint(2, size=N_GENOMES)
+	kmers = set()
+	while len(kmers) < N_KMERS:
+		kmers.add("".join(random_generator.choice(list("ACGT"), KMER_SIZE)))
+	with open(join(directory, "matrix.tsv"), "w") as f:
+		f.write("kmers\t" + "\t".join(genome_ids) + "\n")
+		for i, kmer in enumerate(sorted(kmers)):
+			# A few k-mers are predictive of the phenotype, so that the models have rules
+			row = labels if i % 50 == 0 else random_generator.randint(2, size=N_GENOMES)
+			f.write(kmer + "\t" + "\t".join(str(v) for v in row) + "\n")
+	with open(join(directory, "metadata.tsv"), "w") as f:
+		for genome_id, label in zip(genome_ids, labels):
+			f.write("%s\t%d\n" % (genome_id, label))
+
+	dataset_path = join(directory, "dataset.kover")
+	from_tsv(join(directory, "matrix.tsv"), dataset_path, "phenotype", join(directory, "metadata.tsv"), 4, n_cpu=1)
+	split_with_proportion(dataset_path, "split", train_prop=0.7, random_seed=42, n_folds=3)
+	return dataset_path
+
+
+class DatasetHandleTests(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.directory = mkdtemp()
+		cls.dataset_path = _write_dataset(cls.directory)
+
+	@classmethod
+	def tearDownClass(cls):
+		rmtree(cls.directory)
+
+	def setUp(self):
+		# Every call to h5f.open is logged with the process that made it. The forked workers of the learning
+		# algorithms inherit the patched function and append to the same log.
+		self.open_log = join(self.directory, "h5f_open.log")
+		if os.path.exists(self.open_log):
+			os.remove(self.open_log)
+		self.h5f_open = h.h5f.open
+		h5f_open, open_log, dataset_path = self.h5f_open, self.open_log, self.dataset_path
+
+		def logged_h5f_open(name, *args, **kwargs):
+			if os.path.abspath(name) == os.path.abspath(dataset_path):
+				with open(open_log, "a") as f:
+					f.write("%d\n" % os.getpid())
+			return h5f_open(name, *args, **kwargs)
+		h.h5f.open = logged_h5f_open
+
+	def tearDown(self):
+		h.h5f.open = self.h5f_open
+
+	def _opens_by_process(self):
+		if not os.path.exists(self.open_log):
+			return Counter()
+		return Counter(int(pid) for pid in open(self.open_log).read().split())
+
+	def _assert_bounded_opens(self, max_main_opens, max_worker_opens):
+		# _hdf5_open_no_chunk_cache calls h5f.open twice per file open. The number of opens does not depend on the
+		# number of folds or of iterations: each worker opens the dataset once per hyperparameter combination.
+		opens = self._opens_by_process()
+		self.assertLessEqual(opens.pop(os.getpid(), 0), 2 * max_main_opens)
+		self.assertLessEqual(sum(opens.values()), 2 * max_worker_opens)
+		self.assertEqual(len(ds._process_open_files()), 0, "The learning left datasets open.")
+
+	def _learn_SCM(self, parameter_selection):
+		return learn_SCM(dataset_file=self.dataset_path, split_name="split", model_type=["conjunction", "disjunction"],
+						 p=[0.5, 1.0, 2.0], kmer_blacklist_file=None, max_rules=5, max_equiv_rules=10,
+						 parameter_selection=parameter_selection, n_cpu=2, random_seed=42, authorized_rules=None,
+						 bound_delta=0.05, bound_max_genome_size=5000)
+
+	def test_scm_cv_opens(self):
+		self._learn_SCM("cv")
+		# The blacklist and the training each open the dataset once in the main process
+		self._assert_bounded_opens(max_main_opens=2, max_worker_opens=6)
+
+	def test_scm_bound_opens(self):
+		self._learn_SCM("bound")
+		self._assert_bounded_opens(max_main_opens=2, max_worker_opens=6)
+
+	def test_cart_cv_opens(self):
+		learn_CART(dataset_file=self.dataset_path, split_name="split", criterion=["gini"], max_depth=[3],
+				   min_samples_split=[2], class_importance=[{0: 1.0, 1: 1.0}], bound_delta=0.05,
+				   bound_max_genome_size=5000, kmer_blacklist_file=None, parameter_selection="cv", n_cpu=2,
+				   authorized_rules=None)
+		self._assert_bounded_opens(max_main_opens=2, max_worker_opens=1)
+
+	def test_shared_handle(self):
+		first, second = KoverDataset(self.dataset_path), KoverDataset(self.dataset_path)
+		for _ in xrange(10):
+			first.kmer_count, second.genome_count, first.kmer_matrix, second.get_split("split").folds
+		self.assertEqual(self._opens_by_process()[os.getpid()], 2)
+		first.close()
+		# The file stays open while the second dataset uses it
+		self.assertTrue(second.dataset_open().id.valid)
+		second.close()
+		self.assertEqual(len(ds._process_open_files()), 0)
+
+	def test_split_after_reopen(self):
+		dataset = KoverDataset(self.dataset_path)
+		split = dataset.get_split("split")
+		fold = split.folds[0]
+		risks = split.unique_risk_by_kmer[...], fold.unique_risk_by_kmer[...]
+		train_genome_idx = split.train_genome_idx
+		# The HDF5 datasets of the split are looked up again once the file is reopened
+		dataset.close()
+		self.assertTrue((split.unique_risk_by_kmer[...] == risks[0]).all())
+		self.assertTrue((fold.unique_risk_by_kmer[...] == risks[1]).all())
+		self.assertTrue((split.train_genome_idx == train_genome_idx).all())
+		dataset.close()
+		self.assertEqual(len(ds._process_open_files()), 0)
+
+	def test_fork(self):
+		with KoverDataset(self.dataset_path) as dataset:
+			kmer_count = dataset.kmer_count
+			pid = os.fork()
+			if pid == 0:
+				# The child cannot use the handle of its parent: it opens its own
+				status = 0
+				try:
+					if dataset.kmer_count != kmer_count or len(ds._process_open_files()) != 1:
+						status = 1
+					dataset.close()
+					if len(ds._process_open_files()) != 0:
+						status = 1
+				except Exception:
+					status = 1
+				os._exit(status)
+			_, status = os.waitpid(pid, 0)
+			self.assertEqual(status, 0)
+			# The handle of the parent is still usable after the child exits
+			self.assertEqual(dataset.kmer_count, kmer_count)
+			opens = self._opens_by_process()
+			self.assertEqual(opens[os.getpid()], 2)
+			self.assertEqual(opens[pid], 2)
+		self.assertEqual(len(ds._process_open_files()), 0)
+
+
+if __name__ == "__main__":
+	unittest.main()
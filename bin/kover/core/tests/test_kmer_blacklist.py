@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+Tests of the k-mer blacklist of the learning algorithms on datasets whose k-mers are grouped into equivalence classes
+(see kover dataset create --deduplicate-kmers): a blacklisted k-mer is never reported as a rule, even when its column
+is kept since other k-mers of its class are not blacklisted.
+
+Usage: python -m unittest discover -s tests
+"""
+
+import numpy as np
+import unittest
+
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from kover.dataset.create import from_tsv
+from kover.dataset.ds import KoverDataset
+from kover.dataset.split import split_with_proportion
+from kover.learning.experiments.experiment_cart import learn_CART
+from kover.learning.experiments.experiment_scm import learn_SCM
+
+N_GENOMES = 60
+N_KMERS = 200
+KMER_SIZE = 15
+
+
+def _write_dataset(directory):
+	"""
+	Writes a deduplicated dataset in which a single equivalence class of three k-mers is present exactly in the genomes
+	of the positive class. Returns the dataset and the k-mers of the class, with the k-mer of the column first.
+	"""
+	random_generator = np.random.RandomState(42)
+	genome_ids = ["genome_%d" % i for i in xrange(N_GENOMES)]
+	labels = np.arange(N_GENOMES) % 2
+	kmers = set()
+	while len(kmers) < N_KMERS:
+		kmers.add("".join(random_generator.choice(list("ACGT"), KMER_SIZE)))
+	kmers = sorted(kmers)
+	predictive_kmers = kmers[10], kmers[50], kmers[150]
+	with open(join(directory, "matrix.tsv"), "w") as f:
+		f.write("kmers\t" + "\t".join(genome_ids) + "\n")
+		for kmer in kmers:
+			if kmer in predictive_kmers:
+				row = labels
+			else:
+				# Present in a random half of the genomes, so that no other k-mer is predictive
+				row = (random_generator.rand(N_GENOMES) < 0.5).astype(int)
+			f.write(kmer + "\t" + "\t".join(str(v) for v in row) + "\n")
+	with open(join(directory, "metadata.tsv"), "w") as f:
+		for genome_id, label in zip(genome_ids, labels):
+			f.write("%s\t%d\n" % (genome_id, label))
+
+	dataset_path = join(directory, "dataset.kover")
+	from_tsv(join(directory, "matrix.tsv"), dataset_path, "phenotype", join(directory, "metadata.tsv"), 4, n_cpu=1,
+			 deduplicate_kmers=True)
+	split_with_proportion(dataset_path, "split", train_prop=0.7, random_seed=42, n_folds=3)
+
+	with KoverDataset(dataset_path) as dataset:
+		column = int(dataset.lookup_kmers([predictive_kmers[0]])[0])
+		representative = dataset.kmer_sequences[dataset.kmer_by_matrix_column[column]]
+		members = dataset.get_kmer_class_members([column])[column]
+	return dataset_path, [representative] + sorted(members)
+
+
+class KmerBlacklistTests(unittest.TestCase):
+	@classmethod
+	def setUpClass(cls):
+		cls.directory = mkdtemp()
+		cls.dataset_path, cls.class_kmers = _write_dataset(cls.directory)
+
+	@classmethod
+	def tearDownClass(cls):
+		rmtree(cls.directory)
+
+	def _write_blacklist(self, kmers):
+		path = join(self.directory, "blacklist.txt")
+		with open(path, "w") as f:
+			f.write("\n".join(kmers) + "\n")
+		return path
+
+	def _learn_SCM(self, blacklist_path):
+		result = learn_SCM(dataset_file=self.dataset_path, split_name="split", model_type=["conjunction"], p=[1.0],
+						   kmer_blacklist_file=blacklist_path, max_rules=1, max_equiv_rules=10,
+						   parameter_selection="none", n_cpu=1, random_seed=42, authorized_rules=None,
+						   bound_delta=0.05, bound_max_genome_size=5000)
+		model, equivalent_rules = result[4], result[6]
+		return list(model.rules), [rule for equivalent in equivalent_rules for rule in equivalent]
+
+	def _learn_CART(self, blacklist_path):
+		result = learn_CART(dataset_file=self.dataset_path, split_name="split", criterion=["gini"], max_depth=[1],
+							min_samples_split=[2], class_importance=[{0: 1.0, 1: 1.0}], bound_delta=0.05,
+							bound_max_genome_size=5000, kmer_blacklist_file=blacklist_path, parameter_selection="bound",
+							n_cpu=1, authorized_rules=None)
+		model, equivalent_rules = result[4], result[6]
+		return model.decision_tree.rules, [rule for equivalent in equivalent_rules.values() for rule in equivalent]
+
+	def _check_partly_blacklisted_class(self, learn):
+		# The k-mer of the column and another k-mer of the class are blacklisted: the column is kept
+		blacklisted = self.class_kmers[:2]
+		model_rules, equivalent_rules = learn(self._write_blacklist(blacklisted))
+		self.assertEqual([rule.kmer_sequence for rule in model_rules], [self.class_kmers[2]])
+		reported = set(rule.kmer_sequence for rule in model_rules + equivalent_rules)
+		self.assertIn(self.class_kmers[2], reported)
+		self.assertEqual(reported.intersection(blacklisted), set())
+
+	def _check_unblacklisted_class(self, learn):
+		model_rules, equivalent_rules = learn(None)
+		self.assertEqual([rule.kmer_sequence for rule in model_rules], [self.class_kmers[0]])
+		self.assertTrue(set(self.class_kmers) <= set(rule.kmer_sequence for rule in equivalent_rules))
+
+	def test_scm_partly_blacklisted_class(self):
+		self._check_partly_blacklisted_class(self._learn_SCM)
+
+	def test_scm_unblacklisted_class(self):
+		self._check_unblacklisted_class(self._learn_SCM)
+
+	def test_cart_partly_blacklisted_class(self):
+		self._check_partly_blacklisted_class(self._learn_CART)
+
+	def test_cart_unblacklisted_class(self):
+		self._check_unblacklisted_class(self._learn_CART)
+
+
+if __name__ == "__main__":
+	unittest.main()
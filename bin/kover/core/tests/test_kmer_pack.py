@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+Tests of the merge of the sorted k-mers of the genomes counted by DSK (see kover dataset create from-contigs): the
+packed blocks of a range are the presence of the k-mers of the range in the genomes, whatever the chunk size.
+
+Usage: python -m unittest discover -s tests
+"""
+
+import numpy as np
+import unittest
+
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from kover.dataset.tools.kmer_pack import decode_dsk_kmers, merge_kmer_range
+
+N_GENOMES = 150
+KMER_LENGTH = 10
+
+
+class MergeKmerRangeTests(unittest.TestCase):
+	def setUp(self):
+		self.directory = mkdtemp()
+		random_generator = np.random.RandomState(42)
+		self.genome_kmers = []
+		self.genome_kmer_files = []
+		for genome_idx in xrange(N_GENOMES):
+			# Genomes of very different sizes, some of them empty
+			kmers = np.unique(random_generator.randint(0, 4 ** KMER_LENGTH,
+			                                           random_generator.randint(0, 500)).astype(np.uint64))
+			path = join(self.directory, "%d.npy" % genome_idx)
+			np.save(path, kmers)
+			self.genome_kmers.append(kmers)
+			self.genome_kmer_files.append(path)
+
+	def tearDown(self):
+		rmtree(self.directory)
+
+	def _expected_blocks(self, low, high, min_genome_count):
+		kmers = np.unique(np.hstack(self.genome_kmers))
+		kmers = kmers[(kmers >= low) & (kmers < high)]
+		presence = np.array([np.in1d(kmers, genome_kmers) for genome_kmers in self.genome_kmers])
+		keep = presence.sum(axis=0) >= min_genome_count
+		return decode_dsk_kmers(kmers[keep], KMER_LENGTH), presence[:, keep]
+
+	def _check_merge(self, chunk_size, min_genome_count):
+		low, high = np.uint64(4 ** KMER_LENGTH / 4), np.uint64(4 ** KMER_LENGTH / 2)
+		blocks = merge_kmer_range((low, high), self.genome_kmer_files, KMER_LENGTH, min_genome_count,
+		                          chunk_size=chunk_size, block_size=100)
+		expected_kmers, expected_presence = self._expected_blocks(low, high, min_genome_count)
+		self.assertTrue(all(len(kmers) == 100 for kmers, _ in blocks[:-1]))
+		self.assertTrue((np.hstack([kmers for kmers, _ in blocks]) == expected_kmers).all())
+		packed = np.hstack([block for _, block in blocks])
+		genomes = np.arange(N_GENOMES)
+		presence = (packed[genomes / 64] >> (63 - genomes % 64).astype(np.uint64)[:, None]) & np.uint64(1)
+		self.assertTrue((presence == expected_presence).all())
+
+	def test_chunks_smaller_than_genomes(self):
+		self._check_merge(chunk_size=7, min_genome_count=1)
+
+	def test_single_chunk_per_genome(self):
+		self._check_merge(chunk_size=1000, min_genome_count=1)
+
+	def test_singleton_filter(self):
+		self._check_merge(chunk_size=7, min_genome_count=2)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""
+	Kover: Learn interpretable computational phenotyping models from k-merized genomic data
+	Copyright (C) 2018  Alexandre Drouin & Gael Letarte
+
+	This program is free software: you can redistribute it and/or modify
+	it under the terms of the GNU General Public License as published by
+	the Free Software Foundation, either version 3 of the License, or
+	(at your option) any later version.
+
+	This program is distributed in the hope that it will be useful,
+	but WITHOUT ANY WARRANTY; without even the implied warranty of
+	MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+	GNU General Public License for more details.
+
+	You should have received a copy of the GNU General Public License
+	along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+Tests of kover dataset merge: the merge of datasets is the dataset created from scratch with all their genomes, even
+when the datasets store the k-mers in different orientations (e.g., the canonical form of DSK and that of the python
+k-mer counter).
+
+Usage: python -m unittest discover -s tests
+"""
+
+import numpy as np
+import unittest
+
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from kover.dataset.create import from_tsv
+from kover.dataset.ds import KoverDataset
+from kover.dataset.merge import merge_datasets
+
+N_GENOMES = 40
+N_KMERS = 300
+
+_complements = {"A": "T", "C": "G", "G": "C", "T": "A"}
+
+
+def _reverse_complement(kmer):
+	return "".join(_complements[nucleotide] for nucleotide in reversed(kmer))
+
+
+def _canonical(kmer, nucleotide_order):
+	def key(sequence):
+		return [nucleotide_order.index(nucleotide) for nucleotide in sequence]
+	return min(kmer, _reverse_complement(kmer), key=key)
+
+
+def _write_dataset(directory, name, kmers, matrix, genome_ids, labels, nucleotide_order):
+	"""
+	Writes a dataset from a k-mer matrix, with the k-mers in their canonical form for an order of the nucleotides. The
+	k-mers that are absent from all the genomes are left out, as a k-mer counter would.
+	"""
+	with open(join(directory, name + ".tsv"), "w") as f:
+		f.write("kmers\t" + "\t".join(genome_ids) + "\n")
+		for kmer, row in zip(kmers, matrix):
+			if row.any():
+				f.write(_canonical(kmer, nucleotide_order) + "\t" + "\t".join(str(v) for v in row) + "\n")
+	with open(join(directory, name + ".tsv.metadata"), "w") as f:
+		for genome_id, label in zip(genome_ids, labels):
+			f.write("%s\t%d\n" % (genome_id, label))
+	dataset_path = join(directory, name + ".kover")
+	from_tsv(join(directory, name + ".tsv"), dataset_path, "phenotype", join(directory, name + ".tsv.metadata"), 4,
+			 n_cpu=1)
+	return dataset_path
+
+
+def _genomes_by_kmer(dataset_path):
+	with KoverDataset(dataset_path) as dataset:
+		genome_ids = np.array(dataset.genome_identifiers[...])
+		kmer_sequences = dataset.kmer_sequences[...]
+		kmer_by_matrix_column = dataset.kmer_by_matrix_column[...]
+		matrix = dataset.kmer_matrix[...]
+		labels = dict(zip(genome_ids, dataset.phenotype.metadata[...]))
+	genomes = np.arange(len(genome_ids))
+	bits = (matrix[genomes // 64] >> (63 - genomes % 64).astype(np.uint64)[:, None]) & np.uint64(1)
+	genomes_by_kmer = dict((kmer_sequences[kmer_by_matrix_column[column]], frozenset(genome_ids[bits[:, column] == 1]))
+						   for column in xrange(bits.shape[1]))
+	return genomes_by_kmer, labels
+
+
+class MergeTests(unittest.TestCase):
+	def setUp(self):
+		self.directory = mkdtemp()
+
+	def tearDown(self):
+		rmtree(self.directory)
+
+	def _check_merge_of_orientations(self, kmer_size):
+		random_generator = np.random.RandomState(42)
+		genome_ids = ["genome_%d" % i for i in xrange(N_GENOMES)]
+		labels = random_generator.randint(2, size=N_GENOMES)
+		kmers = set()
+		while len(kmers) < N_KMERS:
+			kmers.add(_canonical("".join(random_generator.choice(list("ACGT"), kmer_size)), "ACGT"))
+		kmers = sorted(kmers)
+		matrix = (random_generator.rand(N_KMERS, N_GENOMES) < 0.3).astype(int)
+		# Many k-mers are absent from the genomes of one of the datasets
+		matrix[: N_KMERS // 3, : N_GENOMES // 2] = 0
+		matrix[-N_KMERS // 3:, N_GENOMES // 2:] = 0
+
+		half = N_GENOMES // 2
+		# The first dataset has the canonical k-mers of DSK (A < C < T < G), the second those of the python counter
+		first = _write_dataset(self.directory, "first", kmers, matrix[:, :half], genome_ids[:half], labels[:half],
+							   "ACTG")
+		second = _write_dataset(self.directory, "second", kmers, matrix[:, half:], genome_ids[half:], labels[half:],
+								"ACGT")
+		full = _write_dataset(self.directory, "full", kmers, matrix, genome_ids, labels, "ACGT")
+		with KoverDataset(first) as dataset:
+			self.assertNotEqual(set(dataset.kmer_sequences[...]) - set(kmers), set(),
+								"The test needs k-mers whose canonical forms differ.")
+
+		merged = join(self.directory, "merged.kover")
+		merge_datasets([first, second], merged)
+		self.assertEqual(_genomes_by_kmer(merged), _genomes_by_kmer(full))
+
+	def test_merge_of_orientations(self):
+		self._check_merge_of_orientations(15)
+
+	def test_merge_of_orientations_long_kmers(self):
+		# The k-mers that are longer than MAX_KMER_SIZE are indexed by their sequence
+		self._check_merge_of_orientations(35)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -1495,7 +1495,7 @@ class App(ctk.CTk):
             tuple(range(2)), weight=1, uniform="column"
         )
 
-        self.dataset_type = ["contigs", "kmer matrix"]
+        self.dataset_type = ["contigs", "kmer matrix", "ray surveyor"]
 
         self.dataset_creation_control_panel_dataset_type_selector = Combobox(
             master=self.dataset_creation_frame.control_panel,
@@ -1529,9 +1529,14 @@ class App(ctk.CTk):
             font=self.default_font(12),
             command=lambda: self.update_entry(
                 self.dataset_creation_frame_dataset_path,
-                util.select_file(
-                    filetypes=[("TSV Files", "*.tsv")],
-                    title="Select Dataset File",
+                (
+                    util.select_directory(title="Select Dataset Folder")
+                    if self.dataset_creation_control_panel_dataset_type_selector.get()
+                    == self.dataset_type[2]
+                    else util.select_file(
+                        filetypes=[("TSV Files", "*.tsv")],
+                        title="Select Dataset File",
+                    )
                 ),
                 self.dataset_creation_validate_ui,
             ),
@@ -2938,13 +2943,19 @@ class App(ctk.CTk):
                 state=tk.DISABLED
             )
             self.dataset_creation_frame_kmer_size_spinbox.configure(state=tk.DISABLED)
-            self.dataset_creation_control_panel_cpu_spinbox.configure(state=tk.DISABLED)
+        elif (
+            self.dataset_creation_control_panel_dataset_type_selector.get()
+            == self.dataset_type[2]
+        ):
+            self.dataset_creation_control_panel_singleton_kmer_checkbox.configure(
+                state=tk.DISABLED
+            )
+            self.dataset_creation_frame_kmer_size_spinbox.configure(state=tk.NORMAL)
         else:
             self.dataset_creation_control_panel_singleton_kmer_checkbox.configure(
                 state=tk.NORMAL
             )
             self.dataset_creation_frame_kmer_size_spinbox.configure(state=tk.NORMAL)
-            self.dataset_creation_control_panel_cpu_spinbox.configure(state=tk.NORMAL)
 
         if not self.dataset_creation_frame_dataset_path.get():
             self.dataset_creation_frame_create_dataset_button_hover.text += (
@@ -3348,6 +3359,8 @@ class App(ctk.CTk):
 
     @threaded
     def create_dataset(self):
+        config_path = None
+
         try:
             output_path = util.select_directory(title="Select Output Directory")
 
@@ -3360,17 +3373,40 @@ class App(ctk.CTk):
                 self.dataset_creation_control_panel_dataset_type_selector.get()
             )
 
+            genomic_data = self.dataset_creation_frame_dataset_path.get()
+
             if selected_source == self.dataset_type[0]:
                 source = kover.Source.CONTIGS
-            elif selected_source == self.dataset_type[1]:
+            elif selected_source in (self.dataset_type[1], self.dataset_type[2]):
                 source = kover.Source.K_MER_MATREX
             else:
                 return
 
+            if selected_source == self.dataset_type[2]:
+                # Ray Surveyor's k-mer matrix is piped to Kover while it is written
+                input_files = [
+                    f"{genomic_data}/{file}"
+                    for file in os.listdir(genomic_data)
+                    if file.endswith(".fna")
+                ]
+
+                if not input_files:
+                    messagebox.showerror(
+                        "Error", "No .fna files found in the selected dataset folder."
+                    )
+                    return
+
+                config_path = self.generate_survey_conf(
+                    input_files,
+                    self.dataset_creation_frame_kmer_size_spinbox.get(),
+                    os.path.dirname(output_path),
+                )
+                genomic_data = kover.STDIN
+
             command = kover.create_command(
                 Path.KOVER,
                 source,
-                self.dataset_creation_frame_dataset_path.get(),
+                genomic_data,
                 output_path,
                 self.dataset_creation_frame_description_path.get(),
                 self.dataset_creation_frame_metadata_path.get(),
@@ -3384,6 +3420,13 @@ class App(ctk.CTk):
                 False,
             )
 
+            if selected_source == self.dataset_type[2]:
+                command = kover.ray_surveyor_stream_command(
+                    f'mpiexec -n 4 "{util.to_linux_path(Path.RAY)}" "{util.to_linux_path(config_path)}"',
+                    os.path.join(os.path.dirname(output_path), "survey.res"),
+                    command,
+                )
+
             process = util.run_bash_command(command, Path.TEMP)
 
             self.dataset_creation_frame_create_dataset_button.configure(
@@ -3424,6 +3467,9 @@ class App(ctk.CTk):
                 text="Create Dataset", command=self.create_dataset
             )
 
+            if config_path:
+                util.try_pass_except(os.remove, config_path)
+
     def generate_random_seed(self, seed_entry: ctk.CTkEntry):
         util.force_insertable_value(random.randint(1, 10000), seed_entry)
 
@@ -35,6 +35,9 @@ class MinLen:
 
 
 DEFAULT = None
+STDIN = "-"
+# The k-mer matrix written by Ray Surveyor (-write-kmer-matrix), relative to its output directory
+RAY_SURVEYOR_KMER_MATRIX = "Surveyor/KmerMatrix.tsv"
 
 
 def create_contigs_path_tsv(contigs_path: str, genome_name: str):
@@ -71,7 +74,11 @@ def create_command(
     command = (
         to_linux_path(kover_path),
         f"dataset create from-{source}",
-        f"--genomic-data {to_linux_path(genomic_data)}",
+        (
+            f"--genomic-data {STDIN}"
+            if genomic_data == STDIN
+            else f"--genomic-data {to_linux_path(genomic_data)}"
+        ),
         (
             f"--phenotype-description {to_linux_path(phenotype_description)}"
             if phenotype_description
@@ -94,7 +101,7 @@ def create_command(
             else ""
         ),
         "--singleton-kmers" if singleton_kmers else "",
-        f"--n-cpu {n_cpu}" if source != Source.K_MER_MATREX and n_cpu else "",
+        f"--n-cpu {n_cpu}" if n_cpu else "",
         f"--compression {compression}" if compression else "",
         (
             f"--temp-dir {to_linux_path(temp_dir)}"
@@ -293,3 +300,48 @@ def tree_command(
     )
 
     return " ".join(filter(lambda x: x != "", command))
+
+
+# Pipes the k-mer matrix of Ray Surveyor to "kover dataset create from-tsv --genomic-data -"
+# while it is being written. Ray Surveyor creates its own output directory, so the matrix is replaced
+# by a named pipe (FIFO) as soon as the directory exists: the matrix then never touches the disk and
+# Kover reads it in a single pass. If the matrix file was already created, it is followed with tail -F
+# instead, and deleted once the dataset is created.
+def ray_surveyor_stream_command(
+    ray_surveyor_command: str,
+    ray_surveyor_output: str,
+    create_command: str,
+):
+    kmer_matrix = to_linux_path(
+        os.path.join(ray_surveyor_output, RAY_SURVEYOR_KMER_MATRIX)
+    )
+    kmer_matrix_dir = os.path.dirname(kmer_matrix)
+
+    command = (
+        f"{ray_surveyor_command} &",
+        "ray_surveyor_pid=$!",
+        f'while [ ! -d "{kmer_matrix_dir}" ] && kill -0 $ray_surveyor_pid 2> /dev/null; do sleep 1; done',
+        f'if mkfifo "{kmer_matrix}" 2> /dev/null; then',
+        f'    {create_command} < "{kmer_matrix}" &',
+        "    kover_pid=$!",
+        "    if ! wait $ray_surveyor_pid; then",
+        "        kill $kover_pid 2> /dev/null",
+        f'        rm -f "{kmer_matrix}"',
+        "        exit 1",
+        "    fi",
+        "    # Unblocks Kover if Ray Surveyor never opened the matrix",
+        f'    exec 3<> "{kmer_matrix}"',
+        "    exec 3>&-",
+        "    wait $kover_pid",
+        "    kover_status=$?",
+        f'    rm -f "{kmer_matrix}"',
+        "    exit $kover_status",
+        "fi",
+        f'tail -c +1 -F --pid=$ray_surveyor_pid "{kmer_matrix}" 2> /dev/null | {create_command}',
+        "kover_status=${PIPESTATUS[1]}",
+        "wait $ray_surveyor_pid || exit 1",
+        f'if [ $kover_status -eq 0 ]; then rm -f "{kmer_matrix}"; fi',
+        "exit $kover_status",
+    )
+
+    return "\n".join(command)
@@ -205,34 +205,38 @@ def display_process_output(
     enqueue_output(process.stdout, messages, Tag.NORMAL)
     enqueue_output(process.stderr, messages, Tag.ERROR)
 
-    pack_string = ""
-    message_count = 0
-
     while (result := process.poll()) is None:
         try:
             tag, message = messages.get(timeout=0.1)
-            pack_string += message
-            if not message_count % message_buffer:
-                if message_buffer > 1:
-                    if output_target:
-                        update_cmd_output(pack_string, output_target, Tag.NORMAL)
-                    else:
-                        print(pack_string, end="")
+            if message_buffer > 1:
+                # The messages that are already queued are displayed at once (e.g.,
+                # the k-mers of kover dataset info), instead of waiting for the
+                # refresh timeout between each of them
+                pack = [message]
+                while len(pack) < message_buffer:
+                    try:
+                        pack.append(messages.get_nowait()[1])
+                    except Empty:
+                        break
+                if output_target:
+                    update_cmd_output("".join(pack), output_target, Tag.NORMAL)
+                else:
+                    print("".join(pack), end="")
+            else:
+                if output_target:
+                    update_cmd_output(message, output_target, tag)
                 else:
-                    if output_target:
-                        update_cmd_output(pack_string, output_target, tag)
-                    else:
-                        print(f"{tag}: {pack_string}", end="")
-                pack_string = ""
-            message_count += 1
+                    print(f"{tag}: {message}", end="")
         except Empty:
             pass
 
         sleep(refresh_timeout / 1000)
 
+    pack = []
     while messages.qsize() > 0:
         tag, message = messages.get()
-        pack_string += message
+        pack.append(message)
+    pack_string = "".join(pack)
 
     if pack_string:
         if output_target: